@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""AC-3 syncframe utilities (python version of src/ac3_utils.cc)."""
+
+import collections
+import modulo
+import numpy
+import pes_utils
+import pts_utils
+
+mod = modulo.Modulo(pts_utils.kPtsMaxValue, pts_utils.kPtsInvalid)
+
+AC3_SYNCWORD = '\x0b\x77'
+# syncword, crc1, and fscod/frmsizecod
+AC3_SYNCINFO_SIZE = 5
+AC3_SAMPLES_PER_FRAME = 1536
+
+# fscod to sample rate (fscod 3 is reserved)
+AC3_SAMPLE_RATE = [48000, 44100, 32000]
+
+# frame size (in 16-bit words) per frmsizecod, for each fscod
+# (ATSC A/52, Table 5.18)
+AC3_FRAME_SIZE_WORDS = [
+    # 48 kHz
+    [64, 64, 80, 80, 96, 96, 112, 112, 128, 128, 160, 160, 192, 192,
+     224, 224, 256, 256, 320, 320, 384, 384, 448, 448, 512, 512,
+     640, 640, 768, 768, 896, 896, 1024, 1024, 1152, 1152, 1280, 1280],
+    # 44.1 kHz
+    [69, 70, 87, 88, 104, 105, 121, 122, 139, 140, 174, 175, 208, 209,
+     243, 244, 278, 279, 348, 349, 417, 418, 487, 488, 557, 558,
+     696, 697, 835, 836, 975, 976, 1114, 1115, 1253, 1254, 1393, 1394],
+    # 32 kHz
+    [96, 96, 120, 120, 144, 144, 168, 168, 192, 192, 240, 240, 288, 288,
+     336, 336, 384, 384, 480, 480, 576, 576, 672, 672, 768, 768,
+     960, 960, 1152, 1152, 1344, 1344, 1536, 1536, 1728, 1728, 1920, 1920],
+]
+
+# fscod/frmsizecod values accepted by "m2pb --syncframe"
+SYNCFRAME_DISTANCE_CODES = (
+    '\x14',  # 48 kHz, 192 kbps
+    '\x0c',  # 48 kHz, 96 kbps
+)
+
+# a located syncframe: packet number and file byte offset of its first
+# byte, its size (in bytes), sample rate, and pts
+Syncframe = collections.namedtuple('Syncframe',
+    ['packet', 'byte', 'frame_size', 'sample_rate', 'pts'])
+
+
+def get_syncframe_distance(data):
+  """Returns the distance to the first AC-3 syncframe in data (or -1).
+
+  This is the same heuristic than "m2pb --syncframe".
+  """
+  i = data.find(AC3_SYNCWORD)
+  while i >= 0 and i < len(data) - 5:
+    if data[i + 4] in SYNCFRAME_DISTANCE_CODES:
+      return i
+    i = data.find(AC3_SYNCWORD, i + 1)
+  return -1
+
+
+def parse_syncinfo(data, i=0):
+  """Parses the syncinfo at data[i:].
+
+  Returns:
+    a (sample_rate, frame_size) tuple (frame_size in bytes), or None if
+    data[i:] does not start with a valid syncinfo.
+  """
+  if (len(data) < i + AC3_SYNCINFO_SIZE or
+      data[i:i + 2] != AC3_SYNCWORD):
+    return None
+  fscod = ord(data[i + 4]) >> 6
+  frmsizecod = ord(data[i + 4]) & 0x3f
+  if fscod >= len(AC3_SAMPLE_RATE) or frmsizecod >= 38:
+    return None
+  return (AC3_SAMPLE_RATE[fscod],
+      2 * AC3_FRAME_SIZE_WORDS[fscod][frmsizecod])
+
+
+def get_frame_pts(pts, frames, sample_rate):
+  """Returns the pts of the frame that is frames after one at pts."""
+  return mod.add(pts, (frames * AC3_SAMPLES_PER_FRAME *
+      pts_utils.kPtsPerSecond) // sample_rate)
+
+
+class Ac3Framer(object):
+  """Locates AC-3 syncframes in the TS payloads of an audio pid.
+
+  Syncframes can span TS packet (and PES) boundaries. Once a syncframe
+  is found, the next one is expected right after it (frame_size bytes
+  later). When not locked, a syncword is only accepted if there is
+  another syncword right after the frame.
+
+  Each PES pts is assigned to the first syncframe starting in the PES.
+  Following syncframes get the previous pts plus one frame duration.
+  """
+
+  def __init__(self):
+    # elementary stream bytes not yet consumed, and their es offset
+    self._buf = ''
+    self._buf_start = 0
+    # position (in self._buf) where the next syncframe is expected
+    self._pos = 0
+    # position (in self._buf) where the previous syncframe ended
+    self._frame_end = 0
+    self._es_len = 0
+    self._locked = False
+    # (es_offset, packet, byte) of each payload in self._buf
+    self._chunks = collections.deque()
+    # (es_offset, pts) of each PES with a pts
+    self._pes_pts = collections.deque()
+    self._base_pts = pts_utils.kPtsInvalid
+    self._frames_since_base = 0
+    # accounting
+    self.skipped_bytes = 0
+
+  def add(self, payload, packet, byte, pusi):
+    """Adds a TS payload.
+
+    Args:
+      payload: the TS packet payload
+      packet: the packet number
+      byte: the file offset of the payload
+      pusi: whether the packet has the payload_unit_start_indicator set
+
+    Returns:
+      a list of the Syncframes found.
+    """
+    if pusi:
+      header = pes_utils.parse_pes_header(payload)
+      if header is not None:
+        if header['pts'] != pts_utils.kPtsInvalid:
+          self._pes_pts.append((self._es_len, header['pts']))
+        skip = min(header['header_length'], len(payload))
+        payload = payload[skip:]
+        byte += skip
+    if not payload:
+      return []
+    self._chunks.append((self._es_len, packet, byte))
+    self._es_len += len(payload)
+    self._buf += payload
+    return self._scan(False)
+
+  def flush(self):
+    """Returns the Syncframes pending confirmation (at end of stream)."""
+    return self._scan(True)
+
+  def _get_location(self, es_offset):
+    location = None
+    for chunk_es_offset, packet, byte in self._chunks:
+      if chunk_es_offset > es_offset:
+        break
+      location = packet, byte + (es_offset - chunk_es_offset)
+    return location
+
+  def _get_pts(self, es_offset, sample_rate):
+    new_base = False
+    while self._pes_pts and self._pes_pts[0][0] <= es_offset:
+      _, self._base_pts = self._pes_pts.popleft()
+      new_base = True
+    if new_base:
+      self._frames_since_base = 0
+    else:
+      self._frames_since_base += 1
+    if self._base_pts == pts_utils.kPtsInvalid:
+      return pts_utils.kPtsInvalid
+    return get_frame_pts(self._base_pts, self._frames_since_base,
+        sample_rate)
+
+  def _scan(self, final):
+    out = []
+    buf = self._buf
+    pos = self._pos
+    frame_end = self._frame_end
+    while True:
+      i = buf.find(AC3_SYNCWORD, pos)
+      if i < 0:
+        # keep the last byte (it may be the start of a syncword)
+        cut = max(pos, len(buf) - 1)
+        break
+      if i != pos and self._locked:
+        # lost sync
+        self._locked = False
+      info = parse_syncinfo(buf, i)
+      if info is None:
+        if len(buf) < i + AC3_SYNCINFO_SIZE and not final:
+          # need more data
+          cut = i
+          break
+        pos = i + 1
+        continue
+      sample_rate, frame_size = info
+      if not self._locked:
+        # confirm the syncframe by looking at the next one
+        next_sync = buf[i + frame_size:i + frame_size + 2]
+        if len(next_sync) < 2 and not final:
+          cut = i
+          break
+        if len(next_sync) == 2 and next_sync != AC3_SYNCWORD:
+          pos = i + 1
+          continue
+      self.skipped_bytes += i - frame_end
+      es_offset = self._buf_start + i
+      packet, byte = self._get_location(es_offset)
+      out.append(Syncframe(packet, byte, frame_size, sample_rate,
+          self._get_pts(es_offset, sample_rate)))
+      self._locked = True
+      pos = frame_end = i + frame_size
+    if final:
+      cut = len(buf)
+    cut = min(cut, len(buf))
+    # the dropped bytes which are not part of a syncframe
+    self.skipped_bytes += max(0, cut - frame_end)
+    self._buf = buf[cut:]
+    self._buf_start += cut
+    self._pos = max(0, pos - cut)
+    self._frame_end = max(0, frame_end - cut)
+    # drop the chunks that are fully consumed
+    while len(self._chunks) > 1 and self._chunks[1][0] <= self._buf_start:
+      self._chunks.popleft()
+    return out
+
+
+def get_syncframes(view, pids):
+  """Locates the AC-3 syncframes of some pids in a ts_view.HeaderView.
+
+  Yields:
+    (pid, Syncframe) tuples, in file order per pid.
+  """
+  index = numpy.nonzero(numpy.isin(view.pid, list(pids)) &
+      view.payload_exists)[0]
+  framers = dict((pid, Ac3Framer()) for pid in pids)
+  pid_l = view.pid[index]
+  pusi_l = view.payload_unit_start_indicator[index]
+  payload_offset_l = view.payload_offset[index]
+  for i, pid, pusi, payload_offset in zip(index, pid_l, pusi_l,
+      payload_offset_l):
+    start = view.offsets[i] + payload_offset
+    payload = view.data[start:view.offsets[i] + 188].tobytes()
+    for syncframe in framers[pid].add(payload, i, start, pusi):
+      yield pid, syncframe
+  for pid, framer in framers.iteritems():
+    for syncframe in framer.flush():
+      yield pid, syncframe
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+
+"""Unit tests for ac3_utils.py."""
+
+import unittest
+import ac3_utils
+import pts_utils
+
+
+def make_syncframe(i, code='\x14'):
+  """Returns a 768-byte (48 kHz, 192 kbps) syncframe."""
+  frame = ac3_utils.AC3_SYNCWORD + '\x00\x00' + code
+  return frame + chr(i & 0xff) * (768 - len(frame))
+
+
+def make_pes(pts, payload):
+  b = [0x21 | ((pts >> 29) & 0x0e), (pts >> 22) & 0xff,
+       ((pts >> 14) & 0xfe) | 1, (pts >> 7) & 0xff, ((pts << 1) & 0xfe) | 1]
+  return ('\x00\x00\x01\xbd' + chr((len(payload) + 8) >> 8) +
+          chr((len(payload) + 8) & 0xff) + '\x80\x80\x05' +
+          ''.join(chr(x) for x in b) + payload)
+
+
+class Ac3UtilsTest(unittest.TestCase):
+
+  def testGetSyncframeDistance(self):
+    self.assertEqual(0, ac3_utils.get_syncframe_distance(make_syncframe(0)))
+    self.assertEqual(3, ac3_utils.get_syncframe_distance(
+        'abc' + make_syncframe(0, '\x0c')))
+    # 44.1 kHz is not accepted by m2pb --syncframe
+    self.assertEqual(-1, ac3_utils.get_syncframe_distance(
+        'abc' + make_syncframe(0, '\x54')))
+    self.assertEqual(-1, ac3_utils.get_syncframe_distance('\x0b\x77\x00'))
+
+  def testParseSyncinfo(self):
+    self.assertEqual((48000, 768),
+                     ac3_utils.parse_syncinfo(make_syncframe(0)))
+    self.assertEqual((44100, 2788),
+                     ac3_utils.parse_syncinfo('\x0b\x77\x00\x00\x65'))
+    self.assertEqual((32000, 3840),
+                     ac3_utils.parse_syncinfo('\x0b\x77\x00\x00\xa5'))
+    # reserved fscod and frmsizecod
+    self.assertEqual(None, ac3_utils.parse_syncinfo('\x0b\x77\x00\x00\xc0'))
+    self.assertEqual(None, ac3_utils.parse_syncinfo('\x0b\x77\x00\x00\x26'))
+    self.assertEqual(None, ac3_utils.parse_syncinfo('\x0b\x77\x00\x00'))
+
+  def testAc3Framer(self):
+    # 2 PES with 2 frames each, and a pts close to the wrap point
+    pts0 = pts_utils.kPtsMaxValue - 1000
+    es = 'garbage' + make_syncframe(0) + make_syncframe(1)
+    stream = make_pes(pts0, es)
+    stream += make_pes(1000 + 2 * 2880 - 1, make_syncframe(2) +
+                       make_syncframe(3))
+    framer = ac3_utils.Ac3Framer()
+    syncframes = []
+    pes2_start = len(make_pes(pts0, es))
+    for i in range(0, len(stream), 184):
+      payload = stream[i:i + 184]
+      pusi = i == 0 or i == pes2_start
+      if i < pes2_start < i + 184:
+        # start the second PES in its own packet
+        syncframes += framer.add(stream[i:pes2_start], i // 184, i, pusi)
+        syncframes += framer.add(stream[pes2_start:i + 184], i // 184,
+                                 pes2_start, True)
+        continue
+      syncframes += framer.add(payload, i // 184, i, pusi)
+    syncframes += framer.flush()
+    self.assertEqual(4, len(syncframes))
+    self.assertEqual(len(make_pes(pts0, 'garbage')), syncframes[0].byte)
+    self.assertEqual(syncframes[0].byte + 768, syncframes[1].byte)
+    self.assertEqual([0, 4, 8, 12], [s.packet for s in syncframes])
+    self.assertEqual([768] * 4, [s.frame_size for s in syncframes])
+    self.assertEqual([pts0, 1879, 1000 + 2 * 2880 - 1, 1000 + 3 * 2880 - 1],
+                     [s.pts for s in syncframes])
+    self.assertEqual(7, framer.skipped_bytes)
+
+
+if __name__ == '__main__':
+  unittest.main()
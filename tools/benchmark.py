@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""Reproducible throughput benchmarks for the m2pb tools.
+
+Generates deterministic synthetic streams (see ts_gen.py) of several
+sizes, and times every benchmark target on each of them. Every run
+happens in a forked child process, so that its peak RSS can be measured
+on its own. Results are written as JSON, and can be compared against a
+previous (baseline) run.
+
+Targets that need the m2pb binary are skipped when it is not in the PATH.
+"""
+
+import argparse
+import datetime
+import distutils.spawn
+import json
+import os
+import resource
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import gop
+import modulo
+import pts_utils
+import splice
+import splice_index
+import splice_plan
+import ts_gen
+
+BENCHMARK_VERSION = 1
+DEFAULT_SIZES_MB = (1, 10, 50)
+DEFAULT_REPEAT = 1
+MODULO_OPS_PER_PACKET = 1
+
+
+def get_splice_specs(filename, size):
+  """Returns splice input specs (the file, and its second half)."""
+  duration = size * 8.0 / ts_gen.DEFAULT_BITRATE
+  pts = ts_gen.mod.add(ts_gen.DEFAULT_PTS_START,
+                       int(pts_utils.seconds_to_pts(duration / 2)))
+  return [filename + ':', '%s:%i:' % (filename, pts)]
+
+
+def run_modulo(filename, size, work_dir):
+  mod = modulo.Modulo(pts_utils.kPtsMaxValue, pts_utils.kPtsInvalid)
+  x = ts_gen.DEFAULT_PTS_START
+  for _ in xrange(size // ts_gen.MPEG_TS_PACKET_SIZE * MODULO_OPS_PER_PACKET):
+    y = mod.add(x, ts_gen.PTS_PER_FRAME)
+    mod.sub(y, x)
+    mod.cmp(x, y)
+    x = y
+
+
+def run_pts(filename, size, work_dir):
+  gop.dump_frame_info(filename, [], 0)
+
+
+def run_summary(filename, size, work_dir):
+  gop.dump_frame_summary(filename, [], 0)
+
+
+def run_sample(filename, size, work_dir):
+  gop.dump_frame_sample(filename, os.path.join(work_dir, 'sample.txt'), 0)
+
+
+def run_splice(filename, size, work_dir):
+  splice.splice_streams(get_splice_specs(filename, size),
+      os.path.join(work_dir, 'splice.ts'), False, 0,
+      splice.frames_to_pts(splice.SPLICE_BUFFER_FRAMES))
+
+
+def run_splice_plan(filename, size, work_dir):
+  output_filename = os.path.join(work_dir, 'splice.ts')
+  plan = splice_plan.SplicePlan()
+  splice.splice_streams(get_splice_specs(filename, size), output_filename,
+      False, 0, splice.frames_to_pts(splice.SPLICE_BUFFER_FRAMES), plan,
+      splice_index.SourceIndexCache())
+  splice_plan.execute_plan(plan, output_filename)
+
+
+# name: (function, whether it needs m2pb)
+TARGETS = {
+    'modulo': (run_modulo, False),
+    'pts': (run_pts, True),
+    'summary': (run_summary, False),
+    'sample': (run_sample, True),
+    'splice': (run_splice, True),
+    'splice_plan': (run_splice_plan, False),
+}
+DEFAULT_TARGETS = ('modulo', 'pts', 'summary', 'sample', 'splice',
+                   'splice_plan')
+
+
+def run_target(target, filename, size, work_dir):
+  """Runs a target in a child process.
+
+  Returns:
+    a dictionary with the status, elapsed time, and peak RSS (in KB) of
+    the run, and of its subprocesses (e.g. m2pb).
+  """
+  rfd, wfd = os.pipe()
+  pid = os.fork()
+  if pid == 0:
+    os.close(rfd)
+    # the targets print their results
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    try:
+      start = time.time()
+      TARGETS[target][0](filename, size, work_dir)
+      result = {'status': 'ok', 'elapsed': time.time() - start}
+    except BaseException as e:
+      result = {'status': 'error', 'error': repr(e)}
+    result['peak_rss_kb'] = resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss
+    result['children_peak_rss_kb'] = resource.getrusage(
+        resource.RUSAGE_CHILDREN).ru_maxrss
+    os.write(wfd, json.dumps(result))
+    os._exit(0)
+  os.close(wfd)
+  chunks = []
+  while True:
+    chunk = os.read(rfd, 65536)
+    if not chunk:
+      break
+    chunks.append(chunk)
+  os.close(rfd)
+  os.waitpid(pid, 0)
+  if not chunks:
+    return {'status': 'error', 'error': 'child process died'}
+  return json.loads(''.join(chunks))
+
+
+def run_benchmarks(sizes, targets, work_dir, repeat=DEFAULT_REPEAT,
+                   debug=0):
+  """Runs every target on a synthetic stream of every size.
+
+  Returns:
+    a list of result dictionaries (the best of repeat runs).
+  """
+  has_m2pb = distutils.spawn.find_executable(splice.M2PB) is not None
+  results = []
+  for size in sizes:
+    filename = os.path.join(work_dir, 'bench_%i.ts' % size)
+    generator = ts_gen.write_stream(filename, size)
+    packets = generator.packets
+    for target in targets:
+      result = {'target': target, 'size': os.path.getsize(filename),
+                'packets': packets}
+      if TARGETS[target][1] and not has_m2pb:
+        result['status'] = 'skipped'
+      else:
+        runs = [run_target(target, filename, size, work_dir)
+                for _ in range(repeat)]
+        ok_runs = [run for run in runs if run['status'] == 'ok']
+        result.update(min(ok_runs, key=lambda run: run['elapsed'])
+                      if ok_runs else runs[-1])
+        if result['status'] == 'ok':
+          result['packets_per_second'] = packets / (result['elapsed'] or
+                                                    1e-9)
+      if debug >= 0:
+        sys.stderr.write('%s\n' % get_result_str(result))
+      results.append(result)
+    os.remove(filename)
+  return results
+
+
+def get_result_str(result, baseline=None):
+  s = '%-12s %6.1f MB' % (result['target'], result['size'] / 1e6)
+  if result['status'] != 'ok':
+    return '%s  %s %s' % (s, result['status'], result.get('error', ''))
+  s += '  %8.3f s  %10.0f packets/s  %7i KB rss' % (result['elapsed'],
+      result['packets_per_second'], result['peak_rss_kb'])
+  if baseline is not None and baseline.get('status') == 'ok':
+    s += '  (%.2fx)' % (result['packets_per_second'] /
+                        baseline['packets_per_second'])
+  return s
+
+
+def compare(results, baseline_results):
+  """Prints every result next to its speedup over the baseline."""
+  baseline = dict(((r['target'], r['size']), r) for r in baseline_results)
+  for result in results:
+    print get_result_str(result, baseline.get((result['target'],
+                                               result['size'])))
+
+
+def get_opts(argv):
+  parser = argparse.ArgumentParser(description='m2pb tools benchmarks.')
+  parser.add_argument('-d', '--debug', dest='debug', default=0,
+      action='count',
+      help='Increase verbosity (specify multiple times for more)')
+  parser.add_argument('--quiet', action='store_const',
+      dest='debug', const=-1,
+      help='Zero verbosity',)
+  parser.add_argument('--sizes', action='store',
+      dest='sizes', default=','.join(str(s) for s in DEFAULT_SIZES_MB),
+      help='comma-separated stream sizes (MB)',)
+  parser.add_argument('--targets', action='store',
+      dest='targets', default=','.join(DEFAULT_TARGETS),
+      help='comma-separated targets (%s)' % ', '.join(sorted(TARGETS)),)
+  parser.add_argument('--repeat', action='store',
+      dest='repeat', type=int, default=DEFAULT_REPEAT,
+      help='runs per target (the best one is reported)',)
+  parser.add_argument('--work-dir', action='store',
+      dest='work_dir', default=None,
+      help='where to write the streams (default: a temporary directory)',)
+  parser.add_argument('-o', '--output', action='store',
+      dest='output_filename', default=None,
+      metavar='OUTPUT_FILENAME',
+      help='JSON results file ("-" for stdout)',)
+  parser.add_argument('--baseline', action='store',
+      dest='baseline_filename', default=None,
+      metavar='BASELINE_FILENAME',
+      help='JSON results of a previous run to compare against',)
+  return parser.parse_args(argv[1:])
+
+
+def main(argv):
+  vals = get_opts(argv)
+  sizes = [int(float(size) * (1 << 20)) for size in vals.sizes.split(',')]
+  targets = vals.targets.split(',')
+  for target in targets:
+    if target not in TARGETS:
+      print 'error: invalid target: %s' % target
+      sys.exit(-1)
+  work_dir = vals.work_dir or tempfile.mkdtemp(prefix='m2pb_bench_')
+  try:
+    results = run_benchmarks(sizes, targets, work_dir, vals.repeat,
+                             vals.debug)
+  finally:
+    if vals.work_dir is None:
+      shutil.rmtree(work_dir)
+  report = {
+      'version': BENCHMARK_VERSION,
+      'date': datetime.datetime.now().isoformat(),
+      'hostname': socket.gethostname(),
+      'python': sys.version.split()[0],
+      'results': results,
+  }
+  if vals.output_filename == '-':
+    json.dump(report, sys.stdout, indent=1, sort_keys=True)
+  elif vals.output_filename is not None:
+    with open(vals.output_filename, 'w') as f:
+      json.dump(report, f, indent=1, sort_keys=True)
+  if vals.baseline_filename is not None:
+    with open(vals.baseline_filename) as f:
+      compare(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""Single-pass MPTS (multi-program) to SPTS (single-program) demuxing.
+
+The input is read once: it is mmap'ed and processed in chunks of packets,
+and every chunk is routed by pid to the outputs of all the programs (a
+pid shared by several programs, e.g. a common pcr pid, goes to all of
+them). Every output gets its own single-program PAT, which replaces the
+input PAT packets (with its own continuity counter). Null packets, and
+the pids not referenced by any selected program, are dropped.
+
+The packets of a program in a chunk are gathered with numpy, and written
+with a single write, so an N-program split costs one read of the input,
+and one (large) write per program and chunk.
+
+The programs are learnt from the first PAT of the file, and the first
+PMT of every program (the file is scanned until all of them are found).
+The pids of a program are then re-derived from every PMT with a new
+version_number, from the packet carrying it on. (PMT sections crossing a
+chunk boundary are missed, but PMTs are repeated.) Gaps (bytes that are
+not part of any packet) are not copied.
+"""
+
+import argparse
+import numpy
+import os
+import sys
+import time
+import psi_utils
+import ts_view
+
+# packets per chunk (~12 MB)
+DEFAULT_CHUNK_PACKETS = 1 << 16
+STUFFING_BYTE = 0xff
+
+
+def find_programs(data, runs, stride=ts_view.MPEG_TS_PACKET_SIZE,
+                  chunk_packets=DEFAULT_CHUNK_PACKETS, program_numbers=None):
+  """Finds the first PAT of a file, and the first PMT of its programs.
+
+  The file is scanned, chunk by chunk, until the PMTs of all the programs
+  are found.
+
+  Args:
+    data: the file data
+    runs: the packet runs of data (see ts_view.get_packet_runs())
+    stride: the packet size
+    chunk_packets: number of packets scanned at once
+    program_numbers: only look for the PMTs of these programs (default:
+        all of them)
+
+  Returns:
+    a (pat, programs) tuple, where pat is the PAT section (None if there
+    is none), and programs a dictionary mapping every program_number to
+    a (pmt_pid, pmt) tuple (pmt is the PMT section, or None if the file
+    has none).
+  """
+  packets = sum(length for _, length in runs)
+  pat = None
+  programs = {}
+  for start in range(0, packets, chunk_packets):
+    view = ts_view.HeaderView(data, ts_view.get_run_offsets(runs, start,
+        start + chunk_packets, stride), stride=stride)
+    if pat is None:
+      pat = psi_utils.get_section(view, psi_utils.PAT_PID)
+      if psi_utils.parse_pat(pat) is None:
+        pat = None
+        continue
+      # (program 0 is the network pid)
+      programs = dict((program_number, (pmt_pid, None)) for
+          program_number, pmt_pid in psi_utils.parse_pat(pat).iteritems()
+          if program_number != 0)
+    missing = [program_number for program_number, (_, pmt) in
+               programs.iteritems() if pmt is None and
+               (program_numbers is None or program_number in program_numbers)]
+    for program_number in missing:
+      pmt_pid = programs[program_number][0]
+      for _, section in psi_utils.iter_sections(view, pmt_pid):
+        pmt = psi_utils.parse_pmt(section)
+        # (several programs may share a PMT pid)
+        if pmt is not None and pmt['program_number'] == program_number:
+          programs[program_number] = (pmt_pid, section)
+          break
+    if all(programs[program_number][1] is not None
+           for program_number in missing):
+      break
+  return pat, programs
+
+
+def get_program_pids(pmt_pid, pmt):
+  """Returns the pids of a program (its PMT, pcr, and elementary pids)."""
+  pids = set([pmt_pid])
+  if pmt is not None:
+    pids.update(pid for pid, _ in pmt['streams'])
+    pids.add(pmt['pcr_pid'])
+  pids.discard(psi_utils.NO_PCR_PID)
+  return pids
+
+
+def make_pat(pat, program_number, pmt_pid):
+  """Returns a single-program PAT section.
+
+  Args:
+    pat: the input PAT section (its header, i.e. the transport_stream_id
+        and version, is kept)
+    program_number, pmt_pid: the program
+  """
+  body = bytearray([program_number >> 8, program_number & 0xff,
+                    0xe0 | (pmt_pid >> 8), pmt_pid & 0xff])
+  return psi_utils.make_section(
+      bytearray(pat[:psi_utils.PSI_SECTION_HEADER_SIZE]), body)
+
+
+def make_pat_packet(section, stride=ts_view.MPEG_TS_PACKET_SIZE):
+  """Returns a (stride-sized) PAT packet carrying a section, as a row.
+
+  The continuity_counter is 0, and the prefix (any M2TS header) is zero.
+  """
+  payload = bytearray([0x47, 0x40 | (psi_utils.PAT_PID >> 8),
+                       psi_utils.PAT_PID & 0xff, 0x10, 0x00]) + section
+  payload += bytearray([STUFFING_BYTE]) * (ts_view.MPEG_TS_PACKET_SIZE -
+                                           len(payload))
+  row = numpy.zeros(stride, dtype=numpy.uint8)
+  prefix = ts_view.get_prefix_size(stride)
+  row[prefix:prefix + ts_view.MPEG_TS_PACKET_SIZE] = numpy.frombuffer(
+      bytes(payload), dtype=numpy.uint8)
+  return row
+
+
+class ProgramWriter(object):
+  """The output of a program.
+
+  Attributes:
+    program_number, pmt_pid: the program
+    version: the version_number of the current PMT
+    pids: a numpy array (indexed by pid) with whether the program uses
+        every pid (according to the current PMT)
+    pat_packet: the (stride-sized) single-program PAT packet
+    packets: the number of packets written
+    pmt_updates: the number of PMT version changes
+  """
+
+  def __init__(self, program_number, pmt_pid, pmt, pat, fout,
+               stride=ts_view.MPEG_TS_PACKET_SIZE):
+    self.program_number = program_number
+    self.pmt_pid = pmt_pid
+    self.set_pmt(pmt)
+    self.pat_packet = make_pat_packet(make_pat(pat, program_number, pmt_pid),
+                                      stride)
+    self.fout = fout
+    self.stride = stride
+    self._prefix = ts_view.get_prefix_size(stride)
+    self._pat_cc = 0
+    self.packets = 0
+    self.pmt_updates = 0
+
+  def set_pmt(self, pmt):
+    """Derives the pids of the program from a PMT section."""
+    self.version = psi_utils.get_version_number(pmt)
+    self.pids = numpy.zeros(ts_view.MAX_PID + 1, dtype=bool)
+    self.pids[list(get_program_pids(self.pmt_pid,
+                                    psi_utils.parse_pmt(pmt)))] = True
+
+  def get_pmt_updates(self, view):
+    """Returns the PMT sections of a view with a new version_number.
+
+    Returns:
+      a list of (index, section) tuples, in packet order.
+    """
+    updates = []
+    version = self.version
+    for index, section in psi_utils.iter_sections(view, self.pmt_pid):
+      pmt = psi_utils.parse_pmt(section)
+      if (pmt is None or pmt['program_number'] != self.program_number or
+          psi_utils.get_crc32(section)):
+        continue
+      if psi_utils.get_version_number(section) != version:
+        version = psi_utils.get_version_number(section)
+        updates.append((index, section))
+    return updates
+
+  def get_members(self, view):
+    """Returns whether every packet of a view belongs to the program.
+
+    PMT version changes are applied from the packet carrying them on.
+    """
+    members = self.pids[view.pid]
+    for index, section in self.get_pmt_updates(view):
+      self.set_pmt(section)
+      self.pmt_updates += 1
+      members[index:] = self.pids[view.pid[index:]]
+    return members
+
+  def write(self, data, offsets, pat_starts):
+    """Writes some packets.
+
+    Args:
+      data: the file data
+      offsets: the offsets of the packets (see ts_view.HeaderView)
+      pat_starts: whether every packet starts a PAT section (these are
+          replaced by the program PAT)
+    """
+    # (a writable copy)
+    out = numpy.asarray(data)[(offsets - self._prefix)[:, numpy.newaxis] +
+                              numpy.arange(self.stride)]
+    pat_rows = numpy.nonzero(pat_starts)[0]
+    if len(pat_rows):
+      i = self._prefix
+      # (keep the M2TS headers of the input PAT packets)
+      out[pat_rows, i:] = self.pat_packet[i:]
+      out[pat_rows, i + 3] = 0x10 | ((self._pat_cc +
+          numpy.arange(len(pat_rows))) & 0x0f)
+      self._pat_cc = (self._pat_cc + len(pat_rows)) & 0x0f
+    out.tofile(self.fout)
+    self.packets += len(out)
+
+
+class Demuxer(object):
+  """Routes the packets of a stream to the program writers, chunk by chunk."""
+
+  def __init__(self, writers, stride=ts_view.MPEG_TS_PACKET_SIZE):
+    self.writers = writers
+    self.stride = stride
+    # accounting
+    self.packets = 0
+    self.dropped = 0
+
+  def write(self, data, offsets):
+    """Routes the packets at offsets (see ts_view.HeaderView)."""
+    view = ts_view.HeaderView(data, offsets, stride=self.stride)
+    pat_starts = ((view.pid == psi_utils.PAT_PID) &
+                  view.payload_unit_start_indicator)
+    written = pat_starts.copy()
+    for writer in self.writers:
+      index = numpy.nonzero(writer.get_members(view) | pat_starts)[0]
+      writer.write(data, offsets[index], pat_starts[index])
+      written[index] = True
+    self.packets += len(offsets)
+    self.dropped += len(offsets) - numpy.count_nonzero(written)
+
+
+def get_output_filename(pattern, program_number):
+  """Returns the output file name of a program ("%i" in pattern)."""
+  return pattern % program_number
+
+
+def demux_file(filename, output_pattern, program_numbers=None, stride=None,
+               chunk_packets=DEFAULT_CHUNK_PACKETS):
+  """Splits a file into one file per program.
+
+  Args:
+    filename: the (regular) input file
+    output_pattern: the output file names (with a "%i" replaced by the
+        program_number)
+    program_numbers: the programs to write (default: all the programs
+        with a PMT)
+    stride: the packet size (detected from the file contents if None)
+    chunk_packets: number of packets processed at once
+
+  Returns:
+    a dictionary with the number of input and dropped packets, the
+    "programs" (a dictionary mapping every program_number to its output
+    file name, number of packets, and number of PMT version changes),
+    and the "skipped_programs" (the programs of the PAT without a PMT).
+
+  Raises:
+    ValueError: if the file has no PAT, or some program_numbers are not
+        in it, or have no PMT.
+  """
+  data = ts_view.open_file(filename)
+  if stride is None:
+    stride = ts_view.detect_stride(data)
+  runs, _ = ts_view.get_packet_runs(data, stride)
+  packets = sum(length for _, length in runs)
+  pat, programs = find_programs(data, runs, stride, chunk_packets,
+                                program_numbers)
+  if pat is None:
+    raise ValueError('no PAT in %s' % filename)
+  skipped = sorted(program_number for program_number, (_, pmt) in
+                   programs.iteritems() if pmt is None)
+  if program_numbers is None:
+    program_numbers = sorted(set(programs) - set(skipped))
+  else:
+    missing = sorted(set(program_numbers) - set(programs))
+    if missing:
+      raise ValueError('programs not in the PAT: %r' % missing)
+    missing = sorted(set(program_numbers) & set(skipped))
+    if missing:
+      raise ValueError('programs without a PMT: %r' % missing)
+    skipped = []
+  writers = []
+  demuxer = Demuxer(writers, stride)
+  try:
+    for program_number in program_numbers:
+      pmt_pid, pmt = programs[program_number]
+      writers.append(ProgramWriter(program_number, pmt_pid, pmt, pat,
+          open(get_output_filename(output_pattern, program_number), 'wb'),
+          stride))
+    for start in range(0, packets, chunk_packets):
+      demuxer.write(data, ts_view.get_run_offsets(runs, start,
+                                                  start + chunk_packets,
+                                                  stride))
+  finally:
+    for writer in writers:
+      writer.fout.close()
+  return {
+      'input_packets': demuxer.packets,
+      'dropped_packets': demuxer.dropped,
+      'programs': dict((writer.program_number, {
+          'filename': writer.fout.name,
+          'packets': writer.packets,
+          'pmt_updates': writer.pmt_updates,
+      }) for writer in writers),
+      'skipped_programs': skipped,
+  }
+
+
+def get_opts(argv):
+  parser = argparse.ArgumentParser(
+      description='Split a multi-program mpeg-ts file (in a single pass).')
+  parser.add_argument('-d', '--debug', dest='debug', default=0,
+      action='count',
+      help='Increase verbosity (specify multiple times for more)')
+  parser.add_argument('--program', action='append',
+      dest='program_numbers', type=int, default=None,
+      metavar='PROGRAM_NUMBER',
+      help='write only this program (can be used multiple times)',)
+  parser.add_argument('-o', '--output', action='store',
+      dest='output_pattern', default=None,
+      metavar='OUTPUT_PATTERN',
+      help='output filenames, with "%%i" replaced by the program_number '
+          '(default: the input filename, with a "_%%i.ts" suffix)',)
+  parser.add_argument('input_file', nargs=1,
+      help='input file (a regular file)')
+  return parser.parse_args(argv[1:])
+
+
+def main(argv):
+  vals = get_opts(argv)
+  start = time.time()
+  output_pattern = vals.output_pattern
+  if output_pattern is None:
+    output_pattern = (os.path.splitext(vals.input_file[0])[0]
+                      .replace('%', '%%') + '_%i.ts')
+  try:
+    stats = demux_file(vals.input_file[0], output_pattern,
+                       vals.program_numbers)
+  except ValueError as e:
+    print 'error: %s' % e
+    sys.exit(-1)
+  if stats['skipped_programs']:
+    sys.stderr.write('warning: programs without a PMT (not written): %r\n' %
+                     stats['skipped_programs'])
+  if vals.debug > 0:
+    for program_number, program in sorted(stats['programs'].iteritems()):
+      sys.stderr.write('program %i: %i packets (%i PMT updates) to %s\n' % (
+          program_number, program['packets'], program['pmt_updates'],
+          program['filename']))
+    sys.stderr.write('%i packets in, %i dropped in %.3f secs\n' % (
+        stats['input_packets'], stats['dropped_packets'],
+        time.time() - start))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
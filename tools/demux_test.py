@@ -0,0 +1,182 @@
+#!/usr/bin/python
+
+"""Unit tests for demux.py."""
+
+import itertools
+import numpy
+import os
+import tempfile
+import unittest
+import demux
+import psi_utils
+import ts_gen
+import ts_view
+
+
+def make_pmt(version, audio_pid):
+  """Returns a PMT section of program 2 (video 491, and an audio pid)."""
+  return psi_utils.make_section(
+      bytearray([0x02, 0xb0, 0x00, 0x00, 0x02, 0xc1 | (version << 1), 0, 0]),
+      bytearray([0xe1, 0xeb, 0xf0, 0x00,
+                 ts_gen.STREAM_TYPE_H264, 0xe1, 0xeb, 0xf0, 0x00,
+                 ts_gen.STREAM_TYPE_AC3, 0xe0 | (audio_pid >> 8),
+                 audio_pid & 0xff, 0xf0, 0x00]))
+
+
+def write_mpts(filename, packets, drop_pids=(), switch_packet=None):
+  """Writes a 2-program stream (programs 1 and 2), with null packets.
+
+  Args:
+    filename: the output file
+    packets: the number of program packets
+    drop_pids: pids not written
+    switch_packet: from this packet on, program 2 has a new PMT version,
+        and its audio moves from pid 492 to 493 after the first new PMT
+        (None: never)
+  """
+  pat = ts_gen.make_section(0x00, 1, '\x00\x01\xe1\xe0\x00\x02\xe1\xea')
+  pat_packet = ('\x47\x40\x00\x10\x00' + pat +
+                '\xff' * (ts_gen.MPEG_TS_PACKET_SIZE - 5 - len(pat)))
+  null_packet = '\x47\x1f\xff\x10' + '\xff' * (ts_gen.MPEG_TS_PACKET_SIZE - 4)
+  program1 = ts_gen.StreamGenerator(pmt_pid=480, video_pid=481,
+                                    audio_pids=(482,)).iter_packets()
+  program2 = ts_gen.StreamGenerator(pmt_pid=490, video_pid=491,
+                                    audio_pids=(492,), seed=1).iter_packets()
+  with open(filename, 'wb') as f:
+    cc = 0
+    switched = False
+    for i, packet in enumerate(itertools.islice(
+        itertools.chain.from_iterable(itertools.izip(program1, program2)),
+        packets)):
+      pid = ((ord(packet[1]) & 0x1f) << 8) | ord(packet[2])
+      if pid in drop_pids:
+        continue
+      if pid == 0:
+        if i % 2:
+          # (a single PAT, from program 1)
+          continue
+        packet = pat_packet[:3] + chr(0x10 | cc) + pat_packet[4:]
+        cc = (cc + 1) & 0x0f
+      if pid == 490 and ord(packet[1]) & 0x40:
+        switched = switch_packet is not None and i >= switch_packet
+        # (the generator PMTs are all for program 1)
+        payload = '\x00' + (make_pmt(1, 493) if switched else
+                            make_pmt(0, 492))
+        packet = (packet[:3] + chr(0x10 | (ord(packet[3]) & 0x0f)) + payload +
+                  '\xff' * (ts_gen.MPEG_TS_PACKET_SIZE - 4 - len(payload)))
+      elif pid == 492 and switched:
+        packet = (packet[0] + chr(ord(packet[1]) & 0xe0 | 0x01) + '\xed' +
+                  packet[3:])
+      f.write(packet)
+      if i % 7 == 0:
+        f.write(null_packet)
+
+
+class DemuxTest(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    fd, cls.filename = tempfile.mkstemp(suffix='.ts')
+    os.close(fd)
+    write_mpts(cls.filename, 10000)
+
+  @classmethod
+  def tearDownClass(cls):
+    os.remove(cls.filename)
+
+  def setUp(self):
+    self.output_dir = tempfile.mkdtemp()
+    self.output_pattern = os.path.join(self.output_dir, 'out_%i.ts')
+
+  def tearDown(self):
+    for name in os.listdir(self.output_dir):
+      os.remove(os.path.join(self.output_dir, name))
+    os.rmdir(self.output_dir)
+
+  def testDemuxFile(self):
+    in_view = ts_view.open_view(self.filename)
+    # (with 1-packet chunks, the PMTs are not in the first chunk)
+    for chunk_packets in (demux.DEFAULT_CHUNK_PACKETS, 7, 1):
+      stats = demux.demux_file(self.filename, self.output_pattern,
+                               chunk_packets=chunk_packets)
+      self.assertEqual([1, 2], sorted(stats['programs']))
+      self.assertEqual([], stats['skipped_programs'])
+      self.assertEqual(numpy.sum(in_view.pid == ts_view.NULL_PID),
+                       stats['dropped_packets'])
+      for program_number, pmt_pid, pids in ((1, 480, [481, 482]),
+                                            (2, 490, [491, 492])):
+        filename = self.output_pattern % program_number
+        self.assertEqual(filename,
+                         stats['programs'][program_number]['filename'])
+        view = ts_view.open_view(filename)
+        self.assertEqual(stats['programs'][program_number]['packets'],
+                         len(view))
+        self.assertEqual([psi_utils.PAT_PID, pmt_pid] + pids,
+                         numpy.unique(view.pid).tolist())
+        # a single-program PAT (with a valid crc)
+        pat = psi_utils.get_section(view, psi_utils.PAT_PID)
+        self.assertEqual(0, psi_utils.get_crc32(pat))
+        self.assertEqual({program_number: pmt_pid}, psi_utils.parse_pat(pat))
+        # a continuous PAT continuity_counter
+        index = numpy.nonzero(view.pid == psi_utils.PAT_PID)[0]
+        self.assertEqual(numpy.sum(in_view.pid == psi_utils.PAT_PID),
+                         len(index))
+        cc = view.data[view.offsets[index] + 3] & 0x0f
+        self.assertTrue(numpy.all(numpy.diff(cc) % 16 == 1))
+        # the other packets are unchanged, in order
+        in_index = numpy.nonzero(numpy.isin(in_view.pid, [pmt_pid] + pids))[0]
+        index = numpy.nonzero(view.pid != psi_utils.PAT_PID)[0]
+        self.assertTrue(numpy.array_equal(
+            in_view.data[in_view.offsets[in_index][:, numpy.newaxis] +
+                         numpy.arange(ts_view.MPEG_TS_PACKET_SIZE)],
+            view.data[view.offsets[index][:, numpy.newaxis] +
+                      numpy.arange(ts_view.MPEG_TS_PACKET_SIZE)]))
+
+  def testPrograms(self):
+    stats = demux.demux_file(self.filename, self.output_pattern,
+                             program_numbers=[2])
+    self.assertEqual([2], stats['programs'].keys())
+    self.assertEqual(['out_2.ts'], os.listdir(self.output_dir))
+    self.assertRaises(ValueError, demux.demux_file, self.filename,
+                      self.output_pattern, program_numbers=[3])
+
+  def testMissingPmt(self):
+    fd, filename = tempfile.mkstemp(suffix='.ts')
+    os.close(fd)
+    try:
+      write_mpts(filename, 1000, drop_pids=(490,))
+      stats = demux.demux_file(filename, self.output_pattern, chunk_packets=7)
+      self.assertEqual([1], stats['programs'].keys())
+      self.assertEqual([2], stats['skipped_programs'])
+      self.assertRaises(ValueError, demux.demux_file, filename,
+                        self.output_pattern, program_numbers=[2])
+    finally:
+      os.remove(filename)
+
+  def testPmtUpdate(self):
+    fd, filename = tempfile.mkstemp(suffix='.ts')
+    os.close(fd)
+    try:
+      write_mpts(filename, 10000, switch_packet=5000)
+      in_view = ts_view.open_view(filename)
+      for chunk_packets in (demux.DEFAULT_CHUNK_PACKETS, 7):
+        stats = demux.demux_file(filename, self.output_pattern,
+                                 chunk_packets=chunk_packets)
+        self.assertEqual(0, stats['programs'][1]['pmt_updates'])
+        self.assertEqual(1, stats['programs'][2]['pmt_updates'])
+        self.assertEqual(numpy.sum(in_view.pid == ts_view.NULL_PID),
+                         stats['dropped_packets'])
+        view = ts_view.open_view(self.output_pattern % 2)
+        self.assertEqual([psi_utils.PAT_PID, 490, 491, 492, 493],
+                         numpy.unique(view.pid).tolist())
+        self.assertEqual(numpy.sum(in_view.pid == 493),
+                         numpy.sum(view.pid == 493))
+        view = ts_view.open_view(self.output_pattern % 1)
+        self.assertEqual([psi_utils.PAT_PID, 480, 481, 482],
+                         numpy.unique(view.pid).tolist())
+    finally:
+      os.remove(filename)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""A disk cache of per-packet analysis results (e.g. "m2pb dump" columns).
+
+Results are stored as compressed npz files (one numpy array per column),
+keyed by the identity of the analyzed file (path, size, and mtime) and
+by the analysis fields, so that modifying the file invalidates them.
+The cache is kept under a disk budget by evicting the least recently
+used entries.
+"""
+
+import hashlib
+import numpy
+import os
+import sys
+import tempfile
+import m2pb_pipe
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'm2pb')
+DEFAULT_CACHE_BYTES = 1 << 30
+CACHE_SUFFIX = '.npz'
+
+M2PB = 'm2pb'
+# dump fields that are not numbers
+STRING_FIELDS = ('type',)
+# numeric value of the "-" (unset) dump fields
+INVALID_VALUE = -1
+
+
+def get_key(filename, fields):
+  """Returns the cache key of the analysis fields of a file."""
+  st = os.stat(filename)
+  key = repr((CACHE_VERSION, os.path.abspath(filename), st.st_size,
+              st.st_mtime, tuple(fields)))
+  return hashlib.sha1(key).hexdigest()
+
+
+class DumpCache(object):
+  """An LRU cache of column dictionaries, under a disk budget."""
+
+  def __init__(self, cache_dir=DEFAULT_CACHE_DIR,
+               max_bytes=DEFAULT_CACHE_BYTES):
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+
+  def _get_path(self, filename, fields):
+    return os.path.join(self.cache_dir, get_key(filename, fields) +
+                        CACHE_SUFFIX)
+
+  def get(self, filename, fields):
+    """Returns the cached columns (a dict of numpy arrays), or None."""
+    path = self._get_path(filename, fields)
+    try:
+      with numpy.load(path) as npz:
+        columns = dict((name, npz[name]) for name in npz.files)
+      # mark the entry as recently used
+      os.utime(path, None)
+    except (IOError, OSError, ValueError):
+      return None
+    return columns
+
+  def put(self, filename, fields, columns):
+    """Stores the columns (a dict of numpy arrays) of a file."""
+    if not os.path.isdir(self.cache_dir):
+      os.makedirs(self.cache_dir)
+    path = self._get_path(filename, fields)
+    # write atomically (concurrent readers never see partial entries)
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        numpy.savez_compressed(f, **columns)
+      os.rename(tmp_path, path)
+    except:
+      os.remove(tmp_path)
+      raise
+    self.evict()
+
+  def evict(self):
+    """Removes the least recently used entries over the disk budget."""
+    entries = []
+    for name in os.listdir(self.cache_dir):
+      if not name.endswith(CACHE_SUFFIX):
+        continue
+      path = os.path.join(self.cache_dir, name)
+      try:
+        st = os.stat(path)
+      except OSError:
+        continue
+      entries.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+      if total <= self.max_bytes:
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+      total -= size
+
+
+def parse_dump_lines(lines, fields):
+  """Converts "m2pb dump" lines into columns.
+
+  Args:
+    lines: the dump lines
+    fields: the dump fields (in command-line order)
+
+  Returns:
+    a dictionary mapping every field to a numpy array. Numeric fields
+    are int64 (INVALID_VALUE when unset), and STRING_FIELDS are strings.
+    Invalid lines are ignored.
+  """
+  rows = [line.split() for line in lines]
+  rows = [row for row in rows if len(row) == len(fields)]
+  table = numpy.array(rows, dtype=str).reshape(-1, len(fields))
+  columns = {}
+  for i, field in enumerate(fields):
+    column = table[:, i]
+    if field not in STRING_FIELDS:
+      unset = column == '-'
+      column = numpy.where(unset, str(INVALID_VALUE), column)
+      try:
+        column = column.astype(numpy.int64)
+      except ValueError:
+        # not a number (e.g. a raw packet): unset
+        column = numpy.array([long(x) if x.lstrip('-').isdigit() else
+                              INVALID_VALUE for x in column],
+                             dtype=numpy.int64)
+    else:
+      # use the narrowest string type
+      column = numpy.array(column.tolist(), dtype=str)
+    columns[field] = column
+  return columns
+
+
+def concatenate_columns(blocks, fields):
+  """Concatenates the column dictionaries of some blocks."""
+  if not blocks:
+    return parse_dump_lines([], fields)
+  return dict((field, numpy.concatenate([block[field] for block in blocks]))
+              for field in fields)
+
+
+def iter_dump(input_file, fields, debug=0, cache=None, progress=None):
+  """Yields the "m2pb dump" columns of a file, block by block.
+
+  The m2pb output is parsed one read block at a time (see
+  m2pb_pipe.M2pbReader.iter_blocks()), so only the typed columns (and
+  not the dump lines) are kept. A regular file found in the cache is a
+  single block. Otherwise, its blocks are added to the cache once the
+  dump is complete. progress (a progress.Progress), if set, is ticked
+  once per dumped packet.
+
+  Yields:
+    column dictionaries (see parse_dump_lines()).
+  """
+  cacheable = cache is not None and os.path.isfile(input_file)
+  if cacheable:
+    columns = cache.get(input_file, fields)
+    if columns is not None:
+      if debug > 0:
+        print '#using cached dump of %s' % input_file
+      yield columns
+      return
+  command = [M2PB] + ['--%s' % field for field in fields] + ['dump']
+  if debug > 0:
+    print ' '.join(command + [input_file])
+  reader = m2pb_pipe.M2pbReader(command, input_file, debug)
+  blocks = []
+  try:
+    for lines in reader.iter_blocks():
+      columns = parse_dump_lines(lines, fields)
+      if progress is not None and progress.tick(len(lines)):
+        progress.report()
+      if cacheable:
+        blocks.append(columns)
+      yield columns
+  finally:
+    reader.close()
+  if debug > 0 or reader.source is not None:
+    sys.stderr.write('%s\n' % reader.get_stats_str())
+  if cacheable:
+    cache.put(input_file, fields, concatenate_columns(blocks, fields))
+
+
+def get_dump(input_file, fields, debug=0, cache=None, progress=None):
+  """Returns the "m2pb dump" columns of a file (see iter_dump())."""
+  return concatenate_columns(list(iter_dump(input_file, fields, debug, cache,
+                                            progress)), fields)
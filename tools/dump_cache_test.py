@@ -0,0 +1,122 @@
+#!/usr/bin/python
+
+"""Unit tests for dump_cache.py."""
+
+import numpy
+import os
+import shutil
+import tempfile
+import unittest
+import dump_cache
+
+FIELDS = ('packet', 'pts', 'pusi', 'pid', 'type')
+DUMP_BLOCKS = [
+    ['0 - 1 0 - ', '1 8589934591 1 481 I '],
+    ['2 - 0 - - ', 'invalid line'],
+    ['3 3003 1 481 PB '],
+]
+
+
+class FakeReader(object):
+  """An M2pbReader returning DUMP_BLOCKS (instead of running m2pb)."""
+
+  def __init__(self, command, spec, debug=0):
+    self.source = None
+    self.closed = False
+
+  def iter_blocks(self):
+    for lines in DUMP_BLOCKS:
+      yield lines
+
+  def close(self):
+    self.closed = True
+
+
+class DumpCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+    fd, self.filename = tempfile.mkstemp(suffix='.ts')
+    with os.fdopen(fd, 'wb') as f:
+      f.write('\x47' * 188 * 10)
+
+  def tearDown(self):
+    shutil.rmtree(self.cache_dir)
+    os.remove(self.filename)
+
+  def testParseDumpLines(self):
+    columns = dump_cache.parse_dump_lines([
+        '0 - 1 0 - ',
+        '1 8589934591 1 481 I ',
+        'invalid line',
+        '2 - 0 - - ',
+    ], FIELDS)
+    self.assertEqual([0, 1, 2], list(columns['packet']))
+    self.assertEqual([-1, (1 << 33) - 1, -1], list(columns['pts']))
+    self.assertEqual([1, 1, 0], list(columns['pusi']))
+    self.assertEqual([0, 481, -1], list(columns['pid']))
+    self.assertEqual(['-', 'I', '-'], list(columns['type']))
+    self.assertEqual(numpy.dtype('S1'), columns['type'].dtype)
+    columns = dump_cache.parse_dump_lines([], FIELDS)
+    self.assertEqual(0, len(columns['pts']))
+
+  def testIterDump(self):
+    reader_class = dump_cache.m2pb_pipe.M2pbReader
+    dump_cache.m2pb_pipe.M2pbReader = FakeReader
+    try:
+      cache = dump_cache.DumpCache(self.cache_dir)
+      blocks = list(dump_cache.iter_dump(self.filename, FIELDS, cache=cache))
+      # typed columns, one dictionary per block
+      self.assertEqual([2, 1, 1], [len(block['pid']) for block in blocks])
+      self.assertEqual(numpy.int64, blocks[0]['pts'].dtype)
+      columns = dump_cache.get_dump(self.filename, FIELDS, cache=cache)
+      self.assertEqual([0, 1, 2, 3], list(columns['packet']))
+      self.assertEqual([0, 481, -1, 481], list(columns['pid']))
+      self.assertEqual(['-', 'I', '-', 'PB'], list(columns['type']))
+      # (the complete dump is cached)
+      self.assertEqual([0, 1, 2, 3],
+                       list(cache.get(self.filename, FIELDS)['packet']))
+      # no blocks
+      self.assertEqual(0, len(dump_cache.concatenate_columns([], FIELDS)
+                              ['pts']))
+    finally:
+      dump_cache.m2pb_pipe.M2pbReader = reader_class
+
+  def testCache(self):
+    cache = dump_cache.DumpCache(self.cache_dir)
+    columns = {'pts': numpy.arange(10), 'type': numpy.array(['I', 'P'])}
+    self.assertEqual(None, cache.get(self.filename, FIELDS))
+    cache.put(self.filename, FIELDS, columns)
+    cached = cache.get(self.filename, FIELDS)
+    self.assertEqual(sorted(columns), sorted(cached))
+    self.assertEqual(list(columns['pts']), list(cached['pts']))
+    self.assertEqual(list(columns['type']), list(cached['type']))
+    # different fields
+    self.assertEqual(None, cache.get(self.filename, FIELDS[:-1]))
+    # modified file
+    with open(self.filename, 'ab') as f:
+      f.write('\x47' * 188)
+    self.assertEqual(None, cache.get(self.filename, FIELDS))
+
+  def testEviction(self):
+    cache = dump_cache.DumpCache(self.cache_dir)
+    columns = {'pts': numpy.random.randint(0, 1 << 33, 10000)}
+    cache.put(self.filename, ('a',), columns)
+    size = os.path.getsize(os.path.join(self.cache_dir,
+                                        os.listdir(self.cache_dir)[0]))
+    # room for 2 entries
+    cache.max_bytes = 2 * size + size // 2
+    cache.put(self.filename, ('b',), columns)
+    # make "a" the oldest entry, and then use it
+    for name in os.listdir(self.cache_dir):
+      os.utime(os.path.join(self.cache_dir, name), (0, 0))
+    self.assertNotEqual(None, cache.get(self.filename, ('a',)))
+    cache.put(self.filename, ('c',), columns)
+    self.assertEqual(2, len(os.listdir(self.cache_dir)))
+    self.assertNotEqual(None, cache.get(self.filename, ('a',)))
+    self.assertEqual(None, cache.get(self.filename, ('b',)))
+    self.assertNotEqual(None, cache.get(self.filename, ('c',)))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -4,16 +4,27 @@
 
 import argparse
 import datetime
+import dump_cache
+import h264_utils
 import matplotlib as mpl
 import matplotlib.pyplot as plt
+import m2pb_pipe
 import modulo
 import numpy
 import os.path
 import pandas as pd
+import perf_counters
+import progress
+import psi_utils
 import pts_utils
 import re
 import subprocess
 import sys
+import totxt_utils
+import ts_sample
+import ts_scan
+import ts_source
+import ts_view
 
 M2PB = 'm2pb'
 
@@ -23,6 +34,27 @@ M2PB = 'm2pb'
 DEFAULT_PACKET_LENGTH = 10000
 # marker size for non-pusi packets
 NON_PUSI_MARKERSIZE = 3
+# maximum number of points in decimated plots
+MAX_PLOT_POINTS = 10000
+
+# maximum pcr interval (ISO/IEC 13818-1 2.7.2)
+PCR_MAX_INTERVAL_MS = 40
+# maximum pcr inaccuracy (ISO/IEC 13818-1 2.4.2.2)
+PCR_MAX_ACCURACY_NS = 500
+DEFAULT_PCR_WINDOW_MS = 1000
+
+# packets at the start of a file where to look for the PAT and PMTs
+PSI_SCAN_PACKETS = 1 << 17
+
+# m2pb dump fields used by the pts plot
+DUMP_FIELDS = ('packet', 'pts', 'pusi', 'pid', 'type')
+# frame summary columns
+SUMMARY_COLUMNS = ('type', 'pts', 'packet', 'byte', 'gop', 'frame_index',
+    'video_packets', 'audio_packets', 'other_packets')
+# analyses of the run subcommand (in output order)
+RUN_ANALYSES = ('pts', 'summary', 'sample', 'stats')
+# an escaped h.264 start code in "m2pb totxt" data_bytes
+ESCAPED_START_CODE = '\\000\\000\\001'
 
 mod = modulo.Modulo(pts_utils.kPtsMaxValue, pts_utils.kPtsInvalid)
 
@@ -69,6 +101,43 @@ def get_opts(argv):
   parser.add_argument('--pusi-skip', action='store_const',
       dest='pusi_skip', default=False, const=True,
       help='Skip samples without pusi',)
+  parser.add_argument('-j', '--jobs', action='store',
+      dest='jobs', type=int, default=ts_scan.get_default_jobs(),
+      metavar='JOBS',
+      help='number of processes scanning (regular) files',)
+  parser.add_argument('--cache-dir', action='store',
+      dest='cache_dir', default=dump_cache.DEFAULT_CACHE_DIR,
+      metavar='CACHE_DIR',
+      help='where to cache dump and summary results of (regular) files',)
+  parser.add_argument('--cache-size', action='store',
+      dest='cache_size', type=int,
+      default=dump_cache.DEFAULT_CACHE_BYTES >> 20,
+      metavar='CACHE_SIZE_MB',
+      help='disk budget of the cache (in MB)',)
+  parser.add_argument('--no-cache', action='store_const',
+      dest='cache_dir', const=None,
+      help='do not cache results',)
+  parser.add_argument('--profile', action='store',
+      dest='profile_filename', default=None,
+      metavar='PROFILE_FILENAME',
+      help='run under cProfile, and dump the stats into PROFILE_FILENAME',)
+  parser.add_argument('--counters', action='store',
+      dest='counters_filename',
+      default=os.environ.get(perf_counters.COUNTERS_ENV),
+      metavar='COUNTERS_FILENAME',
+      help='write the stage timers and row counts as JSON ("-" for '
+          'stderr, default: $%s)' % perf_counters.COUNTERS_ENV,)
+  parser.add_argument('--progress', action='store', nargs='?',
+      dest='progress_interval', type=float, default=None,
+      const=progress.DEFAULT_INTERVAL,
+      metavar='SECONDS',
+      help='report the progress to stderr every SECONDS (default: %s)' %
+          progress.DEFAULT_INTERVAL,)
+  parser.add_argument('--metrics-file', action='store',
+      dest='metrics_filename', default=None,
+      metavar='METRICS_FILENAME',
+      help='also write the progress metrics into METRICS_FILENAME '
+          '(Prometheus text format)',)
   parser.add_argument('-v', '--version', action='version',
       version='%(prog)s 1.0')
   # add sub-parsers
@@ -80,20 +149,84 @@ def get_opts(argv):
   parser_summary.set_defaults(subcommand='summary')
   parser_sample = subparsers.add_parser('sample', help='sample')
   parser_sample.set_defaults(subcommand='sample')
+  parser_pcr = subparsers.add_parser('pcr',
+      help='pcr bitrate, interval, and accuracy analysis')
+  parser_pcr.set_defaults(subcommand='pcr')
+  parser_pcr.add_argument('--pcr-pid', action='store',
+      dest='pcr_pid', type=int, default=None,
+      metavar='PCR_PID',
+      help='specify pcr pid (default: the pid carrying most pcrs)',)
+  parser_pcr.add_argument('--window', action='store',
+      dest='window_ms', type=int, default=DEFAULT_PCR_WINDOW_MS,
+      metavar='WINDOW_MS',
+      help='bitrate window length (in ms)',)
+  parser_cc = subparsers.add_parser('cc',
+      help='continuity counter and transport error check')
+  parser_cc.set_defaults(subcommand='cc')
+  parser_stats = subparsers.add_parser('stats',
+      help='per-pid packet, pts, and cc statistics')
+  parser_stats.set_defaults(subcommand='stats')
+  parser_stats.add_argument('--sample-chunks', action='store',
+      dest='sample_chunks', type=int, default=None,
+      metavar='CHUNKS',
+      help='estimate the stats from CHUNKS windows only (default: read '
+          'the whole file)',)
+  parser_stats.add_argument('--sample-rate', action='store',
+      dest='sample_rate', type=float, default=None,
+      metavar='FRACTION',
+      help='estimate the stats from windows covering FRACTION of the file',)
+  parser_stats.add_argument('--sample-window', action='store',
+      dest='sample_window', type=int,
+      default=ts_sample.DEFAULT_WINDOW_PACKETS,
+      metavar='PACKETS',
+      help='packets per sampled window (default: %i)' %
+          ts_sample.DEFAULT_WINDOW_PACKETS,)
+  parser_stats.add_argument('--sample-random', action='store_const',
+      dest='sample_random', default=False, const=True,
+      help='sample random windows (default: evenly spaced ones)',)
+  parser_stats.add_argument('--seed', action='store',
+      dest='seed', type=int, default=0,
+      metavar='SEED',
+      help='random seed of --sample-random (default: 0)',)
+  parser_index = subparsers.add_parser('index',
+      help='build a frame index (packet, byte, pid, pts, dts, type)')
+  parser_index.set_defaults(subcommand='index')
+  parser_run = subparsers.add_parser('run',
+      help='run several analyses on a single decode of the input')
+  parser_run.set_defaults(subcommand='run', analyses=[])
+  for analysis in RUN_ANALYSES:
+    parser_run.add_argument('--%s' % analysis, action='append_const',
+        dest='analyses', const=analysis,
+        help='run the %s analysis' % analysis,)
+  parser_run.add_argument('--pts-output', action='store',
+      dest='pts_output_filename', default=None,
+      metavar='PTS_OUTPUT_FILENAME',
+      help='pts plot filename (default: the input basename, plus .pdf)',)
+  parser_run.add_argument('--sample-output', action='store',
+      dest='sample_output_filename', default=None,
+      metavar='SAMPLE_OUTPUT_FILENAME',
+      help='sample output filename (default: stdout)',)
   # do the parsing
-  for p in (parser, parser_pts, parser_summary, parser_sample):
+  for p in (parser, parser_pts, parser_summary, parser_sample, parser_pcr,
+      parser_cc, parser_stats, parser_index):
     p.add_argument('-o', '--output', action='store',
         dest='output_filename',
         metavar='OUTPUT_FILENAME',
         help='output filename',)
-  for p in (parser_pts, parser_summary, parser_sample):
-    p.add_argument('input_file', nargs=1, help='input log file')
+  for p in (parser_pts, parser_summary, parser_sample, parser_pcr,
+      parser_cc, parser_stats, parser_index, parser_run):
+    p.add_argument('input_file', nargs=1,
+        help='input file ("-", a fifo, or udp://[host:]port for live input)')
     p.add_argument('remaining', nargs=argparse.REMAINDER)
   return parser.parse_args(argv[1:])
 
 
 videostr_pid = 481
 audiostr_pid_d = {482: 1, 483: 2}
+# stage timers and row counts of the current run
+counters = perf_counters.Counters()
+# progress reports of the current run (a progress.Progress, if enabled)
+progress_ = None
 pmtstr = ' program_map_section {'
 
 video_stream_type_l = [
@@ -307,31 +440,33 @@ def parse_pmt_old(l):
       i += 1
 
 
-def dump_frame_info(input_file, delta_l, debug, pusi_skip=False):
-  lst = []
-  command = [M2PB, '--packet', '--pts', '--pusi', '--pid', '--type',
-      'dump', input_file]
-  if debug > 0:
-    print ' '.join(command)
-  proc = subprocess.Popen(command, stdout=subprocess.PIPE)
-  last_pts_d = {}
-  start_pts = pts_utils.kPtsInvalid
-  pts_delta = 0
-  dumped_lines_d = {}
-  raw_packets = 0
-  for line in iter(proc.stdout.readline, ''):
-    l = line.rstrip()
-    packet, pts, pusi, pid, t = l.split()
-    packet = long(packet)
-    pts = long(pts) if pts != '-' else pts_utils.kPtsInvalid
-    pusi = (pusi == '1')
-    try:
-      pid = int(pid)
-    except ValueError:
-      # raw ts packet
-      raw_packets += 1
-    if pusi_skip and not pusi:
-      continue
+class PtsAnalysis(object):
+  """The pts plot rows of the audio and video packets."""
+
+  name = 'pts'
+
+  def __init__(self, input_file, delta_l, debug, pusi_skip=False,
+      plot_args=None):
+    self.input_file = input_file
+    self.delta_l = delta_l
+    self.debug = debug
+    self.pusi_skip = pusi_skip
+    # (filename, xmin, xmax, ymin, ymax) of the plot written by finalize()
+    self.plot_args = plot_args
+    self.lst = []
+    self.last_pts_d = {}
+    self.start_pts = pts_utils.kPtsInvalid
+    self.pts_delta = 0
+    self.dumped_lines_d = {}
+    self.raw_packets = 0
+
+  def add(self, packet, pts, pusi, pid, t):
+    if pid == dump_cache.INVALID_VALUE:
+      # raw ts packets have no pid
+      self.raw_packets += 1
+      return
+    if self.pusi_skip and not pusi:
+      return
 
     if pid == videostr_pid or pid in audiostr_pid_d.keys():
       # ensure a valid type
@@ -343,42 +478,75 @@ def dump_frame_info(input_file, delta_l, debug, pusi_skip=False):
       pts_orig = pts_utils.kPtsInvalid
       if pusi:
         pts_orig = pts
-        last_pts_d[pid] = pts_orig
-      elif pid in last_pts_d:
-        pts_orig = last_pts_d[pid]
+        self.last_pts_d[pid] = pts_orig
+      elif pid in self.last_pts_d:
+        pts_orig = self.last_pts_d[pid]
       # check the delta
-      if len(delta_l) > 0 and delta_l[0][0] == pts_orig:
+      if len(self.delta_l) > 0 and self.delta_l[0][0] == pts_orig:
         # set the new delta
-        pts_delta = delta_l[0][1]
-        print '#setting pts_delta: %i' % pts_delta
-        delta_l = delta_l[1:]
-      pts = mod.add(pts_orig, pts_delta)
-      if start_pts == pts_utils.kPtsInvalid:
-        start_pts = pts
-      if debug > 1:
+        self.pts_delta = self.delta_l[0][1]
+        print '#setting pts_delta: %i' % self.pts_delta
+        self.delta_l = self.delta_l[1:]
+      pts = mod.add(pts_orig, self.pts_delta)
+      if self.start_pts == pts_utils.kPtsInvalid:
+        self.start_pts = pts
+      if self.debug > 1:
         print '%i %i %i %i %s' % (packet, pts_orig, pts, pusi, t)
       if pts == pts_utils.kPtsInvalid:
-        if pid not in dumped_lines_d:
-          dumped_lines_d[pid] = 1
+        if pid not in self.dumped_lines_d:
+          self.dumped_lines_d[pid] = 1
         else:
-          dumped_lines_d[pid] += 1
-        if debug > 2:
-          print 'error: dumping %s' % line
+          self.dumped_lines_d[pid] += 1
+        if self.debug > 2:
+          print 'error: dumping %i %i %i %i %s' % (packet, pts, pusi, pid, t)
       else:
-        lst.append([packet, pts_orig, pts, pusi, t])
-
-  for pid in dumped_lines_d:
-    print 'error: dumped %i lines for pid %i' % (dumped_lines_d[pid], pid)
-
-  if not lst:
-    print 'error: no valid lines read from %r' % command
-    sys.exit(-1)
-
-  if raw_packets:
-    print 'warning: found %i raw packets' % raw_packets
-  return pd.DataFrame(lst, columns=['packet', 'pts_orig', 'pts', 'pusi',
-      'type'])
-  #return numpy.array(lst, dtype=dtype)
+        self.lst.append([packet, pts_orig, pts, pusi, t])
+
+  def consume(self, packet):
+    self.add(packet.packet, packet.pts, packet.pusi, packet.pid, packet.type)
+    return False
+
+  def get_frame_info(self):
+    counters.count('rows', len(self.lst))
+    counters.count('raw_packets', self.raw_packets)
+    counters.count('dumped_lines', sum(self.dumped_lines_d.itervalues()))
+    for pid in self.dumped_lines_d:
+      print 'error: dumped %i lines for pid %i' % (self.dumped_lines_d[pid],
+          pid)
+
+    if not self.lst:
+      print 'error: no valid lines read from %s' % self.input_file
+      sys.exit(-1)
+
+    if self.raw_packets:
+      print 'warning: found %i raw packets' % self.raw_packets
+    return pd.DataFrame(self.lst, columns=['packet', 'pts_orig', 'pts',
+        'pusi', 'type'])
+    #return numpy.array(lst, dtype=dtype)
+
+  def finalize(self):
+    df = self.get_frame_info()
+    if self.plot_args is not None:
+      with counters.timer('plot'):
+        do_plot(df, *self.plot_args)
+      print 'written file %s' % self.plot_args[0]
+
+
+def dump_frame_info(input_file, delta_l, debug, pusi_skip=False, cache=None):
+  # the dump columns are cached (the deltas are applied afterwards), and
+  # processed one block at a time
+  analysis = PtsAnalysis(input_file, delta_l, debug, pusi_skip)
+  t = perf_counters.get_ns()
+  for columns in dump_cache.iter_dump(input_file, DUMP_FIELDS, debug, cache,
+                                      progress_):
+    t = counters.add_time('dump', t)
+    for packet, pts, pusi, pid, frame_type in zip(*[columns[field].tolist()
+        for field in DUMP_FIELDS]):
+      analysis.add(packet, pts, pusi == 1, pid, frame_type)
+    counters.count('packets', len(columns['pid']))
+    t = counters.add_time('process', t)
+  counters.add_time('dump', t)
+  return analysis.get_frame_info()
 
 
 def dump_frame_info_inefficient(input_file, delta_l, debug, pusi_skip=False):
@@ -649,76 +817,181 @@ def do_plot(df, filename, xmin, xmax, ymin, ymax):
   plt.savefig(filename)
 
 
-def dump_frame_summary(input_file, delta_l, debug):
-  lst = []
-  command = [M2PB, '--packet', '--byte', '--pts', '--pid', '--type',
-      'dump', input_file]
+def get_scan_pids(input_file, video_pid, audio_pid_l):
+  """Returns the video and audio pids to scan in a (regular) file.
+
+  Pids not specified by the user are taken from the first PAT and PMTs.
+  """
+  video_pids = [video_pid] if video_pid else []
+  audio_pids = list(audio_pid_l)
+  if not video_pids or not audio_pids:
+    data = ts_view.open_file(input_file)
+    stride = ts_view.detect_stride(data)
+    head = data[:PSI_SCAN_PACKETS * stride]
+    streams = psi_utils.get_program_streams(ts_view.HeaderView(head,
+        ts_view.get_packet_offsets(head, stride), stride=stride))
+    if not video_pids:
+      video_pids = [pid for pid, stream_type in streams
+          if stream_type in video_stream_type_l]
+    if not audio_pids:
+      audio_pids = [pid for pid, stream_type in streams
+          if stream_type in audio_stream_type_l]
+  # default to the global values
+  return (video_pids or [videostr_pid],
+      audio_pids or sorted(audiostr_pid_d, key=audiostr_pid_d.get))
+
+
+def scan_file(input_file, video_pid, audio_pid_l, jobs, debug):
+  video_pids, audio_pids = get_scan_pids(input_file, video_pid, audio_pid_l)
   if debug > 0:
-    print ' '.join(command)
-  proc = subprocess.Popen(command, stdout=subprocess.PIPE)
-  last_pts_d = {}
-  start_pts = pts_utils.kPtsInvalid
-  pts_delta = 0
-  dumped_lines_d = {}
-  raw_packets = 0
-  # init counters
-  video_pkts_ = 0
-  audio_pkts_ = 0
-  other_pkts_ = 0
-  video_gop_cnt = -1
-  video_frame_index = 0
-  for line in iter(proc.stdout.readline, ''):
-    l = line.rstrip()
-    packet, byte, pts, pid, t = l.split()
-    pts = long(pts) if pts != '-' else pts_utils.kPtsInvalid
-    try:
-      pid = int(pid)
-    except ValueError:
+    print 'scanning %s (video: %r audio: %r jobs: %i)' % (input_file,
+        video_pids, audio_pids, jobs)
+  start = datetime.datetime.now()
+  scan = ts_scan.scan_file(input_file, video_pids, audio_pids, jobs)
+  if debug > 0:
+    elapsed = (datetime.datetime.now() - start).total_seconds()
+    sys.stderr.write('scanned %i packets in %.3f secs\n' % (scan.packets,
+        elapsed))
+  return scan, video_pids, audio_pids
+
+
+def get_summary_columns(input_file, video_pid, audio_pid_l, jobs, debug,
+    cache=None):
+  """Returns the summary rows of a regular file, as (cached) columns."""
+  fields = ('summary', video_pid) + tuple(audio_pid_l)
+  columns = cache.get(input_file, fields) if cache is not None else None
+  if columns is not None:
+    if debug > 0:
+      print '#using cached summary of %s' % input_file
+    return columns
+  scan, _, _ = scan_file(input_file, video_pid, audio_pid_l, jobs, debug)
+  columns = {}
+  for i, name in enumerate(SUMMARY_COLUMNS):
+    values = [row[i] for row in scan.rows]
+    columns[name] = numpy.array(values, dtype=str if i == 0 else numpy.int64)
+  if cache is not None:
+    cache.put(input_file, fields, columns)
+  return columns
+
+
+class SummaryAnalysis(object):
+  """The summary rows (one per audio and video frame) of a stream."""
+
+  name = 'summary'
+
+  def __init__(self):
+    self.raw_packets = 0
+    # init counters
+    self.video_pkts_ = 0
+    self.audio_pkts_ = 0
+    self.other_pkts_ = 0
+    self.video_gop_cnt = -1
+    self.video_frame_index = 0
+
+  def add(self, packet, byte, pts, pid, t):
+    if pid == dump_cache.INVALID_VALUE:
       # raw ts packet
-      raw_packets += 1
+      self.raw_packets += 1
     if t == '-':
       # just count the packet
       if pid == videostr_pid:
-        video_pkts_ += 1
+        self.video_pkts_ += 1
       elif pid in audiostr_pid_d.keys():
-        audio_pkts_ += 1
+        self.audio_pkts_ += 1
       else:
-        other_pkts_ += 1
-      continue
+        self.other_pkts_ += 1
+      return
     # packet with type
     if t == 'I':
-      video_gop_cnt += 1
-      video_frame_index = 0
+      self.video_gop_cnt += 1
+      self.video_frame_index = 0
     elif t in ('P', 'B', 'V'):
-      video_frame_index += 1
+      self.video_frame_index += 1
     if pid == videostr_pid or pid in audiostr_pid_d.keys():
       print "%s, %s, %s, %s, %i, %i, %i, %i, %i" % (
           t, pts, packet, byte,
-          video_gop_cnt,
-          video_frame_index,
-          video_pkts_, audio_pkts_, other_pkts_)
+          self.video_gop_cnt,
+          self.video_frame_index,
+          self.video_pkts_, self.audio_pkts_, self.other_pkts_)
+      counters.count('rows')
     else:
       print "ARGH"
     # init counters
-    video_pkts_ = 0
-    audio_pkts_ = 0
-    other_pkts_ = 0
+    self.video_pkts_ = 0
+    self.audio_pkts_ = 0
+    self.other_pkts_ = 0
+
+  def consume(self, packet):
+    self.add(packet.packet, packet.byte, packet.pts, packet.pid, packet.type)
+    return False
+
+  def finalize(self):
+    counters.count('raw_packets', self.raw_packets)
+
+
+def dump_frame_summary(input_file, delta_l, debug, video_pid=None,
+    audio_pid_l=(), jobs=1, cache=None):
+  if os.path.isfile(input_file):
+    # regular files are scanned in-process (and in parallel)
+    with counters.timer('scan'):
+      columns = get_summary_columns(input_file, video_pid, audio_pid_l, jobs,
+          debug, cache)
+    if progress_ is not None:
+      # the scan processes the whole file at once
+      progress_.tick(os.path.getsize(input_file) // progress_.stride)
+    with counters.timer('print'):
+      for row in zip(*[columns[name].tolist() for name in SUMMARY_COLUMNS]):
+        print "%s, %s, %s, %s, %i, %i, %i, %i, %i" % row
+    counters.count('rows', len(columns['type']))
+    return
+  command = [M2PB, '--packet', '--byte', '--pts', '--pid', '--type',
+      'dump']
+  if debug > 0:
+    print ' '.join(command + [input_file])
+  reader = m2pb_pipe.M2pbReader(command, input_file, debug)
+  analysis = SummaryAnalysis()
+  for line in reader:
+    packet, byte, pts, pid, t = line.split()
+    pts = long(pts) if pts != '-' else pts_utils.kPtsInvalid
+    try:
+      pid = int(pid)
+    except ValueError:
+      # raw ts packet
+      pid = dump_cache.INVALID_VALUE
+    analysis.add(packet, byte, pts, pid, t)
+    if progress_ is not None and progress_.tick():
+      progress_.report(pts=pts, raw_packets=analysis.raw_packets)
+  reader.close()
+  if debug > 0 or reader.source is not None:
+    sys.stderr.write('%s\n' % reader.get_stats_str())
+  analysis.finalize()
+  counters.append('input_pipes', reader.get_stats())
+
+
+class SampleAnalysis(object):
+  """The sample packets (the first PAT, its PMTs, and a packet per pid)."""
+
+  name = 'sample'
+
+  def __init__(self, output_filename):
+    self.output_filename = output_filename
+    self.found_pat = False
+    self.pmt_pid_list = []
+    self.other_pid_list = []
+    if output_filename is not None:
+      self.fout = open(output_filename, 'w+')
+    else:
+      self.fout = sys.stdout
+    self.ferr = sys.stderr
 
+  def add_line(self, l):
+    """Processes an "m2pb totxt" line.
 
-def dump_frame_sample(input_file, output_filename, debug):
-  lst = []
-  command = [M2PB, 'totxt', input_file]
-  proc = subprocess.Popen(command, stdout=subprocess.PIPE)
-  found_pat = False
-  pmt_pid_list = []
-  other_pid_list = []
-  if output_filename is not None:
-    fout = open(output_filename, 'w+')
-  else:
-    fout = sys.stdout
-  ferr = sys.stderr
-  for line in iter(proc.stdout.readline, ''):
-    l = line.rstrip()
+    Returns:
+      whether the sample is complete (no more lines needed).
+    """
+    fout = self.fout
+    ferr = self.ferr
     # use simpler comparison for faster parsing
     #header_match = re.search(headerre, l, re.X)
     #if not header_match:
@@ -729,63 +1002,573 @@ def dump_frame_sample(input_file, output_filename, debug):
     #pusi = header_match.group('pusi') == 'true'
     parts = l.split(' ')
     if parts[0] != 'packet:' or len(parts) < 16:
-      continue
+      return False
     packet = long(parts[1])
     if parts[4] == 'raw:':
-      continue
+      return False
     pid = int(parts[15])
     pusi = parts[11] == 'true'
 
     # first look for a valid PAT
-    if not found_pat and pid != 0:
-      continue
+    if not self.found_pat and pid != 0:
+      return False
 
-    if not found_pat and pid == 0:
-      found_pat = True
+    if not self.found_pat and pid == 0:
+      self.found_pat = True
       program_info = parse_pat(l)
       for program_number, program_information in program_info.iteritems():
         for k, v in program_information.iteritems():
           if k == 'program_map_pid':
-            pmt_pid_list.append(v)
+            self.pmt_pid_list.append(v)
           else:
-            other_pid_list.append(v)
+            self.other_pid_list.append(v)
       fout.write(l + '\n')
-      ferr.write("lists: %s, %s\n" % (pmt_pid_list, other_pid_list))
-      continue
+      ferr.write("lists: %s, %s\n" % (self.pmt_pid_list,
+          self.other_pid_list))
+      return False
 
     # second look for an expected PMT
-    if pid in pmt_pid_list:
+    if pid in self.pmt_pid_list:
       try:
         _, stream_info = parse_pmt(l)
       except:
         # invalid pmt: try again
-        continue
-      other_pid_list += stream_info.keys()
-      pmt_pid_list.remove(pid)
+        return False
+      self.other_pid_list += stream_info.keys()
+      self.pmt_pid_list.remove(pid)
       fout.write(l + '\n')
-      ferr.write("lists: %s, %s\n" % (pmt_pid_list, other_pid_list))
-      continue
+      ferr.write("lists: %s, %s\n" % (self.pmt_pid_list,
+          self.other_pid_list))
+      return False
 
     # check whether the pid is in the other list
-    if pid in other_pid_list:
-      other_pid_list.remove(pid)
+    if pid in self.other_pid_list:
+      self.other_pid_list.remove(pid)
       fout.write(l + '\n')
-      ferr.write("lists: %s, %s\n" % (pmt_pid_list, other_pid_list))
-      continue
+      ferr.write("lists: %s, %s\n" % (self.pmt_pid_list,
+          self.other_pid_list))
+      return False
 
     # exit if no more packets needed
-    if not pmt_pid_list and not other_pid_list:
+    return not self.pmt_pid_list and not self.other_pid_list
+
+  def consume(self, packet):
+    return self.add_line(packet.line)
+
+  def finalize(self):
+    if self.output_filename is not None:
+      self.fout.close()
+
+
+def dump_frame_sample(input_file, output_filename, debug):
+  reader = m2pb_pipe.M2pbReader([M2PB, 'totxt'], input_file, debug)
+  analysis = SampleAnalysis(output_filename)
+  for l in reader:
+    if progress_ is not None and progress_.tick():
+      progress_.report()
+    if analysis.add_line(l):
       break
 
-  if output_filename is not None:
-    fout.close()
+  # stop reading the input (we may be done early)
+  reader.close()
+  if debug > 0 or reader.source is not None:
+    sys.stderr.write('%s\n' % reader.get_stats_str())
+  counters.append('input_pipes', reader.get_stats())
+  analysis.finalize()
+
+
+
+def get_pcr_pid(view):
+  """Returns the pid carrying the most pcr values (or None)."""
+  index, _ = view.get_pcr()
+  if not len(index):
+    return None
+  return int(numpy.argmax(numpy.bincount(view.pid[index])))
+
+
+def get_pcr_info(view, pcr_pid, window_ms):
+  """Analyses the pcr values of a pid.
+
+  All the work is done with numpy over the full set of pcr values.
+
+  Returns:
+    a dictionary of per-pcr numpy arrays. Per-interval arrays (between a
+    pcr and the next one) have one element less than per-pcr ones.
+  """
+  index, pcr = view.get_pcr(pcr_pid)
+  offsets = view.offsets[index]
+  # per-interval values (intervals across a discontinuity are invalid)
+  valid = ~view.discontinuity_indicator[index[1:]]
+  dpcr = numpy.diff(pcr) % (ts_view.kPcrMaxValue + 1)
+  valid &= (dpcr > 0)
+  dpcr = numpy.where(valid, dpcr, 0)
+  # count mpeg-ts bytes only (not the M2TS headers or the RS parity)
+  dbytes = numpy.where(valid, numpy.diff(offsets) *
+      ts_view.MPEG_TS_PACKET_SIZE // view.stride, 0)
+  interval_ms = numpy.where(valid, dpcr * 1000.0 / ts_view.kPcrPerSecond,
+      numpy.nan)
+  bitrate = numpy.where(valid, dbytes * 8.0 * ts_view.kPcrPerSecond /
+      numpy.maximum(dpcr, 1), numpy.nan)
+  # unwrapped (and discontinuity-free) pcr and byte axes
+  t = numpy.concatenate(([0], numpy.cumsum(dpcr)))
+  b = numpy.concatenate(([0], numpy.cumsum(dbytes)))
+  # windowed bitrate
+  window = window_ms * ts_view.kPcrPerSecond / 1000
+  j = numpy.searchsorted(t, t + window)
+  in_range = j < len(t)
+  j = numpy.minimum(j, len(t) - 1)
+  window_bitrate = numpy.where(in_range & (t[j] > t),
+      (b[j] - b) * 8.0 * ts_view.kPcrPerSecond / numpy.maximum(t[j] - t, 1),
+      numpy.nan)
+  # accuracy: compare each pcr with the one interpolated (using the
+  # packet byte positions) from its neighbours
+  accuracy_ns = numpy.full(len(t), numpy.nan)
+  if len(t) > 2:
+    both_valid = valid[:-1] & valid[1:]
+    span = numpy.maximum(b[2:] - b[:-2], 1)
+    expected = t[:-2] + (t[2:] - t[:-2]) * (b[1:-1] - b[:-2]) / (span * 1.0)
+    accuracy_ns[1:-1] = numpy.where(both_valid,
+        (t[1:-1] - expected) * 1e9 / ts_view.kPcrPerSecond, numpy.nan)
+  return {
+      'index': index,
+      'offsets': offsets,
+      'pcr': pcr,
+      'time': t / float(ts_view.kPcrPerSecond),
+      'interval_ms': interval_ms,
+      'bitrate': bitrate,
+      'window_bitrate': window_bitrate,
+      'accuracy_ns': accuracy_ns,
+  }
+
+
+def decimate(*arrays):
+  """Subsamples some (same-length) arrays to at most MAX_PLOT_POINTS."""
+  step = max(1, len(arrays[0]) // MAX_PLOT_POINTS)
+  return [a[::step] for a in arrays]
+
+
+def do_pcr_plot(info, window_ms, filename):
+  t, window_bitrate, accuracy_ns = decimate(info['time'],
+      info['window_bitrate'], info['accuracy_ns'])
+  t_interval, interval_ms = decimate(info['time'][1:], info['interval_ms'])
+  _, (ax1, ax2, ax3) = plt.subplots(3, sharex=True)
+  ax1.plot(t, window_bitrate / 1e6, '-b')
+  ax1.set_ylabel('Mbps (%i ms)' % window_ms)
+  ax2.plot(t_interval, interval_ms, '.g', markersize=NON_PUSI_MARKERSIZE)
+  ax2.axhline(y=PCR_MAX_INTERVAL_MS, color='r', ls='dotted')
+  ax2.set_ylabel('interval (ms)')
+  ax3.plot(t, accuracy_ns, '.k', markersize=NON_PUSI_MARKERSIZE)
+  for y in (-PCR_MAX_ACCURACY_NS, PCR_MAX_ACCURACY_NS):
+    ax3.axhline(y=y, color='r', ls='dotted')
+  ax3.set_ylabel('accuracy (ns)')
+  ax3.set_xlabel('time (secs)')
+  plt.savefig(filename)
 
 
+def dump_pcr_info(input_file, pcr_pid, window_ms, output_filename, debug):
+  view = ts_view.open_view(input_file)
+  if pcr_pid is None:
+    pcr_pid = get_pcr_pid(view)
+  if pcr_pid is None:
+    print 'error: no pcr values in %s' % input_file
+    sys.exit(-1)
+  info = get_pcr_info(view, pcr_pid, window_ms)
+  if len(info['pcr']) < 2:
+    print 'error: not enough pcr values for pid %i' % pcr_pid
+    sys.exit(-1)
+  bitrate = info['bitrate']
+  window_bitrate = info['window_bitrate']
+  interval_ms = info['interval_ms']
+  accuracy_ns = info['accuracy_ns']
+  with numpy.errstate(invalid='ignore'):
+    # nan values (invalid intervals) never count as violations
+    violations = numpy.nonzero(interval_ms > PCR_MAX_INTERVAL_MS)[0]
+    inaccurate = numpy.abs(accuracy_ns) > PCR_MAX_ACCURACY_NS
+  print 'pcr_pid: %i' % pcr_pid
+  print 'pcr_packets: %i' % len(info['pcr'])
+  print 'duration_secs: %.3f' % info['time'][-1]
+  # (bitrate and interval_ms are nan for the same, invalid, intervals)
+  if not numpy.isnan(bitrate).all():
+    print 'bitrate_bps: mean %i min %i max %i' % (numpy.nanmean(bitrate),
+        numpy.nanmin(bitrate), numpy.nanmax(bitrate))
+  if not numpy.isnan(window_bitrate).all():
+    print 'window_bitrate_bps (%i ms): mean %i min %i max %i' % (window_ms,
+        numpy.nanmean(window_bitrate), numpy.nanmin(window_bitrate),
+        numpy.nanmax(window_bitrate))
+  if not numpy.isnan(interval_ms).all():
+    print 'interval_ms: mean %.3f max %.3f violations (> %i ms) %i' % (
+        numpy.nanmean(interval_ms), numpy.nanmax(interval_ms),
+        PCR_MAX_INTERVAL_MS, len(violations))
+  if not numpy.isnan(accuracy_ns).all():
+    print ('accuracy_ns: max %.1f rms %.1f jitter (p2p) %.1f '
+        'violations (> %i ns) %i' % (numpy.nanmax(numpy.abs(accuracy_ns)),
+            numpy.sqrt(numpy.nanmean(accuracy_ns ** 2)),
+            numpy.nanmax(accuracy_ns) - numpy.nanmin(accuracy_ns),
+            PCR_MAX_ACCURACY_NS, numpy.count_nonzero(inaccurate)))
+  # interval violations
+  if len(violations):
+    print '# packet, byte, pcr, interval_ms'
+  for i in violations:
+    print '%i, %i, %i, %.3f' % (info['index'][i + 1],
+        info['offsets'][i + 1], info['pcr'][i + 1], interval_ms[i])
+  if debug > 0:
+    # accuracy violations
+    for i in numpy.nonzero(inaccurate)[0]:
+      print 'inaccurate pcr: %i, %i, %i, %.1f' % (info['index'][i],
+          info['offsets'][i], info['pcr'][i], accuracy_ns[i])
+  if output_filename:
+    do_pcr_plot(info, window_ms, output_filename)
+    print 'written file %s' % output_filename
+
+
+
+def get_pid_stats_str(pid, t, packets, pusi, cc_errors, duplicates, tei,
+    pts_info):
+  """Returns a per-pid stats line (pts_info as in ts_scan.Scan.pts)."""
+  if pts_info is None:
+    pts_str = '0, -, -, -, 0'
+  else:
+    pts_str = '%i, %i, %i, %.3f, %i' % (pts_info['count'],
+        pts_info['first'], pts_info['last'],
+        mod.diff(pts_info['last'], pts_info['first']) /
+        float(pts_utils.kPtsPerSecond), len(pts_info['jumps']))
+  return '%i, %s, %i, %i, %i, %i, %i, %s' % (pid, t, packets, pusi,
+      cc_errors, duplicates, tei, pts_str)
+
+
+def dump_stats(input_file, video_pid, audio_pid_l, jobs, debug):
+  scan, video_pids, audio_pids = scan_file(input_file, video_pid,
+      audio_pid_l, jobs, debug)
+  print '# stride: %i' % scan.stride
+  print '# pid, type, packets, pusi, cc_errors, duplicates, tei, pes_pts, ' \
+      'first_pts, last_pts, duration_secs, pts_jumps'
+  for pid in numpy.nonzero(scan.pid_packets)[0]:
+    if pid in video_pids:
+      t = TYPE_VIDEO
+    elif pid in audio_pids:
+      t = TYPE_AUDIO
+    else:
+      t = TYPE_OTHER
+    print get_pid_stats_str(pid, t, scan.pid_packets[pid],
+        scan.pid_pusi[pid], scan.cc_errors[pid], scan.cc_duplicates[pid],
+        scan.pid_tei[pid], scan.pts.get(pid))
+  # video frame types
+  print '# frames: pid, I, P, B, V, unknown'
+  for pid in video_pids:
+    types = [t for p, t in zip(scan.frames['pid'], scan.frames['type'])
+        if p == pid]
+    print 'frames: %i, %s' % (pid, ', '.join('%i' % types.count(t)
+        for t in ('I', 'P', 'B', 'V', ts_scan.FRAME_TYPE_NONE)))
+  # corrupted (or non-ts) areas
+  print 'gaps: %i (%i bytes)' % (len(scan.gaps),
+      sum(end - start for start, end in scan.gaps))
+  if debug > 0:
+    for start, end in scan.gaps:
+      print 'gap: %i, %i, %i' % (start, end, end - start)
+    for pid, pts_info in sorted(scan.pts.iteritems()):
+      for packet, last_pts, pts in pts_info['jumps']:
+        print 'pts jump: %i, %i, %i, %i' % (packet, pid, last_pts, pts)
+    for packet, expected_cc in zip(scan.cc_error_index,
+        scan.cc_error_expected_cc):
+      print 'cc error: %i, %i' % (packet, expected_cc)
+
+
+def get_sample_chunks(input_file, chunks, rate, window_packets):
+  """Returns the number of windows to sample (--sample-chunks/rate)."""
+  if chunks is not None:
+    return max(1, chunks)
+  stride = ts_view.detect_stride(ts_view.open_file(input_file))
+  window_bytes = window_packets * stride
+  return max(1, int(numpy.ceil(rate * os.path.getsize(input_file) /
+                               window_bytes)))
+
+
+def dump_sampled_stats(input_file, video_pid, audio_pid_l, jobs, debug,
+    chunks, window_packets=ts_sample.DEFAULT_WINDOW_PACKETS, seed=None):
+  """Prints the stats estimated from a sample of windows of a file."""
+  video_pids, audio_pids = get_scan_pids(input_file, video_pid, audio_pid_l)
+  # windows use their own PSI, unless the user chose the pids
+  sample = ts_sample.sample_file(input_file, video_pids, audio_pids,
+      chunks, window_packets, seed, jobs,
+      video_stream_types=None if video_pid else video_stream_type_l,
+      audio_stream_types=None if audio_pid_l else audio_stream_type_l)
+  windows = sample['windows']
+  print '# stride: %i' % sample['stride']
+  print '# sampled %i of %i windows (%s): %.1f of %.1f MB (%.1f%%)' % (
+      len(windows), sample['population'],
+      'random' if seed is not None else 'evenly spaced',
+      sample['sampled_bytes'] / 1e6, sample['size'] / 1e6,
+      100.0 * sample['sampled_bytes'] / max(1, sample['size']))
+  print '# windows without psi: %i' % sum(1 for w in windows if not w['psi'])
+  print '# estimate, value, ci95_low, ci95_high'
+  for name, estimate in sample['estimates']:
+    if estimate is None:
+      print '%s, -, -, -' % name
+      continue
+    print '%s, %s' % (name, ', '.join('-' if value is None else
+        '%.6g' % value for value in estimate))
+  if debug > 0:
+    print '# window: start, end, packets, gap_bytes, psi, bitrate, I, P, ' \
+        'B, V, audio_frames'
+    for w in windows:
+      print 'window: %i, %i, %i, %i, %i, %.0f, %s, %i' % (w['start'],
+          w['end'], w['packets'], w['gap_bytes'], w['psi'], w['bitrate'],
+          ', '.join('%i' % w['frame_types'][t]
+                    for t in ts_sample.VIDEO_FRAME_TYPES),
+          w['audio_frames'])
+
+
+class StatsAnalysis(object):
+  """Per-pid packet, pts, and cc statistics (see dump_stats()).
+
+  Unlike dump_stats(), it works on any input, but it does not know about
+  the gaps of the input (m2pb reports them as raw packets).
+  """
+
+  name = 'stats'
+
+  def __init__(self, debug, max_pts_jump=ts_scan.DEFAULT_MAX_PTS_JUMP):
+    self.debug = debug
+    self.max_pts_jump = max_pts_jump
+    self.raw_packets = 0
+    self.pid_packets = {}
+    self.pid_pusi = {}
+    self.pid_tei = {}
+    self.cc_errors = {}
+    self.cc_duplicates = {}
+    # (packet, expected_cc) tuples
+    self.cc_error_list = []
+    # as in ts_scan.Scan.pts
+    self.pts = {}
+    # video pid -> frame type -> count
+    self.frame_types = {}
+    # pid -> (cc, whether the packet had payload, whether it was a
+    # duplicate)
+    self._last_cc = {}
+
+  def _check_cc(self, packet, pid):
+    """Checks the cc of a packet (see ts_scan.get_cc_info())."""
+    cc = int(packet.get('parsed.header.continuity_counter'))
+    payload = packet.get('parsed.header.payload_exists') == 'true'
+    discontinuity = (packet.get(
+        'parsed.adaptation_field.discontinuity_indicator') == 'true')
+    duplicate = False
+    if pid in self._last_cc and not discontinuity:
+      prev_cc, prev_payload, prev_duplicate = self._last_cc[pid]
+      expected_cc = (prev_cc + 1) & 0x0f if payload else prev_cc
+      duplicate = prev_payload and payload and cc == prev_cc
+      if duplicate and not prev_duplicate:
+        # a single duplicate is allowed
+        self.cc_duplicates[pid] = self.cc_duplicates.get(pid, 0) + 1
+      elif duplicate or cc != expected_cc:
+        self.cc_errors[pid] = self.cc_errors.get(pid, 0) + 1
+        self.cc_error_list.append((packet.packet, expected_cc))
+    self._last_cc[pid] = (cc, payload, duplicate)
+
+  def consume(self, packet):
+    pid = packet.pid
+    if pid == dump_cache.INVALID_VALUE:
+      self.raw_packets += 1
+      return False
+    self.pid_packets[pid] = self.pid_packets.get(pid, 0) + 1
+    if packet.get('parsed.header.transport_error_indicator') == 'true':
+      self.pid_tei[pid] = self.pid_tei.get(pid, 0) + 1
+    elif pid != ts_view.NULL_PID:
+      self._check_cc(packet, pid)
+    if not packet.pusi:
+      return False
+    self.pid_pusi[pid] = self.pid_pusi.get(pid, 0) + 1
+    if pid == videostr_pid:
+      types = self.frame_types.setdefault(pid, {})
+      types[packet.type] = types.get(packet.type, 0) + 1
+    pts = packet.pts
+    if pts != pts_utils.kPtsInvalid:
+      info = self.pts.setdefault(pid, {'first': pts, 'last': None,
+          'count': 0, 'jumps': []})
+      if (info['last'] is not None and
+          abs(mod.sub(pts, info['last'])) > self.max_pts_jump):
+        info['jumps'].append((packet.packet, info['last'], pts))
+      info['last'] = pts
+      info['count'] += 1
+    return False
+
+  def finalize(self):
+    print '# pid, type, packets, pusi, cc_errors, duplicates, tei, pes_pts, ' \
+        'first_pts, last_pts, duration_secs, pts_jumps'
+    for pid in sorted(self.pid_packets):
+      if pid == videostr_pid:
+        t = TYPE_VIDEO
+      elif pid in audiostr_pid_d:
+        t = TYPE_AUDIO
+      else:
+        t = TYPE_OTHER
+      print get_pid_stats_str(pid, t, self.pid_packets[pid],
+          self.pid_pusi.get(pid, 0), self.cc_errors.get(pid, 0),
+          self.cc_duplicates.get(pid, 0), self.pid_tei.get(pid, 0),
+          self.pts.get(pid))
+    # video frame types
+    print '# frames: pid, I, P, B, V, unknown'
+    for pid, types in sorted(self.frame_types.iteritems()):
+      print 'frames: %i, %s' % (pid, ', '.join('%i' % types.get(t, 0)
+          for t in ('I', 'P', 'B', 'V', ts_scan.FRAME_TYPE_NONE)))
+    print 'raw packets: %i' % self.raw_packets
+    if self.debug > 0:
+      for pid, pts_info in sorted(self.pts.iteritems()):
+        for packet, last_pts, pts in pts_info['jumps']:
+          print 'pts jump: %i, %i, %i, %i' % (packet, pid, last_pts, pts)
+      for packet, expected_cc in self.cc_error_list:
+        print 'cc error: %i, %i' % (packet, expected_cc)
+
+
+def get_packet_type(text_packet, pid, pts):
+  """Returns the "m2pb --type dump" type of an "m2pb totxt" packet."""
+  if pid == videostr_pid:
+    data = text_packet.get('parsed.data_bytes')
+    # (most payloads have no start code)
+    if data is None or ESCAPED_START_CODE not in data:
+      return ts_scan.FRAME_TYPE_NONE
+    return h264_utils.get_frame_type_str(h264_utils.get_frame_type(
+        data[1:-1].decode('string_escape')))
+  if pid in audiostr_pid_d and pts != pts_utils.kPtsInvalid:
+    return '%i' % audiostr_pid_d[pid]
+  return ts_scan.FRAME_TYPE_NONE
+
+
+class RunPacket(object):
+  """An "m2pb totxt" packet, with the fields of "m2pb dump".
+
+  This is what the analyses of a run consume. The frame type is only
+  computed if an analysis asks for it.
+  """
+
+  __slots__ = ('text_packet', 'packet', 'byte', 'pid', 'pusi', 'pts',
+               '_type')
+
+  def __init__(self, text_packet):
+    self.text_packet = text_packet
+    self.packet = text_packet.packet
+    self.byte = text_packet.byte
+    pid = text_packet.pid
+    # raw ts packets have no pid
+    self.pid = pid if pid is not None else dump_cache.INVALID_VALUE
+    self.pusi = text_packet.pusi
+    self.pts = text_packet.pts if self.pusi else pts_utils.kPtsInvalid
+    self._type = None
+
+  @property
+  def line(self):
+    return self.text_packet.line
+
+  @property
+  def type(self):
+    if self._type is None:
+      self._type = get_packet_type(self.text_packet, self.pid, self.pts)
+    return self._type
+
+  def get(self, name, default=None):
+    return self.text_packet.get(name, default)
+
+
+def get_run_consumer(analysis):
+  """Returns a m2pb_pipe.tee() consumer feeding RunPackets to an analysis."""
+  def consume(packets):
+    for packet in packets:
+      if analysis.consume(packet):
+        return True
+    return False
+  return consume
+
+
+def decode_run_packets(lines):
+  """Decodes a block of "m2pb totxt" lines into RunPackets."""
+  packets = []
+  for line in lines:
+    text_packet = totxt_utils.TextPacket(line)
+    if not text_packet.is_valid():
+      counters.count('invalid_lines')
+      continue
+    packets.append(RunPacket(text_packet))
+  if progress_ is not None and progress_.tick(len(packets)) and packets:
+    progress_.report(pts=packets[-1].pts)
+  return packets
+
+
+def run_analyses(reader, analyses):
+  """Fans the "m2pb totxt" lines of a reader out to several analyses.
+
+  The lines are fanned out with m2pb_pipe.tee(): every block of lines is
+  decoded once into RunPackets, which are dispatched, in order, to the
+  consume() method of every analysis, until the analysis returns True (it
+  needs no more packets). Reading stops when all the analyses are done.
+
+  Returns:
+    the m2pb_pipe.Stage of the decoding, and then of every analysis.
+  """
+  stages = m2pb_pipe.tee(reader, [(analysis.name, get_run_consumer(analysis))
+                                  for analysis in analyses],
+                         decode=decode_run_packets)
+  for name, stage in zip(['decode'] + ['analysis.%s' % analysis.name
+                                       for analysis in analyses], stages):
+    counters.add_ns(name, int(stage.busy * 1e9))
+  return stages
+
+
+def dump_run(input_file, analyses, debug):
+  """Runs several analyses on a single "m2pb totxt" decode of the input.
+
+  See run_analyses(). The finalize() method of every analysis is called
+  at the end of the input.
+  """
+  reader = m2pb_pipe.ThreadedReader(
+      m2pb_pipe.M2pbReader([M2PB, 'totxt'], input_file, debug))
+  stages = run_analyses(reader, analyses)
+  # stop reading the input (all the analyses may be done early)
+  reader.close()
+  if debug > 0 or reader.source is not None:
+    sys.stderr.write('%s\n' % reader.get_stats_str())
+    for stage in stages:
+      sys.stderr.write('%s\n' % stage.get_stats_str())
+  counters.append('input_pipes', reader.get_stats())
+  for analysis in analyses:
+    with counters.timer('finalize.%s' % analysis.name):
+      analysis.finalize()
+
+
+def dump_index(input_file, output_filename, video_pid, audio_pid_l, jobs,
+    debug):
+  scan, _, _ = scan_file(input_file, video_pid, audio_pid_l, jobs, debug)
+  if not output_filename:
+    output_filename = ts_source.get_basename(input_file) + '.idx'
+  ts_scan.write_index(output_filename, scan.frames)
+  print 'written file %s' % output_filename
+
+
+def dump_cc_info(input_file, debug):
+  view = ts_view.open_view(input_file)
+  info = ts_scan.get_cc_info(view)
+  print '# pid, packets, cc_errors, duplicates, tei'
+  for pid, packets, errors, duplicates, tei in zip(info['pid'],
+      info['packets'], info['errors'], info['duplicates'], info['tei']):
+    print '%i, %i, %i, %i, %i' % (pid, packets, errors, duplicates, tei)
+  if len(info['error_index']):
+    print '# cc error: packet, byte, pid, expected_cc, cc'
+  for i, expected_cc in zip(info['error_index'], info['error_expected_cc']):
+    print 'cc error: %i, %i, %i, %i, %i' % (i, view.offsets[i], view.pid[i],
+        expected_cc, view.continuity_counter[i])
+  if len(info['tei_index']):
+    print '# tei: packet, byte, pid'
+  for i in info['tei_index']:
+    print 'tei: %i, %i, %i' % (i, view.offsets[i], view.pid[i])
+  if view.gaps:
+    print '# gap: start, end, bytes'
+  for start, end in view.gaps:
+    print 'gap: %i, %i, %i' % (start, end, end - start)
 
 
 def main(argv):
   global videostr_pid
   global audiostr_pid_d
+  global progress_
   vals = get_opts(argv)
   # check global values
   if vals.videostr_pid:
@@ -804,22 +1587,97 @@ def main(argv):
       print 'vals.%s = %s' % (k, v)
     print 'remaining: %r' % vals.remaining
 
+  if vals.progress_interval is not None or vals.metrics_filename is not None:
+    progress_ = progress.Progress(vals.subcommand,
+        progress.get_total_bytes(vals.input_file),
+        vals.progress_interval or progress.DEFAULT_INTERVAL,
+        vals.metrics_filename,
+        stride=(ts_source.get_stride(vals.input_file[0])
+                if ts_source.is_valid_input(vals.input_file[0])
+                else ts_view.MPEG_TS_PACKET_SIZE))
+  try:
+    with counters.timer('subcommand.%s' % vals.subcommand):
+      if vals.profile_filename is not None:
+        perf_counters.run_profiled(vals.profile_filename, run, vals)
+      else:
+        run(vals)
+    if progress_ is not None:
+      progress_.report(final=True)
+  finally:
+    if vals.counters_filename:
+      counters.write(vals.counters_filename)
+
+
+def run(vals):
   # get input file
-  assert os.path.isfile(vals.input_file[0]), \
+  assert ts_source.is_valid_input(vals.input_file[0]), \
       'need a valid mpeg-ts input file (%s)' % vals.input_file[0]
+  cache = None
+  if vals.cache_dir is not None:
+    cache = dump_cache.DumpCache(vals.cache_dir, vals.cache_size << 20)
   if vals.subcommand == 'pts':
     df = dump_frame_info(vals.input_file[0], vals.delta, vals.debug,
-        vals.pusi_skip)
+        vals.pusi_skip, cache)
     if vals.output_filename:
       filename = vals.output_filename
     else:
-      filename = os.path.split(vals.input_file[0])[1] + '.pdf'
-    do_plot(df, filename, vals.xmin, vals.xmax, vals.ymin, vals.ymax)
+      filename = ts_source.get_basename(vals.input_file[0]) + '.pdf'
+    with counters.timer('plot'):
+      do_plot(df, filename, vals.xmin, vals.xmax, vals.ymin, vals.ymax)
     print 'written file %s' % filename
   elif vals.subcommand == 'summary':
-    dump_frame_summary(vals.input_file[0], vals.delta, vals.debug)
+    dump_frame_summary(vals.input_file[0], vals.delta, vals.debug,
+        vals.videostr_pid, vals.audiostr_pid_l, vals.jobs, cache)
   elif vals.subcommand == 'sample':
     dump_frame_sample(vals.input_file[0], vals.output_filename, vals.debug)
+  elif vals.subcommand == 'pcr':
+    assert os.path.isfile(vals.input_file[0]), \
+        'pcr analysis needs a regular file (%s)' % vals.input_file[0]
+    dump_pcr_info(vals.input_file[0], vals.pcr_pid, vals.window_ms,
+        vals.output_filename, vals.debug)
+  elif vals.subcommand == 'cc':
+    assert os.path.isfile(vals.input_file[0]), \
+        'cc check needs a regular file (%s)' % vals.input_file[0]
+    dump_cc_info(vals.input_file[0], vals.debug)
+  elif vals.subcommand == 'stats':
+    assert os.path.isfile(vals.input_file[0]), \
+        'stats need a regular file (%s)' % vals.input_file[0]
+    if vals.sample_chunks is None and vals.sample_rate is None:
+      dump_stats(vals.input_file[0], vals.videostr_pid, vals.audiostr_pid_l,
+          vals.jobs, vals.debug)
+    else:
+      dump_sampled_stats(vals.input_file[0], vals.videostr_pid,
+          vals.audiostr_pid_l, vals.jobs, vals.debug,
+          get_sample_chunks(vals.input_file[0], vals.sample_chunks,
+              vals.sample_rate, vals.sample_window),
+          vals.sample_window, vals.seed if vals.sample_random else None)
+  elif vals.subcommand == 'run':
+    if not vals.analyses:
+      print 'error: run needs at least one analysis (%s)' % ', '.join(
+          '--%s' % analysis for analysis in RUN_ANALYSES)
+      sys.exit(-1)
+    analyses = []
+    for name in RUN_ANALYSES:
+      if name not in vals.analyses:
+        continue
+      if name == 'pts':
+        filename = (vals.pts_output_filename or
+            ts_source.get_basename(vals.input_file[0]) + '.pdf')
+        analyses.append(PtsAnalysis(vals.input_file[0], vals.delta,
+            vals.debug, vals.pusi_skip, (filename, vals.xmin, vals.xmax,
+            vals.ymin, vals.ymax)))
+      elif name == 'summary':
+        analyses.append(SummaryAnalysis())
+      elif name == 'sample':
+        analyses.append(SampleAnalysis(vals.sample_output_filename))
+      elif name == 'stats':
+        analyses.append(StatsAnalysis(vals.debug))
+    dump_run(vals.input_file[0], analyses, vals.debug)
+  elif vals.subcommand == 'index':
+    assert os.path.isfile(vals.input_file[0]), \
+        'index building needs a regular file (%s)' % vals.input_file[0]
+    dump_index(vals.input_file[0], vals.output_filename, vals.videostr_pid,
+        vals.audiostr_pid_l, vals.jobs, vals.debug)
 
 
 
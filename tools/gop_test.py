@@ -0,0 +1,304 @@
+#!/usr/bin/python
+
+"""Unit tests for the single-pass analyses of gop.py."""
+
+import os
+import StringIO
+import sys
+import tempfile
+import unittest
+from google.protobuf import text_format
+import numpy
+import gop
+import mpeg2ts_parser
+import totxt_utils
+import ts_gen
+import ts_scan
+import ts_scan_test
+import ts_view
+
+PCR_PID = 100
+FILLER_PID = 101
+# a pcr every PCR_PACKETS packets, every PCR_STEP (10 ms)
+PCR_PACKETS = 10
+PCR_STEP = 270000
+# (so the bitrate is 1504000 bps)
+PCR_BITRATE = PCR_PACKETS * ts_view.MPEG_TS_PACKET_SIZE * 8 * 100
+
+
+def get_run_packets(filename):
+  """Returns the RunPackets of a file (as decoded by "m2pb totxt")."""
+  return [gop.RunPacket(totxt_utils.TextPacket(
+      text_format.MessageToString(mpeg2ts, as_one_line=True)))
+      for mpeg2ts in mpeg2ts_parser.get_packets(filename)]
+
+
+def write_pcr_stream(filename, pcrs, discontinuities=()):
+  """Writes a stream with a pcr packet (and filler packets) per pcr value.
+
+  Args:
+    filename: the output file name
+    pcrs: the 27 MHz pcr values
+    discontinuities: the indexes of the pcrs with the discontinuity
+        indicator set
+  """
+  with open(filename, 'wb') as f:
+    for i, pcr in enumerate(pcrs):
+      adaptation_field = (chr(0x90 if i in discontinuities else 0x10) +
+                          ts_gen.make_pcr(pcr))
+      f.write('\x47' + chr(PCR_PID >> 8) + chr(PCR_PID & 0xff) +
+              chr(0x30 | (i & 0x0f)) + chr(len(adaptation_field)) +
+              adaptation_field + '\xff' * (ts_view.MPEG_TS_PACKET_SIZE - 5 -
+                                            len(adaptation_field)))
+      for j in range(PCR_PACKETS - 1):
+        f.write('\x47' + chr(FILLER_PID >> 8) + chr(FILLER_PID & 0xff) +
+                chr(0x10 | (j & 0x0f)) +
+                '\xff' * (ts_view.MPEG_TS_PACKET_SIZE - 4))
+
+
+class GopPcrTest(unittest.TestCase):
+
+  def setUp(self):
+    fd, self.filename = tempfile.mkstemp(suffix='.ts')
+    os.close(fd)
+
+  def tearDown(self):
+    os.remove(self.filename)
+
+  def get_pcr_info(self, pcrs, discontinuities=(), window_ms=100):
+    write_pcr_stream(self.filename, pcrs, discontinuities)
+    view = ts_view.open_view(self.filename)
+    self.assertEqual(PCR_PID, gop.get_pcr_pid(view))
+    return gop.get_pcr_info(view, PCR_PID, window_ms)
+
+  def dump_pcr_info(self):
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+      gop.dump_pcr_info(self.filename, None, 100, None, 0)
+      return sys.stdout.getvalue().splitlines()
+    finally:
+      sys.stdout = stdout
+
+  def testBitrate(self):
+    info = self.get_pcr_info([i * PCR_STEP for i in range(50)])
+    self.assertTrue(numpy.allclose(info['bitrate'], PCR_BITRATE))
+    self.assertTrue(numpy.allclose(info['interval_ms'], 10.0))
+    # the 100 ms window is complete for all but the last 10 pcrs
+    self.assertTrue(numpy.allclose(info['window_bitrate'][:40], PCR_BITRATE))
+    self.assertTrue(numpy.isnan(info['window_bitrate'][40:]).all())
+    self.assertAlmostEqual(0.49, info['time'][-1])
+    # a constant bitrate is perfectly accurate
+    self.assertTrue(numpy.allclose(info['accuracy_ns'][1:-1], 0))
+    self.assertTrue(numpy.isnan(info['accuracy_ns'][[0, -1]]).all())
+
+  def testIntervalViolations(self):
+    # a 50 ms interval (with the same bytes) between pcrs 4 and 5
+    pcrs = [i * PCR_STEP for i in range(10)]
+    pcrs[5:] = [pcr + 4 * PCR_STEP for pcr in pcrs[5:]]
+    info = self.get_pcr_info(pcrs)
+    self.assertAlmostEqual(50.0, info['interval_ms'][4])
+    self.assertAlmostEqual(PCR_BITRATE / 5.0, info['bitrate'][4])
+    lines = self.dump_pcr_info()
+    self.assertIn('interval_ms: mean 14.444 max 50.000 violations (> 40 ms) '
+                  '1', lines)
+    self.assertEqual('# packet, byte, pcr, interval_ms', lines[-2])
+    self.assertEqual('50, %i, %i, 50.000' % (
+        50 * ts_view.MPEG_TS_PACKET_SIZE, pcrs[5]), lines[-1])
+
+  def testJitter(self):
+    # pcr 10 is late by 10 us
+    pcrs = [i * PCR_STEP for i in range(20)]
+    pcrs[10] += 270
+    info = self.get_pcr_info(pcrs)
+    accuracy_ns = info['accuracy_ns']
+    self.assertAlmostEqual(10000.0, accuracy_ns[10])
+    # (its neighbours are interpolated from it)
+    self.assertAlmostEqual(-5000.0, accuracy_ns[9])
+    self.assertAlmostEqual(-5000.0, accuracy_ns[11])
+    self.assertTrue(numpy.allclose(numpy.delete(accuracy_ns[1:-1],
+                                                [8, 9, 10]), 0))
+    lines = self.dump_pcr_info()
+    self.assertIn('accuracy_ns: max 10000.0 rms 2886.8 jitter (p2p) 15000.0 '
+                  'violations (> 500 ns) 3', lines)
+
+  def testInvalidIntervals(self):
+    # a discontinuity, and equal pcrs: no valid interval
+    info = self.get_pcr_info([0, 1000], discontinuities=[1])
+    self.assertTrue(numpy.isnan(info['bitrate']).all())
+    self.assertTrue(numpy.isnan(info['interval_ms']).all())
+    self.assertEqual(['pcr_pid: %i' % PCR_PID, 'pcr_packets: 2',
+                      'duration_secs: 0.000'], self.dump_pcr_info())
+    self.get_pcr_info([1000, 1000])
+    self.assertEqual(['pcr_pid: %i' % PCR_PID, 'pcr_packets: 2',
+                      'duration_secs: 0.000'], self.dump_pcr_info())
+
+
+class GopCcTest(unittest.TestCase):
+
+  def setUp(self):
+    fd, self.filename = tempfile.mkstemp(suffix='.ts')
+    os.close(fd)
+    self.packets = ts_scan_test.write_cc_stream(self.filename)
+
+  def tearDown(self):
+    os.remove(self.filename)
+
+  def testDumpCcInfo(self):
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+      gop.dump_cc_info(self.filename, 0)
+      lines = sys.stdout.getvalue().splitlines()
+    finally:
+      sys.stdout = stdout
+    self.assertEqual([
+        '# pid, packets, cc_errors, duplicates, tei',
+        '48, 4, 1, 0, 0',
+        '49, 4, 0, 1, 0',
+        '50, 5, 1, 1, 0',
+        '51, 4, 0, 0, 0',
+        '52, 4, 1, 0, 0',
+        '53, 4, 0, 0, 1',
+        '54, 4, 1, 0, 0',
+        '8191, 5, 0, 0, 0',
+        '# cc error: packet, byte, pid, expected_cc, cc',
+        'cc error: 20, 3760, 52, 2, 7',
+        'cc error: 24, 4512, 48, 1, 2',
+        'cc error: 26, 4888, 50, 2, 1',
+        'cc error: 30, 5640, 54, 2, 1',
+        '# tei: packet, byte, pid',
+        'tei: 21, 3948, 53',
+    ], lines)
+    # (packet 21, at byte 21 * 188, is the tei one)
+    self.assertEqual((0x35, 9), self.packets[21][:2])
+
+
+class GopSampleChunksTest(unittest.TestCase):
+
+  def setUp(self):
+    fd, self.filename = tempfile.mkstemp(suffix='.ts')
+    # 1000 m2ts packets (a 4-byte header before every sync byte)
+    packets = numpy.zeros((1000, ts_view.M2TS_PACKET_SIZE), dtype=numpy.uint8)
+    packets[:, ts_view.M2TS_HEADER_SIZE] = 0x47
+    with os.fdopen(fd, 'wb') as f:
+      f.write(packets.tostring())
+
+  def tearDown(self):
+    os.remove(self.filename)
+
+  def testGetSampleChunks(self):
+    self.assertEqual(3, gop.get_sample_chunks(self.filename, 3, None, 10))
+    # (windows of 10 packets of 192 bytes)
+    self.assertEqual(50, gop.get_sample_chunks(self.filename, None, 0.5, 10))
+    self.assertEqual(1, gop.get_sample_chunks(self.filename, None, 0.0, 10))
+
+
+class GopRunTest(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    fd, cls.filename = tempfile.mkstemp(suffix='.ts')
+    os.close(fd)
+    ts_gen.write_stream(cls.filename, 1 << 18, cc_error_rate=0.01)
+    cls.packets = get_run_packets(cls.filename)
+
+  @classmethod
+  def tearDownClass(cls):
+    os.remove(cls.filename)
+
+  def run_analysis(self, analysis):
+    """Runs an analysis, and returns its output lines."""
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+      for packet in self.packets:
+        if analysis.consume(packet):
+          break
+      analysis.finalize()
+      return sys.stdout.getvalue().splitlines()
+    finally:
+      sys.stdout = stdout
+
+  def testRunAnalyses(self):
+    class Reader(object):
+      def __init__(self, lines):
+        self.lines = lines
+        self.blocks = 0
+      def iter_blocks(self):
+        for i in range(0, len(self.lines), 100):
+          self.blocks += 1
+          yield self.lines[i:i + 100]
+    reader = Reader([packet.line for packet in self.packets])
+    fd, output_filename = tempfile.mkstemp()
+    os.close(fd)
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = StringIO.StringIO()
+    sys.stderr = StringIO.StringIO()
+    try:
+      analyses = [gop.SummaryAnalysis(), gop.SampleAnalysis(output_filename)]
+      stages = gop.run_analyses(reader, analyses)
+      for analysis in analyses:
+        analysis.finalize()
+      lines = sys.stdout.getvalue().splitlines()
+    finally:
+      sys.stdout, sys.stderr = stdout, stderr
+      os.remove(output_filename)
+    # the summary needs every packet (the sample analysis stops early)
+    self.assertEqual(self.run_analysis(gop.SummaryAnalysis()), lines)
+    self.assertEqual(['decode', 'summary', 'sample'],
+                     [stage.name for stage in stages])
+    self.assertEqual(len(self.packets), stages[0].lines)
+    self.assertTrue(stages[2].lines < stages[1].lines)
+    self.assertEqual(-(-len(self.packets) // 100), reader.blocks)
+
+  def testRunPacket(self):
+    scan = ts_scan.scan_file(self.filename, [481], [482])
+    types = [packet.type for packet in self.packets if packet.pusi and
+             packet.pid in (481, 482)]
+    self.assertEqual(scan.frames['type'], types)
+    self.assertEqual(scan.frames['pts'], [packet.pts for packet in
+        self.packets if packet.pusi and packet.pid in (481, 482)])
+
+  def testSummaryAnalysis(self):
+    lines = self.run_analysis(gop.SummaryAnalysis())
+    scan = ts_scan.scan_file(self.filename, [481], [482])
+    self.assertEqual(['%s, %s, %s, %s, %i, %i, %i, %i, %i' % row
+                      for row in scan.rows], lines)
+
+  def testStatsAnalysis(self):
+    lines = self.run_analysis(gop.StatsAnalysis(0))
+    scan = ts_scan.scan_file(self.filename, [481], [482])
+    self.assertTrue(scan.cc_errors.sum() > 0)
+    self.assertEqual(gop.get_pid_stats_str(481, gop.TYPE_VIDEO,
+        scan.pid_packets[481], scan.pid_pusi[481], scan.cc_errors[481],
+        scan.cc_duplicates[481], scan.pid_tei[481], scan.pts.get(481)),
+        lines[3])
+    self.assertEqual('raw packets: 0', lines[-1])
+
+  def testSampleAnalysis(self):
+    fd, output_filename = tempfile.mkstemp()
+    os.close(fd)
+    stderr = sys.stderr
+    sys.stderr = StringIO.StringIO()
+    try:
+      analysis = gop.SampleAnalysis(output_filename)
+      consumed = 0
+      for packet in self.packets:
+        consumed += 1
+        if analysis.consume(packet):
+          break
+      analysis.finalize()
+      with open(output_filename) as f:
+        pids = [totxt_utils.TextPacket(line).pid for line in f]
+    finally:
+      sys.stderr = stderr
+      os.remove(output_filename)
+    # the PAT, the PMT, and a packet of every stream
+    self.assertEqual([0, 480, 481, 482], pids)
+    # done early
+    self.assertTrue(consumed < len(self.packets))
+
+
+if __name__ == '__main__':
+  unittest.main()
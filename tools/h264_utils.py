@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""h.264 frame type classification (python version of src/h264_utils.cc).
+
+The frame type of a video PES is obtained, as in the C++ version, from
+the first of these NAL units: an Access Unit Delimiter (its
+primary_pic_type), an IDR slice (always an I frame), or a non-IDR slice
+(whose slice_type is read from the slice header). As the AUD starts the
+access unit, its primary_pic_type wins over the slices when present.
+(Unlike the C++ version, the nal_ref_idc of the NAL header is ignored.)
+"""
+
+import pes_utils
+
+H264_FRAME_TYPE_UNKNOWN = 0
+H264_FRAME_TYPE_I = 1
+H264_FRAME_TYPE_P = 2
+H264_FRAME_TYPE_B = 3
+H264_FRAME_TYPE_OTHER = 4
+
+# "m2pb --type dump" names
+FRAME_TYPE_STR = {
+    H264_FRAME_TYPE_UNKNOWN: '-',
+    H264_FRAME_TYPE_I: 'I',
+    H264_FRAME_TYPE_P: 'P',
+    H264_FRAME_TYPE_B: 'B',
+    H264_FRAME_TYPE_OTHER: 'V',
+}
+
+START_CODE = '\x00\x00\x01'
+
+NAL_UNIT_TYPE_SLICE = 1
+NAL_UNIT_TYPE_IDR_SLICE = 5
+NAL_UNIT_TYPE_AUD = 9
+
+# slice_type (mod 5) to frame type (SP slices are P, SI slices are I)
+SLICE_TYPE_FRAME_TYPE = [
+    H264_FRAME_TYPE_P,
+    H264_FRAME_TYPE_B,
+    H264_FRAME_TYPE_I,
+    H264_FRAME_TYPE_P,
+    H264_FRAME_TYPE_I,
+]
+
+# AUD primary_pic_type to frame type (the C++ version ignores the AUDs
+# with other primary_pic_type values)
+PRIMARY_PIC_TYPE_FRAME_TYPE = [
+    H264_FRAME_TYPE_I,  # I
+    H264_FRAME_TYPE_P,  # P, I
+    H264_FRAME_TYPE_B,  # P, B, I
+]
+
+# the slice header fields we need fit in a few bytes: first_mb_in_slice
+# is at most 2 * 18 + 1 bits (for 8k video), and slice_type 9 bits
+SLICE_HEADER_PREFIX_SIZE = 8
+
+# how much of the PES to look at before giving up on finding a slice
+DEFAULT_MAX_PREFIX = 4096
+
+
+def get_frame_type_str(frame_type):
+  return FRAME_TYPE_STR.get(frame_type, '-')
+
+
+def read_golomb_uint(data, bit_offset):
+  """Reads an Exp-Golomb-coded (ue(v)) value.
+
+  Args:
+    data: a bytearray
+    bit_offset: the bit position where the code starts
+
+  Returns:
+    a (value, bit_offset) tuple, where bit_offset points to the bit after
+    the code. value is None if data is too short.
+  """
+  nbits = len(data) * 8
+  leading_zero_bits = 0
+  while (bit_offset < nbits and
+      not (data[bit_offset >> 3] >> (7 - (bit_offset & 0x07))) & 1):
+    leading_zero_bits += 1
+    bit_offset += 1
+  # skip the '1' bit, and then read the same number of bits as zeros
+  bit_offset += 1
+  if bit_offset + leading_zero_bits > nbits:
+    return None, bit_offset
+  suffix_bits = 0
+  for _ in range(leading_zero_bits):
+    suffix_bits = ((suffix_bits << 1) |
+        ((data[bit_offset >> 3] >> (7 - (bit_offset & 0x07))) & 1))
+    bit_offset += 1
+  return (1 << leading_zero_bits) - 1 + suffix_bits, bit_offset
+
+
+def get_type_from_slice_header(data):
+  """Returns the frame type of a (non-IDR) slice, given its slice header.
+
+  Because slice_type is in the first bytes of the NAL, which can't be
+  zero, we don't need to filter start code emulation prevention bytes.
+  """
+  data = bytearray(data[:SLICE_HEADER_PREFIX_SIZE])
+  # skip first_mb_in_slice
+  first_mb_in_slice, bit_offset = read_golomb_uint(data, 0)
+  if first_mb_in_slice is None:
+    return H264_FRAME_TYPE_UNKNOWN
+  slice_type, _ = read_golomb_uint(data, bit_offset)
+  if slice_type is None:
+    return H264_FRAME_TYPE_UNKNOWN
+  if slice_type > 9:
+    return H264_FRAME_TYPE_OTHER
+  return SLICE_TYPE_FRAME_TYPE[slice_type % 5]
+
+
+def get_frame_type(data, final=True):
+  """Returns the h.264 frame type of a (prefix of a) video PES.
+
+  Args:
+    data: a string with the PES (or its ES payload) prefix
+    final: whether no more data will be available. If not, the function
+        returns H264_FRAME_TYPE_UNKNOWN (instead of guessing) when the
+        slice header is incomplete, so that the caller can retry with a
+        longer prefix.
+
+  Returns:
+    the frame type (one of the H264_FRAME_TYPE_* values)
+  """
+  i = data.find(START_CODE)
+  while i >= 0 and i + 3 < len(data):
+    nal_header = ord(data[i + 3])
+    nal_unit_type = nal_header & 0x1f
+    if nal_header & 0x80:
+      # forbidden_zero_bit set: not a NAL unit (e.g. a PES start code)
+      pass
+    elif nal_unit_type == NAL_UNIT_TYPE_AUD:
+      if i + 4 >= len(data):
+        # AUD split: need more data
+        break
+      primary_pic_type = ord(data[i + 4]) >> 5
+      if primary_pic_type < len(PRIMARY_PIC_TYPE_FRAME_TYPE):
+        return PRIMARY_PIC_TYPE_FRAME_TYPE[primary_pic_type]
+    elif nal_unit_type == NAL_UNIT_TYPE_IDR_SLICE:
+      return H264_FRAME_TYPE_I
+    elif nal_unit_type == NAL_UNIT_TYPE_SLICE:
+      slice_header = data[i + 4:i + 4 + SLICE_HEADER_PREFIX_SIZE]
+      frame_type = get_type_from_slice_header(slice_header)
+      if frame_type != H264_FRAME_TYPE_UNKNOWN or final:
+        return frame_type
+      # slice header split: need more data
+      return H264_FRAME_TYPE_UNKNOWN
+    i = data.find(START_CODE, i + 3)
+  return H264_FRAME_TYPE_UNKNOWN
+
+
+class FrameTypeScanner(object):
+  """Classifies a video PES from the payloads of its first TS packets.
+
+  Usage: call start() with the payload of the PUSI packet, and add() with
+  the payloads of the following packets of the same pid, until the frame
+  type is known (or the prefix gets too long). finish() returns the best
+  guess with the data seen so far.
+  """
+
+  def __init__(self, max_prefix=DEFAULT_MAX_PREFIX):
+    self._max_prefix = max_prefix
+    self._chunks = []
+    self._len = 0
+    self.frame_type = H264_FRAME_TYPE_UNKNOWN
+
+  def start(self, payload):
+    self._chunks = []
+    self._len = 0
+    self.frame_type = H264_FRAME_TYPE_UNKNOWN
+    return self.add(payload)
+
+  def add(self, payload):
+    """Adds a payload. Returns the frame type, or UNKNOWN if undecided."""
+    if self.frame_type != H264_FRAME_TYPE_UNKNOWN:
+      return self.frame_type
+    self._chunks.append(payload)
+    self._len += len(payload)
+    final = self._len >= self._max_prefix
+    self.frame_type = get_frame_type(''.join(self._chunks), final)
+    return self.frame_type
+
+  def finish(self):
+    if self.frame_type == H264_FRAME_TYPE_UNKNOWN and self._chunks:
+      self.frame_type = get_frame_type(''.join(self._chunks), True)
+    return self.frame_type
+
+
+def get_pes_frame_type(unit, max_prefix=DEFAULT_MAX_PREFIX):
+  """Classifies a video pes_utils.PesUnit (reading as few chunks as needed)."""
+  scanner = FrameTypeScanner(max_prefix)
+  frame_type = scanner.start(unit.chunks[0].tobytes())
+  for chunk in unit.chunks[1:]:
+    if frame_type != H264_FRAME_TYPE_UNKNOWN:
+      break
+    frame_type = scanner.add(chunk.tobytes())
+  return scanner.finish()
+
+
+def get_frame_types(view, pid, max_prefix=DEFAULT_MAX_PREFIX):
+  """Classifies all the video PES of a pid in a ts_view.HeaderView.
+
+  Yields:
+    (packet_index, frame_type) tuples, one per PUSI packet of the pid.
+  """
+  for unit in pes_utils.get_pes_units(view, [pid]):
+    yield unit.packets[0], get_pes_frame_type(unit, max_prefix)
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+
+"""Unit tests for h264_utils.py."""
+
+import unittest
+import h264_utils
+from h264_utils import (H264_FRAME_TYPE_UNKNOWN, H264_FRAME_TYPE_I,
+    H264_FRAME_TYPE_P, H264_FRAME_TYPE_B)
+
+# PES header (video, pts only)
+PES_HEADER = '\x00\x00\x01\xe0\x00\x00\x80\x80\x05\x21\x00\x01\x00\x01'
+# access unit delimiters (primary_pic_type I, P, B, and 7, ignored)
+AUD_I = '\x00\x00\x00\x01\x09\x10'
+AUD_P = '\x00\x00\x00\x01\x09\x30'
+AUD_B = '\x00\x00\x00\x01\x09\x50'
+AUD_7 = '\x00\x00\x00\x01\x09\xf0'
+SPS = '\x00\x00\x00\x01\x67\x4d\x40\x28\xe4\x60\x3c\x02\x23\xef\x01\x10'
+SEI = '\x00\x00\x01\x06\x05\x10' + 'x' * 16 + '\x80'
+IDR_SLICE = '\x00\x00\x01\x65\x88\x84\x00\x21'
+# non-idr slices: first_mb_in_slice: 0 ('1'), slice_type: 5 (P, '00110'),
+# 6 (B, '00111'), and 7 (I, '0001000')
+P_SLICE = '\x00\x00\x01\x41\x9a\x21\x6c'
+B_SLICE = '\x00\x00\x01\x01\x9e\x21\x6c'
+I_SLICE = '\x00\x00\x01\x21\x88\x21\x6c'
+
+
+class H264UtilsTest(unittest.TestCase):
+
+  def testReadGolombUint(self):
+    data = bytearray('\xa6\x42\x80')  # 1 010 011 00100 00101 0...
+    values = []
+    bit_offset = 0
+    for _ in range(5):
+      value, bit_offset = h264_utils.read_golomb_uint(data, bit_offset)
+      values.append(value)
+    self.assertEqual([0, 1, 2, 3, 4], values)
+    self.assertEqual(17, bit_offset)
+    # not enough bits
+    value, _ = h264_utils.read_golomb_uint(bytearray('\x00\x01'), 0)
+    self.assertEqual(None, value)
+
+  def testGetFrameType(self):
+    self.assertEqual(H264_FRAME_TYPE_I, h264_utils.get_frame_type(
+        PES_HEADER + AUD_I + SPS + SEI + IDR_SLICE))
+    self.assertEqual(H264_FRAME_TYPE_P, h264_utils.get_frame_type(
+        PES_HEADER + AUD_P + P_SLICE))
+    self.assertEqual(H264_FRAME_TYPE_B, h264_utils.get_frame_type(
+        PES_HEADER + AUD_B + B_SLICE))
+    # no AUD: use the first slice
+    self.assertEqual(H264_FRAME_TYPE_I, h264_utils.get_frame_type(
+        PES_HEADER + SPS + SEI + IDR_SLICE + P_SLICE))
+    self.assertEqual(H264_FRAME_TYPE_I, h264_utils.get_frame_type(
+        PES_HEADER + SEI + I_SLICE))
+    self.assertEqual(H264_FRAME_TYPE_P, h264_utils.get_frame_type(
+        PES_HEADER + AUD_7 + P_SLICE))
+    self.assertEqual(H264_FRAME_TYPE_UNKNOWN, h264_utils.get_frame_type(
+        PES_HEADER + SEI))
+    self.assertEqual(H264_FRAME_TYPE_UNKNOWN, h264_utils.get_frame_type(
+        PES_HEADER + AUD_7 + SEI))
+    self.assertEqual('I', h264_utils.get_frame_type_str(H264_FRAME_TYPE_I))
+
+  def testAudPrecedence(self):
+    # like src/h264_utils.cc, the AUD wins over the slices after it
+    self.assertEqual(H264_FRAME_TYPE_P, h264_utils.get_frame_type(
+        PES_HEADER + AUD_P + I_SLICE))
+    self.assertEqual(H264_FRAME_TYPE_B, h264_utils.get_frame_type(
+        PES_HEADER + AUD_B + SPS + SEI + IDR_SLICE))
+    self.assertEqual(H264_FRAME_TYPE_I, h264_utils.get_frame_type(
+        PES_HEADER + AUD_I + P_SLICE))
+    # (but not over the slices before it)
+    self.assertEqual(H264_FRAME_TYPE_B, h264_utils.get_frame_type(
+        PES_HEADER + B_SLICE + AUD_I))
+
+  def testFrameTypeScanner(self):
+    scanner = h264_utils.FrameTypeScanner()
+    data = PES_HEADER + SPS + SEI + B_SLICE
+    # split the start code and the slice across chunks
+    cut1 = len(data) - 5
+    cut2 = len(data) - 3
+    self.assertEqual(H264_FRAME_TYPE_UNKNOWN, scanner.start(data[:cut1]))
+    self.assertEqual(H264_FRAME_TYPE_UNKNOWN, scanner.add(data[cut1:cut2]))
+    self.assertEqual(H264_FRAME_TYPE_B, scanner.add(data[cut2:]))
+    self.assertEqual(H264_FRAME_TYPE_B, scanner.finish())
+    # the AUD decides as soon as it is seen
+    self.assertEqual(H264_FRAME_TYPE_P,
+                     scanner.start(PES_HEADER + AUD_P + SEI))
+    self.assertEqual(H264_FRAME_TYPE_P, scanner.finish())
+    # a split slice header, and no more data
+    self.assertEqual(H264_FRAME_TYPE_UNKNOWN,
+                     scanner.start(PES_HEADER + SEI + P_SLICE[:4]))
+    self.assertEqual(H264_FRAME_TYPE_UNKNOWN, scanner.finish())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""Shared m2pb subprocess layer.
+
+Reading the output of "m2pb totxt" (or "m2pb dump") with readline(), and
+feeding "m2pb tobin" one write() per line, costs a syscall (and a GIL
+round trip) per packet. Instead:
+
+* M2pbReader launches m2pb with large pipe buffers, and reads its output
+  in MB-sized blocks, which are split into lines.
+* M2pbWriter batches the lines written into "m2pb tobin".
+* tee() fans a single m2pb output stream out to several consumers (e.g.
+  the analyses of "gop.py run"), decoding every block only once.
+* ThreadedReader and ThreadedWriter move the reading and the writing
+  into their own threads, connected to the caller through bounded queues
+  of line batches, so that a (single-threaded) transform overlaps with
+  both pipes instead of running in lockstep with them.
+
+Every stage accounts for its lines, bytes, and busy time (spent
+processing), apart from the time it waits for its pipe, and every queue
+for its depth and wait times, so that get_stats_str() tells which stage
+is the bottleneck.
+"""
+
+import fcntl
+import os
+import Queue
+import subprocess
+import threading
+import time
+import ts_source
+
+M2PB = 'm2pb'
+
+# linux-only fcntl to resize a pipe (see fcntl(2))
+F_SETPIPE_SZ = 1031
+# default /proc/sys/fs/pipe-max-size
+PIPE_BUFFER_SIZE = 1 << 20
+# how much to read from m2pb in each read() call
+DEFAULT_READ_BLOCK_SIZE = 4 << 20
+# how much to batch before writing into m2pb
+DEFAULT_WRITE_BATCH_SIZE = 1 << 20
+# how many line batches a pipeline queue holds
+DEFAULT_QUEUE_BATCHES = 8
+# how many lines a ThreadedWriter batches before queueing them
+DEFAULT_QUEUE_BATCH_LINES = 4096
+# how often blocked pipeline threads check whether they must stop
+QUEUE_POLL_TIMEOUT = 0.1
+
+
+def set_pipe_size(f, size=PIPE_BUFFER_SIZE):
+  """Tries to enlarge the kernel buffer of a pipe (linux only)."""
+  try:
+    fcntl.fcntl(f.fileno(), F_SETPIPE_SZ, size)
+  except (IOError, OSError):
+    pass
+
+
+class Stage(object):
+  """Throughput counters for a pipeline stage."""
+
+  def __init__(self, name):
+    self.name = name
+    self.lines = 0
+    self.bytes = 0
+    # time spent processing
+    self.busy = 0.0
+    # time spent blocked on the pipe (e.g. in os.read())
+    self.wait = 0.0
+    self._start = time.time()
+
+  def add(self, lines, size, busy, wait=0.0):
+    self.lines += lines
+    self.bytes += size
+    self.busy += busy
+    self.wait += wait
+
+  def get_stats(self):
+    return {'name': self.name, 'lines': self.lines, 'bytes': self.bytes,
+            'busy': self.busy, 'wait': self.wait,
+            'elapsed': time.time() - self._start}
+
+  def get_stats_str(self):
+    elapsed = time.time() - self._start
+    busy = self.busy or 1e-9
+    return ('%s: %i lines, %i bytes, %.2f/%.2f s busy, %.2f s waiting '
+            '(%.1f MB/s, %.0f lines/s)' % (self.name, self.lines, self.bytes,
+                                           self.busy, elapsed, self.wait,
+                                           self.bytes / busy / 1e6,
+                                           self.lines / busy))
+
+
+class M2pbReader(object):
+  """Runs an m2pb command on an input spec, and reads its output lines.
+
+  Iterating over the reader yields lines (without the trailing newline).
+  iter_blocks() yields lists of lines instead, one per block read.
+  """
+
+  def __init__(self, command, spec, debug=0,
+               block_size=DEFAULT_READ_BLOCK_SIZE, offset=0):
+    """
+    Args:
+      command: the m2pb command (without the input file argument)
+      spec: the input file spec (see ts_source.popen())
+      debug: verbosity level
+      block_size: maximum size of each read() from m2pb
+      offset: where to start reading a regular file (the byte fields of
+          the output lines are relative to it)
+    """
+    self._block_size = block_size
+    self.proc, self.source = ts_source.popen(command, spec, debug, offset,
+        stdout=subprocess.PIPE)
+    set_pipe_size(self.proc.stdout)
+    self.stage = Stage(' '.join(command))
+
+  def __iter__(self):
+    for lines in self.iter_blocks():
+      for line in lines:
+        yield line
+
+  def iter_blocks(self):
+    fd = self.proc.stdout.fileno()
+    rem = ''
+    while True:
+      start = time.time()
+      block = os.read(fd, self._block_size)
+      read = time.time()
+      if not block:
+        self.stage.add(0, 0, 0, read - start)
+        break
+      lines = (rem + block).split('\n')
+      # the last line may be incomplete
+      rem = lines.pop()
+      self.stage.add(len(lines), len(block), time.time() - read, read - start)
+      yield lines
+    if rem:
+      self.stage.add(1, 0, 0)
+      yield [rem]
+
+  def close(self):
+    """Stops m2pb (even if its output was not read completely)."""
+    if self.source is not None:
+      # stop reading the live source
+      self.source.close()
+    self.proc.stdout.close()
+    self.proc.wait()
+
+  def get_stats(self):
+    return self.stage.get_stats()
+
+  def get_stats_str(self):
+    stats = [self.stage.get_stats_str()]
+    if self.source is not None:
+      stats.append(self.source.get_stats_str())
+    return '\n'.join(stats)
+
+
+class M2pbWriter(object):
+  """Runs an m2pb command (e.g. "tobin - out.ts"), and batches its input."""
+
+  def __init__(self, command, batch_size=DEFAULT_WRITE_BATCH_SIZE):
+    self._batch_size = batch_size
+    self._batch = []
+    self._batch_bytes = 0
+    self.proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+    set_pipe_size(self.proc.stdin)
+    self.stage = Stage(' '.join(command))
+
+  def write(self, line):
+    """Writes a line (without the trailing newline)."""
+    self._batch.append(line)
+    self._batch_bytes += len(line) + 1
+    if self._batch_bytes >= self._batch_size:
+      self.flush()
+
+  def writelines(self, lines):
+    for line in lines:
+      self.write(line)
+
+  def flush(self):
+    if not self._batch:
+      return
+    start = time.time()
+    self._batch.append('')
+    data = '\n'.join(self._batch)
+    joined = time.time()
+    self.proc.stdin.write(data)
+    self.stage.add(len(self._batch) - 1, self._batch_bytes, joined - start,
+                   time.time() - joined)
+    self._batch = []
+    self._batch_bytes = 0
+
+  def close(self):
+    self.flush()
+    self.proc.stdin.close()
+    return self.proc.wait()
+
+  def get_stats(self):
+    return self.stage.get_stats()
+
+  def get_stats_str(self):
+    return self.stage.get_stats_str()
+
+
+def tee(reader, consumers, decode=None):
+  """Fans the lines of a reader out to several consumers.
+
+  Args:
+    reader: an M2pbReader (or anything with an iter_blocks() method)
+    consumers: a list of (name, function) tuples. Every function is
+        called with each block, in order. A function returning True is
+        done, and does not get any more blocks.
+    decode: a function called once per block of lines, returning what
+        the consumers get (e.g. the parsed lines). By default, the
+        consumers get the lines.
+
+  Returns:
+    a list with the Stage of each consumer, preceded by the Stage of
+    decode (if any). Reading stops as soon as all the consumers are done.
+  """
+  stages = [Stage(name) for name, _ in consumers]
+  decode_stage = Stage('decode')
+  active = range(len(consumers))
+  for lines in reader.iter_blocks():
+    size = sum(len(line) + 1 for line in lines)
+    block = lines
+    if decode is not None:
+      start = time.time()
+      block = decode(lines)
+      decode_stage.add(len(lines), size, time.time() - start)
+    for i in list(active):
+      start = time.time()
+      done = consumers[i][1](block)
+      stages[i].add(len(lines), size, time.time() - start)
+      if done:
+        active.remove(i)
+    if not active:
+      break
+  return stages if decode is None else [decode_stage] + stages
+
+
+class InstrumentedQueue(object):
+  """A bounded queue that accounts for its depth and wait times.
+
+  A queue that is mostly full means that its consumer is the bottleneck
+  (and its producer waits in put()). A queue that is mostly empty means
+  that its producer is the bottleneck (and its consumer waits in get()).
+  """
+
+  def __init__(self, name, maxsize=DEFAULT_QUEUE_BATCHES):
+    self.name = name
+    self.maxsize = maxsize
+    self.puts = 0
+    self.depth_sum = 0
+    self.max_depth = 0
+    self.put_wait = 0.0
+    self.get_wait = 0.0
+    self._queue = Queue.Queue(maxsize)
+
+  def put(self, item, timeout=None):
+    """Adds an item (raises Queue.Full if timeout expires)."""
+    start = time.time()
+    self._queue.put(item, True, timeout)
+    self.put_wait += time.time() - start
+    # depth seen by this item (including itself)
+    depth = self._queue.qsize()
+    self.puts += 1
+    self.depth_sum += depth
+    self.max_depth = max(self.max_depth, depth)
+
+  def get(self):
+    start = time.time()
+    item = self._queue.get()
+    self.get_wait += time.time() - start
+    return item
+
+  def drain(self):
+    """Removes all the queued items (unblocking the producer)."""
+    while True:
+      try:
+        self._queue.get_nowait()
+      except Queue.Empty:
+        return
+
+  def get_average_depth(self):
+    return float(self.depth_sum) / (self.puts or 1)
+
+  def get_stats(self):
+    return {'name': self.name, 'puts': self.puts,
+            'average_depth': self.get_average_depth(),
+            'max_depth': self.max_depth, 'maxsize': self.maxsize,
+            'put_wait': self.put_wait, 'get_wait': self.get_wait}
+
+  def get_stats_str(self):
+    average_depth = self.get_average_depth()
+    return ('%s queue: %i batches, depth %.1f avg/%i max/%i size, '
+            '%.2f s put wait, %.2f s get wait' % (self.name, self.puts,
+                average_depth, self.max_depth, self.maxsize, self.put_wait,
+                self.get_wait))
+
+
+class ThreadedReader(object):
+  """Reads the lines of an M2pbReader in a separate thread.
+
+  Iterating over the threaded reader yields lines (like M2pbReader), but
+  the os.read() calls (which release the GIL) happen in the background,
+  while the caller processes the previous blocks.
+  """
+
+  def __init__(self, reader, maxsize=DEFAULT_QUEUE_BATCHES):
+    self.reader = reader
+    self.source = reader.source
+    self.queue = InstrumentedQueue('read', maxsize)
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._run, name='m2pb_reader')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _put(self, item):
+    while not self._stop.is_set():
+      try:
+        self.queue.put(item, QUEUE_POLL_TIMEOUT)
+        return True
+      except Queue.Full:
+        pass
+    return False
+
+  def _run(self):
+    try:
+      for lines in self.reader.iter_blocks():
+        if not self._put(lines):
+          return
+    except (IOError, OSError, ValueError):
+      # the pipe was closed under our feet
+      pass
+    self._put(None)
+
+  def __iter__(self):
+    for lines in self.iter_blocks():
+      for line in lines:
+        yield line
+
+  def iter_blocks(self):
+    while True:
+      lines = self.queue.get()
+      if lines is None:
+        break
+      yield lines
+
+  def close(self):
+    """Stops the reader thread and m2pb (even if not read completely)."""
+    self._stop.set()
+    self.queue.drain()
+    if self._thread.is_alive() and self.reader.proc.poll() is None:
+      # unblock a pending os.read()
+      self.reader.proc.terminate()
+    self._thread.join()
+    self.reader.close()
+
+  def get_stats(self):
+    return {'reader': self.reader.get_stats(),
+            'queue': self.queue.get_stats()}
+
+  def get_stats_str(self):
+    return '%s\n%s' % (self.reader.get_stats_str(),
+                        self.queue.get_stats_str())
+
+
+class ThreadedWriter(object):
+  """Writes lines into an M2pbWriter from a separate thread.
+
+  Lines are batched, and the batches handed over through a bounded queue,
+  so that the pipe write() calls (which release the GIL) happen in the
+  background.
+  """
+
+  def __init__(self, writer, maxsize=DEFAULT_QUEUE_BATCHES,
+               batch_lines=DEFAULT_QUEUE_BATCH_LINES):
+    self.writer = writer
+    self.queue = InstrumentedQueue('write', maxsize)
+    self._batch_lines = batch_lines
+    self._batch = []
+    self._error = None
+    self._thread = threading.Thread(target=self._run, name='m2pb_writer')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _run(self):
+    while True:
+      lines = self.queue.get()
+      if lines is None:
+        break
+      if self._error is not None:
+        # keep draining, so that the producer never blocks
+        continue
+      try:
+        self.writer.writelines(lines)
+      except (IOError, OSError) as e:
+        self._error = e
+
+  def write(self, line):
+    self._batch.append(line)
+    if len(self._batch) >= self._batch_lines:
+      self.flush()
+
+  def writelines(self, lines):
+    for line in lines:
+      self.write(line)
+
+  def flush(self):
+    if self._batch:
+      self.queue.put(self._batch)
+      self._batch = []
+
+  def close(self):
+    """Waits for the queued lines to be written, and closes the writer."""
+    self.flush()
+    self.queue.put(None)
+    self._thread.join()
+    if self._error is not None:
+      raise self._error
+    return self.writer.close()
+
+  def get_stats(self):
+    return {'writer': self.writer.get_stats(),
+            'queue': self.queue.get_stats()}
+
+  def get_stats_str(self):
+    return '%s\n%s' % (self.queue.get_stats_str(),
+                        self.writer.get_stats_str())
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+
+"""Unit tests for m2pb_pipe.py."""
+
+import os
+import tempfile
+import unittest
+import m2pb_pipe
+
+LINES = ['packet: %i byte: %i' % (i, 188 * i) for i in range(1000)]
+
+
+class M2pbPipeTest(unittest.TestCase):
+
+  def setUp(self):
+    fd, self.filename = tempfile.mkstemp()
+    with os.fdopen(fd, 'w') as f:
+      f.write('\n'.join(LINES) + '\n')
+
+  def tearDown(self):
+    os.remove(self.filename)
+
+  def testReader(self):
+    # small blocks split lines all over the place
+    for block_size in (7, 100, m2pb_pipe.DEFAULT_READ_BLOCK_SIZE):
+      reader = m2pb_pipe.M2pbReader(['cat'], self.filename,
+                                    block_size=block_size)
+      self.assertEqual(LINES, list(reader))
+      reader.close()
+      self.assertEqual(len(LINES), reader.stage.lines)
+      self.assertEqual(os.path.getsize(self.filename), reader.stage.bytes)
+    # closing early
+    reader = m2pb_pipe.M2pbReader(['cat'], self.filename, block_size=100)
+    self.assertEqual(LINES[0], next(iter(reader)))
+    reader.close()
+
+  def testWriter(self):
+    output_filename = self.filename + '.out'
+    writer = m2pb_pipe.M2pbWriter(['sh', '-c', 'cat > %s' % output_filename],
+                                  batch_size=1000)
+    writer.writelines(LINES[:10])
+    writer.write(LINES[10])
+    writer.writelines(LINES[11:])
+    self.assertEqual(0, writer.close())
+    with open(output_filename) as f:
+      self.assertEqual(LINES, f.read().splitlines())
+    os.remove(output_filename)
+    self.assertEqual(len(LINES), writer.stage.lines)
+
+  def testTee(self):
+    reader = m2pb_pipe.M2pbReader(['cat'], self.filename, block_size=1000)
+    all_lines = []
+    first_lines = []
+    def get_first_lines(lines):
+      first_lines.extend(lines)
+      return len(first_lines) >= 10
+    stages = m2pb_pipe.tee(reader, [('all', all_lines.extend),
+                                    ('first', get_first_lines)])
+    reader.close()
+    self.assertEqual(LINES, all_lines)
+    self.assertEqual(LINES[:len(first_lines)], first_lines)
+    self.assertTrue(len(first_lines) < len(LINES))
+    self.assertEqual(['all', 'first'], [stage.name for stage in stages])
+    self.assertEqual(len(LINES), stages[0].lines)
+    # the lines are decoded once per block
+    reader = m2pb_pipe.M2pbReader(['cat'], self.filename, block_size=1000)
+    packets = []
+    stages = m2pb_pipe.tee(reader, [('packets', packets.extend)],
+        decode=lambda lines: [int(line.split()[1]) for line in lines])
+    reader.close()
+    self.assertEqual(range(len(LINES)), packets)
+    self.assertEqual(['decode', 'packets'], [stage.name for stage in stages])
+    self.assertEqual(len(LINES), stages[0].lines)
+    # (the time blocked in os.read() is not busy time)
+    self.assertTrue(reader.stage.wait > 0)
+
+  def testThreadedReader(self):
+    reader = m2pb_pipe.ThreadedReader(
+        m2pb_pipe.M2pbReader(['cat'], self.filename, block_size=100),
+        maxsize=2)
+    self.assertEqual(LINES, list(reader))
+    reader.close()
+    self.assertTrue(reader.queue.puts > 2)
+    self.assertTrue(reader.queue.max_depth <= 2)
+    # closing early (the reader thread is blocked on a full queue)
+    reader = m2pb_pipe.ThreadedReader(
+        m2pb_pipe.M2pbReader(['cat'], self.filename, block_size=100),
+        maxsize=1)
+    self.assertEqual(LINES[0], next(iter(reader)))
+    reader.close()
+
+  def testThreadedWriter(self):
+    output_filename = self.filename + '.out'
+    writer = m2pb_pipe.ThreadedWriter(
+        m2pb_pipe.M2pbWriter(['sh', '-c', 'cat > %s' % output_filename]),
+        maxsize=2, batch_lines=7)
+    writer.writelines(LINES)
+    self.assertEqual(0, writer.close())
+    with open(output_filename) as f:
+      self.assertEqual(LINES, f.read().splitlines())
+    os.remove(output_filename)
+    # all the batches, plus the end marker
+    self.assertEqual((len(LINES) + 6) // 7 + 1, writer.queue.puts)
+
+
+if __name__ == '__main__':
+  unittest.main()
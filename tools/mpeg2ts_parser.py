@@ -0,0 +1,590 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""In-process mpeg-ts parser producing mpeg2ts_pb2 messages.
+
+This is a pure-Python port of the parsing half of src/mpeg2ts_parser.cc:
+it fills the same Mpeg2Ts/Mpeg2TsPacket structure that "m2pb totxt"
+prints, straight from the binary packets, without the m2pb subprocess
+and the text encoding/decoding of every packet.
+
+A field mask (a set of Mpeg2TsPacket field names) limits which
+submessages are materialized: header-only consumers never build (or
+parse) the PES or PSI parts of the packets. Note that only the
+materialized parts of a packet are validated, so a packet with a broken
+PES header is returned as "raw" only if its pes_packet is requested.
+
+Packets are parsed one at a time, so PSI sections longer than the rest
+of their packet (i.e. continued in the next packets of the pid) are not
+supported: their packets are returned as "raw". (psi_utils reassembles
+such sections from a ts_view.HeaderView.)
+"""
+
+import os
+import sys
+import ts_view
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'src'))
+import mpeg2ts_pb2
+
+MPEG_TS_PACKET_SYNC = 0x47
+
+MPEG_TS_TABLE_ID_PROGRAM_ASSOCIATION_SECTION = 0x00
+MPEG_TS_TABLE_ID_TS_PROGRAM_MAP_SECTION = 0x02
+MPEG_TS_TABLE_ID_DVB_SERVICE_DESCRIPTION_TABLE_CURRENT = 0x42
+MPEG_TS_TABLE_ID_DVB_SERVICE_DESCRIPTION_TABLE_OTHER = 0x46
+MPEG_TS_TABLE_ID_FORBIDDEN = 0xff
+
+# ISO/IEC 13818-1 Table 2-24
+DSM_TRICK_MODE_FAST_FORWARD = 0
+DSM_TRICK_MODE_SLOW_MOTION = 1
+DSM_TRICK_MODE_FREEZE_FRAME = 2
+DSM_TRICK_MODE_FAST_REVERSE = 3
+DSM_TRICK_MODE_SLOW_REVERSE = 4
+
+# Mpeg2TsPacket fields (for the field mask)
+FIELD_HEADER = 'header'
+FIELD_ADAPTATION_FIELD = 'adaptation_field'
+FIELD_PES_PACKET = 'pes_packet'
+FIELD_PSI_PACKET = 'psi_packet'
+FIELD_DATA_BYTES = 'data_bytes'
+ALL_FIELDS = frozenset((FIELD_HEADER, FIELD_ADAPTATION_FIELD,
+                        FIELD_PES_PACKET, FIELD_PSI_PACKET,
+                        FIELD_DATA_BYTES))
+HEADER_FIELDS = frozenset((FIELD_HEADER,))
+
+PesPacket = mpeg2ts_pb2.PesPacket
+
+# stream ids without the optional PES header fields
+NO_OPTIONAL_HEADER_STREAM_ID_TYPES = (
+    PesPacket.STREAM_ID_PROGRAM_STREAM_MAP,
+    PesPacket.STREAM_ID_PADDING_STREAM,
+    PesPacket.STREAM_ID_PRIVATE_STREAM_2,
+    PesPacket.STREAM_ID_ECM_STREAM,
+    PesPacket.STREAM_ID_EMM_STREAM,
+    PesPacket.STREAM_ID_DSMCC_STREAM,
+    PesPacket.STREAM_ID_H222_E_STREAM,
+    PesPacket.STREAM_ID_PROGRAM_STREAM_DIRECTORY,
+)
+
+# stream ids with a single StreamIdType value
+STREAM_ID_TYPES = dict((stream_id, stream_id) for stream_id in (
+    PesPacket.STREAM_ID_PROGRAM_STREAM_MAP,
+    PesPacket.STREAM_ID_PRIVATE_STREAM_1,
+    PesPacket.STREAM_ID_PADDING_STREAM,
+    PesPacket.STREAM_ID_PRIVATE_STREAM_2,
+    PesPacket.STREAM_ID_ECM_STREAM,
+    PesPacket.STREAM_ID_EMM_STREAM,
+    PesPacket.STREAM_ID_DSMCC_STREAM,
+    PesPacket.STREAM_ID_13522_STREAM,
+    PesPacket.STREAM_ID_H222_A_STREAM,
+    PesPacket.STREAM_ID_H222_B_STREAM,
+    PesPacket.STREAM_ID_H222_C_STREAM,
+    PesPacket.STREAM_ID_H222_D_STREAM,
+    PesPacket.STREAM_ID_H222_E_STREAM,
+    PesPacket.STREAM_ID_ANCILLARY_STREAM,
+    PesPacket.STREAM_ID_PROGRAM_STREAM_DIRECTORY,
+))
+
+
+class ParseError(Exception):
+  pass
+
+
+def get_stream_id_type(stream_id):
+  if 0xc0 <= stream_id <= 0xdf:
+    return PesPacket.STREAM_ID_AUDIO_13818
+  if 0xe0 <= stream_id <= 0xef:
+    return PesPacket.STREAM_ID_VIDEO_13818
+  return STREAM_ID_TYPES.get(stream_id, PesPacket.STREAM_ID_OTHER)
+
+
+def get_int32(b, bi):
+  """Returns the 4 bytes at b[bi] as a (signed) int32."""
+  value = (b[bi] << 24) | (b[bi + 1] << 16) | (b[bi + 2] << 8) | b[bi + 3]
+  return value - (1 << 32) if value & 0x80000000 else value
+
+
+def check_length(end, bi, length):
+  if end - bi < length:
+    raise ParseError()
+
+
+def parse_pcr(b, bi, end, pcr):
+  check_length(end, bi, 6)
+  # check that the padding bits are 1
+  if (b[bi + 4] & 0x7e) != 0x7e:
+    raise ParseError()
+  pcr.base = ((b[bi] << 25) | (b[bi + 1] << 17) | (b[bi + 2] << 9) |
+              (b[bi + 3] << 1) | (b[bi + 4] >> 7))
+  pcr.extension = ((b[bi + 4] & 0x01) << 8) | b[bi + 5]
+  return bi + 6
+
+
+def parse_escr(b, bi, end, pcr):
+  check_length(end, bi, 6)
+  pcr.base = (((b[bi] & 0x38) << 27) | ((b[bi] & 0x03) << 28) |
+              (b[bi + 1] << 20) | ((b[bi + 2] & 0xf8) << 12) |
+              ((b[bi + 2] & 0x03) << 13) | (b[bi + 3] << 5) |
+              ((b[bi + 4] & 0xf8) >> 3))
+  pcr.extension = ((b[bi + 4] & 0x03) << 8) | ((b[bi + 5] & 0xfe) >> 1)
+  return bi + 6
+
+
+def parse_pts(b, bi, end):
+  """Returns a 33-bit timestamp (pts, dts, or dts_next_au)."""
+  check_length(end, bi, 5)
+  guard = b[bi] >> 4
+  if guard not in (1, 2, 3):
+    raise ParseError()
+  if not (b[bi] & b[bi + 2] & b[bi + 4] & 0x01):
+    # invalid markers
+    raise ParseError()
+  return (((b[bi] & 0x0e) << 29) | (b[bi + 1] << 22) |
+          ((b[bi + 2] & 0xfe) << 14) | (b[bi + 3] << 7) | (b[bi + 4] >> 1))
+
+
+def parse_header(b, header):
+  header.transport_error_indicator = bool(b[1] & 0x80)
+  header.payload_unit_start_indicator = bool(b[1] & 0x40)
+  header.transport_priority = bool(b[1] & 0x20)
+  header.pid = ((b[1] & 0x1f) << 8) | b[2]
+  header.transport_scrambling_control = (b[3] & 0xc0) >> 6
+  header.adaptation_field_exists = bool(b[3] & 0x20)
+  header.payload_exists = bool(b[3] & 0x10)
+  header.continuity_counter = b[3] & 0x0f
+
+
+def parse_adaptation_field_extension(b, bi, end, extension):
+  check_length(end, bi, 2)
+  length = b[bi]
+  extension.adaptation_field_extension_length = length
+  check_length(end, bi + 1, length)
+  flags = b[bi + 1]
+  fixed_bi = bi + 1
+  bi += 2
+  if flags & 0x80:
+    # ltw_flag
+    extension.ltw_valid_flag = bool(b[bi] & 0x80)
+    extension.ltw_offset = ((b[bi] & 0x7f) << 8) | b[bi + 1]
+    bi += 2
+  if flags & 0x40:
+    # piecewise_rate_flag
+    extension.piecewise_rate = (((b[bi] & 0x3f) << 16) | (b[bi + 1] << 8) |
+                                b[bi + 2])
+    bi += 3
+  if flags & 0x20:
+    # seamless_splice_flag
+    extension.splice_type = (b[bi] & 0xf0) >> 4
+    extension.dts_next_au = (((b[bi] & 0x0e) << 29) | (b[bi + 1] << 22) |
+                             ((b[bi + 2] & 0xfe) << 14) | (b[bi + 3] << 7) |
+                             (b[bi + 4] >> 1))
+  # ignore reserved bytes
+  return fixed_bi + length
+
+
+def parse_adaptation_field(b, bi, end, adaptation_field):
+  check_length(end, bi, 1)
+  length = b[bi]
+  bi += 1
+  check_length(end, bi, length)
+  if adaptation_field is None:
+    return bi + length
+  adaptation_field.adaptation_field_length = length
+  if length == 0:
+    return bi
+  fixed_bi = bi
+  flags = b[bi]
+  adaptation_field.discontinuity_indicator = bool(flags & 0x80)
+  adaptation_field.random_access_indicator = bool(flags & 0x40)
+  adaptation_field.elementary_stream_priority_indicator = bool(flags & 0x20)
+  adaptation_field.splicing_point_flag = bool(flags & 0x04)
+  bi += 1
+  if flags & 0x10:
+    bi = parse_pcr(b, bi, end, adaptation_field.pcr)
+  if flags & 0x08:
+    bi = parse_pcr(b, bi, end, adaptation_field.opcr)
+  if flags & 0x04:
+    adaptation_field.splice_countdown = b[bi]
+    bi += 1
+  if flags & 0x02:
+    private_data_length = b[bi]
+    bi += 1
+    adaptation_field.transport_private_data = str(
+        b[bi:bi + private_data_length])
+    bi += private_data_length
+  if flags & 0x01:
+    bi = parse_adaptation_field_extension(
+        b, bi, end, adaptation_field.adaptation_field_extension)
+  # skip stuffing bytes
+  return fixed_bi + length
+
+
+def parse_dsm_trick_mode(b, bi, end, dsm_trick_mode):
+  check_length(end, bi, 1)
+  trick_mode_control = (b[bi] & 0xe0) >> 5
+  dsm_trick_mode.trick_mode_control = trick_mode_control
+  if trick_mode_control in (DSM_TRICK_MODE_FAST_FORWARD,
+                            DSM_TRICK_MODE_FAST_REVERSE):
+    dsm_trick_mode.field_id = (b[bi] & 0x18) >> 3
+    dsm_trick_mode.intra_slice_refresh = bool(b[bi] & 0x04)
+    dsm_trick_mode.frequency_truncation = b[bi] & 0x03
+  elif trick_mode_control in (DSM_TRICK_MODE_SLOW_MOTION,
+                              DSM_TRICK_MODE_SLOW_REVERSE):
+    dsm_trick_mode.rep_cntrl = b[bi] & 0x1f
+  elif trick_mode_control == DSM_TRICK_MODE_FREEZE_FRAME:
+    dsm_trick_mode.field_id = (b[bi] & 0x18) >> 3
+  return bi + 1
+
+
+def parse_pes_extension(b, bi, end, pes_extension):
+  check_length(end, bi, 1)
+  flags = b[bi]
+  bi += 1
+  if flags & 0x80:
+    # pes_private_data_flag
+    check_length(end, bi, 16)
+    pes_extension.pes_private_data = str(b[bi:bi + 16])
+    bi += 16
+  if flags & 0x40:
+    # pack_header_field_flag
+    check_length(end, bi, 1)
+    pack_field_length = b[bi]
+    bi += 1
+    check_length(end, bi, pack_field_length)
+    pes_extension.pack_header = str(b[bi:bi + pack_field_length])
+    bi += pack_field_length
+  if flags & 0x20:
+    # program_packet_sequence_counter_flag
+    check_length(end, bi, 2)
+    pes_extension.program_packet_sequence_counter = (b[bi] & 0x7f) >> 1
+    pes_extension.mpeg1_mpeg2_identifier = bool(b[bi + 1] & 0x40)
+    pes_extension.original_stuff_length = b[bi + 1] & 0x3f
+    bi += 2
+  if flags & 0x10:
+    # p_std_buffer_flag
+    check_length(end, bi, 2)
+    pes_extension.p_std_buffer_scale = bool(b[bi] & 0x20)
+    pes_extension.p_std_buffer_size = ((b[bi] & 0x1f) << 4) | b[bi + 1]
+    bi += 2
+  if flags & 0x01:
+    # pes_extension_flag_2
+    check_length(end, bi, 1)
+    field_length = b[bi]
+    bi += 1
+    check_length(end, bi, field_length)
+    pes_extension.pes_extension_field = str(b[bi:bi + field_length])
+    bi += field_length
+  return bi
+
+
+def parse_pes_packet(b, bi, end, pes_packet):
+  check_length(end, bi, 6)
+  stream_id = b[bi + 3]
+  pes_packet.stream_id = stream_id
+  stream_id_type = get_stream_id_type(stream_id)
+  pes_packet.stream_id_type = stream_id_type
+  pes_packet.pes_packet_length = (b[bi + 4] << 8) | b[bi + 5]
+  bi += 6
+  if stream_id_type in NO_OPTIONAL_HEADER_STREAM_ID_TYPES:
+    # remaining is data bytes (m2pb never fills padding_byte)
+    return bi
+  check_length(end, bi, 3)
+  flags = b[bi]
+  pes_packet.pes_scrambling_control = (flags & 0x30) >> 4
+  pes_packet.pes_priority = (flags & 0x08) >> 3
+  pes_packet.data_alignment_indicator = bool(flags & 0x04)
+  pes_packet.copyright = bool(flags & 0x02)
+  pes_packet.original_or_copy = bool(flags & 0x01)
+  flags = b[bi + 1]
+  pes_header_data_length = b[bi + 2]
+  pes_packet.pes_header_data_length = pes_header_data_length
+  bi += 3
+  fixed_bi = bi
+  if flags & 0x80:
+    pes_packet.pts = parse_pts(b, bi, end)
+    bi += 5
+  if flags & 0x40:
+    pes_packet.dts = parse_pts(b, bi, end)
+    bi += 5
+  if flags & 0x20:
+    bi = parse_escr(b, bi, end, pes_packet.escr)
+  if flags & 0x10:
+    check_length(end, bi, 3)
+    pes_packet.es_rate = (((b[bi] & 0x7f) << 15) | (b[bi + 1] << 7) |
+                          (b[bi + 2] >> 1))
+    bi += 3
+  if flags & 0x08:
+    bi = parse_dsm_trick_mode(b, bi, end, pes_packet.dsm_trick_mode)
+  if flags & 0x04:
+    pes_packet.additional_copy_info = b[bi] & 0x7f
+    bi += 1
+  if flags & 0x02:
+    pes_packet.previous_pes_packet_crc = (b[bi] << 8) | b[bi + 1]
+    bi += 2
+  if flags & 0x01:
+    bi = parse_pes_extension(b, bi, end, pes_packet.pes_extension)
+  # skip stuffing bytes (remaining is data bytes)
+  return max(bi, fixed_bi + pes_header_data_length)
+
+
+def parse_descriptor(b, bi, end, descriptor):
+  check_length(end, bi, 2)
+  descriptor.tag = b[bi]
+  length = b[bi + 1]
+  descriptor.length = length
+  bi += 2
+  check_length(end, bi, length)
+  descriptor.data = str(b[bi:bi + length])
+  return bi + length
+
+
+def parse_descriptors(b, bi, length, descriptors):
+  end = bi + length
+  while bi < end:
+    bi = parse_descriptor(b, bi, end, descriptors.add())
+  return bi
+
+
+def parse_section_header(b, bi, end, section, zero_bit=0):
+  """Parses table_id and section_length (of a section ending before end).
+
+  Returns:
+    a (bi, section_end) tuple.
+  """
+  check_length(end, bi, 8)
+  section.table_id = b[bi]
+  flags = b[bi + 1]
+  # section_syntax_indicator, '0' (or reserved_future_use), reserved,
+  # and the first two bits of section_length (must be '00')
+  if (flags & 0xfc) != (0xb0 | (zero_bit << 6)):
+    raise ParseError()
+  section_length = ((flags & 0x0f) << 8) | b[bi + 2]
+  section.section_length = section_length
+  bi += 3
+  # sections must end in their packet (see the module docstring)
+  if end < bi + section_length:
+    raise ParseError()
+  return bi, bi + section_length
+
+
+def parse_section_version(b, bi, section):
+  section.version_number = (b[bi] & 0x3e) >> 1
+  section.current_next_indicator = bool(b[bi] & 0x01)
+  section.section_number = b[bi + 1]
+  section.last_section_number = b[bi + 2]
+  return bi + 3
+
+
+def parse_program_association_section(b, bi, end, section):
+  bi, section_end = parse_section_header(b, bi, end, section)
+  section.transport_stream_id = (b[bi] << 8) | b[bi + 1]
+  bi = parse_section_version(b, bi + 2, section)
+  while bi < section_end - 4:
+    check_length(end, bi, 4)
+    program_information = section.program_information.add()
+    program_number = (b[bi] << 8) | b[bi + 1]
+    program_information.program_number = program_number
+    pid = ((b[bi + 2] & 0x1f) << 8) | b[bi + 3]
+    if program_number == 0:
+      program_information.network_pid = pid
+    else:
+      program_information.program_map_pid = pid
+    bi += 4
+  section.crc_32 = get_int32(b, bi)
+  return bi + 4
+
+
+def parse_stream_description(b, bi, end, stream_description):
+  check_length(end, bi, 5)
+  stream_description.stream_type = b[bi]
+  stream_description.elementary_pid = ((b[bi + 1] & 0x1f) << 8) | b[bi + 2]
+  es_info_length = ((b[bi + 3] & 0x0f) << 8) | b[bi + 4]
+  # ensure the first 2 out of the 12 bits are 0
+  if es_info_length & 0xc00:
+    raise ParseError()
+  stream_description.es_info_length = es_info_length
+  return parse_descriptors(b, bi + 5, es_info_length,
+                           stream_description.mpegts_descriptor)
+
+
+def parse_program_map_section(b, bi, end, section):
+  bi, section_end = parse_section_header(b, bi, end, section)
+  section.program_number = (b[bi] << 8) | b[bi + 1]
+  bi = parse_section_version(b, bi + 2, section)
+  section.pcr_pid = ((b[bi] & 0x1f) << 8) | b[bi + 1]
+  program_info_length = ((b[bi + 2] & 0x0f) << 8) | b[bi + 3]
+  section.program_info_length = program_info_length
+  bi = parse_descriptors(b, bi + 4, program_info_length,
+                         section.mpegts_descriptor)
+  while bi < section_end - 4:
+    bi = parse_stream_description(b, bi, section_end - 4,
+                                  section.stream_description.add())
+  section.crc_32 = get_int32(b, bi)
+  return bi + 4
+
+
+def parse_service_description(b, bi, end, service_description):
+  check_length(end, bi, 5)
+  service_description.service_id = (b[bi] << 8) | b[bi + 1]
+  # check reserved_future_use
+  if (b[bi + 2] & 0xfc) != 0xfc:
+    raise ParseError()
+  service_description.eit_schedule_flag = bool(b[bi + 2] & 0x02)
+  service_description.eit_present_following_flag = bool(b[bi + 2] & 0x01)
+  service_description.running_status = (b[bi + 3] & 0xe0) >> 5
+  service_description.free_ca_mode = bool(b[bi + 3] & 0x10)
+  descriptors_loop_length = ((b[bi + 3] & 0x0f) << 8) | b[bi + 4]
+  service_description.descriptors_loop_length = descriptors_loop_length
+  return parse_descriptors(b, bi + 5, descriptors_loop_length,
+                           service_description.mpegts_descriptor)
+
+
+def parse_service_description_section(b, bi, end, section):
+  bi, section_end = parse_section_header(b, bi, end, section, zero_bit=1)
+  section.transport_stream_id = (b[bi] << 8) | b[bi + 1]
+  if (b[bi + 2] & 0xc0) != 0xc0:
+    raise ParseError()
+  bi = parse_section_version(b, bi + 2, section)
+  check_length(end, bi, 3)
+  section.original_network_id = (b[bi] << 8) | b[bi + 1]
+  if b[bi + 2] != 0xff:
+    raise ParseError()
+  bi += 3
+  while bi < section_end - 4:
+    bi = parse_service_description(b, bi, end,
+                                   section.service_description.add())
+  check_length(end, bi, 4)
+  section.crc_32 = get_int32(b, bi)
+  return bi + 4
+
+
+def parse_psi_packet(b, bi, end, psi_packet):
+  check_length(end, bi, 1)
+  pointer_field_length = b[bi]
+  bi += 1
+  check_length(end, bi, pointer_field_length)
+  psi_packet.pointer_field = str(b[bi:bi + pointer_field_length])
+  bi += pointer_field_length
+  check_length(end, bi, 1)
+  table_id = b[bi]
+  if table_id == MPEG_TS_TABLE_ID_PROGRAM_ASSOCIATION_SECTION:
+    return parse_program_association_section(
+        b, bi, end, psi_packet.program_association_section.add())
+  elif table_id == MPEG_TS_TABLE_ID_TS_PROGRAM_MAP_SECTION:
+    return parse_program_map_section(
+        b, bi, end, psi_packet.program_map_section.add())
+  elif table_id in (MPEG_TS_TABLE_ID_DVB_SERVICE_DESCRIPTION_TABLE_CURRENT,
+                    MPEG_TS_TABLE_ID_DVB_SERVICE_DESCRIPTION_TABLE_OTHER):
+    return parse_service_description_section(
+        b, bi, end, psi_packet.service_description_section.add())
+  elif table_id == MPEG_TS_TABLE_ID_FORBIDDEN:
+    # remaining bytes are data bytes
+    return bi
+  # unsupported PSI section
+  check_length(end, bi, 8)
+  other_psi_section = psi_packet.other_psi_section.add()
+  other_psi_section.table_id = table_id
+  other_psi_section.remaining = str(b[bi + 1:end])
+  return end
+
+
+class Mpeg2TsParser(object):
+  """Parses 188-byte mpeg-ts packets into mpeg2ts_pb2.Mpeg2Ts messages."""
+
+  def __init__(self, fields=ALL_FIELDS):
+    """
+    Args:
+      fields: the Mpeg2TsPacket fields to materialize (see ALL_FIELDS)
+    """
+    self._fields = frozenset(fields)
+    unknown = self._fields - ALL_FIELDS
+    if unknown:
+      raise ValueError('invalid field(s): %s' % ', '.join(sorted(unknown)))
+    self._header = FIELD_HEADER in self._fields
+    self._adaptation_field = FIELD_ADAPTATION_FIELD in self._fields
+    self._pes_packet = FIELD_PES_PACKET in self._fields
+    self._psi_packet = FIELD_PSI_PACKET in self._fields
+    self._data_bytes = FIELD_DATA_BYTES in self._fields
+    # the payload is only parsed if something needs it
+    self._payload = (self._pes_packet or self._psi_packet or
+                     self._data_bytes)
+
+  def parse_packet(self, packet, byte, buf):
+    """Returns the Mpeg2Ts message of a packet.
+
+    Args:
+      packet: the packet index
+      byte: the packet byte offset
+      buf: the 188-byte packet (a string, buffer, or bytearray)
+
+    Returns:
+      an Mpeg2Ts message. Packets that cannot be parsed are returned in
+      its raw field, as m2pb does.
+    """
+    mpeg2ts = mpeg2ts_pb2.Mpeg2Ts()
+    mpeg2ts.packet = packet
+    mpeg2ts.byte = byte
+    try:
+      self._parse_valid_packet(bytearray(buf), mpeg2ts.parsed)
+    except (ParseError, IndexError):
+      mpeg2ts.ClearField('parsed')
+      mpeg2ts.raw = str(buf)
+    return mpeg2ts
+
+  def _parse_valid_packet(self, b, mpeg2ts_packet):
+    end = len(b)
+    if end < 4 or b[0] != MPEG_TS_PACKET_SYNC:
+      raise ParseError()
+    if self._header:
+      parse_header(b, mpeg2ts_packet.header)
+    else:
+      # an empty header marks the packet as parsed
+      mpeg2ts_packet.header.SetInParent()
+    bi = 4
+    if b[3] & 0x20:
+      bi = parse_adaptation_field(
+          b, bi, end, mpeg2ts_packet.adaptation_field
+          if self._adaptation_field else None)
+    if not self._payload:
+      return
+    if b[1] & 0x40:
+      # payload_unit_start_indicator: check PES/PSI packet
+      if b[bi:bi + 3] == '\x00\x00\x01':
+        pes_packet = (mpeg2ts_packet.pes_packet if self._pes_packet else
+                      mpeg2ts_pb2.PesPacket())
+        bi = parse_pes_packet(b, bi, end, pes_packet)
+      else:
+        psi_packet = (mpeg2ts_packet.psi_packet if self._psi_packet else
+                      mpeg2ts_pb2.PsiPacket())
+        bi = parse_psi_packet(b, bi, end, psi_packet)
+    # remainder is data bytes
+    if self._data_bytes and bi < end:
+      mpeg2ts_packet.data_bytes = str(b[bi:end])
+
+  def get_packets(self, view, start=0, end=None):
+    """Yields the Mpeg2Ts messages of (a range of) the packets of a view.
+
+    Args:
+      view: a ts_view.HeaderView
+      start, end: the packet index range
+
+    Yields:
+      an Mpeg2Ts message per packet. Byte offsets are file offsets.
+    """
+    if end is None:
+      end = len(view.offsets)
+    data = view.data
+    size = ts_view.MPEG_TS_PACKET_SIZE
+    for i in xrange(start, end):
+      offset = int(view.offsets[i])
+      yield self.parse_packet(i, offset,
+                              data[offset:offset + size].tobytes())
+
+
+def get_packets(filename, fields=ALL_FIELDS):
+  """Yields the Mpeg2Ts messages of all the packets of a file."""
+  view = ts_view.open_view(filename)
+  return Mpeg2TsParser(fields).get_packets(view)
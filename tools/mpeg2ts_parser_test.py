@@ -0,0 +1,121 @@
+#!/usr/bin/python
+
+"""Unit tests for mpeg2ts_parser.py."""
+
+import numpy
+import unittest
+import mpeg2ts_parser
+import ts_scan_test
+import ts_view
+import ts_view_test
+from pes_utils_test import make_pes, make_packets
+
+
+def to_string(packet):
+  return numpy.array(packet, dtype=numpy.uint8).tostring()
+
+
+class Mpeg2TsParserTest(unittest.TestCase):
+
+  def setUp(self):
+    self.parser = mpeg2ts_parser.Mpeg2TsParser()
+
+  def testParseHeader(self):
+    packet = ts_view_test.make_packet(481, 5, pcr=27000000 + 7,
+                                      discontinuity=True)
+    mpeg2ts = self.parser.parse_packet(3, 564, to_string(packet))
+    self.assertEqual((3, 564), (mpeg2ts.packet, mpeg2ts.byte))
+    header = mpeg2ts.parsed.header
+    self.assertEqual((481, False, 5, True), (
+        header.pid, header.payload_unit_start_indicator,
+        header.continuity_counter, header.adaptation_field_exists))
+    adaptation_field = mpeg2ts.parsed.adaptation_field
+    self.assertEqual(7, adaptation_field.adaptation_field_length)
+    self.assertTrue(adaptation_field.discontinuity_indicator)
+    self.assertEqual((90000, 7), (adaptation_field.pcr.base,
+                                  adaptation_field.pcr.extension))
+    self.assertEqual('\xff' * 176, mpeg2ts.parsed.data_bytes)
+    # a PSI packet with an invalid pointer_field
+    packet[1] |= 0x40
+    mpeg2ts = self.parser.parse_packet(3, 564, to_string(packet))
+    self.assertFalse(mpeg2ts.HasField('parsed'))
+    # no sync byte
+    mpeg2ts = self.parser.parse_packet(0, 0, '\x00' + to_string(packet)[1:])
+    self.assertFalse(mpeg2ts.HasField('parsed'))
+    self.assertEqual(188, len(mpeg2ts.raw))
+
+  def testParsePes(self):
+    pes = make_pes('x' * 300, pts=(1 << 33) - 1, stream_id='\xe0')
+    packets = make_packets(0x100, pes)
+    mpeg2ts = self.parser.parse_packet(0, 0, to_string(packets[0]))
+    pes_packet = mpeg2ts.parsed.pes_packet
+    self.assertEqual(0xe0, pes_packet.stream_id)
+    self.assertEqual(mpeg2ts_parser.PesPacket.STREAM_ID_VIDEO_13818,
+                     pes_packet.stream_id_type)
+    self.assertEqual((1 << 33) - 1, pes_packet.pts)
+    self.assertFalse(pes_packet.HasField('dts'))
+    self.assertEqual('x' * (184 - 14), mpeg2ts.parsed.data_bytes)
+    mpeg2ts = self.parser.parse_packet(1, 188, to_string(packets[1]))
+    self.assertFalse(mpeg2ts.parsed.HasField('pes_packet'))
+
+  def testParsePsi(self):
+    pat, pmt = ts_scan_test.make_psi_packets()
+    mpeg2ts = self.parser.parse_packet(0, 0, to_string(pat))
+    section = mpeg2ts.parsed.psi_packet.program_association_section[0]
+    self.assertEqual(1, section.transport_stream_id)
+    self.assertEqual([(1, ts_scan_test.PMT_PID)],
+                     [(p.program_number, p.program_map_pid)
+                      for p in section.program_information])
+    mpeg2ts = self.parser.parse_packet(1, 188, to_string(pmt))
+    section = mpeg2ts.parsed.psi_packet.program_map_section[0]
+    self.assertEqual(ts_scan_test.VIDEO_PID, section.pcr_pid)
+    self.assertEqual([(0x1b, ts_scan_test.VIDEO_PID),
+                      (0x81, ts_scan_test.AUDIO_PID)],
+                     [(s.stream_type, s.elementary_pid)
+                      for s in section.stream_description])
+
+  def testLongSections(self):
+    # sections continued in the next packet are not supported
+    pat, _ = ts_scan_test.make_psi_packets()
+    # (the 16-byte PAT section ends the packet: make it 256 bytes longer)
+    pat[-15] = 0xb1
+    mpeg2ts = self.parser.parse_packet(0, 0, to_string(pat))
+    self.assertFalse(mpeg2ts.HasField('parsed'))
+    # (a 256-byte service description section)
+    sdt = bytearray('\x47\x40\x11\x10\x00'
+                    '\x42\xf1\x00\x00\x01\xc1\x00\x00\x00\x01\xff')
+    sdt += '\xff' * (188 - len(sdt))
+    mpeg2ts = self.parser.parse_packet(0, 0, str(sdt))
+    self.assertFalse(mpeg2ts.HasField('parsed'))
+    # a short one
+    sdt[6:8] = '\xf0\x0c'
+    sdt[16:20] = '\x00\x00\x00\x00'
+    mpeg2ts = self.parser.parse_packet(0, 0, str(sdt))
+    section = mpeg2ts.parsed.psi_packet.service_description_section[0]
+    self.assertEqual((1, 1), (section.transport_stream_id,
+                              section.original_network_id))
+
+  def testFieldMask(self):
+    self.assertRaises(ValueError, mpeg2ts_parser.Mpeg2TsParser, ['pts'])
+    parser = mpeg2ts_parser.Mpeg2TsParser(mpeg2ts_parser.HEADER_FIELDS)
+    data = ts_view_test.make_data(ts_scan_test.make_stream())
+    view = ts_view.HeaderView(data, ts_view.get_packet_offsets(data))
+    packets = list(parser.get_packets(view))
+    self.assertEqual(len(view.offsets), len(packets))
+    self.assertEqual(list(view.pid), [p.parsed.header.pid for p in packets])
+    self.assertEqual([188 * i for i in range(len(packets))],
+                     [p.byte for p in packets])
+    for mpeg2ts in packets:
+      self.assertEqual(['header'],
+                       [f.name for f, _ in mpeg2ts.parsed.ListFields()])
+    # data bytes without the PES headers
+    parser = mpeg2ts_parser.Mpeg2TsParser(['data_bytes'])
+    mpeg2ts = parser.parse_packet(0, 0, to_string(
+        make_packets(0x100, make_pes('x' * 100, pts=0))[0]))
+    self.assertEqual(['header', 'data_bytes'],
+                     [f.name for f, _ in mpeg2ts.parsed.ListFields()])
+    self.assertEqual('x' * 100, mpeg2ts.parsed.data_bytes[-100:])
+
+
+if __name__ == '__main__':
+  unittest.main()
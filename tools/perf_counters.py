@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""Always-on performance counters, and profiling helpers.
+
+Counters are cheap enough to stay on in production runs, as long as the
+per-packet loops only update integers, and read the clock per block (or
+per input): every timer is a (calls, nanoseconds) pair, updated with a
+couple of clock reads, and every count is a dictionary increment. (Per
+packet, a couple of clock reads cost as much as the work they time, so
+per-packet stage timers are only enabled on request.) Counters are
+written as JSON when a run finishes, so that slow runs can be attributed
+to a stage without re-running them under a profiler.
+
+Note that python 2 has no nanosecond clock: timers use time.time() (in
+ns units), so they are only accurate in aggregate.
+"""
+
+import collections
+import contextlib
+import cProfile
+import json
+import pstats
+import sys
+import time
+
+# environment variable with the default counters file
+COUNTERS_ENV = 'M2PB_COUNTERS'
+# how many functions of a profile to print
+DEFAULT_PROFILE_LINES = 30
+
+
+def get_ns():
+  return int(time.time() * 1e9)
+
+
+class Counters(object):
+  """Named timers and counts."""
+
+  def __init__(self):
+    # name -> [calls, ns]
+    self.timers = collections.defaultdict(lambda: [0, 0])
+    self.counts = collections.defaultdict(int)
+    self.extra = {}
+    self._start = get_ns()
+
+  def add_time(self, name, start, calls=1):
+    """Accounts the time since start (a get_ns() value) to a timer.
+
+    Returns:
+      the current get_ns() value (so that consecutive stages can be timed
+      with a single clock read each).
+    """
+    now = get_ns()
+    self.add_ns(name, now - start, calls)
+    return now
+
+  def add_ns(self, name, ns, calls=1):
+    """Accounts ns nanoseconds (measured elsewhere) to a timer."""
+    timer = self.timers[name]
+    timer[0] += calls
+    timer[1] += ns
+
+  @contextlib.contextmanager
+  def timer(self, name):
+    start = get_ns()
+    try:
+      yield
+    finally:
+      self.add_time(name, start)
+
+  def count(self, name, n=1):
+    self.counts[name] += n
+
+  def append(self, name, value):
+    """Adds a value to a list of (non-counter) results."""
+    self.extra.setdefault(name, []).append(value)
+
+  def to_dict(self):
+    d = {
+        'elapsed_ns': get_ns() - self._start,
+        'timers': dict((name, {'calls': calls, 'ns': ns})
+                       for name, (calls, ns) in self.timers.iteritems()),
+        'counts': dict(self.counts),
+    }
+    d.update(self.extra)
+    return d
+
+  def write(self, filename):
+    """Writes the counters as JSON ("-" for stderr)."""
+    if filename == '-':
+      json.dump(self.to_dict(), sys.stderr, indent=1, sort_keys=True)
+      sys.stderr.write('\n')
+      return
+    with open(filename, 'w') as f:
+      json.dump(self.to_dict(), f, indent=1, sort_keys=True)
+
+
+def run_profiled(filename, function, *args, **kwargs):
+  """Runs a function under cProfile.
+
+  The profile is dumped into filename (see pstats), and its most
+  expensive functions printed to stderr, even if the function fails.
+  """
+  profiler = cProfile.Profile()
+  try:
+    return profiler.runcall(function, *args, **kwargs)
+  finally:
+    profiler.dump_stats(filename)
+    stats = pstats.Stats(filename, stream=sys.stderr)
+    stats.sort_stats('cumulative').print_stats(DEFAULT_PROFILE_LINES)
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+
+"""Unit tests for perf_counters.py."""
+
+import json
+import os
+import pstats
+import tempfile
+import unittest
+import perf_counters
+
+
+class PerfCountersTest(unittest.TestCase):
+
+  def setUp(self):
+    fd, self.filename = tempfile.mkstemp()
+    os.close(fd)
+
+  def tearDown(self):
+    os.remove(self.filename)
+
+  def testCounters(self):
+    counters = perf_counters.Counters()
+    t = perf_counters.get_ns()
+    t2 = counters.add_time('read', t)
+    self.assertGreaterEqual(t2, t)
+    counters.add_time('read', t2, calls=2)
+    with counters.timer('write'):
+      pass
+    counters.count('rows')
+    counters.count('rows', 2)
+    counters.append('input_pipes', {'lines': 1})
+    d = counters.to_dict()
+    self.assertEqual(3, d['timers']['read']['calls'])
+    self.assertGreaterEqual(d['timers']['read']['ns'], 0)
+    self.assertEqual(1, d['timers']['write']['calls'])
+    self.assertEqual({'rows': 3}, d['counts'])
+    self.assertEqual([{'lines': 1}], d['input_pipes'])
+    # the timer accounts failing stages too
+    with self.assertRaises(ValueError):
+      with counters.timer('write'):
+        raise ValueError()
+    self.assertEqual(2, counters.timers['write'][0])
+    counters.write(self.filename)
+    with open(self.filename) as f:
+      d = json.load(f)
+    self.assertEqual(3, d['counts']['rows'])
+    self.assertGreaterEqual(d['elapsed_ns'], 0)
+
+  def testRunProfiled(self):
+    def function(a, b=0):
+      return a + b
+    self.assertEqual(3, perf_counters.run_profiled(self.filename, function,
+                                                   1, b=2))
+    stats = pstats.Stats(self.filename)
+    self.assertTrue(any(name == 'function' for _, _, name in stats.stats))
+
+
+if __name__ == '__main__':
+  unittest.main()
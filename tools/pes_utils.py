@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""PES (Packetized Elementary Stream) header parsing and reassembly."""
+
+import itertools
+import numpy
+import pts_utils
+import ts_view
+
+PES_START_CODE = '\x00\x00\x01'
+# minimum PES header (start code, stream_id, and pes_packet_length)
+PES_PREFIX_SIZE = 6
+# minimum PES header including the optional header fixed part
+PES_OPTIONAL_HEADER_SIZE = 9
+# PES_header_data_length is at most 255
+PES_MAX_HEADER_SIZE = PES_OPTIONAL_HEADER_SIZE + 255
+
+# stream ids without the optional PES header (ISO/IEC 13818-1 2.4.3.7)
+STREAM_ID_PROGRAM_STREAM_MAP = 0xbc
+STREAM_ID_PADDING_STREAM = 0xbe
+STREAM_ID_PRIVATE_STREAM_2 = 0xbf
+STREAM_ID_ECM_STREAM = 0xf0
+STREAM_ID_EMM_STREAM = 0xf1
+STREAM_ID_DSMCC_STREAM = 0xf2
+STREAM_ID_H222_E_STREAM = 0xf8
+STREAM_ID_PROGRAM_STREAM_DIRECTORY = 0xff
+NO_OPTIONAL_HEADER_STREAM_IDS = (
+    STREAM_ID_PROGRAM_STREAM_MAP,
+    STREAM_ID_PADDING_STREAM,
+    STREAM_ID_PRIVATE_STREAM_2,
+    STREAM_ID_ECM_STREAM,
+    STREAM_ID_EMM_STREAM,
+    STREAM_ID_DSMCC_STREAM,
+    STREAM_ID_H222_E_STREAM,
+    STREAM_ID_PROGRAM_STREAM_DIRECTORY,
+)
+
+
+def parse_timestamp(data, i):
+  """Parses the 33-bit timestamp (pts or dts) in data[i:i+5]."""
+  b = bytearray(data[i:i + 5])
+  return (((b[0] >> 1) & 0x07) << 30 | b[1] << 22 | (b[2] >> 1) << 15 |
+      b[3] << 7 | b[4] >> 1)
+
+
+def write_timestamp(b, i, value):
+  """Writes a 33-bit timestamp into bytearray b[i:i+5].
+
+  The 4-bit prefix ('0010', '0011', or '0001') and the marker bits are
+  preserved.
+  """
+  b[i] = (b[i] & 0xf1) | ((value >> 29) & 0x0e)
+  b[i + 1] = (value >> 22) & 0xff
+  b[i + 2] = (b[i + 2] & 0x01) | ((value >> 14) & 0xfe)
+  b[i + 3] = (value >> 7) & 0xff
+  b[i + 4] = (b[i + 4] & 0x01) | ((value << 1) & 0xfe)
+
+
+def parse_timestamps(data, positions):
+  """Vectorized parse_timestamp() of data[i:i+5], for every i in positions.
+
+  Args:
+    data: a numpy uint8 array
+    positions: a numpy array with the timestamp offsets
+
+  Returns:
+    a numpy int64 array with the 33-bit timestamps.
+  """
+  b = [data[positions + k].astype(numpy.int64) for k in range(5)]
+  return (((b[0] >> 1) & 0x07) << 30 | b[1] << 22 | (b[2] >> 1) << 15 |
+      b[3] << 7 | b[4] >> 1)
+
+
+def write_timestamps(data, positions, values):
+  """Vectorized write_timestamp() (prefixes and marker bits are preserved).
+
+  Args:
+    data: a (writable) numpy uint8 array
+    positions: a numpy array with the timestamp offsets
+    values: a numpy int64 array with the 33-bit timestamps
+  """
+  data[positions] = (data[positions] & 0xf1) | ((values >> 29) & 0x0e)
+  data[positions + 1] = (values >> 22) & 0xff
+  data[positions + 2] = ((data[positions + 2] & 0x01) |
+      ((values >> 14) & 0xfe))
+  data[positions + 3] = (values >> 7) & 0xff
+  data[positions + 4] = ((data[positions + 4] & 0x01) |
+      ((values << 1) & 0xfe))
+
+
+def get_timestamp_positions(view):
+  """Locates the pts and dts fields of the PES headers in a HeaderView.
+
+  Only PES headers that fit in the PUSI packet are considered.
+
+  Returns:
+    a (pts_index, pts_positions, dts_index, dts_positions) tuple, where
+    *_index are the packet indexes, and *_positions the data offsets of
+    the 5-byte timestamps.
+  """
+  index = numpy.nonzero(view.payload_unit_start_indicator &
+      view.payload_exists & ~view.transport_error_indicator)[0]
+  payload_offset = view.payload_offset[index]
+  # (the PES header flags must be in the packet)
+  fits = (payload_offset + PES_OPTIONAL_HEADER_SIZE <=
+      ts_view.MPEG_TS_PACKET_SIZE)
+  index = index[fits]
+  payload_offset = payload_offset[fits]
+  start = view.offsets[index] + payload_offset
+  data = view.data
+  valid = ((data[start] == 0) & (data[start + 1] == 0) &
+      (data[start + 2] == 1) &
+      ~numpy.isin(data[start + 3], NO_OPTIONAL_HEADER_STREAM_IDS))
+  pts_dts_flags = data[start + 7] >> 6
+  has_pts = (valid & ((pts_dts_flags & 0x02) != 0) &
+      (payload_offset + 14 <= ts_view.MPEG_TS_PACKET_SIZE))
+  has_dts = (valid & (pts_dts_flags == 0x03) &
+      (payload_offset + 19 <= ts_view.MPEG_TS_PACKET_SIZE))
+  return (index[has_pts], start[has_pts] + 9,
+          index[has_dts], start[has_dts] + 14)
+
+
+def parse_pes_header(data):
+  """Parses a PES header.
+
+  Args:
+    data: a string starting with the PES packet
+
+  Returns:
+    a dictionary with the stream_id, pes_packet_length, pts, dts (both
+    pts_utils.kPtsInvalid if missing), and header_length (the offset of
+    the PES payload), or None if data does not start with a valid PES
+    header.
+  """
+  if len(data) < PES_PREFIX_SIZE or not data.startswith(PES_START_CODE):
+    return None
+  b = bytearray(data[:PES_OPTIONAL_HEADER_SIZE])
+  header = {
+      'stream_id': b[3],
+      'pes_packet_length': (b[4] << 8) | b[5],
+      'pts': pts_utils.kPtsInvalid,
+      'dts': pts_utils.kPtsInvalid,
+      'header_length': PES_PREFIX_SIZE,
+  }
+  if header['stream_id'] in NO_OPTIONAL_HEADER_STREAM_IDS:
+    return header
+  if len(b) < PES_OPTIONAL_HEADER_SIZE:
+    return None
+  header['header_length'] = PES_OPTIONAL_HEADER_SIZE + b[8]
+  pts_dts_flags = b[7] >> 6
+  if pts_dts_flags & 0x02 and len(data) >= 14:
+    header['pts'] = parse_timestamp(data, 9)
+  if pts_dts_flags == 0x03 and len(data) >= 19:
+    header['dts'] = parse_timestamp(data, 14)
+  return header
+
+
+class PesUnit(object):
+  """A PES packet, as a list of slices of the TS payloads that carry it.
+
+  The slices are memoryviews of the (mmap'ed) file data, so building a
+  PesUnit does not copy its payload. Use tobytes() (or get_payload()) to
+  get contiguous bytes.
+
+  Attributes:
+    pid: the pid
+    packets: the packet index of each chunk
+    chunks: the TS payloads (memoryviews), the first one starting with
+        the PES header
+    header: the parsed PES header (see parse_pes_header), or None if the
+        unit does not start with a valid one
+  """
+
+  def __init__(self, pid, packets, chunks):
+    self.pid = pid
+    self.packets = packets
+    self.chunks = chunks
+    self._header = False
+
+  def __len__(self):
+    return sum(len(chunk) for chunk in self.chunks)
+
+  @property
+  def header(self):
+    if self._header is False:
+      header = parse_pes_header(self.chunks[0].tobytes())
+      if header is None and len(self.chunks) > 1:
+        # the header spans several TS packets
+        header = parse_pes_header(self.get_prefix(PES_MAX_HEADER_SIZE))
+      self._header = header
+    return self._header
+
+  @property
+  def pts(self):
+    return self.header['pts'] if self.header else pts_utils.kPtsInvalid
+
+  @property
+  def dts(self):
+    return self.header['dts'] if self.header else pts_utils.kPtsInvalid
+
+  def is_complete(self):
+    """Whether the unit has pes_packet_length bytes (if known)."""
+    if not self.header:
+      return False
+    if self.header['pes_packet_length'] == 0:
+      # unbounded (video) PES
+      return True
+    return len(self) == PES_PREFIX_SIZE + self.header['pes_packet_length']
+
+  def get_prefix(self, size):
+    """Returns (up to) the first size bytes of the unit."""
+    out = []
+    for chunk in self.chunks:
+      if size <= 0:
+        break
+      out.append(chunk[:size].tobytes())
+      size -= len(chunk)
+    return ''.join(out)
+
+  def tobytes(self):
+    """Returns the whole unit (header included) as a string."""
+    return ''.join(chunk.tobytes() for chunk in self.chunks)
+
+  def get_payload_chunks(self):
+    """Returns the chunks of the PES payload (without the header)."""
+    skip = self.header['header_length'] if self.header else 0
+    for i, chunk in enumerate(self.chunks):
+      if skip < len(chunk):
+        return [chunk[skip:]] + self.chunks[i + 1:]
+      skip -= len(chunk)
+    return []
+
+  def get_payload(self):
+    """Returns the PES payload (the elementary stream data)."""
+    return ''.join(chunk.tobytes() for chunk in self.get_payload_chunks())
+
+
+def get_pes_units(view, pids=None, partial=True):
+  """Reassembles the PES packets of a ts_view.HeaderView.
+
+  A unit starts at a packet with the payload_unit_start_indicator set,
+  and ends before the next one of the same pid. Packets preceding the
+  first PUSI of a pid, or with the transport_error_indicator set, are
+  dropped.
+
+  Args:
+    view: a ts_view.HeaderView
+    pids: only reassemble these pids (default: all of them)
+    partial: whether to yield the units still open at the end of the file
+
+  Yields:
+    PesUnit objects, in the order they are completed.
+  """
+  mask = view.payload_exists & ~view.transport_error_indicator
+  if pids is not None:
+    mask &= numpy.isin(view.pid, list(pids))
+  index = numpy.nonzero(mask)[0]
+  starts = view.offsets[index] + view.payload_offset[index]
+  ends = view.offsets[index] + ts_view.MPEG_TS_PACKET_SIZE
+  data = memoryview(view.data)
+  # pid -> (packets, chunks) of the unit being reassembled
+  units = {}
+  for i, pid, pusi, start, end in itertools.izip(index.tolist(),
+      view.pid[index].tolist(), view.payload_unit_start_indicator[index],
+      starts.tolist(), ends.tolist()):
+    if start >= end:
+      # bogus adaptation_field_length
+      continue
+    if pusi:
+      if pid in units:
+        yield PesUnit(pid, *units[pid])
+      units[pid] = ([i], [data[start:end]])
+    elif pid in units:
+      packets, chunks = units[pid]
+      packets.append(i)
+      chunks.append(data[start:end])
+  if partial:
+    for pid, unit in sorted(units.iteritems(), key=lambda x: x[1][0][0]):
+      yield PesUnit(pid, *unit)
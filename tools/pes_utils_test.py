@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+"""Unit tests for pes_utils.py."""
+
+import numpy
+import unittest
+import pes_utils
+import pts_utils
+import ts_view
+
+
+def make_pes(payload, pts=None, stream_id='\xc0', length=True):
+  header = '\x80\x00\x00'
+  if pts is not None:
+    header = '\x80\x80\x05' + ''.join(chr(x) for x in [
+        0x21 | ((pts >> 29) & 0x0e), (pts >> 22) & 0xff,
+        ((pts >> 14) & 0xfe) | 1, (pts >> 7) & 0xff, ((pts << 1) & 0xfe) | 1])
+  size = len(header) + len(payload) if length else 0
+  return ('\x00\x00\x01' + stream_id + chr(size >> 8) + chr(size & 0xff) +
+          header + payload)
+
+
+def make_packets(pid, pes, cc=0, pusi=True):
+  """Splits a PES into 188-byte packets (the last one with stuffing)."""
+  packets = []
+  for i in range(0, len(pes), 184):
+    chunk = pes[i:i + 184]
+    header = [0x47, (0x40 if pusi and i == 0 else 0) | (pid >> 8), pid & 0xff,
+              0x10 | ((cc + len(packets)) & 0x0f)]
+    if len(chunk) < 184:
+      header[3] |= 0x20
+      stuffing = 184 - len(chunk) - 1
+      header += [stuffing] + ([0x00] + [0xff] * (stuffing - 1)
+                              if stuffing else [])
+    packets.append(header + [ord(c) for c in chunk])
+  return packets
+
+
+def make_view(packets):
+  data = numpy.array(sum(packets, []), dtype=numpy.uint8)
+  return ts_view.HeaderView(data, ts_view.get_packet_offsets(data))
+
+
+class PesUtilsTest(unittest.TestCase):
+
+  def testParsePesHeader(self):
+    header = pes_utils.parse_pes_header(make_pes('abc', pts=0x1deadbeef))
+    self.assertEqual(0xc0, header['stream_id'])
+    self.assertEqual(0x1deadbeef, header['pts'])
+    self.assertEqual(pts_utils.kPtsInvalid, header['dts'])
+    self.assertEqual(14, header['header_length'])
+    self.assertEqual(11, header['pes_packet_length'])
+    self.assertEqual(None, pes_utils.parse_pes_header('\x00\x00\x02\xc0\x00'))
+
+  def testWriteTimestamp(self):
+    # a dts ('0001' prefix)
+    b = bytearray('\x11\x00\x01\x00\x01')
+    pes_utils.write_timestamp(b, 0, (1 << 33) - 1)
+    self.assertEqual(bytearray('\x1f\xff\xff\xff\xff'), b)
+    self.assertEqual((1 << 33) - 1, pes_utils.parse_timestamp(str(b), 0))
+    pes_utils.write_timestamp(b, 0, 0x1deadbeef)
+    self.assertEqual(0x1deadbeef, pes_utils.parse_timestamp(str(b), 0))
+    pes_utils.write_timestamp(b, 0, 0)
+    self.assertEqual(bytearray('\x11\x00\x01\x00\x01'), b)
+
+  def testGetPesUnits(self):
+    audio = [make_pes('a' * 300, pts=1000), make_pes('b' * 10, pts=2000)]
+    video = make_pes('v' * 500, pts=3000, stream_id='\xe0', length=False)
+    packets = (make_packets(0x100, 'orphan', pusi=False) + make_packets(0x101, video) +
+               make_packets(0x100, audio[0]) + make_packets(0x100, audio[1]))
+    view = make_view(packets)
+    units = list(pes_utils.get_pes_units(view))
+    self.assertEqual([0x100, 0x101, 0x100], [unit.pid for unit in units])
+    self.assertEqual([[4, 5], [1, 2, 3], [6]],
+                     [unit.packets for unit in units])
+    self.assertEqual([1000, 3000, 2000], [unit.pts for unit in units])
+    self.assertEqual(audio[0], units[0].tobytes())
+    self.assertEqual('a' * 300, units[0].get_payload())
+    self.assertEqual(video, units[1].tobytes())
+    self.assertEqual(audio[0][:200], units[0].get_prefix(200))
+    self.assertTrue(all(unit.is_complete() for unit in units))
+    # the chunks are slices of the file data
+    self.assertTrue(isinstance(units[0].chunks[0], memoryview))
+    # pid filter, and unterminated units
+    units = list(pes_utils.get_pes_units(view, [0x100], partial=False))
+    self.assertEqual([[4, 5]], [unit.packets for unit in units])
+
+
+if __name__ == '__main__':
+  unittest.main()
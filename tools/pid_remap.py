@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""Binary pid remapping and filtering of mpeg-ts files.
+
+This replaces the text round trip (m2pb totxt | sed | m2pb tobin) for pid
+changes. The input is mmap'ed and processed in chunks of packets: the
+packets of the kept pids are gathered with numpy, and only their 13-bit
+pid fields are rewritten. The PAT and PMT sections are regenerated (with
+the remapped pids, without the dropped programs and streams, and with a
+new CRC32), in place: a section that shrinks is padded with stuffing
+bytes, so packets are never added or removed. Everything else is copied
+unchanged.
+
+Gaps (bytes that are not part of any packet) are not copied.
+"""
+
+import argparse
+import numpy
+import sys
+import time
+import psi_utils
+import ts_view
+
+# packets per chunk (~12 MB)
+DEFAULT_CHUNK_PACKETS = 1 << 16
+STUFFING_BYTE = 0xff
+
+
+def get_collisions(pid_map, keep, pids):
+  """Returns the pids that other pids are remapped into.
+
+  Args:
+    pid_map, keep: the pid tables (see get_pid_tables())
+    pids: the pids to check (only the kept pids that are not remapped
+        collide)
+
+  Returns:
+    a sorted list with the pids of pids whose packets would be merged
+    with the ones of a remapped pid.
+  """
+  remapped = keep & (pid_map != numpy.arange(len(pid_map)))
+  targets = set(pid_map[remapped].tolist())
+  return sorted(pid for pid in set(pids)
+                if keep[pid] and not remapped[pid] and pid in targets)
+
+
+def get_pid_tables(pid_map_l=(), keep_l=(), drop_l=()):
+  """Returns the pid map and keep tables.
+
+  Args:
+    pid_map_l: a list of (pid, new_pid) tuples
+    keep_l: the pids to keep (default: all of them)
+    drop_l: the pids to drop
+
+  Returns:
+    a (pid_map, keep) tuple of numpy arrays indexed by pid.
+
+  Raises:
+    ValueError: if two pids are remapped into the same pid, or a pid is
+        remapped into a pid of keep_l that is not remapped.
+  """
+  new_pids = [new_pid for _, new_pid in pid_map_l]
+  if len(set(new_pids)) != len(new_pids):
+    raise ValueError('pids remapped into the same pid: %r' % pid_map_l)
+  pid_map = numpy.arange(ts_view.MAX_PID + 1, dtype=numpy.int32)
+  for pid, new_pid in pid_map_l:
+    pid_map[pid] = new_pid
+  keep = numpy.ones(ts_view.MAX_PID + 1, dtype=bool)
+  if keep_l:
+    keep[:] = False
+    keep[list(keep_l)] = True
+  keep[list(drop_l)] = False
+  collisions = get_collisions(pid_map, keep, keep_l)
+  if collisions:
+    raise ValueError('pids remapped into kept pids: %r' % collisions)
+  return pid_map, keep
+
+
+class PidRemapper(object):
+  """Remaps and filters the packets of a stream, chunk by chunk.
+
+  The PAT pid, and the PMT pids announced by the PATs, are kept (unless
+  explicitly dropped). Sections that are not complete at the end of a
+  chunk are carried over (with all the packets that follow them) to the
+  next one. The sections of the carried packets that were already
+  rewritten are remembered, so they are not rewritten twice.
+  """
+
+  def __init__(self, pid_map, keep, drop_l=(),
+               stride=ts_view.MPEG_TS_PACKET_SIZE):
+    self.pid_map = pid_map
+    self.keep = keep.copy()
+    self.stride = stride
+    self._drop = set(drop_l)
+    self._prefix = ts_view.get_prefix_size(stride)
+    self._carry = numpy.zeros((0, stride), dtype=numpy.uint8)
+    # whether every carried row starts an already rewritten section
+    self._rewritten = numpy.zeros(0, dtype=bool)
+    # pids carrying PAT/PMT sections
+    self.psi_pids = set()
+    self.add_psi_pid(psi_utils.PAT_PID)
+    # accounting
+    self.packets = 0
+    self.sections = 0
+    self.bad_sections = 0
+
+  def add_psi_pid(self, pid):
+    self.psi_pids.add(pid)
+    if pid not in self._drop:
+      self.keep[pid] = True
+
+  def add_pat(self, section):
+    """Learns the PMT pids of a PAT section."""
+    for program_number, pid in (psi_utils.parse_pat(section) or {}).items():
+      if program_number != 0:
+        self.add_psi_pid(pid)
+
+  def get_rows(self, data, offsets):
+    """Returns the packets (a rows x stride array) of the kept pids."""
+    view = ts_view.HeaderView(data, offsets, stride=self.stride)
+    kept = offsets[self.keep[view.pid]] - self._prefix
+    # (a writable copy)
+    return numpy.asarray(data)[kept[:, numpy.newaxis] +
+                               numpy.arange(self.stride)]
+
+  def get_pids(self, rows):
+    i = self._prefix
+    return ((rows[:, i + 1].astype(numpy.int32) & 0x1f) << 8) | rows[:, i + 2]
+
+  def get_section_positions(self, rows, section_rows):
+    """Returns the (flat) positions of the section bytes in some rows.
+
+    Returns:
+      a numpy array, or None if the section is not complete.
+    """
+    positions = []
+    for i in section_rows:
+      b = rows[i]
+      start = self._prefix + 4
+      if b[self._prefix + 3] & 0x20:
+        start += 1 + int(b[self._prefix + 4])
+      if i == section_rows[0] and start < self.stride:
+        # skip the pointer_field
+        start += 1 + int(b[start])
+      positions.append(i * self.stride + numpy.arange(start, self.stride))
+    positions = numpy.concatenate(positions)
+    if len(positions) < psi_utils.PSI_SECTION_PREFIX_SIZE:
+      return None
+    prefix = rows.flat[positions[:psi_utils.PSI_SECTION_PREFIX_SIZE]]
+    length = (psi_utils.PSI_SECTION_PREFIX_SIZE +
+              ((int(prefix[1]) & 0x0f) << 8 | prefix[2]))
+    if len(positions) < length:
+      return None
+    return positions[:length]
+
+  def rewrite_section(self, rows, positions):
+    """Rewrites the (PAT or PMT) section at the given positions of rows."""
+    section = rows.flat[positions].tobytes()
+    table_id = ord(section[0])
+    if table_id == psi_utils.TABLE_ID_PAT:
+      self.add_pat(section)
+      new_section = psi_utils.remap_pat(section, self.pid_map, self.keep)
+    elif table_id == psi_utils.TABLE_ID_PMT:
+      new_section = psi_utils.remap_pmt(section, self.pid_map, self.keep)
+    else:
+      return
+    if new_section is None:
+      self.bad_sections += 1
+      return
+    self.sections += 1
+    new_section = numpy.frombuffer(new_section, dtype=numpy.uint8)
+    rows.flat[positions[:len(new_section)]] = new_section
+    rows.flat[positions[len(new_section):]] = STUFFING_BYTE
+
+  def rewrite_sections(self, rows, rewritten):
+    """Rewrites the PSI sections of some rows.
+
+    Args:
+      rows: the packets (a rows x stride array)
+      rewritten: whether every row starts a section that is already
+          rewritten (updated with the sections rewritten now)
+
+    Returns:
+      the number of leading rows that are done (the next ones start with
+      an incomplete section).
+    """
+    pids = self.get_pids(rows)
+    i = self._prefix
+    usable = (((rows[:, i + 1] & 0x80) == 0) & ((rows[:, i + 3] & 0x10) != 0))
+    # pid -> rows of the section being reassembled
+    pending = {}
+    for row in numpy.nonzero(usable & numpy.isin(pids,
+        list(self.psi_pids)))[0].tolist():
+      pid = pids[row]
+      if rows[row, i + 1] & 0x40:
+        if rewritten[row]:
+          pending.pop(pid, None)
+          continue
+        pending[pid] = [row]
+      elif pid in pending:
+        pending[pid].append(row)
+        if len(pending[pid]) > psi_utils.DEFAULT_MAX_SECTION_PACKETS:
+          del pending[pid]
+          continue
+      else:
+        continue
+      positions = self.get_section_positions(rows, pending[pid])
+      if positions is not None:
+        self.rewrite_section(rows, positions)
+        rewritten[pending[pid][0]] = True
+        del pending[pid]
+    if not pending:
+      return len(rows)
+    return min(section_rows[0] for section_rows in pending.itervalues())
+
+  def remap(self, rows):
+    """Rewrites the pid field of some rows."""
+    i = self._prefix
+    new_pids = self.pid_map[self.get_pids(rows)]
+    rows[:, i + 1] = (rows[:, i + 1] & 0xe0) | (new_pids >> 8)
+    rows[:, i + 2] = new_pids & 0xff
+
+  def write(self, rows, fout):
+    """Processes some rows, and writes the ones that are done."""
+    rewritten = numpy.zeros(len(self._carry) + len(rows), dtype=bool)
+    rewritten[:len(self._carry)] = self._rewritten
+    if len(self._carry):
+      rows = numpy.concatenate((self._carry, rows))
+    done = self.rewrite_sections(rows, rewritten)
+    self.remap(rows[:done])
+    rows[:done].tofile(fout)
+    self.packets += done
+    self._carry = rows[done:]
+    self._rewritten = rewritten[done:]
+
+  def flush(self, fout):
+    """Writes the carried rows (their sections are never completed)."""
+    self.remap(self._carry)
+    self._carry.tofile(fout)
+    self.packets += len(self._carry)
+    self._carry = self._carry[:0]
+    self._rewritten = self._rewritten[:0]
+
+
+def remap_file(filename, output_filename, pid_map, keep, drop_l=(),
+               stride=None, chunk_packets=DEFAULT_CHUNK_PACKETS):
+  """Remaps and filters the pids of a file.
+
+  Args:
+    filename: the (regular) input file
+    output_filename: the output file ("-" for stdout)
+    pid_map, keep: the pid tables (see get_pid_tables())
+    drop_l: the pids explicitly dropped (even if they carry PSI)
+    stride: the packet size (detected from the file contents if None)
+    chunk_packets: number of packets processed at once
+
+  Returns:
+    a dictionary with the number of input and output packets, and of
+    rewritten and bad (not rewritten) sections.
+
+  Raises:
+    ValueError: if a pid is remapped into a pid of the stream (announced
+        by its first PAT/PMTs, or in its first chunk) that is kept and
+        not remapped.
+  """
+  data = ts_view.open_file(filename)
+  if stride is None:
+    stride = ts_view.detect_stride(data)
+  runs, _ = ts_view.get_packet_runs(data, stride)
+  packets = sum(length for _, length in runs)
+  remapper = PidRemapper(pid_map, keep, drop_l, stride)
+  # learn the PMT pids before dropping any packet
+  head = ts_view.HeaderView(data, ts_view.get_run_offsets(runs, 0,
+      max(chunk_packets, DEFAULT_CHUNK_PACKETS), stride), stride=stride)
+  remapper.add_pat(psi_utils.get_section(head, psi_utils.PAT_PID))
+  pids = set(head.pid.tolist()) | remapper.psi_pids
+  pids.update(pid for pid, _ in psi_utils.get_program_streams(head))
+  collisions = get_collisions(pid_map, remapper.keep, pids)
+  if collisions:
+    raise ValueError('pids remapped into kept pids: %r' % collisions)
+  fout = sys.stdout if output_filename == '-' else open(output_filename, 'wb')
+  try:
+    for start in range(0, packets, chunk_packets):
+      offsets = ts_view.get_run_offsets(runs, start, start + chunk_packets,
+                                        stride)
+      remapper.write(remapper.get_rows(data, offsets), fout)
+    remapper.flush(fout)
+  finally:
+    if fout is not sys.stdout:
+      fout.close()
+  return {
+      'input_packets': packets,
+      'output_packets': remapper.packets,
+      'sections': remapper.sections,
+      'bad_sections': remapper.bad_sections,
+  }
+
+
+def parse_pid_map(spec):
+  """Parses a "pid:new_pid" string."""
+  pid, new_pid = spec.split(':', 1)
+  return int(pid, 0), int(new_pid, 0)
+
+
+def get_opts(argv):
+  parser = argparse.ArgumentParser(
+      description='Remap and filter the pids of an mpeg-ts file.')
+  parser.add_argument('-d', '--debug', dest='debug', default=0,
+      action='count',
+      help='Increase verbosity (specify multiple times for more)')
+  parser.add_argument('--map', action='append',
+      dest='pid_map_l', type=parse_pid_map, default=[],
+      metavar='PID:NEW_PID',
+      help='remap a pid (can be used multiple times)',)
+  parser.add_argument('--keep', action='append',
+      dest='keep_l', type=lambda pid: int(pid, 0), default=[],
+      metavar='PID',
+      help='keep only this pid (and the PSI pids, can be used multiple '
+          'times)',)
+  parser.add_argument('--drop', action='append',
+      dest='drop_l', type=lambda pid: int(pid, 0), default=[],
+      metavar='PID',
+      help='drop this pid (can be used multiple times)',)
+  parser.add_argument('-o', '--output', action='store',
+      dest='output_filename', default='-',
+      metavar='OUTPUT_FILENAME',
+      help='output filename',)
+  parser.add_argument('input_file', nargs=1,
+      help='input file (a regular file)')
+  return parser.parse_args(argv[1:])
+
+
+def main(argv):
+  vals = get_opts(argv)
+  start = time.time()
+  try:
+    pid_map, keep = get_pid_tables(vals.pid_map_l, vals.keep_l, vals.drop_l)
+    stats = remap_file(vals.input_file[0], vals.output_filename, pid_map,
+                       keep, vals.drop_l)
+  except ValueError as e:
+    print 'error: %s' % e
+    sys.exit(-1)
+  if vals.debug > 0:
+    sys.stderr.write('%i packets in, %i out: %i sections rewritten, %i bad '
+                     'sections in %.3f secs\n' % (stats['input_packets'],
+                         stats['output_packets'], stats['sections'],
+                         stats['bad_sections'], time.time() - start))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
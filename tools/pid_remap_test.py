@@ -0,0 +1,150 @@
+#!/usr/bin/python
+
+"""Unit tests for pid_remap.py (and the psi_utils section rewriting)."""
+
+import numpy
+import os
+import random
+import tempfile
+import unittest
+import pid_remap
+import psi_utils
+import ts_gen
+import ts_scan
+import ts_view
+
+
+def get_crc32_bitwise(data):
+  crc = 0xffffffff
+  for c in bytearray(data):
+    crc ^= c << 24
+    for _ in range(8):
+      crc = ((crc << 1) ^ 0x04c11db7 if crc & 0x80000000 else
+             crc << 1) & 0xffffffff
+  return crc
+
+
+def write_long_pmt_stream(filename, groups):
+  """Writes a stream with a 2-packet PMT (on pid 480), and a PAT inside it."""
+  generator = ts_gen.StreamGenerator()
+  pat, _ = generator.get_psi_sections()
+  # (a 64-byte descriptor per stream)
+  descriptor = '\x05\x3e' + 'd' * 62
+  pmt = ts_gen.make_section(0x02, 1, '\xe1\xe1\xf0\x00' + ''.join(
+      chr(stream_type) + chr(0xe0 | (pid >> 8)) + chr(pid & 0xff) +
+      chr(0xf0) + chr(len(descriptor)) + descriptor
+      for stream_type, pid in ((ts_gen.STREAM_TYPE_H264, 481),
+                               (ts_gen.STREAM_TYPE_AC3, 482),
+                               (ts_gen.STREAM_TYPE_AC3, 483))))
+  with open(filename, 'wb') as f:
+    for _ in range(groups):
+      pmt_packets = generator.packetize(480, '\x00' + pmt)
+      assert len(pmt_packets) == 2
+      f.write(pmt_packets[0])
+      f.write(generator.packetize(psi_utils.PAT_PID, '\x00' + pat)[0])
+      f.write(pmt_packets[1])
+      for pid in (481, 482, 483):
+        f.write(generator.packetize(pid, 'x' * 100)[0])
+
+
+class PidRemapTest(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    fd, cls.filename = tempfile.mkstemp(suffix='.ts')
+    os.close(fd)
+    ts_gen.write_stream(cls.filename, 1 << 20, audio_pids=(482, 483))
+
+  @classmethod
+  def tearDownClass(cls):
+    os.remove(cls.filename)
+
+  def setUp(self):
+    fd, self.output_filename = tempfile.mkstemp(suffix='.ts')
+    os.close(fd)
+
+  def tearDown(self):
+    os.remove(self.output_filename)
+
+  def testGetCrc32(self):
+    rnd = random.Random(0)
+    for size in (0, 1, 17, 1024):
+      data = ''.join(chr(rnd.randint(0, 255)) for _ in range(size))
+      self.assertEqual(get_crc32_bitwise(data), psi_utils.get_crc32(data))
+
+  def testRemapFile(self):
+    pid_map, keep = pid_remap.get_pid_tables([(482, 582), (480, 0x100)],
+                                             drop_l=[483])
+    for chunk_packets in (pid_remap.DEFAULT_CHUNK_PACKETS, 7):
+      stats = pid_remap.remap_file(self.filename, self.output_filename,
+          pid_map, keep, [483], chunk_packets=chunk_packets)
+      self.assertEqual(0, stats['bad_sections'])
+      view = ts_view.open_view(self.output_filename)
+      in_view = ts_view.open_view(self.filename)
+      self.assertEqual(numpy.sum(in_view.pid != 483), len(view))
+      self.assertEqual([0, 0x100, 481, 582], numpy.unique(view.pid).tolist())
+      # the sections are regenerated (with a valid crc)
+      section = psi_utils.get_section(view, 0x100)
+      self.assertEqual(0, psi_utils.get_crc32(section))
+      self.assertEqual({1: 0x100}, psi_utils.parse_pat(
+          psi_utils.get_section(view, psi_utils.PAT_PID)))
+      self.assertEqual([(481, ts_gen.STREAM_TYPE_H264),
+                        (582, ts_gen.STREAM_TYPE_AC3)],
+                       psi_utils.get_program_streams(view))
+      # the payloads are unchanged
+      scan = ts_scan.scan_file(self.filename, [481], [482])
+      out_scan = ts_scan.scan_file(self.output_filename, [481], [582])
+      self.assertEqual(scan.frames['pts'], out_scan.frames['pts'])
+      self.assertEqual(scan.frames['type'], out_scan.frames['type'])
+
+  def testSectionAcrossChunks(self):
+    fd, filename = tempfile.mkstemp(suffix='.ts')
+    os.close(fd)
+    try:
+      write_long_pmt_stream(filename, 4)
+      pid_map, keep = pid_remap.get_pid_tables([(480, 490), (490, 480)])
+      outputs = []
+      for chunk_packets in (pid_remap.DEFAULT_CHUNK_PACKETS, 1, 2, 3, 4):
+        stats = pid_remap.remap_file(filename, self.output_filename,
+            pid_map, keep, chunk_packets=chunk_packets)
+        self.assertEqual(8, stats['sections'])
+        view = ts_view.open_view(self.output_filename)
+        self.assertEqual({1: 490}, psi_utils.parse_pat(
+            psi_utils.get_section(view, psi_utils.PAT_PID)))
+        self.assertEqual([0, 481, 482, 483, 490],
+                         numpy.unique(view.pid).tolist())
+        self.assertEqual([(481, ts_gen.STREAM_TYPE_H264),
+                          (482, ts_gen.STREAM_TYPE_AC3),
+                          (483, ts_gen.STREAM_TYPE_AC3)],
+                         psi_utils.get_program_streams(view))
+        with open(self.output_filename, 'rb') as f:
+          outputs.append(f.read())
+      # (the same output, whatever the chunk size)
+      self.assertEqual(1, len(set(outputs)))
+    finally:
+      os.remove(filename)
+
+  def testCollisions(self):
+    pid_map, keep = pid_remap.get_pid_tables([(482, 481)])
+    self.assertRaises(ValueError, pid_remap.remap_file, self.filename,
+                      self.output_filename, pid_map, keep)
+    # (unless the kept pid is dropped, or remapped too)
+    pid_map, keep = pid_remap.get_pid_tables([(482, 481)], drop_l=[481])
+    pid_remap.remap_file(self.filename, self.output_filename, pid_map, keep,
+                         [481])
+    pid_map, keep = pid_remap.get_pid_tables([(482, 481), (481, 482)])
+    pid_remap.remap_file(self.filename, self.output_filename, pid_map, keep)
+
+  def testGetPidTables(self):
+    self.assertRaises(ValueError, pid_remap.get_pid_tables,
+                      [(482, 600), (483, 600)])
+    self.assertRaises(ValueError, pid_remap.get_pid_tables,
+                      [(482, 481)], keep_l=[481, 482])
+    pid_map, keep = pid_remap.get_pid_tables(keep_l=[481, 482],
+                                             drop_l=[482])
+    self.assertEqual([481], numpy.nonzero(keep)[0].tolist())
+    self.assertEqual(482, pid_map[482])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""Periodic progress and throughput metrics for long runs.
+
+A Progress is ticked once per packet from the hot loops. Ticking just
+increments a counter: the clock is read every CHECK_PACKETS packets, and
+a report is due at most every interval seconds. Reports are a single
+stderr line and, optionally, a Prometheus text-format file. The file is
+replaced atomically, so it can be scraped (e.g. by the node exporter
+textfile collector) at any time.
+"""
+
+import datetime
+import os
+import sys
+import time
+import pts_utils
+import ts_view
+
+DEFAULT_INTERVAL = 10.0
+# packets between clock reads
+CHECK_PACKETS = 1024
+METRICS_PREFIX = 'm2pb'
+MPEG_TS_PACKET_SIZE = ts_view.MPEG_TS_PACKET_SIZE
+
+# (name, type, help) of every metric, in report order
+METRICS = (
+    ('packets_total', 'counter', 'Packets processed.'),
+    ('bytes_total', 'counter', 'Bytes processed.'),
+    ('packets_per_second', 'gauge', 'Average packet throughput.'),
+    ('pts', 'gauge', 'Current PTS (90 kHz units).'),
+    ('progress_ratio', 'gauge', 'Processed fraction of the input size.'),
+    ('eta_seconds', 'gauge', 'Estimated time left.'),
+    ('buffered_packets', 'gauge', 'Packets currently buffered.'),
+    ('dropped_packets_total', 'counter', 'Packets not forwarded.'),
+    ('raw_packets_total', 'counter', 'Raw (unparseable) packets.'),
+)
+
+
+def get_total_bytes(filenames):
+  """Returns the total size of some files (None if any is not regular)."""
+  total = 0
+  for filename in filenames:
+    if not os.path.isfile(filename):
+      return None
+    total += os.path.getsize(filename)
+  return total
+
+
+class Progress(object):
+  """Packet counts of a long run, and their (rate-limited) reports."""
+
+  def __init__(self, name, total_bytes=None, interval=DEFAULT_INTERVAL,
+               metrics_filename=None, stream=None,
+               stride=MPEG_TS_PACKET_SIZE):
+    self.name = name
+    self.total_bytes = total_bytes
+    # packet size of the current input (see set_stride())
+    self.stride = stride
+    self.interval = interval
+    self.metrics_filename = metrics_filename
+    self.stream = stream
+    self.packets = 0
+    self.reports = 0
+    # bytes and packets of the previous inputs
+    self._base_bytes = 0
+    self._base_packets = 0
+    self._start = self._last = time.time()
+    self._next_check = CHECK_PACKETS
+
+  def tick(self, n=1):
+    """Accounts n packets.
+
+    Returns:
+      whether a report is due (the caller then calls report()).
+    """
+    self.packets += n
+    if self.packets < self._next_check:
+      return False
+    self._next_check = self.packets + CHECK_PACKETS
+    return time.time() - self._last >= self.interval
+
+  def set_stride(self, stride):
+    """Sets the packet size of the next packets (e.g. of a new input)."""
+    self._base_bytes = self.get_bytes()
+    self._base_packets = self.packets
+    self.stride = stride
+
+  def get_bytes(self):
+    """Returns the input bytes of the packets ticked so far."""
+    return self._base_bytes + (self.packets - self._base_packets) * self.stride
+
+  def wrap(self, iterable):
+    """Ticks (and reports) once per item of an iterable."""
+    for item in iterable:
+      yield item
+      if self.tick():
+        self.report()
+
+  def get_metrics(self, pts=pts_utils.kPtsInvalid, buffered=None,
+                  dropped=None, raw_packets=None):
+    """Returns the current metrics, as a name -> value dictionary.
+
+    Metrics that are unknown (e.g. the ETA of a live input) are left out.
+    """
+    elapsed = time.time() - self._start
+    nbytes = self.get_bytes()
+    metrics = {
+        'packets_total': self.packets,
+        'bytes_total': nbytes,
+        'packets_per_second': self.packets / elapsed if elapsed > 0 else 0.0,
+    }
+    if pts != pts_utils.kPtsInvalid:
+      metrics['pts'] = pts
+    if self.total_bytes:
+      metrics['progress_ratio'] = min(1.0, float(nbytes) / self.total_bytes)
+      if nbytes > 0:
+        metrics['eta_seconds'] = (max(0, self.total_bytes - nbytes) *
+                                  elapsed / nbytes)
+    if buffered is not None:
+      metrics['buffered_packets'] = buffered
+    if dropped is not None:
+      metrics['dropped_packets_total'] = dropped
+    if raw_packets is not None:
+      metrics['raw_packets_total'] = raw_packets
+    return metrics
+
+  def report(self, final=False, **kwargs):
+    """Writes the current metrics (see get_metrics() for the kwargs)."""
+    metrics = self.get_metrics(**kwargs)
+    self._last = time.time()
+    self.reports += 1
+    stream = self.stream if self.stream is not None else sys.stderr
+    stream.write('%s\n' % get_metrics_str(self.name, metrics, final))
+    stream.flush()
+    if self.metrics_filename is not None:
+      write_metrics(self.metrics_filename, self.name, metrics)
+
+
+def get_metrics_str(name, metrics, final=False):
+  s = '%s%s: %i packets, %.1f MB' % (name, ' (done)' if final else '',
+      metrics['packets_total'], metrics['bytes_total'] / 1e6)
+  if 'progress_ratio' in metrics:
+    s += ' (%.1f%%)' % (metrics['progress_ratio'] * 100)
+  s += ', %.0f packets/s' % metrics['packets_per_second']
+  if 'pts' in metrics:
+    s += ', pts %i' % metrics['pts']
+  if 'buffered_packets' in metrics:
+    s += ', buffered %i' % metrics['buffered_packets']
+  if 'dropped_packets_total' in metrics:
+    s += ', dropped %i' % metrics['dropped_packets_total']
+  if 'raw_packets_total' in metrics:
+    s += ', raw %i' % metrics['raw_packets_total']
+  if 'eta_seconds' in metrics and not final:
+    s += ', eta %s' % datetime.timedelta(
+        seconds=int(metrics['eta_seconds']))
+  return s
+
+
+def write_metrics(filename, name, metrics):
+  """Atomically writes metrics in the Prometheus text format."""
+  lines = []
+  for metric, metric_type, metric_help in METRICS:
+    if metric not in metrics:
+      continue
+    full_name = '%s_%s' % (METRICS_PREFIX, metric)
+    lines.append('# HELP %s %s' % (full_name, metric_help))
+    lines.append('# TYPE %s %s' % (full_name, metric_type))
+    value = metrics[metric]
+    # (repr() keeps the float precision, str() drops the "L" of longs)
+    lines.append('%s{job="%s"} %s' % (full_name, name,
+        repr(value) if isinstance(value, float) else str(value)))
+  tmp_filename = '%s.tmp' % filename
+  with open(tmp_filename, 'w') as f:
+    f.write('\n'.join(lines) + '\n')
+  os.rename(tmp_filename, filename)
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+"""Unit tests for progress.py."""
+
+import os
+import StringIO
+import tempfile
+import unittest
+import progress
+
+
+class ProgressTest(unittest.TestCase):
+
+  def setUp(self):
+    fd, self.filename = tempfile.mkstemp()
+    os.close(fd)
+
+  def tearDown(self):
+    os.remove(self.filename)
+
+  def testTick(self):
+    p = progress.Progress('test', interval=0)
+    # the clock is only checked every CHECK_PACKETS packets
+    for _ in range(progress.CHECK_PACKETS - 1):
+      self.assertFalse(p.tick())
+    self.assertTrue(p.tick())
+    self.assertFalse(p.tick())
+    self.assertEqual(progress.CHECK_PACKETS + 1, p.packets)
+    # reports are rate-limited
+    p = progress.Progress('test', interval=3600)
+    self.assertFalse(p.tick(progress.CHECK_PACKETS))
+
+  def testWrap(self):
+    stream = StringIO.StringIO()
+    p = progress.Progress('test', interval=0, stream=stream)
+    items = range(progress.CHECK_PACKETS * 2)
+    self.assertEqual(items, list(p.wrap(items)))
+    self.assertEqual(len(items), p.packets)
+    self.assertEqual(2, p.reports)
+    self.assertEqual(2, len(stream.getvalue().splitlines()))
+
+  def testMetrics(self):
+    p = progress.Progress('test', total_bytes=188 * 400)
+    self.assertNotIn('eta_seconds', p.get_metrics())
+    p.tick(100)
+    metrics = p.get_metrics(pts=1234, buffered=2, dropped=3, raw_packets=0)
+    self.assertEqual(100, metrics['packets_total'])
+    self.assertEqual(188 * 100, metrics['bytes_total'])
+    self.assertEqual(0.25, metrics['progress_ratio'])
+    self.assertGreaterEqual(metrics['eta_seconds'], 0)
+    self.assertEqual(1234, metrics['pts'])
+    self.assertEqual(2, metrics['buffered_packets'])
+    self.assertEqual(3, metrics['dropped_packets_total'])
+    self.assertEqual(0, metrics['raw_packets_total'])
+    # live inputs have no size
+    metrics = progress.Progress('test').get_metrics()
+    self.assertNotIn('progress_ratio', metrics)
+    self.assertNotIn('pts', metrics)
+
+  def testStride(self):
+    # m2ts (192-byte) packets
+    p = progress.Progress('test', total_bytes=192 * 400, stride=192)
+    p.tick(100)
+    metrics = p.get_metrics()
+    self.assertEqual(192 * 100, metrics['bytes_total'])
+    self.assertEqual(0.25, metrics['progress_ratio'])
+    # then a dvb (204-byte) input
+    p.set_stride(204)
+    p.tick(10)
+    self.assertEqual(192 * 100 + 204 * 10, p.get_metrics()['bytes_total'])
+    self.assertEqual(110, p.packets)
+
+  def testReport(self):
+    stream = StringIO.StringIO()
+    p = progress.Progress('test', total_bytes=188 * 400,
+                          metrics_filename=self.filename, stream=stream)
+    p.tick(100L)
+    p.report(pts=1234, dropped=3)
+    line = stream.getvalue()
+    self.assertTrue(line.startswith('test: 100 packets, 0.0 MB (25.0%)'))
+    self.assertIn('pts 1234, dropped 3, eta ', line)
+    with open(self.filename) as f:
+      lines = f.read().splitlines()
+    self.assertIn('# TYPE m2pb_packets_total counter', lines)
+    self.assertIn('m2pb_packets_total{job="test"} 100', lines)
+    self.assertIn('m2pb_pts{job="test"} 1234', lines)
+    self.assertIn('m2pb_progress_ratio{job="test"} 0.25', lines)
+    self.assertFalse(os.path.exists(self.filename + '.tmp'))
+
+  def testGetTotalBytes(self):
+    with open(self.filename, 'wb') as f:
+      f.write('\x47' * 376)
+    self.assertEqual(752, progress.get_total_bytes([self.filename] * 2))
+    self.assertIsNone(progress.get_total_bytes([self.filename, '-']))
+
+
+if __name__ == '__main__':
+  unittest.main()
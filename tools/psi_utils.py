@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""PSI (Program Specific Information) sections: PAT and PMT.
+
+Sections are parsed, and rewritten with remapped (or dropped) pids. The
+MPEG-2 CRC32 of rewritten sections is computed with a 256-entry table.
+"""
+
+import numpy
+import ts_view
+
+PAT_PID = 0x0000
+TABLE_ID_PAT = 0x00
+TABLE_ID_PMT = 0x02
+# table_id, section_syntax_indicator, and section_length
+PSI_SECTION_PREFIX_SIZE = 3
+# fixed part of the PAT/PMT section after the prefix (transport_stream_id
+# or program_number, version, and section numbers)
+PSI_SECTION_HEADER_SIZE = 8
+PSI_CRC_SIZE = 4
+# maximum section_length for PAT and PMT sections
+PSI_MAX_SECTION_LENGTH = 1021
+# how many packets of a pid to read when looking for a section
+DEFAULT_MAX_SECTION_PACKETS = 8
+# the pcr_pid of programs without pcr
+NO_PCR_PID = 0x1fff
+
+CRC32_POLYNOMIAL = 0x04c11db7
+
+
+def _get_crc32_table():
+  table = []
+  for i in range(256):
+    crc = i << 24
+    for _ in range(8):
+      crc = ((crc << 1) ^ CRC32_POLYNOMIAL if crc & 0x80000000 else
+             crc << 1) & 0xffffffff
+    table.append(crc)
+  return table
+
+CRC32_TABLE = _get_crc32_table()
+
+
+def get_crc32(data):
+  """Returns the MPEG-2 CRC32 of a PSI section.
+
+  The CRC32 of a whole section (including its crc_32 field) is 0.
+  """
+  crc = 0xffffffff
+  for c in bytearray(data):
+    crc = ((crc << 8) & 0xffffffff) ^ CRC32_TABLE[(crc >> 24) ^ c]
+  return crc
+
+
+def get_crc32_str(data):
+  """Returns the crc_32 field (4 bytes) of a PSI section."""
+  crc = get_crc32(data)
+  return ''.join(chr((crc >> shift) & 0xff) for shift in (24, 16, 8, 0))
+
+
+def get_section_length(section):
+  return ((ord(section[1]) & 0x0f) << 8) | ord(section[2])
+
+
+def get_version_number(section):
+  """Returns the version_number of a (long-form) PSI section."""
+  return (ord(section[5]) >> 1) & 0x1f
+
+
+def iter_sections(view, pid, max_packets=DEFAULT_MAX_SECTION_PACKETS):
+  """Yields the complete PSI sections of a pid.
+
+  Only the section starting at the pointer_field of every PUSI packet is
+  considered.
+
+  Args:
+    view: a ts_view.HeaderView
+    pid: the pid carrying the sections
+    max_packets: how many packets of the pid to read per section before
+        giving up
+
+  Yields:
+    (index, section) tuples, where index is the packet index of the
+    section start, and section a string (from the table_id to the CRC).
+  """
+  index = numpy.nonzero((view.pid == pid) & view.payload_exists &
+      ~view.transport_error_indicator)[0]
+  pusi = view.payload_unit_start_indicator[index]
+  for start in numpy.nonzero(pusi)[0].tolist():
+    data = ''
+    for i in index[start:start + max_packets]:
+      offset = view.offsets[i]
+      payload = view.data[offset + view.payload_offset[i]:
+          offset + ts_view.MPEG_TS_PACKET_SIZE].tobytes()
+      if not data:
+        # skip the pointer_field (and the end of any previous section)
+        if not payload:
+          break
+        payload = payload[1 + ord(payload[0]):]
+      data += payload
+      if len(data) >= PSI_SECTION_PREFIX_SIZE:
+        section_length = get_section_length(data)
+        if len(data) >= PSI_SECTION_PREFIX_SIZE + section_length:
+          yield index[start], data[:PSI_SECTION_PREFIX_SIZE + section_length]
+          break
+
+
+def get_section(view, pid, max_packets=DEFAULT_MAX_SECTION_PACKETS):
+  """Returns the first complete PSI section of a pid (or None).
+
+  See iter_sections() for the arguments.
+
+  Returns:
+    the section (from the table_id to the CRC) as a string.
+  """
+  for _, section in iter_sections(view, pid, max_packets):
+    return section
+  return None
+
+
+def parse_pat(section):
+  """Parses a PAT section.
+
+  Returns:
+    a dictionary mapping program_number to its program_map_pid (or to
+    the network_pid for program 0), or None if section is not a PAT.
+  """
+  if section is None or ord(section[0]) != TABLE_ID_PAT:
+    return None
+  end = PSI_SECTION_PREFIX_SIZE + get_section_length(section) - PSI_CRC_SIZE
+  b = bytearray(section[:end])
+  program_info = {}
+  for i in range(PSI_SECTION_HEADER_SIZE, len(b) - 3, 4):
+    program_number = (b[i] << 8) | b[i + 1]
+    program_info[program_number] = ((b[i + 2] & 0x1f) << 8) | b[i + 3]
+  return program_info
+
+
+def parse_pmt(section):
+  """Parses a PMT section.
+
+  Returns:
+    a dictionary with the program_number, pcr_pid, and streams (a list
+    of (elementary_pid, stream_type) tuples, in PMT order), or None if
+    section is not a PMT.
+  """
+  if section is None or ord(section[0]) != TABLE_ID_PMT:
+    return None
+  end = PSI_SECTION_PREFIX_SIZE + get_section_length(section) - PSI_CRC_SIZE
+  b = bytearray(section[:end])
+  if len(b) < PSI_SECTION_HEADER_SIZE + 4:
+    return None
+  program_info_length = ((b[10] & 0x0f) << 8) | b[11]
+  pmt = {
+      'program_number': (b[3] << 8) | b[4],
+      'pcr_pid': ((b[8] & 0x1f) << 8) | b[9],
+      'streams': [],
+  }
+  i = PSI_SECTION_HEADER_SIZE + 4 + program_info_length
+  while i + 5 <= len(b):
+    stream_type = b[i]
+    elementary_pid = ((b[i + 1] & 0x1f) << 8) | b[i + 2]
+    es_info_length = ((b[i + 3] & 0x0f) << 8) | b[i + 4]
+    pmt['streams'].append((elementary_pid, stream_type))
+    i += 5 + es_info_length
+  return pmt
+
+
+def get_program_streams(view):
+  """Returns the streams announced by the first PAT/PMTs of a view.
+
+  Returns:
+    a list of (elementary_pid, stream_type) tuples, in PAT and PMT order.
+  """
+  program_info = parse_pat(get_section(view, PAT_PID))
+  if not program_info:
+    return []
+  streams = []
+  for program_number, pmt_pid in sorted(program_info.iteritems()):
+    if program_number == 0:
+      # network pid
+      continue
+    pmt = parse_pmt(get_section(view, pmt_pid))
+    if pmt is not None:
+      streams += pmt['streams']
+  return streams
+
+
+def remap_pat(section, pid_map, keep):
+  """Rewrites a PAT section with remapped program_map_pids.
+
+  Args:
+    section: the PAT section (a string, from the table_id to the CRC)
+    pid_map: a sequence mapping every pid to its new value
+    keep: a sequence with whether to keep every pid (programs whose PMT
+        pid is not kept are removed)
+
+  Returns:
+    the new section (with a new CRC), or None if section is not a valid
+    PAT.
+  """
+  if parse_pat(section) is None or get_crc32(section):
+    return None
+  end = PSI_SECTION_PREFIX_SIZE + get_section_length(section) - PSI_CRC_SIZE
+  b = bytearray(section[:end])
+  body = bytearray()
+  for i in range(PSI_SECTION_HEADER_SIZE, len(b) - 3, 4):
+    pid = ((b[i + 2] & 0x1f) << 8) | b[i + 3]
+    if not keep[pid]:
+      continue
+    pid = pid_map[pid]
+    body += b[i:i + 2] + bytearray([(b[i + 2] & 0xe0) | (pid >> 8),
+                                    pid & 0xff])
+  return make_section(b[:PSI_SECTION_HEADER_SIZE], body)
+
+
+def remap_pmt(section, pid_map, keep):
+  """Rewrites a PMT section with remapped (or removed) pids.
+
+  Args:
+    section: the PMT section (a string, from the table_id to the CRC)
+    pid_map: a sequence mapping every pid to its new value
+    keep: a sequence with whether to keep every pid (streams whose
+        elementary_pid is not kept are removed, and so is the pcr_pid)
+
+  Returns:
+    the new section (with a new CRC), or None if section is not a valid
+    PMT.
+  """
+  if parse_pmt(section) is None or get_crc32(section):
+    return None
+  end = PSI_SECTION_PREFIX_SIZE + get_section_length(section) - PSI_CRC_SIZE
+  b = bytearray(section[:end])
+  pcr_pid = ((b[8] & 0x1f) << 8) | b[9]
+  pcr_pid = pid_map[pcr_pid] if keep[pcr_pid] else NO_PCR_PID
+  body = bytearray([(b[8] & 0xe0) | (pcr_pid >> 8), pcr_pid & 0xff])
+  program_info_length = ((b[10] & 0x0f) << 8) | b[11]
+  i = PSI_SECTION_HEADER_SIZE + 4 + program_info_length
+  body += b[10:i]
+  while i + 5 <= len(b):
+    pid = ((b[i + 1] & 0x1f) << 8) | b[i + 2]
+    es_info_length = ((b[i + 3] & 0x0f) << 8) | b[i + 4]
+    if keep[pid]:
+      new_pid = pid_map[pid]
+      body += (b[i:i + 1] + bytearray([(b[i + 1] & 0xe0) | (new_pid >> 8),
+                                       new_pid & 0xff]) +
+               b[i + 3:i + 5 + es_info_length])
+    i += 5 + es_info_length
+  return make_section(b[:PSI_SECTION_HEADER_SIZE], body)
+
+
+def make_section(header, body):
+  """Returns a section from its header and body (fixing its length and CRC).
+
+  Args:
+    header: the first PSI_SECTION_HEADER_SIZE bytes of the section
+    body: the rest of the section (without the CRC)
+  """
+  section_length = (PSI_SECTION_HEADER_SIZE - PSI_SECTION_PREFIX_SIZE +
+                    len(body) + PSI_CRC_SIZE)
+  b = bytearray(header[:PSI_SECTION_HEADER_SIZE]) + body
+  b[1] = (b[1] & 0xf0) | (section_length >> 8)
+  b[2] = section_length & 0xff
+  return str(b) + get_crc32_str(b)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""Moves the timeline (pts, dts, and pcr) of a whole mpeg-ts file.
+
+This replaces the text round trip (m2pb totxt | sed | m2pb tobin) for
+timeline shifts. The file is mmap'ed, and processed in chunks of packets:
+the pts/dts fields of the PES headers, and the pcr bases, of every chunk
+are located with a ts_view.HeaderView, and patched in bulk with numpy
+(modulo 2^33, so timestamps wrap).
+
+The file is either patched in place, or copied to the output first (and
+the copy patched). Only the timestamp bytes are written, so patching in
+place only dirties the pages that carry timestamps.
+"""
+
+import argparse
+import numpy
+import shutil
+import sys
+import time
+import modulo
+import pes_utils
+import pts_utils
+import ts_view
+
+mod = modulo.Modulo(pts_utils.kPtsMaxValue, pts_utils.kPtsInvalid)
+
+# packets per chunk (~188 MB)
+DEFAULT_CHUNK_PACKETS = 1 << 20
+
+
+def get_pid_deltas(delta, pid_delta_l):
+  """Returns the pts delta of every pid, as a numpy array indexed by pid.
+
+  Args:
+    delta: the delta of the pids not in pid_delta_l
+    pid_delta_l: a list of (pid, delta) tuples
+  """
+  deltas = numpy.empty(ts_view.MAX_PID + 1, dtype=numpy.int64)
+  deltas.fill(delta)
+  for pid, pid_delta in pid_delta_l:
+    deltas[pid] = pid_delta
+  return deltas
+
+
+def write_pcr_bases(data, positions, bases):
+  """Writes the 33-bit pcr bases at positions (the extensions are kept)."""
+  data[positions] = (bases >> 25) & 0xff
+  data[positions + 1] = (bases >> 17) & 0xff
+  data[positions + 2] = (bases >> 9) & 0xff
+  data[positions + 3] = (bases >> 1) & 0xff
+  data[positions + 4] = (data[positions + 4] & 0x7f) | ((bases << 7) & 0x80)
+
+
+def restamp_view(view, deltas, pcr=True):
+  """Moves the timestamps of the packets of a (writable) HeaderView.
+
+  Args:
+    view: the ts_view.HeaderView
+    deltas: the pts delta of every pid (see get_pid_deltas())
+    pcr: whether to move the pcrs too
+
+  Returns:
+    a (pts, dts, pcr) tuple with the number of patched fields.
+  """
+  pid_deltas = deltas[view.pid]
+  pts_index, pts_positions, dts_index, dts_positions = (
+      pes_utils.get_timestamp_positions(view))
+  counts = []
+  for index, positions in ((pts_index, pts_positions),
+                           (dts_index, dts_positions)):
+    values = pes_utils.parse_timestamps(view.data, positions)
+    pes_utils.write_timestamps(view.data, positions,
+        mod.wrap_correction(values + pid_deltas[index]))
+    counts.append(len(index))
+  if not pcr:
+    return tuple(counts + [0])
+  index, values = view.get_pcr()
+  bases = values // ts_view.PCR_EXTENSION_PER_BASE
+  write_pcr_bases(view.data, view.offsets[index] + 6,
+                  mod.wrap_correction(bases + pid_deltas[index]))
+  return tuple(counts + [len(index)])
+
+
+def restamp_file(filename, deltas, output_filename=None, pcr=True,
+                 stride=None, chunk_packets=DEFAULT_CHUNK_PACKETS):
+  """Moves the timestamps of a whole file.
+
+  Args:
+    filename: the (regular) input file
+    deltas: the pts delta of every pid (see get_pid_deltas())
+    output_filename: where to write the result (None to patch the input
+        file in place)
+    pcr: whether to move the pcrs too
+    stride: the packet size (detected from the file contents if None)
+    chunk_packets: number of packets processed at once
+
+  Returns:
+    a dictionary with the number of packets, and of pts, dts, and pcr
+    fields patched.
+  """
+  if output_filename is not None:
+    shutil.copyfile(filename, output_filename)
+    filename = output_filename
+  data = ts_view.open_file(filename, mode='r+')
+  if stride is None:
+    stride = ts_view.detect_stride(data)
+  runs, _ = ts_view.get_packet_runs(data, stride)
+  packets = sum(length for _, length in runs)
+  stats = {'packets': packets, 'pts': 0, 'dts': 0, 'pcr': 0}
+  for start in range(0, packets, chunk_packets):
+    view = ts_view.HeaderView(data, ts_view.get_run_offsets(runs, start,
+        start + chunk_packets, stride), stride=stride)
+    pts, dts, pcrs = restamp_view(view, deltas, pcr)
+    stats['pts'] += pts
+    stats['dts'] += dts
+    stats['pcr'] += pcrs
+  if len(data):
+    data.flush()
+  return stats
+
+
+def parse_pid_delta(spec):
+  """Parses a "pid:delta" string."""
+  pid, delta = spec.split(':', 1)
+  return int(pid, 0), long(delta)
+
+
+def get_opts(argv):
+  parser = argparse.ArgumentParser(
+      description='Move the pts, dts, and pcr of a whole mpeg-ts file.')
+  parser.add_argument('-d', '--debug', dest='debug', default=0,
+      action='count',
+      help='Increase verbosity (specify multiple times for more)')
+  parser.add_argument('--delta', action='store',
+      dest='delta', type=long, default=0,
+      metavar='PTS_DELTA',
+      help='pts delta (90 kHz units, can be negative) of every pid',)
+  parser.add_argument('--pid-delta', action='append',
+      dest='pid_delta_l', type=parse_pid_delta, default=[],
+      metavar='PID:PTS_DELTA',
+      help='pts delta of a pid (overrides --delta, can be used multiple '
+          'times)',)
+  parser.add_argument('--no-pcr', action='store_const',
+      dest='pcr', const=False, default=True,
+      help='do not move the pcrs',)
+  output_group = parser.add_mutually_exclusive_group(required=True)
+  output_group.add_argument('-o', '--output', action='store',
+      dest='output_filename', default=None,
+      metavar='OUTPUT_FILENAME',
+      help='output filename (the input is left untouched)',)
+  output_group.add_argument('--in-place', action='store_const',
+      dest='in_place', const=True, default=False,
+      help='patch the input file',)
+  parser.add_argument('input_file', nargs=1,
+      help='input file (a regular file)')
+  return parser.parse_args(argv[1:])
+
+
+def main(argv):
+  vals = get_opts(argv)
+  start = time.time()
+  stats = restamp_file(vals.input_file[0],
+      get_pid_deltas(vals.delta, vals.pid_delta_l), vals.output_filename,
+      vals.pcr)
+  if vals.debug > 0:
+    sys.stderr.write('%i packets: %i pts, %i dts, %i pcr in %.3f secs\n' % (
+        stats['packets'], stats['pts'], stats['dts'], stats['pcr'],
+        time.time() - start))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
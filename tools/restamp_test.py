@@ -0,0 +1,70 @@
+#!/usr/bin/python
+
+"""Unit tests for restamp.py."""
+
+import os
+import tempfile
+import unittest
+import restamp
+import splice_plan
+import ts_gen
+import ts_scan
+
+
+class RestampTest(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    fd, cls.filename = tempfile.mkstemp(suffix='.ts')
+    os.close(fd)
+    # (the default stream starts right before a pts wrap)
+    ts_gen.write_stream(cls.filename, 1 << 20)
+    with open(cls.filename, 'rb') as f:
+      cls.contents = f.read()
+
+  @classmethod
+  def tearDownClass(cls):
+    os.remove(cls.filename)
+
+  def setUp(self):
+    fd, self.output_filename = tempfile.mkstemp(suffix='.ts')
+    os.close(fd)
+
+  def tearDown(self):
+    os.remove(self.output_filename)
+
+  def testRestampFile(self):
+    for delta in (90000, -12345678):
+      stats = restamp.restamp_file(self.filename,
+          restamp.get_pid_deltas(delta, []), self.output_filename,
+          chunk_packets=1000)
+      self.assertEqual(len(self.contents) // 188, stats['packets'])
+      self.assertTrue(stats['pts'] > 0 and stats['dts'] > 0 and
+                      stats['pcr'] > 0)
+      # same as the (per-packet) splice plan patching
+      expected = bytearray(self.contents)
+      splice_plan.patch_pts_delta(expected, delta)
+      with open(self.output_filename, 'rb') as f:
+        self.assertEqual(str(expected), f.read())
+    # the input is left untouched
+    with open(self.filename, 'rb') as f:
+      self.assertEqual(self.contents, f.read())
+
+  def testRestampInPlacePerPid(self):
+    with open(self.output_filename, 'wb') as f:
+      f.write(self.contents)
+    restamp.restamp_file(self.output_filename,
+        restamp.get_pid_deltas(0, [(482, 3003)]), pcr=False)
+    scan = ts_scan.scan_file(self.filename, [481], [482])
+    out_scan = ts_scan.scan_file(self.output_filename, [481], [482])
+    for pid, pts, out_pid, out_pts in zip(scan.frames['pid'],
+        scan.frames['pts'], out_scan.frames['pid'], out_scan.frames['pts']):
+      self.assertEqual(pid, out_pid)
+      if pid == 482:
+        self.assertEqual(restamp.mod.add(pts, 3003), out_pts)
+      else:
+        self.assertEqual(pts, out_pts)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -3,19 +3,20 @@
 # Copyright Google Inc. Apache 2.0.
 
 import argparse
+import m2pb_pipe
 import modulo
 import os.path
+import perf_counters
+import progress
 import pts_utils
-import re
-import subprocess
+import splice_index
+import splice_plan
 import sys
+import totxt_utils
+import ts_seek
+import ts_source
 
 
-from google.protobuf import text_format
-
-sys.path.append('../src')
-import mpeg2ts_pb2
-
 mod = modulo.Modulo(pts_utils.kPtsMaxValue, pts_utils.kPtsInvalid)
 
 M2PB = 'm2pb'
@@ -53,7 +54,8 @@ def get_opts(argv):
   parser.add_argument('-i', '--input', action='append',
       dest='input_file_spec', default=[],
       metavar='INPUT_FILE_SPEC',
-      help='input file specification (file:splice_in:splice_out)',)
+      help='input file specification (file:splice_in:splice_out). file '
+          'can also be "-", a fifo, or udp://host:port',)
   parser.add_argument('-o', '--output', action='store',
       dest='output_filename', default='-',
       metavar='OUTPUT_FILENAME',
@@ -63,6 +65,42 @@ def get_opts(argv):
       type=float,
       metavar='SPLICE_FRAMES',
       help='explicit splice buffer length (in frames)',)
+  parser.add_argument('--seek', action='store_const',
+      dest='seek', const=True, default=False,
+      help='bisect regular input files to (about) their splice-in pts, '
+          'instead of reading them from the start (needs pts that grow '
+          'along the file)',)
+  plan_group = parser.add_mutually_exclusive_group()
+  plan_group.add_argument('--plan-only', action='store',
+      dest='plan_only', default=None,
+      metavar='PLAN_FILENAME',
+      help='analyze the inputs, and write a splice plan (instead of '
+          'the output)',)
+  plan_group.add_argument('--execute-plan', action='store',
+      dest='execute_plan', default=None,
+      metavar='PLAN_FILENAME',
+      help='render the output from a splice plan (no inputs needed)',)
+  parser.add_argument('--profile', action='store',
+      dest='profile_filename', default=None,
+      metavar='PROFILE_FILENAME',
+      help='run under cProfile, and dump the stats into PROFILE_FILENAME',)
+  parser.add_argument('--counters', action='store',
+      dest='counters_filename',
+      default=os.environ.get(perf_counters.COUNTERS_ENV),
+      metavar='COUNTERS_FILENAME',
+      help='write the stage timers and packet counts as JSON ("-" for '
+          'stderr, default: $%s)' % perf_counters.COUNTERS_ENV,)
+  parser.add_argument('--progress', action='store', nargs='?',
+      dest='progress_interval', type=float, default=None,
+      const=progress.DEFAULT_INTERVAL,
+      metavar='SECONDS',
+      help='report the progress to stderr every SECONDS (default: %s)' %
+          progress.DEFAULT_INTERVAL,)
+  parser.add_argument('--metrics-file', action='store',
+      dest='metrics_filename', default=None,
+      metavar='METRICS_FILENAME',
+      help='also write the progress metrics into METRICS_FILENAME '
+          '(Prometheus text format)',)
   parser.add_argument('-v', '--version', action='version',
       version='%(prog)s 1.0')
   # non-opt arguments must be input files
@@ -156,15 +194,6 @@ videore = r"""
 # packet: 8116 byte: 1525808 parsed { header { transport_error_indicator: false payload_unit_start_indicator: true transport_priority: false pid: 482 transport_scrambling_control: 0 adaptation_field_exists: false payload_exists: true continuity_counter: 1 } pes_packet { stream_id: 189 stream_id_type: STREAM_ID_PRIVATE_STREAM_1 pes_packet_length: 1544 pes_scrambling_control: 0 pes_priority: 0 data_alignment_indicator: true copyright: false original_or_copy: false pes_header_data_length: 5 pts: 183003 pes_packet_data_byte: "\013w\034\014\0240C\037\3677$\222\000\000\336l[\204\004\004\004\020\200\200\200\202\n\343\347\317\237>|\371\363\347\317\237>|\371\363\347\317\237>|\371\363\347\317\237>|\371\363\347\317\237\177\316\257\237>|\371\363\347\317\237>|\371\363\347\317\237>|\371\363\347\317\237>|\371\363\347\317\237\177\363\253\347\317\237>|\371\363\347\317\237>|\371\363\347\317\237>|\371\363\347\317\237>|\371\363\347\336S\342H\221$\000\000\000\000\003\306\333m\266\333\307\217\036;\273\273\270\000\000\000\000\000\000\000\000\000\000\000\356\356\356\356\356\356\333m\266\333o\2375" } }
 # packet: 8148 byte: 1531824 parsed { header { transport_error_indicator: false payload_unit_start_indicator: false transport_priority: false pid: 482 transport_scrambling_control: 0 adaptation_field_exists: false payload_exists: true continuity_counter: 2 } data_bytes: "\255kZ\326\265\255kZ\326\265\255kZ\326\265\240\000\000\000\033m\266\333o\036<x\356\356\356\340\000\000\000\000\000\000\000\000\000\000\003\273\273\273\273\273\273m\266\333m\276|\326\265\255kZ\326\230\000\000\000\000\000\007\215\266\333m\267\217\036<wwwp\000\000\000\000\000\000\000\000\000\000\001\335\335\335\335\335\335\266\333m\266\337>kZ\326\265\255kZ\326\265\255kZ\326\265\255k@\000\000\0006\333m\266\336<x\361\335\335\335\300\000\000\000\000\000\000\000\000\000\000\007wwwwwv\333m\266\333|\371\255kZ\326\265\2550\000\000\000\000\000\017\033m\266\333o\036<x\356\356\356\340\000\000" }
 
-ptsre = r"""
-    .*?
-    pes_packet\s{
-      [^}]*
-      \spes_packet_length:\s(?P<pes_packet_length>[0-9]+)
-      [^}]*
-      \spts:\s(?P<pts>[0-9]+)
-"""
-
 scte35re = 'pid: 0x01ea pusi:'
 
 
@@ -202,22 +231,30 @@ scte35re = 'pid: 0x01ea pusi:'
 
 
 
-def adjust_pts_delta(l, pts_delta):
-  packet = mpeg2ts_pb2.Mpeg2Ts()
-  text_format.Merge(l, packet)
-  if packet.parsed.pes_packet.HasField('pts'):
-    # fix pts field
-    packet.parsed.pes_packet.pts = mod.add(packet.parsed.pes_packet.pts,
-                                           pts_delta)
-  if packet.parsed.pes_packet.HasField('dts'):
-    # fix dts field
-    packet.parsed.pes_packet.dts = mod.add(packet.parsed.pes_packet.dts,
-                                           pts_delta)
-  if packet.parsed.adaptation_field.pcr.HasField('base'):
-    # fix pcr.base field
-    packet.parsed.adaptation_field.pcr.base = mod.add(
-        packet.parsed.adaptation_field.pcr.base, pts_delta)
-  return text_format.MessageToString(packet, as_one_line=True)
+def get_splice_pids(streams):
+  """Returns the video and audio pids of a source.
+
+  The pids are taken from the PSI streams of the source (a list of
+  (elementary_pid, stream_type) tuples, see splice_index.get_streams()),
+  and default to the global values.
+
+  Returns:
+    a (video_pid, audio_pids) tuple, where audio_pids is a set.
+  """
+  video_pids = [pid for pid, stream_type in streams
+      if stream_type in video_stream_type_l]
+  audio_pids = set(pid for pid, stream_type in streams
+      if stream_type in audio_stream_type_l)
+  return (video_pids[0] if video_pids else videostr_pid,
+          audio_pids or set(audiostr_pid_d))
+
+
+def split_input_file_spec(input_file_spec):
+  """Splits "fname:rem" (udp://host:port fnames include colons)."""
+  if ts_source.is_udp_spec(input_file_spec):
+    parts = input_file_spec.split(':', 3)
+    return ':'.join(parts[:3]), parts[3] if len(parts) > 3 else ''
+  return input_file_spec.split(':', 1)
 
 
 def parse_input_file_spec(input_file_spec):
@@ -225,7 +262,7 @@ def parse_input_file_spec(input_file_spec):
   pts2 = pts_utils.kPtsInvalid
   fname = '-'
   if ':' in input_file_spec:
-    fname, pts1 = input_file_spec.split(':', 1)
+    fname, pts1 = split_input_file_spec(input_file_spec)
     if ':' in pts1:
       try:
         pts1, pts2 = pts1.split(':', 1)
@@ -234,8 +271,8 @@ def parse_input_file_spec(input_file_spec):
     pts1 = long(pts1) if pts1 else pts_utils.kPtsInvalid
     pts2 = long(pts2) if pts2 else pts_utils.kPtsInvalid
   if fname != '-':
-    # ensure file exists
-    if not os.path.isfile(fname):
+    # ensure file exists (or is a live source)
+    if not ts_source.is_valid_input(fname):
       return -1, '', 0, 0
   return 0, fname, pts1, pts2
 
@@ -261,6 +298,19 @@ def get_state_str(state):
   elif state == STATE_POST_OUT:
     return 'post_out'
 
+# per-state packet counter names
+STATE_COUNTERS = ['state.%s' % get_state_str(state) for state in range(6)]
+# per-packet counts of splice_streams() (the first ones are the states),
+# kept in a list while splicing (see add_counts())
+COUNTS = STATE_COUNTERS + ['forwarded_packets', 'rewrites',
+                           'buffered_packets', 'flushed_packets',
+                           'invalid_lines']
+(COUNT_FORWARDED,
+ COUNT_REWRITES,
+ COUNT_BUFFERED,
+ COUNT_FLUSHED,
+ COUNT_INVALID) = range(len(STATE_COUNTERS), len(COUNTS))
+
 # per input_file_specs
 #
 #                       pts1                        pts2
@@ -297,15 +347,89 @@ def get_state(pts, pts1, pts2, splice_buffer_pts):
   return STATE_THROUGH
 
 
+def get_buffered_pts_delta(pts_delta):
+  """Returns the pts delta of a buffered packet."""
+  if pts_delta == pts_utils.kPtsInvalid:
+    return PTS_DELTA_DONT_PRESENT
+  return mod.add(pts_delta, PTS_DELTA_DONT_PRESENT)
+
+
+def write_packet(writer, plan, text_packet, pts_delta, counters=None,
+    buffered=False):
+  """Writes a packet into the output (or adds it to the splice plan).
+
+  counters, if set, gets the rewrite and write times.
+  """
+  if plan is not None:
+    plan.add_packet(text_packet.byte, pts_delta, buffered)
+    return
+  if counters is None:
+    if pts_delta != pts_utils.kPtsInvalid:
+      text_packet.add_pts_delta(pts_delta)
+    writer.write(text_packet.line)
+    return
+  t = perf_counters.get_ns()
+  if pts_delta != pts_utils.kPtsInvalid:
+    text_packet.add_pts_delta(pts_delta)
+    t = counters.add_time('rewrite', t)
+  writer.write(text_packet.line)
+  counters.add_time('write', t)
+
+
+def add_counts(counters, counts):
+  """Moves the per-packet counts (a list, see COUNTS) into counters."""
+  for i, n in enumerate(counts):
+    if n:
+      counters.count(COUNTS[i], n)
+      counts[i] = 0
+
+
+def report_progress(progress_, counters, pts, buffered, final=False):
+  """Reports the progress of a splice (see progress.Progress)."""
+  progress_.report(final, pts=pts, buffered=buffered,
+      dropped=(progress_.packets - counters.counts['forwarded_packets'] -
+               buffered),
+      raw_packets=counters.counts['invalid_lines'])
+
+
 def splice_streams(input_file_specs, output_file, simple_splice, debug,
-    splice_buffer_pts):
+    splice_buffer_pts, plan=None, index_cache=None, counters=None,
+    progress_=None, seek=False, stage_timers=False):
+  """Splices the input streams.
+
+  If plan (a splice_plan.SplicePlan) is set, the output packets are added
+  to the plan instead of being written into output_file. If index_cache
+  (a splice_index.SourceIndexCache) is also set, the inputs are read from
+  their (cached) indexes instead of from "m2pb totxt".
+
+  The video and audio pids of every input are taken from its first PAT
+  and PMTs (the same way with and without indexes, see get_splice_pids()).
+
+  counters (a perf_counters.Counters) gets the packet counts (per state,
+  forwarded, etc.), and the time spent on the packets of every input
+  ("packets"). If stage_timers is set, it also gets the time spent in
+  every per-packet stage (read, parse, get_state, classify, rewrite, and
+  write): these need several clock reads per packet, which is as
+  expensive as the splicing itself. progress_ (a progress.Progress), if
+  set, is ticked once per packet.
+
+  If seek is set, regular input files with a splice-in pts are read from
+  the I frame preceding their splice buffer (see ts_seek.seek_pts()),
+  instead of from their start.
+  """
+  if index_cache is not None and plan is None:
+    raise ValueError('splicing from indexes needs a splice plan')
+  if counters is None:
+    counters = perf_counters.Counters()
   if debug > 1:
     print 'splice_streams(%r, %s, %s, %i, %i)' % (input_file_specs,
         output_file, simple_splice, debug, splice_buffer_pts)
 
-  # open the output command
-  command_out = [M2PB, 'tobin', '-', output_file]
-  proc_out = subprocess.Popen(command_out, stdin=subprocess.PIPE)
+  # open the output command (written from its own thread)
+  writer = None
+  if plan is None:
+    writer = m2pb_pipe.ThreadedWriter(
+        m2pb_pipe.M2pbWriter([M2PB, 'tobin', '-', output_file]))
   # farthest pts of the previous file
   pts0 = pts_utils.kPtsInvalid
   # init total pts_delta
@@ -316,44 +440,88 @@ def splice_streams(input_file_specs, output_file, simple_splice, debug,
     _, fname, pts1, pts2 = parse_input_file_spec(input_file_spec)
     if debug > 0:
       print '-----------%s:%i:%i' % (fname, pts1, pts2)
-    # open the input file command
-    command_in = [M2PB, 'totxt', fname]
-    proc_in = subprocess.Popen(command_in, stdout=subprocess.PIPE)
+    index = index_cache.get(fname) if index_cache is not None else None
+    video_pid, audio_pids = get_splice_pids(
+        index.streams if index is not None else
+        splice_index.get_file_streams(fname))
+    if debug > 0:
+      print '%s: video pid %i, audio pids %r' % (fname, video_pid,
+          sorted(audio_pids))
+    offset = 0
+    if (seek and index_cache is None and pts1 != pts_utils.kPtsInvalid and
+        os.path.isfile(fname)):
+      with counters.timer('seek'):
+        result = ts_seek.seek_pts(fname, mod.diff(pts1, splice_buffer_pts),
+                                  [video_pid])
+      offset = result['offset']
+      counters.count('seek_probes', result['probes'])
+      counters.count('seek_bytes', result['bytes_read'])
+      if debug > 0:
+        print '%s: seek to byte %i (pts %i, %i probes, %i bytes read)' % (
+            fname, offset, result['pts'], result['probes'],
+            result['bytes_read'])
+    if plan is not None:
+      plan.add_input(input_file_spec, fname, offset)
+    if progress_ is not None:
+      progress_.set_stride(ts_source.get_stride(fname))
+    if index is not None:
+      reader = None
+      text_packets = index.iter_packets()
+    else:
+      # open the input file command (read from its own thread)
+      reader = m2pb_pipe.ThreadedReader(m2pb_pipe.M2pbReader(
+          [M2PB, 'totxt'], fname, debug, offset=offset))
+      text_packets = (totxt_utils.TextPacket(l) for l in reader)
     # get the last pts
     last_video_pts = pts_utils.kPtsInvalid
     last_pts_d = {}
     farthest_video_pts = pts_utils.kPtsInvalid
     # clean up packet buffer
     packet_buffer = []
-    for line in iter(proc_in.stdout.readline, ''):
-      l = line.rstrip()
-      # use simpler comparison for faster parsing
-      parts = l.split(' ')
-      if parts[0] != 'packet:' or len(parts) < 16:
-        print '#invalid line: %s' % l
+    counts = [0] * len(COUNTS)
+    # (the stage timers get the counters)
+    timers = counters if stage_timers else None
+    packets = 0
+    start = t = perf_counters.get_ns()
+    for text_packet in text_packets:
+      packets += 1
+      if stage_timers:
+        t = counters.add_time('read', t)
+      pid = text_packet.pid if text_packet.is_valid() else None
+      if pid is None:
+        print '#invalid line: %s' % text_packet.line
+        counts[COUNT_INVALID] += 1
+        if stage_timers:
+          t = perf_counters.get_ns()
         continue
-      packet = long(parts[1])
-      pid = int(parts[15])
-      pusi = parts[11] == 'true'
+      pusi = text_packet.pusi
+      packet_pts = text_packet.pts if pusi else pts_utils.kPtsInvalid
+      if stage_timers:
+        t = counters.add_time('parse', t)
 
       must_forward = True
-      if pid == videostr_pid or pid not in audiostr_pid_d.keys():
+      # pts delta of the forwarded packet
+      packet_pts_delta = pts_utils.kPtsInvalid
+      if pid == video_pid or pid not in audio_pids:
         # get the pts value
-        pts = pts_utils.kPtsInvalid
-        if pusi:
-          pts_match = re.search(ptsre, l, re.X)
-          if pts_match:
-            pts = long(pts_match.group('pts'))
-            last_video_pts = last_pts_d[pid] = pts
+        pts = packet_pts
+        if pts != pts_utils.kPtsInvalid:
+          last_video_pts = last_pts_d[pid] = pts
         if pts == pts_utils.kPtsInvalid:
           if pid in last_pts_d:
             pts = last_pts_d[pid]
           else:
             pts = last_video_pts
-        # check the location
+        # check the location (the classify time is accounted below)
+        if stage_timers:
+          now = perf_counters.get_ns()
+          classify_ns, t = now - t, now
         state = get_state(pts, pts1, pts2, splice_buffer_pts)
+        if stage_timers:
+          t = counters.add_time('get_state', t)
+        counts[state] += 1
         if (debug > 1 and pusi) or (debug > 3):
-          if pid == videostr_pid:
+          if pid == video_pid:
             who = 'video'
           else:
             who = 'others'
@@ -365,17 +533,18 @@ def splice_streams(input_file_specs, output_file, simple_splice, debug,
           must_forward = False
         elif state == STATE_BUFFER_IN:
           if not simple_splice:
-            # buffer the packet after moving it to the do-no-present zone
-            packet_buffer.append(adjust_pts_delta(l, PTS_DELTA_DONT_PRESENT))
+            # buffer the packet (it will be moved to the do-no-present zone)
+            packet_buffer.append(text_packet)
+            counts[COUNT_BUFFERED] += 1
           must_forward = False
         elif state == STATE_BUFFER_IN2 or state == STATE_THROUGH:
           # re-calculate last video pts value
-          if pid == videostr_pid:
+          if pid == video_pid:
             # store the pts as "farthest pts value"
             farthest_video_pts = mod.max(farthest_video_pts, pts)
           # ensure we have a valid local delta
           if (pts_delta_cur == pts_utils.kPtsInvalid and
-              pid == videostr_pid and
+              pid == video_pid and
               pts0 != pts_utils.kPtsInvalid):
             if pts1 != pts_utils.kPtsInvalid:
               # calculate the delta using the pts that the user requested
@@ -391,22 +560,26 @@ def splice_streams(input_file_specs, output_file, simple_splice, debug,
             if debug > 0:
               print '--------------2- pts_delta: %i' % (pts_delta)
           if state == STATE_BUFFER_IN2 and not simple_splice:
-            # flush packet buffer
-            for ll in packet_buffer:
-              # apply pts_delta
-              if pts_delta != pts_utils.kPtsInvalid:
-                ll = adjust_pts_delta(ll, pts_delta)
-              proc_out.stdin.write(ll + '\n')
+            # flush packet buffer (applying pts_delta)
+            buffered_pts_delta = get_buffered_pts_delta(pts_delta)
+            for buffered_packet in packet_buffer:
+              write_packet(writer, plan, buffered_packet, buffered_pts_delta,
+                           timers, buffered=True)
+            counts[COUNT_FLUSHED] += len(packet_buffer)
+            counts[COUNT_FORWARDED] += len(packet_buffer)
+            counts[COUNT_REWRITES] += len(packet_buffer)
+            if stage_timers:
+              t = perf_counters.get_ns()
           # dump the packet buffer
           packet_buffer = []
           # apply pts_delta
-          if pts_delta != pts_utils.kPtsInvalid:
-            l = adjust_pts_delta(l, pts_delta)
+          packet_pts_delta = pts_delta
           must_forward = True
         elif state == STATE_BUFFER_OUT:
           if not simple_splice:
-            # buffer the packet after moving it to the do-no-present zone
-            packet_buffer.append(adjust_pts_delta(l, PTS_DELTA_DONT_PRESENT))
+            # buffer the packet (it will be moved to the do-no-present zone)
+            packet_buffer.append(text_packet)
+            counts[COUNT_BUFFERED] += 1
           must_forward = False
         elif state == STATE_POST_OUT:
           # dump the packet buffer
@@ -420,19 +593,22 @@ def splice_streams(input_file_specs, output_file, simple_splice, debug,
       else:
         # audio and other streams
         # get the pts value
-        pts = pts_utils.kPtsInvalid
-        if pusi:
-          pts_match = re.search(ptsre, l, re.X)
-          if pts_match:
-            pts = long(pts_match.group('pts'))
-            last_pts_d[pid] = pts
+        pts = packet_pts
+        if pts != pts_utils.kPtsInvalid:
+          last_pts_d[pid] = pts
         if pts == pts_utils.kPtsInvalid:
           if pid in last_pts_d:
             pts = last_pts_d[pid]
           else:
             pts = last_video_pts
-        # check the location
+        # check the location (the classify time is accounted below)
+        if stage_timers:
+          now = perf_counters.get_ns()
+          classify_ns, t = now - t, now
         state = get_state(pts, pts1, pts2, splice_buffer_pts)
+        if stage_timers:
+          t = counters.add_time('get_state', t)
+        counts[state] += 1
         if (debug > 1 and pusi) or (debug > 3):
           print '%s: %s audio PES%s at %s' % (fname,
               get_state_str(state), '*' if pusi else '', pts)
@@ -440,28 +616,58 @@ def splice_streams(input_file_specs, output_file, simple_splice, debug,
           must_forward = False
         elif state == STATE_BUFFER_IN2 or state == STATE_THROUGH:
           # apply pts_delta
-          if pts_delta != pts_utils.kPtsInvalid:
-            l = adjust_pts_delta(l, pts_delta)
+          packet_pts_delta = pts_delta
           must_forward = True
         elif state == STATE_BUFFER_OUT or state == STATE_POST_OUT:
           must_forward = False
           # optimization: punt right away
-          if pid in audiostr_pid_d.keys():
+          if pid in audio_pids:
             break
 
+      if stage_timers:
+        now = perf_counters.get_ns()
+        counters.add_ns('classify', classify_ns + now - t)
+        t = now
       if must_forward:
-        proc_out.stdin.write(l + '\n')
-
-    # close the input_file command
-    proc_in.communicate()
+        write_packet(writer, plan, text_packet, packet_pts_delta, timers)
+        counts[COUNT_FORWARDED] += 1
+        if packet_pts_delta != pts_utils.kPtsInvalid:
+          counts[COUNT_REWRITES] += 1
+        if stage_timers:
+          t = perf_counters.get_ns()
+      if progress_ is not None and progress_.tick():
+        add_counts(counters, counts)
+        report_progress(progress_, counters, last_video_pts,
+                        len(packet_buffer))
+        if stage_timers:
+          t = perf_counters.get_ns()
+    counters.add_time('packets', start, packets)
+    add_counts(counters, counts)
+
+    # close the input_file command (we may have punted early)
+    if reader is not None:
+      reader.close()
+      if debug > 0 or reader.source is not None:
+        sys.stderr.write('%s\n' % reader.get_stats_str())
+      counters.append('input_pipes', reader.get_stats())
     # store a valid out pts value
     if pts2 != pts_utils.kPtsInvalid:
       pts0 = pts2
     else:
       pts0 = farthest_video_pts
 
+  if progress_ is not None:
+    # unflushed buffered packets are dropped
+    report_progress(progress_, counters, pts0, 0, final=True)
+  if plan is not None:
+    return
   # close the output command
-  proc_out.communicate()
+  t = perf_counters.get_ns()
+  writer.close()
+  counters.add_time('close_output', t)
+  if debug > 0:
+    sys.stderr.write('%s\n' % writer.get_stats_str())
+  counters.extra['output_pipe'] = writer.get_stats()
 
 
 def main(argv):
@@ -472,6 +678,27 @@ def main(argv):
       print 'vals.%s = %s' % (k, v)
     print 'remaining: %r' % vals.remaining
 
+  counters = perf_counters.Counters()
+  try:
+    if vals.profile_filename is not None:
+      perf_counters.run_profiled(vals.profile_filename, run, vals, counters)
+    else:
+      run(vals, counters)
+  finally:
+    if vals.counters_filename:
+      counters.write(vals.counters_filename)
+
+
+def run(vals, counters):
+  if vals.execute_plan is not None:
+    try:
+      splice_plan.execute_plan(splice_plan.SplicePlan.load(vals.execute_plan),
+          vals.output_filename, vals.debug)
+    except (IOError, OSError, ValueError) as e:
+      print 'error: cannot execute splice plan: %s' % e
+      sys.exit(-1)
+    return
+
   # check input file specs
   for input_file_spec in vals.input_file_spec:
     res, _, _, _ = parse_input_file_spec(input_file_spec)
@@ -480,8 +707,24 @@ def main(argv):
       sys.exit(-1)
 
   do_print = (vals.debug >= 0)
-  splice_streams(vals.input_file_spec, vals.output_filename,
-      vals.simple, vals.debug, frames_to_pts(vals.splice_frames))
+  plan = splice_plan.SplicePlan() if vals.plan_only is not None else None
+  progress_ = None
+  if vals.progress_interval is not None or vals.metrics_filename is not None:
+    progress_ = progress.Progress('splice', progress.get_total_bytes(
+        [parse_input_file_spec(spec)[1] for spec in vals.input_file_spec]),
+        vals.progress_interval or progress.DEFAULT_INTERVAL,
+        vals.metrics_filename)
+  try:
+    splice_streams(vals.input_file_spec, vals.output_filename,
+        vals.simple, vals.debug, frames_to_pts(vals.splice_frames), plan,
+        counters=counters, progress_=progress_, seek=vals.seek,
+        stage_timers=(vals.counters_filename is not None or
+                      vals.profile_filename is not None))
+  except ValueError as e:
+    print 'error: %s' % e
+    sys.exit(-1)
+  if plan is not None:
+    plan.save(vals.plan_only)
 
 
 if __name__ == '__main__':
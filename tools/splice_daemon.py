@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""A long-running splice service listening on a Unix socket.
+
+Running splice.py once per job pays the python startup, the imports, and
+a full m2pb parse of every input. Instead, the service keeps a warm LRU
+of per-source indexes (and PSI streams), splices every job from them into
+a splice plan, and renders the plan with range copies. Jobs on already
+seen sources cost little more than writing their output.
+
+Clients send one JSON request per line, and get one JSON reply per line:
+
+  {"input": ["ad.ts", "content.ts:1629000:"], "output": "out.ts",
+   "splice_frames": 3.5, "simple": false}
+  {"command": "stats"}
+
+Inputs are splice.py input file specs, except that the service only reads
+regular files: a spec without splice points ("ad.ts") is the whole file.
+
+Connections are served by SocketServer threads, which hand the jobs over
+(through a Queue) to a fixed pool of worker threads.
+"""
+
+import argparse
+import json
+import os
+import Queue
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import traceback
+import pts_utils
+import splice
+import splice_index
+import splice_plan
+
+DEFAULT_WORKERS = 4
+DEFAULT_CACHE_SIZE_MB = splice_index.DEFAULT_CACHE_BYTES >> 20
+
+
+class SpliceService(object):
+  """Runs splice jobs on a pool of worker threads."""
+
+  def __init__(self, workers=DEFAULT_WORKERS,
+               cache_bytes=splice_index.DEFAULT_CACHE_BYTES, debug=0):
+    self.index_cache = splice_index.SourceIndexCache(cache_bytes)
+    self.debug = debug
+    self.jobs_done = 0
+    self.jobs_failed = 0
+    self._stats_lock = threading.Lock()
+    self._jobs = Queue.Queue()
+    self._workers = []
+    for i in range(workers):
+      worker = threading.Thread(target=self._run_worker,
+                                name='splice_worker_%i' % i)
+      worker.daemon = True
+      worker.start()
+      self._workers.append(worker)
+
+  def _run_worker(self):
+    while True:
+      job, reply = self._jobs.get()
+      if job is None:
+        break
+      try:
+        result = self.run_job(job)
+      except Exception as e:
+        # the client waits for a reply: never let a job kill the worker
+        if self.debug >= 0:
+          traceback.print_exc()
+        with self._stats_lock:
+          self.jobs_failed += 1
+        result = {'status': 'error', 'error': '%s: %s' % (type(e).__name__, e)}
+      reply.put(result)
+
+  def stop(self):
+    for _ in self._workers:
+      self._jobs.put((None, None))
+    for worker in self._workers:
+      worker.join()
+
+  def submit(self, job):
+    """Queues a job, and waits for its reply."""
+    reply = Queue.Queue(1)
+    self._jobs.put((job, reply))
+    return reply.get()
+
+  def run_job(self, job):
+    """Runs a splice job (a dictionary), and returns its reply."""
+    start = time.time()
+    try:
+      input_file_specs = job['input']
+      output_file = job['output']
+      if (not isinstance(input_file_specs, list) or
+          not all(isinstance(spec, basestring) for spec in input_file_specs)):
+        raise ValueError('input must be a list of input file specs')
+      input_file_specs = [get_file_spec(spec) for spec in input_file_specs]
+      for input_file_spec in input_file_specs:
+        res, _, pts1, pts2 = splice.parse_input_file_spec(input_file_spec)
+        if res < 0 or (pts1 != pts_utils.kPtsInvalid and
+                       pts2 != pts_utils.kPtsInvalid and
+                       splice.mod.cmp(pts1, pts2) >= 0):
+          raise ValueError('invalid input file spec: "%s"' % input_file_spec)
+      plan = splice_plan.SplicePlan()
+      splice.splice_streams(input_file_specs, output_file,
+          job.get('simple', False), self.debug,
+          splice.frames_to_pts(job.get('splice_frames',
+                                       splice.SPLICE_BUFFER_FRAMES)),
+          plan, self.index_cache)
+      splice_plan.execute_plan(plan, output_file, self.debug)
+    except (KeyError, TypeError, ValueError, IOError, OSError) as e:
+      with self._stats_lock:
+        self.jobs_failed += 1
+      return {'status': 'error', 'error': '%s: %s' % (type(e).__name__, e)}
+    with self._stats_lock:
+      self.jobs_done += 1
+    ranges = sum((entry['ranges'] for entry in plan.inputs), [])
+    return {
+        'status': 'ok',
+        'output': output_file,
+        'ranges': len(ranges),
+        'bytes': sum(r['end'] - r['start'] for r in ranges),
+        'elapsed': time.time() - start,
+    }
+
+  def get_stats(self):
+    return {
+        'status': 'ok',
+        'jobs_done': self.jobs_done,
+        'jobs_failed': self.jobs_failed,
+        'jobs_queued': self._jobs.qsize(),
+        'index_cache': self.index_cache.get_stats(),
+    }
+
+  def handle(self, request):
+    """Returns the reply to a request (a job or a command)."""
+    if not isinstance(request, dict):
+      return {'status': 'error', 'error': 'requests must be JSON objects'}
+    command = request.get('command', 'splice')
+    if command == 'stats':
+      return self.get_stats()
+    elif command == 'splice':
+      return self.submit(request)
+    return {'status': 'error', 'error': 'invalid command: %s' % command}
+
+
+class SpliceRequestHandler(SocketServer.StreamRequestHandler):
+  """Serves the (line-delimited JSON) requests of a connection."""
+
+  def handle(self):
+    for line in iter(self.rfile.readline, ''):
+      if not line.strip():
+        continue
+      try:
+        request = json.loads(line)
+      except ValueError as e:
+        reply = {'status': 'error', 'error': 'invalid JSON: %s' % e}
+      else:
+        reply = self.server.service.handle(request)
+      self.wfile.write(json.dumps(reply) + '\n')
+      self.wfile.flush()
+
+
+class SpliceServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+  daemon_threads = True
+
+  def __init__(self, socket_path, service):
+    if os.path.exists(socket_path):
+      # a stale socket from a previous run
+      os.remove(socket_path)
+    SocketServer.UnixStreamServer.__init__(self, socket_path,
+                                           SpliceRequestHandler)
+    self.service = service
+
+  def server_close(self):
+    SocketServer.UnixStreamServer.server_close(self)
+    if os.path.exists(self.server_address):
+      os.remove(self.server_address)
+
+
+def get_file_spec(input_file_spec):
+  """Returns an input file spec, where "fname" means the whole file.
+
+  (splice.parse_input_file_spec() reads a spec without ':' as stdin.)
+  """
+  if ':' in input_file_spec:
+    return input_file_spec
+  return input_file_spec + ':'
+
+
+def get_absolute_spec(input_file_spec):
+  """Makes the file name of an input file spec absolute."""
+  if ':' not in input_file_spec:
+    return os.path.abspath(input_file_spec)
+  fname, rem = input_file_spec.split(':', 1)
+  return '%s:%s' % (os.path.abspath(fname), rem)
+
+
+def submit(socket_path, request):
+  """Sends a request to a splice service, and returns its reply."""
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.connect(socket_path)
+    f = sock.makefile('r+b')
+    f.write(json.dumps(request) + '\n')
+    f.flush()
+    line = f.readline()
+    f.close()
+  finally:
+    sock.close()
+  if not line:
+    raise IOError('no reply from %s' % socket_path)
+  return json.loads(line)
+
+
+def get_opts(argv):
+  parser = argparse.ArgumentParser(description='Splice service.')
+  parser.add_argument('-d', '--debug', dest='debug', default=0,
+      action='count',
+      help='Increase verbosity (specify multiple times for more)')
+  parser.add_argument('--socket', action='store',
+      dest='socket_path', required=True,
+      metavar='SOCKET_PATH',
+      help='Unix socket path',)
+  subparsers = parser.add_subparsers()
+  parser_serve = subparsers.add_parser('serve', help='run the service')
+  parser_serve.set_defaults(subcommand='serve')
+  parser_serve.add_argument('--workers', action='store',
+      dest='workers', type=int, default=DEFAULT_WORKERS,
+      help='number of worker threads',)
+  parser_serve.add_argument('--cache-size', action='store',
+      dest='cache_size', type=int, default=DEFAULT_CACHE_SIZE_MB,
+      metavar='MB',
+      help='memory budget of the source index cache',)
+  parser_submit = subparsers.add_parser('submit', help='submit a job')
+  parser_submit.set_defaults(subcommand='submit')
+  parser_submit.add_argument('-i', '--input', action='append',
+      dest='input_file_spec', default=[],
+      metavar='INPUT_FILE_SPEC',
+      help='input file specification (file[:splice_in[:splice_out]])',)
+  parser_submit.add_argument('-o', '--output', action='store',
+      dest='output_filename', default=None,
+      metavar='OUTPUT_FILENAME',
+      help='output filename',)
+  parser_submit.add_argument('--simple', action='store_const',
+      dest='simple', const=True, default=False,
+      help='Do simple video filtering',)
+  parser_submit.add_argument('--splice-frames', action='store',
+      dest='splice_frames', default=splice.SPLICE_BUFFER_FRAMES,
+      type=float,
+      help='explicit splice buffer length (in frames)',)
+  parser_submit.add_argument('--stats', action='store_const',
+      dest='stats', const=True, default=False,
+      help='get the service stats (instead of submitting a job)',)
+  return parser.parse_args(argv[1:])
+
+
+def main(argv):
+  vals = get_opts(argv)
+  if vals.subcommand == 'serve':
+    service = SpliceService(vals.workers, vals.cache_size << 20, vals.debug)
+    server = SpliceServer(vals.socket_path, service)
+    if vals.debug > 0:
+      sys.stderr.write('serving on %s\n' % vals.socket_path)
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      server.server_close()
+      service.stop()
+    return
+  if vals.stats:
+    request = {'command': 'stats'}
+  else:
+    if not vals.input_file_spec or vals.output_filename is None:
+      print 'error: submit needs input(s) and an output'
+      sys.exit(-1)
+    # the service may run in a different directory
+    request = {
+        'input': [get_absolute_spec(spec) for spec in vals.input_file_spec],
+        'output': os.path.abspath(vals.output_filename),
+        'simple': vals.simple,
+        'splice_frames': vals.splice_frames,
+    }
+  reply = submit(vals.socket_path, request)
+  print json.dumps(reply, indent=1, sort_keys=True)
+  if reply.get('status') != 'ok':
+    sys.exit(-1)
+
+
+if __name__ == '__main__':
+  main(sys.argv)
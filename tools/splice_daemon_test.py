@@ -0,0 +1,102 @@
+#!/usr/bin/python
+
+"""Unit tests for splice_daemon.py."""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import splice_daemon
+import ts_scan_test
+import ts_view_test
+
+
+class SpliceDaemonTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.filename = os.path.join(self.tmpdir, 'in.ts')
+    with open(self.filename, 'wb') as f:
+      f.write(ts_view_test.make_data(ts_scan_test.make_stream()).tostring())
+    self.socket_path = os.path.join(self.tmpdir, 'splice.sock')
+    self.service = splice_daemon.SpliceService(workers=2, debug=-1)
+    self.server = splice_daemon.SpliceServer(self.socket_path, self.service)
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.start()
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    self.thread.join()
+    self.service.stop()
+    shutil.rmtree(self.tmpdir)
+
+  def splice(self, input_file_specs, output_filename):
+    return splice_daemon.submit(self.socket_path, {
+        'input': input_file_specs,
+        'output': os.path.join(self.tmpdir, output_filename)})
+
+  def testSplice(self):
+    specs = [self.filename + ':', self.filename + ':9000:']
+    outputs = []
+    for i in range(2):
+      reply = self.splice(specs, 'out%i.ts' % i)
+      self.assertEqual('ok', reply['status'])
+      with open(reply['output'], 'rb') as f:
+        outputs.append(f.read())
+      self.assertEqual(reply['bytes'], len(outputs[-1]))
+    self.assertEqual(outputs[0], outputs[1])
+    # the first input is complete
+    self.assertEqual(os.path.getsize(self.filename),
+                     outputs[0].index(outputs[0][:188], 188))
+    stats = splice_daemon.submit(self.socket_path, {'command': 'stats'})
+    self.assertEqual(2, stats['jobs_done'])
+    # a single source, indexed once
+    self.assertEqual(1, stats['index_cache']['entries'])
+    self.assertEqual(1, stats['index_cache']['misses'])
+    self.assertEqual(3, stats['index_cache']['hits'])
+    self.assertEqual([[ts_scan_test.VIDEO_PID, 0x1b],
+                      [ts_scan_test.AUDIO_PID, 0x81]],
+                     stats['index_cache']['sources'][0]['streams'])
+
+  def testErrors(self):
+    reply = self.splice([self.filename + ':2:1'], 'out.ts')
+    self.assertEqual('error', reply['status'])
+    reply = self.splice([os.path.join(self.tmpdir, 'missing.ts:')], 'out.ts')
+    self.assertEqual('error', reply['status'])
+    reply = splice_daemon.submit(self.socket_path, {'command': 'foo'})
+    self.assertEqual('error', reply['status'])
+    # invalid inputs
+    reply = splice_daemon.submit(self.socket_path, {
+        'input': [[':']], 'output': os.path.join(self.tmpdir, 'out.ts')})
+    self.assertEqual('error', reply['status'])
+    self.assertEqual(3, self.service.get_stats()['jobs_failed'])
+    # unexpected errors get a reply, and keep the workers alive
+    def run_job(job):
+      raise AttributeError('oops')
+    self.service.run_job = run_job
+    for _ in range(3):
+      reply = self.splice([self.filename + ':'], 'out.ts')
+      self.assertEqual('error', reply['status'])
+      self.assertEqual('AttributeError: oops', reply['error'])
+    del self.service.run_job
+    self.assertEqual('ok', self.splice([self.filename + ':'],
+                                       'out.ts')['status'])
+
+  def testWholeFileSpec(self):
+    # a spec without ':' is the whole file (not stdin)
+    reply = self.splice([self.filename], 'out.ts')
+    self.assertEqual('ok', reply['status'])
+    self.assertEqual(os.path.getsize(self.filename), reply['bytes'])
+    self.assertEqual('a.ts:', splice_daemon.get_file_spec('a.ts'))
+    self.assertEqual('a.ts:1:', splice_daemon.get_file_spec('a.ts:1:'))
+
+  def testGetAbsoluteSpec(self):
+    self.assertEqual(os.path.abspath('a.ts') + ':1:',
+                     splice_daemon.get_absolute_spec('a.ts:1:'))
+    self.assertEqual('/a.ts', splice_daemon.get_absolute_spec('/a.ts'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""In-memory per-source indexes for splicing.
+
+A SourceIndex holds the few per-packet fields that splice.py looks at
+(byte, pid, pusi, and pts), plus the PSI streams, of a regular mpeg-ts
+file. It is built in-process (with ts_view and pes_utils), so splicing
+from an index needs no m2pb process at all. SourceIndexCache keeps the
+indexes of the most recently used sources under a memory budget.
+"""
+
+import collections
+import numpy
+import os
+import threading
+import pes_utils
+import psi_utils
+import pts_utils
+import ts_view
+
+DEFAULT_CACHE_BYTES = 512 << 20
+# the PSI streams are taken from the first PAT/PMTs in these packets
+PSI_SCAN_PACKETS = 1 << 17
+
+
+def get_streams(view):
+  """Returns the PSI streams of the first PSI_SCAN_PACKETS packets of a view.
+
+  Returns:
+    a list of (elementary_pid, stream_type) tuples.
+  """
+  return psi_utils.get_program_streams(ts_view.HeaderView(view.data,
+      view.offsets[:PSI_SCAN_PACKETS], stride=view.stride))
+
+
+def get_file_streams(filename):
+  """Returns the PSI streams of a file (reading only its head).
+
+  Live sources (and missing files) have no streams.
+  """
+  if not os.path.isfile(filename):
+    return []
+  data = ts_view.open_file(filename)
+  stride = ts_view.detect_stride(data)
+  head = data[:PSI_SCAN_PACKETS * stride]
+  return get_streams(ts_view.HeaderView(head,
+      ts_view.get_packet_offsets(head, stride), stride=stride))
+
+
+class IndexPacket(object):
+  """A packet of a SourceIndex (quacks like totxt_utils.TextPacket)."""
+
+  __slots__ = ('packet', 'byte', 'pid', 'pusi', 'pts')
+
+  def __init__(self, packet, byte, pid, pusi, pts):
+    self.packet = packet
+    self.byte = byte
+    self.pid = pid
+    self.pusi = pusi
+    self.pts = pts
+
+  def is_valid(self):
+    return True
+
+
+class SourceIndex(object):
+  """The splice-relevant fields of every packet of a 188-byte file."""
+
+  def __init__(self, filename):
+    st = os.stat(filename)
+    self.filename = filename
+    self.size = st.st_size
+    self.mtime = st.st_mtime
+    view = ts_view.open_view(filename, ts_view.MPEG_TS_PACKET_SIZE)
+    self.byte = view.offsets.astype(numpy.int64)
+    self.pid = view.pid.astype(numpy.int16)
+    self.pusi = view.payload_unit_start_indicator
+    self.pts = numpy.empty(len(view), dtype=numpy.int64)
+    self.pts.fill(pts_utils.kPtsInvalid)
+    index = numpy.nonzero(self.pusi & view.payload_exists)[0]
+    for i, offset, payload_offset in zip(index.tolist(),
+        self.byte[index].tolist(), view.payload_offset[index].tolist()):
+      header = pes_utils.parse_pes_header(view.data[
+          offset + payload_offset:offset + ts_view.MPEG_TS_PACKET_SIZE]
+          .tostring())
+      if header is not None:
+        self.pts[i] = header['pts']
+    # (elementary_pid, stream_type) tuples, from the first PAT/PMT (used to
+    # pick the splice pids, see splice.get_splice_pids())
+    self.streams = get_streams(view)
+
+  def __len__(self):
+    return len(self.byte)
+
+  @property
+  def nbytes(self):
+    return (self.byte.nbytes + self.pid.nbytes + self.pusi.nbytes +
+            self.pts.nbytes)
+
+  def is_current(self):
+    """Whether the file is unchanged since the index was built."""
+    try:
+      st = os.stat(self.filename)
+    except OSError:
+      return False
+    return st.st_size == self.size and st.st_mtime == self.mtime
+
+  def iter_packets(self):
+    for packet, (byte, pid, pusi, pts) in enumerate(zip(self.byte.tolist(),
+        self.pid.tolist(), self.pusi.tolist(), self.pts.tolist())):
+      yield IndexPacket(packet, byte, pid, pusi, pts)
+
+
+class SourceIndexCache(object):
+  """A thread-safe LRU cache of SourceIndexes, under a memory budget."""
+
+  def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, filename):
+    """Returns the (possibly cached) SourceIndex of a file."""
+    key = os.path.abspath(filename)
+    with self._lock:
+      index = self._entries.pop(key, None)
+      if index is not None and index.is_current():
+        # mark the entry as recently used
+        self._entries[key] = index
+        self.hits += 1
+        return index
+      self.misses += 1
+    # build outside the lock (other sources can be served meanwhile)
+    index = SourceIndex(filename)
+    with self._lock:
+      self._entries.pop(key, None)
+      self._entries[key] = index
+      self.evict()
+    return index
+
+  def evict(self):
+    """Removes the least recently used entries over the memory budget.
+
+    The caller must hold the lock. The most recent entry is always kept.
+    """
+    total = sum(index.nbytes for index in self._entries.itervalues())
+    while total > self.max_bytes and len(self._entries) > 1:
+      _, index = self._entries.popitem(last=False)
+      total -= index.nbytes
+
+  def get_stats(self):
+    with self._lock:
+      return {
+          'hits': self.hits,
+          'misses': self.misses,
+          'entries': len(self._entries),
+          'bytes': sum(index.nbytes for index in self._entries.itervalues()),
+          'sources': [{'filename': index.filename, 'packets': len(index),
+                       'streams': index.streams}
+                      for index in self._entries.itervalues()],
+      }
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""Precomputed splice plans.
+
+A splice plan records, for every input of a splice, the packets that make
+it into the output (in output order), and the pts delta applied to each
+of them. Consecutive packets with the same delta are coalesced into byte
+ranges, so that rendering a plan only needs range copies and timestamp
+patching (no m2pb, and no splice analysis).
+
+Plans are JSON documents with a "version", and a list of "inputs". Every
+input has its "spec", "filename", "size" and "mtime" (so that stale plans
+are detected), the "start" byte where the analysis started reading it
+(non-zero after a pts seek), and a list of "ranges". Every range has its "start" and
+"end" bytes, the "pts_delta" to apply to the pts, dts, and pcr fields
+(null for none), and whether the packets were "buffered" (moved to the
+decode-but-not-present zone).
+"""
+
+import json
+import numpy
+import os
+import sys
+import time
+import modulo
+import pes_utils
+import pts_utils
+import ts_source
+import ts_view
+
+
+mod = modulo.Modulo(pts_utils.kPtsMaxValue, pts_utils.kPtsInvalid)
+
+PLAN_VERSION = 1
+
+MPEG_TS_PACKET_SIZE = ts_view.MPEG_TS_PACKET_SIZE
+
+# how much to copy in each read() (a whole number of packets)
+DEFAULT_COPY_BLOCK_SIZE = ((4 << 20) // MPEG_TS_PACKET_SIZE *
+    MPEG_TS_PACKET_SIZE)
+
+
+class SplicePlan(object):
+  """The packets (byte ranges) and pts deltas of every splice input."""
+
+  def __init__(self, inputs=None):
+    self.inputs = inputs if inputs is not None else []
+
+  def add_input(self, spec, filename, start=0):
+    """Starts a new input. Only regular 188-byte mpeg-ts files work.
+
+    Args:
+      spec: the input file spec
+      filename: the input file name
+      start: where the input is read from (the packet bytes passed to
+          add_packet() are relative to it)
+    """
+    if (not os.path.isfile(filename) or
+        ts_source.get_stride(filename) != MPEG_TS_PACKET_SIZE):
+      raise ValueError('splice plans need regular 188-byte mpeg-ts files '
+                       '(not %s)' % filename)
+    st = os.stat(filename)
+    self.inputs.append({
+        'spec': spec,
+        'filename': filename,
+        'size': st.st_size,
+        'mtime': st.st_mtime,
+        'start': start,
+        'ranges': [],
+    })
+
+  def add_packet(self, byte, pts_delta, buffered=False):
+    """Adds a packet of the current input to the output.
+
+    Args:
+      byte: the offset of the packet in the input file (from the input
+          start)
+      pts_delta: the pts delta to apply (pts_utils.kPtsInvalid for none)
+      buffered: whether the packet was buffered
+    """
+    if pts_delta == pts_utils.kPtsInvalid:
+      pts_delta = None
+    byte += self.inputs[-1]['start']
+    ranges = self.inputs[-1]['ranges']
+    if ranges:
+      last = ranges[-1]
+      if (last['end'] == byte and last['pts_delta'] == pts_delta and
+          last['buffered'] == buffered):
+        last['end'] += MPEG_TS_PACKET_SIZE
+        return
+    ranges.append({
+        'start': byte,
+        'end': byte + MPEG_TS_PACKET_SIZE,
+        'pts_delta': pts_delta,
+        'buffered': buffered,
+    })
+
+  def save(self, filename):
+    plan = {'version': PLAN_VERSION, 'inputs': self.inputs}
+    if filename == '-':
+      json.dump(plan, sys.stdout, indent=1, sort_keys=True)
+      return
+    with open(filename, 'w') as f:
+      json.dump(plan, f, indent=1, sort_keys=True)
+
+  @classmethod
+  def load(cls, filename):
+    with open(filename) as f:
+      plan = json.load(f)
+    if plan.get('version') != PLAN_VERSION:
+      raise ValueError('unsupported splice plan version in %s: %r' % (
+          filename, plan.get('version')))
+    return cls(plan['inputs'])
+
+
+def add_pts_delta(b, offset, pts_delta):
+  """Moves the pts, dts, and pcr base of a packet by pts_delta.
+
+  Args:
+    b: a bytearray
+    offset: the offset of the packet in b
+    pts_delta: the pts delta
+  """
+  payload_offset = offset + 4
+  if b[offset + 3] & 0x20:
+    adaptation_field_length = b[offset + 4]
+    payload_offset += 1 + adaptation_field_length
+    if adaptation_field_length >= 7 and b[offset + 5] & 0x10:
+      i = offset + 6
+      base = (b[i] << 25 | b[i + 1] << 17 | b[i + 2] << 9 | b[i + 3] << 1 |
+          b[i + 4] >> 7)
+      base = mod.add(base, pts_delta)
+      b[i] = (base >> 25) & 0xff
+      b[i + 1] = (base >> 17) & 0xff
+      b[i + 2] = (base >> 9) & 0xff
+      b[i + 3] = (base >> 1) & 0xff
+      b[i + 4] = (b[i + 4] & 0x7f) | ((base << 7) & 0x80)
+  if not (b[offset + 1] & 0x40 and b[offset + 3] & 0x10):
+    return
+  end = offset + MPEG_TS_PACKET_SIZE
+  header = pes_utils.parse_pes_header(str(b[payload_offset:end]))
+  if header is None:
+    return
+  if header['pts'] != pts_utils.kPtsInvalid:
+    pes_utils.write_timestamp(b, payload_offset + 9,
+                              mod.add(header['pts'], pts_delta))
+  if header['dts'] != pts_utils.kPtsInvalid:
+    pes_utils.write_timestamp(b, payload_offset + 14,
+                              mod.add(header['dts'], pts_delta))
+
+
+def patch_pts_delta(b, pts_delta):
+  """Moves the timestamps of all the packets in a bytearray by pts_delta."""
+  data = numpy.frombuffer(str(b), dtype=numpy.uint8)
+  view = ts_view.HeaderView(data, numpy.arange(0, len(b),
+                                               MPEG_TS_PACKET_SIZE))
+  # only PES starts and PCR packets carry timestamps
+  index = numpy.nonzero(view.payload_unit_start_indicator | view.pcr_flag)[0]
+  for i in index.tolist():
+    add_pts_delta(b, i * MPEG_TS_PACKET_SIZE, pts_delta)
+
+
+def copy_range(fin, fout, start, end, pts_delta,
+               block_size=DEFAULT_COPY_BLOCK_SIZE):
+  """Copies bytes [start, end) of fin into fout, moving their timestamps."""
+  fin.seek(start)
+  while start < end:
+    block = fin.read(min(end - start, block_size))
+    if not block or len(block) % MPEG_TS_PACKET_SIZE:
+      raise ValueError('short read at byte %i of %s' % (start, fin.name))
+    if pts_delta is not None:
+      block = bytearray(block)
+      patch_pts_delta(block, pts_delta)
+    fout.write(block)
+    start += len(block)
+
+
+def execute_plan(plan, output_file, debug=0):
+  """Renders a SplicePlan into output_file ("-" for stdout)."""
+  fout = sys.stdout if output_file == '-' else open(output_file, 'wb')
+  start = time.time()
+  total_ranges = 0
+  total_bytes = 0
+  try:
+    for entry in plan.inputs:
+      filename = entry['filename']
+      st = os.stat(filename)
+      if st.st_size != entry['size'] or st.st_mtime != entry['mtime']:
+        raise ValueError('stale splice plan: %s has changed' % filename)
+      if debug > 0:
+        sys.stderr.write('-----------%s: %i ranges\n' % (entry['spec'],
+            len(entry['ranges'])))
+      with open(filename, 'rb') as fin:
+        for r in entry['ranges']:
+          copy_range(fin, fout, r['start'], r['end'], r['pts_delta'])
+          total_ranges += 1
+          total_bytes += r['end'] - r['start']
+  finally:
+    if fout is not sys.stdout:
+      fout.close()
+  if debug > 0:
+    elapsed = (time.time() - start) or 1e-9
+    sys.stderr.write('execute_plan: %i ranges, %i bytes, %.2f s (%.1f MB/s)\n'
+                     % (total_ranges, total_bytes, elapsed,
+                        total_bytes / elapsed / 1e6))
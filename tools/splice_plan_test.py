@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+"""Unit tests for splice_plan.py."""
+
+import numpy
+import os
+import tempfile
+import unittest
+import pes_utils
+import pts_utils
+import splice_plan
+import ts_scan_test
+import ts_view
+import ts_view_test
+
+PTS_DELTA = -9000
+
+
+class SplicePlanTest(unittest.TestCase):
+
+  def setUp(self):
+    packets = ts_scan_test.make_stream()
+    # a PCR packet
+    packets.insert(2, ts_view_test.make_packet(ts_scan_test.VIDEO_PID, 0,
+                                               pcr=300 * 27000 + 5))
+    self.data = ts_view_test.make_data(packets).tostring()
+    fd, self.filename = tempfile.mkstemp(suffix='.ts')
+    with os.fdopen(fd, 'wb') as f:
+      f.write(self.data)
+    self.output_filename = self.filename + '.out'
+    self.plan_filename = self.filename + '.json'
+
+  def tearDown(self):
+    for filename in (self.filename, self.output_filename,
+                     self.plan_filename):
+      if os.path.exists(filename):
+        os.remove(filename)
+
+  def testAddPacket(self):
+    plan = splice_plan.SplicePlan()
+    self.assertRaises(ValueError, plan.add_input, '-', '-')
+    plan.add_input(self.filename + ':1:2', self.filename)
+    for i in range(3):
+      plan.add_packet(188 * i, pts_utils.kPtsInvalid)
+    # not contiguous
+    plan.add_packet(188 * 4, pts_utils.kPtsInvalid)
+    # different delta
+    plan.add_packet(188 * 5, 100)
+    plan.add_packet(188 * 6, 100, buffered=True)
+    plan.save(self.plan_filename)
+    plan = splice_plan.SplicePlan.load(self.plan_filename)
+    self.assertEqual(1, len(plan.inputs))
+    self.assertEqual(self.filename + ':1:2', plan.inputs[0]['spec'])
+    self.assertEqual(
+        [(0, 564, None, False), (752, 940, None, False),
+         (940, 1128, 100, False), (1128, 1316, 100, True)],
+        [(r['start'], r['end'], r['pts_delta'], r['buffered'])
+         for r in plan.inputs[0]['ranges']])
+
+  def testExecutePlan(self):
+    plan = splice_plan.SplicePlan()
+    plan.add_input(self.filename, self.filename)
+    # skip the PSI packets, and move the rest
+    for byte in range(376, len(self.data), 188):
+      plan.add_packet(byte, splice_plan.mod.add(0, PTS_DELTA))
+    splice_plan.execute_plan(plan, self.output_filename)
+    with open(self.output_filename, 'rb') as f:
+      output = f.read()
+    self.assertEqual(len(self.data) - 376, len(output))
+    # only the timestamps changed
+    view = ts_view.HeaderView(numpy.frombuffer(self.data[376:],
+                                               dtype=numpy.uint8),
+                              numpy.arange(0, len(output), 188))
+    output_view = ts_view.HeaderView(numpy.frombuffer(output,
+                                                      dtype=numpy.uint8),
+                                     view.offsets)
+    self.assertEqual(list(view.pid), list(output_view.pid))
+    index, pcr = output_view.get_pcr()
+    self.assertEqual([0], list(index))
+    self.assertEqual([300 * (27000 + PTS_DELTA) + 5], list(pcr))
+    pts = []
+    for i in numpy.nonzero(output_view.payload_unit_start_indicator)[0]:
+      offset = 188 * i + output_view.payload_offset[i]
+      header = pes_utils.parse_pes_header(output[offset:188 * (i + 1)])
+      pts.append(header['pts'])
+    self.assertEqual(splice_plan.mod.add(0, PTS_DELTA), pts[0])
+    self.assertEqual(splice_plan.mod.add(3000, PTS_DELTA), pts[2])
+    # stale plans
+    with open(self.filename, 'ab') as f:
+      f.write(self.data[:188])
+    self.assertRaises(ValueError, splice_plan.execute_plan, plan,
+                      self.output_filename)
+
+
+if __name__ == '__main__':
+  unittest.main()
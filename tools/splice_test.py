@@ -0,0 +1,70 @@
+#!/usr/bin/python
+
+"""Unit tests for splice.py."""
+
+import os
+import tempfile
+import unittest
+import perf_counters
+import splice
+import splice_index
+import splice_plan
+import ts_gen
+
+
+class SpliceTest(unittest.TestCase):
+
+  def testGetSplicePids(self):
+    self.assertEqual((0x100, set([0x101, 0x102])), splice.get_splice_pids(
+        [(0x100, 0x1b), (0x101, 0x81), (0x102, 0x0f), (0x103, 0x86)]))
+    # the first video stream
+    self.assertEqual((0x100, set([0x101])), splice.get_splice_pids(
+        [(0x100, 0x1b), (0x101, 0x81), (0x104, 0x1b)]))
+    # no PSI: the global pids
+    self.assertEqual((splice.videostr_pid, set(splice.audiostr_pid_d)),
+                     splice.get_splice_pids([]))
+    self.assertEqual((splice.videostr_pid, set([0x101])),
+                     splice.get_splice_pids([(0x101, 0x81)]))
+
+  def testInputPids(self):
+    # regular files (indexed or not) get the pids of their PSI
+    fd, filename = tempfile.mkstemp(suffix='.ts')
+    os.close(fd)
+    try:
+      ts_gen.write_stream(filename, 100000, pmt_pid=0x80, video_pid=0x100,
+                          audio_pids=(0x101,))
+      streams = splice_index.get_file_streams(filename)
+      self.assertEqual(streams, splice_index.SourceIndex(filename).streams)
+      self.assertEqual((0x100, set([0x101])), splice.get_splice_pids(streams))
+    finally:
+      os.remove(filename)
+    # live inputs get the global pids
+    self.assertEqual([], splice_index.get_file_streams('-'))
+
+  def testCounters(self):
+    fd, filename = tempfile.mkstemp(suffix='.ts')
+    os.close(fd)
+    try:
+      ts_gen.write_stream(filename, 100000)
+      packets = os.path.getsize(filename) // 188
+      cache = splice_index.SourceIndexCache()
+      for stage_timers in (False, True):
+        counters = perf_counters.Counters()
+        plan = splice_plan.SplicePlan()
+        splice.splice_streams([filename + ':'], filename + '.out', False, -1,
+            splice.frames_to_pts(splice.SPLICE_BUFFER_FRAMES), plan, cache,
+            counters, stage_timers=stage_timers)
+        self.assertEqual(packets, counters.counts['forwarded_packets'])
+        self.assertEqual(packets, counters.counts['state.through'])
+        self.assertEqual(packets, counters.timers['packets'][0])
+        # the per-packet stage timers are optional
+        self.assertEqual(stage_timers, 'read' in counters.timers)
+        if stage_timers:
+          for name in ('read', 'parse', 'get_state', 'classify'):
+            self.assertEqual(packets, counters.timers[name][0])
+    finally:
+      os.remove(filename)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""Fast access to the one-line text format produced by "m2pb totxt".
+
+Every "m2pb totxt" line is the ShortDebugString() of an Mpeg2Ts message:
+
+  packet: 2 byte: 376 parsed { header { transport_error_indicator: false
+  payload_unit_start_indicator: true transport_priority: false pid: 481
+  ... } adaptation_field { ... pcr { base: 18039 extension: 23 } }
+  pes_packet { ... pts: 183003 dts: 180000 pes_packet_data_byte: "..." } }
+
+Parsing it with text_format.Merge() is very slow. TextPacket tokenizes the
+line by hand, only as far as needed to find the requested field, and
+patches numeric fields in place, leaving the rest of the line untouched.
+"""
+
+import modulo
+import pts_utils
+
+mod = modulo.Modulo(pts_utils.kPtsMaxValue, pts_utils.kPtsInvalid)
+
+# named fields (and their paths in the Mpeg2Ts message)
+FIELD_PATHS = {
+    'packet': 'packet',
+    'byte': 'byte',
+    'pid': 'parsed.header.pid',
+    'pusi': 'parsed.header.payload_unit_start_indicator',
+    'pts': 'parsed.pes_packet.pts',
+    'dts': 'parsed.pes_packet.dts',
+    'pcr': 'parsed.adaptation_field.pcr.base',
+}
+
+# positions of the header fields in the m2pb output (fast path)
+HEADER_TOKENS = {
+    'packet': (0, 'packet:'),
+    'byte': (2, 'byte:'),
+    'pusi': (10, 'payload_unit_start_indicator:'),
+    'pid': (14, 'pid:'),
+}
+HEADER_SPLIT = 16
+
+# fields moved by a pts delta
+PTS_DELTA_FIELDS = ('pts', 'dts', 'pcr')
+
+
+def skip_string(line, i):
+  """Returns the position after the C-escaped string starting at line[i]."""
+  while True:
+    j = line.index('"', i + 1)
+    # an odd number of backslashes escapes the quote
+    k = j - 1
+    while line[k] == '\\':
+      k -= 1
+    if (j - k) % 2:
+      return j + 1
+    i = j
+
+
+class TextPacket(object):
+  """A lazily-tokenized "m2pb totxt" line.
+
+  Scalar fields are located by their dotted path (e.g.
+  "parsed.pes_packet.pts"), or by one of the FIELD_PATHS names. Only the
+  first occurrence of a repeated field is recorded.
+  """
+
+  def __init__(self, line):
+    self.line = line
+    # path -> (start, end) of the scalar value
+    self._spans = {}
+    # tokenizer state
+    self._pos = 0
+    self._stack = []
+    self._header = None
+
+  def __str__(self):
+    return self.line
+
+  def is_valid(self):
+    return self.line.startswith('packet: ')
+
+  def _get_header(self, name):
+    """Returns a header field using the fixed m2pb token positions."""
+    if self._header is None:
+      self._header = self.line.split(' ', HEADER_SPLIT)
+    index, token = HEADER_TOKENS[name]
+    if (len(self._header) > index + 1 and self._header[index] == token):
+      return self._header[index + 1]
+    return None
+
+  def _scan(self, path):
+    """Tokenizes the line until the value of path is found."""
+    line = self.line
+    n = len(line)
+    i = self._pos
+    stack = self._stack
+    spans = self._spans
+    while i < n and path not in spans:
+      if line[i] == ' ':
+        i += 1
+        continue
+      if line[i] == '}':
+        if stack:
+          stack.pop()
+        i += 1
+        continue
+      j = line.find(' ', i)
+      if j < 0:
+        j = n
+      name = line[i:j]
+      if name.endswith(':'):
+        # scalar field
+        start = j + 1
+        if line.startswith('"', start):
+          end = skip_string(line, start)
+        else:
+          end = line.find(' ', start)
+          if end < 0:
+            end = n
+        key = '.'.join(stack + [name[:-1]])
+        if key not in spans:
+          spans[key] = (start, end)
+        i = end
+      else:
+        # message field ("name {")
+        brace = line.find('{', i)
+        if brace < 0:
+          # not a message: give up on the rest of the line
+          i = n
+          break
+        stack.append(name.rstrip('{'))
+        i = brace + 1
+    self._pos = i
+
+  def get(self, name, default=None):
+    """Returns the (string) value of a field, or default if unset."""
+    if name in HEADER_TOKENS:
+      value = self._get_header(name)
+      if value is not None:
+        return value
+    path = FIELD_PATHS.get(name, name)
+    if path not in self._spans:
+      self._scan(path)
+    if path not in self._spans:
+      return default
+    start, end = self._spans[path]
+    return self.line[start:end]
+
+  def get_int(self, name, default=None):
+    value = self.get(name)
+    return long(value) if value is not None else default
+
+  def set(self, name, value):
+    """Replaces the value of an existing field (in place).
+
+    Raises:
+      KeyError: if the field is not in the line.
+    """
+    path = FIELD_PATHS.get(name, name)
+    if path not in self._spans:
+      self._scan(path)
+    start, end = self._spans[path]
+    value = str(value)
+    self.line = self.line[:start] + value + self.line[end:]
+    # shift the spans after the patched one
+    delta = len(value) - (end - start)
+    if delta:
+      for key, (s, e) in self._spans.iteritems():
+        if s >= end:
+          self._spans[key] = (s + delta, e + delta)
+      if self._pos >= end:
+        self._pos += delta
+    self._spans[path] = (start, start + len(value))
+    self._header = None
+
+  @property
+  def packet(self):
+    return self.get_int('packet')
+
+  @property
+  def byte(self):
+    return self.get_int('byte')
+
+  @property
+  def pid(self):
+    return self.get_int('pid')
+
+  @property
+  def pusi(self):
+    return self.get('pusi') == 'true'
+
+  @property
+  def pts(self):
+    return self.get_int('pts', pts_utils.kPtsInvalid)
+
+  @property
+  def dts(self):
+    return self.get_int('dts', pts_utils.kPtsInvalid)
+
+  @property
+  def pcr(self):
+    return self.get_int('pcr', pts_utils.kPtsInvalid)
+
+  def add_pts_delta(self, pts_delta):
+    """Moves the pts, dts, and pcr base fields (if present) by pts_delta."""
+    for name in PTS_DELTA_FIELDS:
+      value = self.get(name)
+      if value is not None:
+        self.set(name, mod.add(long(value), pts_delta))
+
+
+def adjust_pts_delta(line, pts_delta):
+  """Returns a totxt line with its pts, dts, and pcr moved by pts_delta."""
+  packet = TextPacket(line)
+  packet.add_pts_delta(pts_delta)
+  return packet.line
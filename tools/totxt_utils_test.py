@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+"""Unit tests for totxt_utils.py."""
+
+import unittest
+import pts_utils
+import totxt_utils
+
+VIDEO_LINE = (
+    'packet: 2 byte: 376 parsed { header { transport_error_indicator: false '
+    'payload_unit_start_indicator: true transport_priority: false pid: 481 '
+    'transport_scrambling_control: 0 adaptation_field_exists: true '
+    'payload_exists: true continuity_counter: 1 } adaptation_field { '
+    'adaptation_field_length: 7 discontinuity_indicator: true '
+    'random_access_indicator: true elementary_stream_priority_indicator: true '
+    'splicing_point_flag: false transport_private_data_flag: false pcr { '
+    'base: 18039 extension: 23 } } pes_packet { stream_id: 224 '
+    'stream_id_type: STREAM_ID_VIDEO_13818 pes_packet_length: 0 '
+    'pes_scrambling_control: 0 pes_priority: 0 data_alignment_indicator: true '
+    'copyright: false original_or_copy: false pes_header_data_length: 10 '
+    'pts: 183003 dts: 180000 pes_packet_data_byte: '
+    '"\\000\\000\\001\\t pts: 1 \\" } dts: 2" } }')
+
+DATA_LINE = (
+    'packet: 3 byte: 564 parsed { header { transport_error_indicator: false '
+    'payload_unit_start_indicator: false transport_priority: false pid: 481 '
+    'transport_scrambling_control: 0 adaptation_field_exists: false '
+    'payload_exists: true continuity_counter: 2 } data_bytes: '
+    '"gies.com\\\\\\" pes_packet { pts: 5 }" }')
+
+
+class TotxtUtilsTest(unittest.TestCase):
+
+  def testFields(self):
+    packet = totxt_utils.TextPacket(VIDEO_LINE)
+    self.assertTrue(packet.is_valid())
+    self.assertEqual((2, 376, 481, True), (packet.packet, packet.byte,
+                                           packet.pid, packet.pusi))
+    self.assertEqual((183003, 180000, 18039),
+                     (packet.pts, packet.dts, packet.pcr))
+    self.assertEqual('STREAM_ID_VIDEO_13818',
+                     packet.get('parsed.pes_packet.stream_id_type'))
+    self.assertEqual('23', packet.get('parsed.adaptation_field.pcr.extension'))
+    # fields inside strings are not fields
+    packet = totxt_utils.TextPacket(DATA_LINE)
+    self.assertEqual((3, 481, False), (packet.packet, packet.pid, packet.pusi))
+    self.assertEqual(pts_utils.kPtsInvalid, packet.pts)
+    self.assertEqual('"gies.com\\\\\\" pes_packet { pts: 5 }"',
+                     packet.get('parsed.data_bytes'))
+    self.assertFalse(totxt_utils.TextPacket('#invalid line').is_valid())
+
+  def testGenericHeader(self):
+    # hand-edited lines do not need the m2pb field order
+    packet = totxt_utils.TextPacket(
+        'packet: 7 parsed {  header { pid: 33 payload_unit_start_indicator: '
+        'true } }')
+    self.assertEqual((7, None, 33, True),
+                     (packet.packet, packet.byte, packet.pid, packet.pusi))
+
+  def testSet(self):
+    packet = totxt_utils.TextPacket(VIDEO_LINE)
+    packet.set('pts', 1)
+    packet.set('byte', 123456789)
+    self.assertEqual(1, packet.pts)
+    self.assertEqual(123456789, packet.byte)
+    self.assertEqual(180000, packet.dts)
+    self.assertEqual(
+        VIDEO_LINE.replace('pts: 183003', 'pts: 1').replace(
+            'byte: 376', 'byte: 123456789'), packet.line)
+    self.assertRaises(KeyError, totxt_utils.TextPacket(DATA_LINE).set,
+                      'pts', 0)
+
+  def testAdjustPtsDelta(self):
+    line = totxt_utils.adjust_pts_delta(VIDEO_LINE, -183003)
+    self.assertEqual(VIDEO_LINE.replace('pts: 183003', 'pts: 0').replace(
+        'dts: 180000', 'dts: %i' % (pts_utils.kPtsMaxValue - 3002)).replace(
+            'base: 18039', 'base: %i' % (pts_utils.kPtsMaxValue - 164963)),
+                     line)
+    self.assertEqual(DATA_LINE, totxt_utils.adjust_pts_delta(DATA_LINE, 10))
+
+
+if __name__ == '__main__':
+  unittest.main()
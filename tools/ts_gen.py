@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""Deterministic synthetic mpeg-ts stream generator.
+
+Generates a single-program stream with an H.264 video pid (access unit
+delimiters and slice headers, so that frame types can be detected), any
+number of AC-3 audio pids (one syncframe per PES), periodic PAT/PMTs, and
+PCRs on the video pid. Video frames are sent in decode order, with
+pts = dts + 1 frame. Lost packets (CC errors) and garbage between packets
+can be injected at pseudo-random (but reproducible) positions.
+
+Streams start (by default) a few seconds before the 2^33 pts wrap, so
+that every consumer gets to see it.
+"""
+
+import argparse
+import random
+import sys
+import ac3_utils
+import modulo
+import psi_utils
+import pts_utils
+import ts_view
+
+
+mod = modulo.Modulo(pts_utils.kPtsMaxValue, pts_utils.kPtsInvalid)
+
+MPEG_TS_PACKET_SIZE = ts_view.MPEG_TS_PACKET_SIZE
+MPEG_TS_PAYLOAD_SIZE = MPEG_TS_PACKET_SIZE - 4
+# adaptation_field_length, flags, and pcr
+PCR_ADAPTATION_FIELD_SIZE = 8
+PAT_PID = 0x0000
+
+DEFAULT_PMT_PID = 480
+DEFAULT_VIDEO_PID = 481
+DEFAULT_AUDIO_PIDS = (482,)
+DEFAULT_BITRATE = 4000000
+DEFAULT_GOP = 'IPBBPBBPBBPBB'
+DEFAULT_PTS_START = mod.add(0, -pts_utils.seconds_to_pts(5))
+DEFAULT_PCR_INTERVAL_MS = 40
+DEFAULT_PSI_INTERVAL_MS = 100
+DEFAULT_SEED = 0
+
+STREAM_TYPE_H264 = 0x1b
+STREAM_TYPE_AC3 = 0x81
+STREAM_ID_VIDEO = 0xe0
+STREAM_ID_PRIVATE_STREAM_1 = 0xbd
+
+PTS_PER_FRAME = 3003
+# 1536 samples at 48 kHz
+AUDIO_PTS_PER_FRAME = 2880
+# how far the pcr runs behind the dts of the frame being sent
+PCR_DELAY = pts_utils.milliseconds_to_pts(500)
+# relative size of the video frames of each type
+FRAME_WEIGHTS = {'I': 6.0, 'P': 2.0, 'B': 1.0}
+
+# access unit delimiter and slice header of every frame type
+FRAME_HEADERS = {
+    'I': '\x00\x00\x00\x01\x09\x10' + '\x00\x00\x01\x65\x88\x84\x00\x21',
+    'P': '\x00\x00\x00\x01\x09\x30' + '\x00\x00\x01\x41\x9a\x21\x6c',
+    'B': '\x00\x00\x00\x01\x09\x50' + '\x00\x00\x01\x01\x9e\x21\x6c',
+}
+# AC-3 syncinfo (48 kHz, 192 kbps) and bsi (bsid 8, 2/0)
+AC3_HEADER = '\x0b\x77\x00\x00\x14\x40\x40'
+
+
+def make_section(table_id, table_id_extension, body):
+  """Returns a PSI section (with its CRC32)."""
+  section_length = 5 + len(body) + 4
+  section = (chr(table_id) + chr(0xb0 | (section_length >> 8)) +
+             chr(section_length & 0xff) + chr(table_id_extension >> 8) +
+             chr(table_id_extension & 0xff) + '\xc1\x00\x00' + body)
+  return section + psi_utils.get_crc32_str(section)
+
+
+def make_timestamp(prefix, value):
+  """Returns a 5-byte pts or dts field."""
+  return ''.join(chr(x) for x in [
+      (prefix << 4) | ((value >> 29) & 0x0e) | 1, (value >> 22) & 0xff,
+      ((value >> 14) & 0xfe) | 1, (value >> 7) & 0xff,
+      ((value << 1) & 0xfe) | 1])
+
+
+def make_pes(stream_id, payload, pts, dts=None):
+  """Returns a PES packet (unbounded for video)."""
+  if dts is None:
+    header = '\x80\x80\x05' + make_timestamp(0x2, pts)
+  else:
+    header = ('\x80\xc0\x0a' + make_timestamp(0x3, pts) +
+              make_timestamp(0x1, dts))
+  size = len(header) + len(payload)
+  if stream_id == STREAM_ID_VIDEO or size > 0xffff:
+    size = 0
+  return ('\x00\x00\x01' + chr(stream_id) + chr(size >> 8) +
+          chr(size & 0xff) + header + payload)
+
+
+def make_pcr(pcr):
+  """Returns the 6-byte pcr field of a 27 MHz pcr value."""
+  base = (pcr // ts_view.PCR_EXTENSION_PER_BASE) % (pts_utils.kPtsMaxValue + 1)
+  extension = pcr % ts_view.PCR_EXTENSION_PER_BASE
+  return ''.join(chr(x) for x in [
+      (base >> 25) & 0xff, (base >> 17) & 0xff, (base >> 9) & 0xff,
+      (base >> 1) & 0xff, ((base & 1) << 7) | 0x7e | (extension >> 8),
+      extension & 0xff])
+
+
+class StreamGenerator(object):
+  """Generates the packets of a synthetic stream."""
+
+  def __init__(self, video_pid=DEFAULT_VIDEO_PID,
+               audio_pids=DEFAULT_AUDIO_PIDS, pmt_pid=DEFAULT_PMT_PID,
+               bitrate=DEFAULT_BITRATE, gop=DEFAULT_GOP,
+               pts_start=DEFAULT_PTS_START,
+               pcr_interval_ms=DEFAULT_PCR_INTERVAL_MS,
+               psi_interval_ms=DEFAULT_PSI_INTERVAL_MS,
+               cc_error_rate=0.0, garbage_rate=0.0, seed=DEFAULT_SEED):
+    """
+    Args:
+      video_pid: the video pid (also the pcr pid)
+      audio_pids: the audio pids
+      pmt_pid: the PMT pid
+      bitrate: the (average) video bitrate, in bits per second
+      gop: the frame types of a GOP, in decode order (e.g. "IPBB")
+      pts_start: the dts of the first video frame
+      pcr_interval_ms: the (maximum) distance between pcrs
+      psi_interval_ms: the distance between PAT/PMTs
+      cc_error_rate: the fraction of (non-PUSI) packets to lose
+      garbage_rate: the fraction of packets followed by garbage
+      seed: the random seed (same seed, same stream)
+    """
+    assert gop and all(t in FRAME_HEADERS for t in gop), 'invalid gop'
+    self.video_pid = video_pid
+    self.audio_pids = list(audio_pids)
+    self.pmt_pid = pmt_pid
+    self.bitrate = bitrate
+    self.gop = gop
+    self.pts_start = pts_start
+    self.pcr_interval = pcr_interval_ms * 27000
+    self.psi_interval = pts_utils.milliseconds_to_pts(psi_interval_ms)
+    self.cc_error_rate = cc_error_rate
+    self.garbage_rate = garbage_rate
+    self._random = random.Random(seed)
+    self._cc = {}
+    self._last_pcr = None
+    # frame size of every frame type (so that a GOP averages the bitrate)
+    gop_bytes = bitrate / 8.0 * len(gop) * PTS_PER_FRAME / 90000
+    weight = sum(FRAME_WEIGHTS[t] for t in gop)
+    self._frame_size = dict((t, int(gop_bytes * FRAME_WEIGHTS[t] / weight))
+                            for t in FRAME_WEIGHTS)
+    _, self._audio_frame_size = ac3_utils.parse_syncinfo(AC3_HEADER)
+    # counters (of the yielded packets)
+    self.packets = 0
+    self.lost_packets = 0
+    self.garbage_bytes = 0
+
+  def get_psi_sections(self):
+    pat = make_section(0x00, 1, '\x00\x01' + chr(0xe0 | (self.pmt_pid >> 8)) +
+                       chr(self.pmt_pid & 0xff))
+    streams = [(STREAM_TYPE_H264, self.video_pid)] + [
+        (STREAM_TYPE_AC3, pid) for pid in self.audio_pids]
+    pmt = make_section(0x02, 1, chr(0xe0 | (self.video_pid >> 8)) +
+                       chr(self.video_pid & 0xff) + '\xf0\x00' +
+                       ''.join(chr(stream_type) + chr(0xe0 | (pid >> 8)) +
+                               chr(pid & 0xff) + '\xf0\x00'
+                               for stream_type, pid in streams))
+    return pat, pmt
+
+  def make_packet(self, pid, payload, pusi, pcr=None):
+    """Returns a packet (with adaptation field stuffing if needed)."""
+    cc = self._cc.get(pid, 0)
+    self._cc[pid] = (cc + 1) & 0x0f
+    header = chr(0x47) + chr((0x40 if pusi else 0) | (pid >> 8)) + chr(
+        pid & 0xff)
+    adaptation_field_size = MPEG_TS_PAYLOAD_SIZE - len(payload)
+    if adaptation_field_size == 0:
+      return header + chr(0x10 | cc) + payload
+    body = '\x10' + make_pcr(pcr) if pcr is not None else '\x00'
+    if adaptation_field_size == 1:
+      adaptation_field = '\x00'
+    else:
+      adaptation_field = chr(adaptation_field_size - 1) + body + '\xff' * (
+          adaptation_field_size - 1 - len(body))
+    return header + chr(0x30 | cc) + adaptation_field + payload
+
+  def _is_pcr_due(self, pcr):
+    if (self._last_pcr is not None and
+        (pcr - self._last_pcr) % (ts_view.kPcrMaxValue + 1) <
+        self.pcr_interval):
+      return False
+    self._last_pcr = pcr
+    return True
+
+  def packetize(self, pid, pes, pcr=None, pcr_step=0):
+    """Splits a PES into packets.
+
+    Args:
+      pid: the pid
+      pes: the PES packet
+      pcr: the pcr of the first packet (None for no pcrs)
+      pcr_step: the pcr increment per packet
+
+    Pcrs are only sent once every pcr interval.
+    """
+    packets = []
+    i = 0
+    while i < len(pes):
+      packet_pcr = None
+      if pcr is not None:
+        packet_pcr = (pcr + len(packets) * pcr_step) % (
+            ts_view.kPcrMaxValue + 1)
+        if not self._is_pcr_due(packet_pcr):
+          packet_pcr = None
+      size = MPEG_TS_PAYLOAD_SIZE
+      if packet_pcr is not None:
+        size -= PCR_ADAPTATION_FIELD_SIZE
+      packets.append(self.make_packet(pid, pes[i:i + size], i == 0,
+                                      packet_pcr))
+      i += size
+    return packets
+
+  def _add_errors(self, packets):
+    out = []
+    for packet in packets:
+      pusi = ord(packet[1]) & 0x40
+      if (not pusi and self.cc_error_rate and
+          self._random.random() < self.cc_error_rate):
+        self.lost_packets += 1
+        continue
+      out.append(packet)
+      if self.garbage_rate and self._random.random() < self.garbage_rate:
+        size = self._random.randint(1, MPEG_TS_PACKET_SIZE - 1)
+        # no sync bytes in the garbage
+        out.append(''.join(chr(self._random.randint(0x48, 0xff))
+                           for _ in range(size)))
+    return out
+
+  def iter_packets(self):
+    """Yields the packets (strings) of the stream, forever.
+
+    Injected garbage is yielded as separate (non-188-byte) strings.
+    """
+    dts = self.pts_start
+    audio_pts = dict((pid, self.pts_start) for pid in self.audio_pids)
+    last_psi = None
+    frame = 0
+    while True:
+      packets = []
+      if last_psi is None or mod.sub(dts, last_psi) >= self.psi_interval:
+        for pid, section in zip((PAT_PID, self.pmt_pid),
+                                self.get_psi_sections()):
+          # pointer_field
+          packets += self.packetize(pid, '\x00' + section)
+        last_psi = dts
+      t = self.gop[frame % len(self.gop)]
+      # frame sizes vary +-10%
+      size = int(self._frame_size[t] * self._random.uniform(0.9, 1.1))
+      es = FRAME_HEADERS[t]
+      es += 'v' * max(0, size - len(es))
+      pes = make_pes(STREAM_ID_VIDEO, es, mod.add(dts, PTS_PER_FRAME), dts)
+      # the frame packets are sent (evenly) over a frame period
+      pcr = (mod.sub(dts, PCR_DELAY) % (pts_utils.kPtsMaxValue + 1) *
+             ts_view.PCR_EXTENSION_PER_BASE)
+      pcr_step = (PTS_PER_FRAME * ts_view.PCR_EXTENSION_PER_BASE //
+                  (len(pes) // MPEG_TS_PAYLOAD_SIZE + 1))
+      packets += self.packetize(self.video_pid, pes, pcr, pcr_step)
+      # audio up to the end of this video frame
+      next_dts = mod.add(dts, PTS_PER_FRAME)
+      for pid in self.audio_pids:
+        while mod.cmp(audio_pts[pid], next_dts) < 0:
+          es = AC3_HEADER + 'a' * (self._audio_frame_size - len(AC3_HEADER))
+          packets += self.packetize(pid, make_pes(
+              STREAM_ID_PRIVATE_STREAM_1, es, audio_pts[pid]))
+          audio_pts[pid] = mod.add(audio_pts[pid], AUDIO_PTS_PER_FRAME)
+      for packet in self._add_errors(packets):
+        if len(packet) == MPEG_TS_PACKET_SIZE:
+          self.packets += 1
+        else:
+          self.garbage_bytes += len(packet)
+        yield packet
+      dts = next_dts
+      frame += 1
+
+
+def write_stream(filename, size, **kwargs):
+  """Writes (about) size bytes of a synthetic stream.
+
+  Args:
+    filename: the output file name ("-" for stdout)
+    size: the stream size (stops at the first packet boundary after it)
+    kwargs: StreamGenerator arguments
+
+  Returns:
+    the StreamGenerator (with its counters).
+  """
+  generator = StreamGenerator(**kwargs)
+  f = sys.stdout if filename == '-' else open(filename, 'wb')
+  written = 0
+  try:
+    for packet in generator.iter_packets():
+      f.write(packet)
+      written += len(packet)
+      if written >= size and len(packet) == MPEG_TS_PACKET_SIZE:
+        break
+  finally:
+    if f is not sys.stdout:
+      f.close()
+  return generator
+
+
+def get_opts(argv):
+  parser = argparse.ArgumentParser(
+      description='Generate a synthetic mpeg-ts stream.')
+  parser.add_argument('-o', '--output', action='store',
+      dest='output_filename', default='-',
+      metavar='OUTPUT_FILENAME',
+      help='output filename',)
+  parser.add_argument('--size', action='store',
+      dest='size', type=int, default=10 << 20,
+      help='stream size (bytes)',)
+  parser.add_argument('--video-pid', action='store',
+      dest='video_pid', type=int, default=DEFAULT_VIDEO_PID,
+      help='video (and pcr) pid',)
+  parser.add_argument('--audio-pid', action='append',
+      dest='audio_pids', type=int, default=[],
+      help='audio pid (can be used multiple times)',)
+  parser.add_argument('--pmt-pid', action='store',
+      dest='pmt_pid', type=int, default=DEFAULT_PMT_PID,
+      help='PMT pid',)
+  parser.add_argument('--bitrate', action='store',
+      dest='bitrate', type=int, default=DEFAULT_BITRATE,
+      help='video bitrate (bits per second)',)
+  parser.add_argument('--gop', action='store',
+      dest='gop', default=DEFAULT_GOP,
+      help='GOP frame types, in decode order',)
+  parser.add_argument('--pts-start', action='store',
+      dest='pts_start', type=long, default=DEFAULT_PTS_START,
+      help='first video dts',)
+  parser.add_argument('--pcr-interval', action='store',
+      dest='pcr_interval_ms', type=int, default=DEFAULT_PCR_INTERVAL_MS,
+      help='pcr interval (ms)',)
+  parser.add_argument('--cc-error-rate', action='store',
+      dest='cc_error_rate', type=float, default=0.0,
+      help='fraction of (non-PUSI) packets to lose',)
+  parser.add_argument('--garbage-rate', action='store',
+      dest='garbage_rate', type=float, default=0.0,
+      help='fraction of packets followed by garbage',)
+  parser.add_argument('--seed', action='store',
+      dest='seed', type=int, default=DEFAULT_SEED,
+      help='random seed',)
+  return parser.parse_args(argv[1:])
+
+
+def main(argv):
+  vals = get_opts(argv)
+  generator = write_stream(vals.output_filename, vals.size,
+      video_pid=vals.video_pid,
+      audio_pids=vals.audio_pids or DEFAULT_AUDIO_PIDS,
+      pmt_pid=vals.pmt_pid, bitrate=vals.bitrate, gop=vals.gop,
+      pts_start=vals.pts_start, pcr_interval_ms=vals.pcr_interval_ms,
+      cc_error_rate=vals.cc_error_rate, garbage_rate=vals.garbage_rate,
+      seed=vals.seed)
+  sys.stderr.write('%i packets, %i lost, %i garbage bytes\n' % (
+      generator.packets, generator.lost_packets, generator.garbage_bytes))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+
+"""Unit tests for ts_gen.py."""
+
+import numpy
+import os
+import tempfile
+import unittest
+import psi_utils
+import ts_gen
+import ts_scan
+import ts_view
+
+
+class TsGenTest(unittest.TestCase):
+
+  def setUp(self):
+    fd, self.filename = tempfile.mkstemp(suffix='.ts')
+    os.close(fd)
+
+  def tearDown(self):
+    os.remove(self.filename)
+
+  def testGetCrc32(self):
+    # CRC-32/MPEG-2 check value
+    self.assertEqual(0x0376e6e7, psi_utils.get_crc32('123456789'))
+
+  def testWriteStream(self):
+    pts_start = ts_gen.mod.add(0, -90000)
+    generator = ts_gen.write_stream(self.filename, 1 << 20,
+                                    audio_pids=(482, 483),
+                                    pts_start=pts_start)
+    size = os.path.getsize(self.filename)
+    self.assertTrue(size >= 1 << 20)
+    self.assertEqual(size, generator.packets * 188)
+    view = ts_view.open_view(self.filename)
+    self.assertEqual([(481, ts_gen.STREAM_TYPE_H264),
+                      (482, ts_gen.STREAM_TYPE_AC3),
+                      (483, ts_gen.STREAM_TYPE_AC3)],
+                     psi_utils.get_program_streams(view))
+    # pcrs every pcr interval
+    _, pcr = view.get_pcr(481)
+    interval = numpy.diff(pcr) % (ts_view.kPcrMaxValue + 1)
+    self.assertTrue(interval.max() < 2 * 40 * 27000)
+    scan = ts_scan.scan_file(self.filename, [481], [482, 483])
+    self.assertEqual(0, scan.cc_errors.sum())
+    video = [row for row in scan.rows if row[0] in 'IPB']
+    self.assertEqual(ts_gen.DEFAULT_GOP * 2,
+                     ''.join(row[0] for row in video[:26]))
+    # the pts wraps
+    pts = [row[1] for row in video]
+    self.assertTrue(pts[0] > pts_start)
+    self.assertTrue(min(pts) < ts_gen.PTS_PER_FRAME * 2)
+
+  def testErrors(self):
+    kwargs = {'cc_error_rate': 0.01, 'garbage_rate': 0.01, 'seed': 3}
+    generator = ts_gen.write_stream(self.filename, 256 << 10, **kwargs)
+    with open(self.filename, 'rb') as f:
+      data = f.read()
+    self.assertTrue(generator.lost_packets > 0)
+    self.assertTrue(generator.garbage_bytes > 0)
+    self.assertEqual(generator.packets * 188 + generator.garbage_bytes,
+                     len(data))
+    view = ts_view.open_view(self.filename)
+    # (packets between garbage too close to the end may not lock)
+    self.assertTrue(0 <= generator.packets - len(view) <= 2)
+    self.assertTrue(len(view.gaps) > 0)
+    scan = ts_scan.scan_file(self.filename, [481], [482])
+    self.assertTrue(scan.cc_errors.sum() > 0)
+    # same seed, same stream
+    ts_gen.write_stream(self.filename, 256 << 10, **kwargs)
+    with open(self.filename, 'rb') as f:
+      self.assertEqual(data, f.read())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""Approximate statistics of an mpeg-ts file, from a sample of windows.
+
+Triage of huge archives (bitrate, duration, frame-type mix, and gop
+structure) does not need every packet. The file is split into as many
+equal strata as windows, and a single window (a few MB) is read from
+every stratum: at its center, or at a random (but seeded) position.
+Windows start on the 188-byte grid, but every window does its own
+resync, and re-acquires the PAT and PMTs it contains (pids announced
+in a window win over the default ones).
+
+Every statistic is measured per window, and extrapolated to the whole
+file. The 95% confidence intervals use the Student t distribution of the
+per-window values, with the finite population correction (so sampling
+every window of a file gives a zero-width interval).
+"""
+
+import math
+import multiprocessing
+import random
+import numpy
+
+import pes_utils
+import psi_utils
+import ts_scan
+import ts_view
+
+DEFAULT_SAMPLE_CHUNKS = 32
+# packets per window (~6 MB)
+DEFAULT_WINDOW_PACKETS = 1 << 15
+
+# two-sided 95% Student t values, per degrees of freedom
+T_95 = (None, 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306,
+        2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110,
+        2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056,
+        2.052, 2.048, 2.045, 2.042)
+# (the normal value, for more degrees of freedom)
+Z_95 = 1.960
+
+VIDEO_FRAME_TYPES = ('I', 'P', 'B', 'V')
+
+
+def get_t_95(df):
+  return T_95[df] if df < len(T_95) else Z_95
+
+
+def get_windows(size, chunks, window_packets=DEFAULT_WINDOW_PACKETS,
+    stride=ts_view.MPEG_TS_PACKET_SIZE, seed=None):
+  """Returns the windows to sample.
+
+  Args:
+    size: the file size
+    chunks: the number of windows
+    window_packets: the number of packets per window
+    stride: the packet size
+    seed: the random seed (None for evenly spaced windows)
+
+  Returns:
+    a (windows, population) tuple, where windows is a list of (start,
+    end) byte ranges, and population the number of windows in the file.
+  """
+  window_bytes = window_packets * stride
+  population = max(1, -(-size // window_bytes))
+  if chunks >= population:
+    # sample the whole file
+    return [(start, min(size, start + window_bytes))
+            for start in range(0, size, window_bytes)] or [(0, 0)], population
+  rnd = random.Random(seed) if seed is not None else None
+  stratum = size / float(chunks)
+  windows = []
+  for i in range(chunks):
+    first = int(i * stratum)
+    slack = max(0, int((i + 1) * stratum) - window_bytes - first)
+    start = first + (rnd.randint(0, slack) if rnd is not None else slack // 2)
+    start -= start % stride
+    windows.append((start, min(size, start + window_bytes)))
+  return windows, population
+
+
+def get_pcr_bitrate(view):
+  """Returns the bitrate of a view, from the pid with most pcrs (or nan)."""
+  index, _ = view.get_pcr()
+  if not len(index):
+    return float('nan')
+  pcr_pid = int(numpy.argmax(numpy.bincount(view.pid[index])))
+  index, pcr = view.get_pcr(pcr_pid)
+  dpcr = numpy.diff(pcr) % (ts_view.kPcrMaxValue + 1)
+  valid = ~view.discontinuity_indicator[index[1:]] & (dpcr > 0)
+  # count mpeg-ts bytes only (not the M2TS headers or the RS parity)
+  dbytes = (numpy.diff(view.offsets[index]) * ts_view.MPEG_TS_PACKET_SIZE //
+            view.stride)
+  if not dpcr[valid].sum():
+    return float('nan')
+  return (dbytes[valid].sum() * 8.0 * ts_view.kPcrPerSecond /
+          dpcr[valid].sum())
+
+
+def sample_window(args):
+  """Measures a window of a file (runs in a worker process).
+
+  Args:
+    args: a (filename, start, end, stride, video_pids, audio_pids,
+        video_stream_types, audio_stream_types) tuple. The pids are used
+        when the window has no PAT/PMT, or if the stream types are None.
+
+  Returns:
+    a dictionary with the window measures.
+  """
+  (filename, start, end, stride, video_pids, audio_pids,
+   video_stream_types, audio_stream_types) = args
+  data = ts_view.open_file(filename)
+  runs, gaps = ts_view.get_packet_runs(data[start:end], stride)
+  view = ts_view.HeaderView(data,
+      ts_view.get_run_offsets(runs, stride=stride) + start, stride=stride)
+  # re-acquire the PSI
+  streams = psi_utils.get_program_streams(view)
+  if streams and video_stream_types is not None:
+    video_pids = [pid for pid, stream_type in streams
+        if stream_type in video_stream_types] or video_pids
+    audio_pids = [pid for pid, stream_type in streams
+        if stream_type in audio_stream_types] or audio_pids
+  # complete PES units only (the last ones may be cut by the window end)
+  units = sorted(pes_utils.get_pes_units(view, video_pids + audio_pids,
+      partial=False), key=lambda unit: unit.packets[0])
+  frame_types = dict((t, 0) for t in VIDEO_FRAME_TYPES)
+  audio_frames = 0
+  video_types = []
+  for unit in units:
+    t = ts_scan.get_frame_type(unit, video_pids, audio_pids)
+    if unit.pid in video_pids[:1] and t in frame_types:
+      frame_types[t] += 1
+      video_types.append(t)
+    elif unit.pid in audio_pids and t != ts_scan.FRAME_TYPE_NONE:
+      audio_frames += 1
+  # complete gops (between two I frames)
+  i_frames = [i for i, t in enumerate(video_types) if t == 'I']
+  pids, counts = numpy.unique(view.pid, return_counts=True)
+  return {
+      'start': start,
+      'end': end,
+      'packets': len(view),
+      # (the file bytes covered by the packets, for per-byte rates)
+      'bytes': len(view) * stride,
+      'gap_bytes': sum(gap_end - gap_start for gap_start, gap_end in gaps),
+      'psi': bool(streams),
+      'video_pids': video_pids,
+      'audio_pids': audio_pids,
+      'bitrate': get_pcr_bitrate(view),
+      'frame_types': frame_types,
+      'audio_frames': audio_frames,
+      'gop_lengths': numpy.diff(i_frames).tolist(),
+      'pid_packets': dict(zip(pids.tolist(), counts.tolist())),
+  }
+
+
+def get_estimate(values, population, scale=1.0):
+  """Extrapolates per-window values.
+
+  Args:
+    values: the per-window values (nan values are ignored)
+    population: the number of windows in the file
+    scale: a factor applied to the result (e.g. the file size, for
+        per-byte values)
+
+  Returns:
+    a (value, ci_low, ci_high) tuple (the interval is None with a single
+    value), or None if there are no values.
+  """
+  values = numpy.asarray(values, dtype=numpy.float64)
+  values = values[~numpy.isnan(values)]
+  n = len(values)
+  if not n:
+    return None
+  mean = values.mean()
+  if n < 2:
+    return (mean * scale, None, None)
+  fpc = math.sqrt(max(0, population - n) / float(max(1, population - 1)))
+  margin = get_t_95(n - 1) * values.std(ddof=1) / math.sqrt(n) * fpc
+  return (mean * scale, (mean - margin) * scale, (mean + margin) * scale)
+
+
+def get_estimates(windows, size, population):
+  """Returns the file statistics, as (name, estimate) tuples."""
+  estimates = []
+  bitrate = get_estimate([w['bitrate'] for w in windows], population)
+  estimates.append(('bitrate_bps', bitrate))
+  duration = None
+  if bitrate is not None:
+    # (a higher bitrate means a shorter duration)
+    duration = tuple(size * 8.0 / value if value else None
+                     for value in (bitrate[0], bitrate[2], bitrate[1]))
+  estimates.append(('duration_secs', duration))
+  # counts: per-byte rates, times the file size
+  video_frames = [sum(w['frame_types'].values()) for w in windows]
+  per_byte = lambda counts: [float(count) / w['bytes'] if w['bytes'] else
+      float('nan') for count, w in zip(counts, windows)]
+  estimates.append(('video_frames', get_estimate(per_byte(video_frames),
+                                                 population, size)))
+  estimates.append(('audio_frames', get_estimate(per_byte(
+      [w['audio_frames'] for w in windows]), population, size)))
+  # the frame-type mix
+  for t in VIDEO_FRAME_TYPES:
+    estimates.append(('frame_ratio.%s' % t, get_estimate(
+        [float(w['frame_types'][t]) / frames if frames else float('nan')
+         for w, frames in zip(windows, video_frames)], population)))
+  # the gop structure
+  estimates.append(('gop_frames', get_estimate(
+      [numpy.mean(w['gop_lengths']) if w['gop_lengths'] else float('nan')
+       for w in windows], population)))
+  # the pid mix
+  pids = sorted(set(pid for w in windows for pid in w['pid_packets']))
+  for pid in pids:
+    estimates.append(('pid_ratio.%i' % pid, get_estimate(
+        [float(w['pid_packets'].get(pid, 0)) / w['packets']
+         if w['packets'] else float('nan') for w in windows], population)))
+  return estimates
+
+
+def sample_file(filename, video_pids, audio_pids,
+    chunks=DEFAULT_SAMPLE_CHUNKS, window_packets=DEFAULT_WINDOW_PACKETS,
+    seed=None, jobs=1, video_stream_types=None, audio_stream_types=None,
+    stride=None):
+  """Samples a file, using jobs processes.
+
+  Args:
+    filename: the (regular) file to sample
+    video_pids, audio_pids: the default pids
+    chunks: the number of windows
+    window_packets: the number of packets per window
+    seed: the random seed (None for evenly spaced windows)
+    jobs: number of worker processes (1 means sampling in-process)
+    video_stream_types, audio_stream_types: the PMT stream types of the
+        video and audio streams (None to always use the default pids)
+    stride: the packet size (detected from the file contents if None)
+
+  Returns:
+    a dictionary with the windows, their population, the sampled bytes,
+    and the estimates (see get_estimates()).
+  """
+  data = ts_view.open_file(filename)
+  size = len(data)
+  if stride is None:
+    stride = ts_view.detect_stride(data)
+  del data
+  windows, population = get_windows(size, chunks, window_packets, stride,
+                                    seed)
+  args = [(filename, start, end, stride, list(video_pids), list(audio_pids),
+      video_stream_types, audio_stream_types) for start, end in windows]
+  if jobs <= 1 or len(args) <= 1:
+    results = [sample_window(a) for a in args]
+  else:
+    pool = multiprocessing.Pool(min(jobs, len(args)))
+    try:
+      results = pool.map(sample_window, args)
+      pool.close()
+    except:
+      pool.terminate()
+      raise
+    finally:
+      pool.join()
+  return {
+      'size': size,
+      'stride': stride,
+      'population': population,
+      'windows': results,
+      'sampled_bytes': sum(end - start for start, end in windows),
+      'estimates': get_estimates(results, size, population),
+  }
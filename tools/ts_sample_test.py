@@ -0,0 +1,72 @@
+#!/usr/bin/python
+
+"""Unit tests for ts_sample.py."""
+
+import os
+import tempfile
+import unittest
+import ts_gen
+import ts_sample
+import ts_scan
+
+
+class TsSampleTest(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    fd, cls.filename = tempfile.mkstemp(suffix='.ts')
+    os.close(fd)
+    ts_gen.write_stream(cls.filename, 1 << 22)
+
+  @classmethod
+  def tearDownClass(cls):
+    os.remove(cls.filename)
+
+  def testGetWindows(self):
+    size = 1000 * 188
+    windows, population = ts_sample.get_windows(size, 4, 10)
+    self.assertEqual(100, population)
+    self.assertEqual(4, len(windows))
+    for i, (start, end) in enumerate(windows):
+      self.assertEqual(0, start % 188)
+      self.assertEqual(10 * 188, end - start)
+      # a window per stratum
+      self.assertTrue(i * size // 4 <= start < (i + 1) * size // 4)
+    # seeded windows are reproducible
+    self.assertEqual(ts_sample.get_windows(size, 4, 10, seed=1),
+                     ts_sample.get_windows(size, 4, 10, seed=1))
+    # too many chunks: the whole file
+    windows, population = ts_sample.get_windows(size, 200, 300)
+    self.assertEqual(4, population)
+    self.assertEqual([(0, 56400), (56400, 112800), (112800, 169200),
+                      (169200, 188000)], windows)
+
+  def testGetEstimate(self):
+    self.assertEqual(None, ts_sample.get_estimate([], 10))
+    self.assertEqual((4.0, None, None), ts_sample.get_estimate([2], 10, 2))
+    value, low, high = ts_sample.get_estimate([1, 2, float('nan'), 3], 100)
+    self.assertAlmostEqual(2.0, value)
+    self.assertTrue(low < 2.0 < high)
+    # the whole population: no sampling error
+    self.assertEqual((2.0, 2.0, 2.0),
+                     ts_sample.get_estimate([1, 2, 3], 3))
+
+  def testSampleFile(self):
+    scan = ts_scan.scan_file(self.filename, [481], [482])
+    sample = ts_sample.sample_file(self.filename, [481], [482], chunks=8,
+        window_packets=1024, seed=0)
+    self.assertEqual(8, len(sample['windows']))
+    self.assertTrue(sample['sampled_bytes'] < sample['size'] / 2)
+    self.assertTrue(all(w['psi'] for w in sample['windows']))
+    estimates = dict(sample['estimates'])
+    value, low, high = estimates['video_frames']
+    frames = scan.frames['pid'].count(481)
+    self.assertTrue(low <= frames <= high)
+    self.assertTrue(abs(value - frames) < 0.1 * frames)
+    value, low, high = estimates['pid_ratio.481']
+    ratio = float(scan.pid_packets[481]) / scan.packets
+    self.assertTrue(low <= ratio <= high)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,494 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""Chunked (multi-core) scanning of an mpeg-ts file.
+
+The file is split into packet-aligned chunks (after resync), and
+every chunk is scanned independently (in a process pool) by scan_chunk().
+The per-chunk results are then merged, in file order, by a Scan object,
+which reconciles the state that crosses chunk boundaries:
+
+* open PES units: a chunk owns the PES units that start (PUSI) in it. It
+  reads up to lookahead packets past its end to complete them (e.g. to
+  classify a video frame), and ignores the packets at its start that
+  belong to a unit started in the previous chunk.
+* cc expectations: every chunk checks its own packets, and reports the
+  first and last cc of every pid, so that the merge can check the pair of
+  packets at each side of the boundary.
+* last pts per pid: pts jumps are checked against the last pts of the
+  previous chunk.
+* gop counters: frame rows before the first I frame of a chunk continue
+  the gop (and frame index) of the previous chunk, and packet counters
+  before the first frame row continue the previous chunk counts.
+"""
+
+import multiprocessing
+import numpy
+
+import h264_utils
+import modulo
+import pes_utils
+import pts_utils
+import ts_view
+
+mod = modulo.Modulo(pts_utils.kPtsMaxValue, pts_utils.kPtsInvalid)
+
+# packets per chunk (~188 MB)
+DEFAULT_CHUNK_PACKETS = 1 << 20
+# packets read past the end of a chunk to complete its last PES units
+DEFAULT_LOOKAHEAD_PACKETS = 4096
+# pts differences (between consecutive PES of a pid) considered a jump
+DEFAULT_MAX_PTS_JUMP = pts_utils.kPtsPerSecond
+
+# packet classes (for the packet counters)
+CLASS_VIDEO = 0
+CLASS_AUDIO = 1
+CLASS_OTHER = 2
+NUM_CLASSES = 3
+
+# frame type chars (same as "m2pb --type dump")
+FRAME_TYPE_NONE = '-'
+VIDEO_FRAME_TYPES = ('P', 'B', 'V')
+
+FRAME_COLUMNS = ('packet', 'byte', 'pid', 'pts', 'dts', 'type')
+
+
+def get_default_jobs():
+  return multiprocessing.cpu_count()
+
+
+def get_chunks(data, chunk_packets=DEFAULT_CHUNK_PACKETS,
+    stride=ts_view.MPEG_TS_PACKET_SIZE):
+  """Splits a file into chunks starting at sync points.
+
+  Chunk boundaries follow the packet grid of the previous boundary when
+  possible (so a clean stream gets 188-aligned chunks), and resync
+  otherwise. Only a few bytes are read per boundary: every chunk does its
+  own resync.
+
+  Returns:
+    a list of (start, end) byte ranges, covering the whole file.
+  """
+  chunk_bytes = chunk_packets * stride
+  prefix = ts_view.get_prefix_size(stride)
+  starts = [0]
+  prev = ts_view.find_next_sync(data, 0, stride)
+  for boundary in range(chunk_bytes, len(data), chunk_bytes):
+    if prev < 0:
+      break
+    if boundary <= starts[-1]:
+      continue
+    # the next packet in the grid of the previous boundary
+    sync = prev + ((boundary + prefix - prev + stride - 1) // stride) * stride
+    if ts_view.find_sync(data, sync, stride, 1) != sync:
+      sync = ts_view.find_next_sync(data, boundary + prefix, stride)
+    if sync < 0:
+      break
+    # chunks start at the packet start (including any M2TS header)
+    starts.append(sync - prefix)
+    prev = sync
+  ends = starts[1:] + [len(data)]
+  return zip(starts, ends)
+
+
+def get_frame_type(unit, video_pids, audio_pids):
+  """Returns the type char of a PES unit (see "m2pb --type dump")."""
+  if unit.pid in video_pids:
+    return h264_utils.get_frame_type_str(h264_utils.get_pes_frame_type(unit))
+  if unit.pid in audio_pids and unit.pts != pts_utils.kPtsInvalid:
+    return '%i' % (audio_pids.index(unit.pid) + 1)
+  return FRAME_TYPE_NONE
+
+
+def get_cc_info(view):
+  """Checks the continuity counters of all the pids.
+
+  Packets are stably sorted by pid, so that every check becomes a diff
+  between consecutive elements of the same pid. Packets without payload
+  must repeat the previous cc, packets with payload must increment it
+  (mod 16). A single duplicate packet (a packet with payload repeating
+  the cc of a previous packet with payload) is allowed.
+  Packets with the discontinuity_indicator set, null packets, and packets
+  with the transport_error_indicator set are not checked.
+
+  Returns:
+    a dictionary of numpy arrays: the per-pid counts ('pid', 'packets',
+    'errors', 'duplicates', 'tei'), the cc errors ('error_index',
+    'error_expected_cc'), and the tei packets ('tei_index').
+  """
+  tei = view.transport_error_indicator
+  checked = numpy.nonzero(~tei & (view.pid != ts_view.NULL_PID))[0]
+  pid = view.pid[checked]
+  order = numpy.argsort(pid, kind='mergesort')
+  index = checked[order]
+  pid = pid[order]
+  cc = view.continuity_counter[index].astype(numpy.int32)
+  payload = view.payload_exists[index]
+  discontinuity = view.discontinuity_indicator[index]
+  # compare every packet with the previous one of the same pid
+  same_pid = pid[1:] == pid[:-1]
+  prev_cc = cc[:-1]
+  cur_cc = cc[1:]
+  prev_payload = payload[:-1]
+  cur_payload = payload[1:]
+  checkable = same_pid & ~discontinuity[1:]
+  expected_cc = numpy.where(cur_payload, (prev_cc + 1) & 0x0f, prev_cc)
+  duplicate = checkable & prev_payload & cur_payload & (cur_cc == prev_cc)
+  # only a single duplicate is allowed
+  duplicate_error = duplicate & numpy.concatenate(([False], duplicate[:-1]))
+  error = checkable & (((cur_cc != expected_cc) & ~duplicate) |
+      duplicate_error)
+  # per-pid counts
+  all_pids = numpy.arange(ts_view.MAX_PID + 1)
+  packets = numpy.bincount(view.pid, minlength=len(all_pids))
+  errors = numpy.bincount(pid[1:][error], minlength=len(all_pids))
+  duplicates = numpy.bincount(pid[1:][duplicate & ~duplicate_error],
+      minlength=len(all_pids))
+  tei_index = numpy.nonzero(tei)[0]
+  teis = numpy.bincount(view.pid[tei_index], minlength=len(all_pids))
+  present = packets > 0
+  # report errors in file order
+  error_index = index[1:][error]
+  error_expected_cc = expected_cc[error]
+  error_order = numpy.argsort(error_index)
+  # first and last checked packet of every pid (to check the packets
+  # around a chunk boundary), and whether every packet repeats the cc of
+  # the previous one
+  first = numpy.nonzero(numpy.concatenate(([True], ~same_pid)))[0]
+  last = numpy.nonzero(numpy.concatenate((~same_pid, [True])))[0]
+  if not len(pid):
+    first = last = first[:0]
+  repeated = numpy.concatenate(([False], duplicate))
+  # (a second packet counted as a duplicate becomes an error if the first
+  # one turns out to be a duplicate too)
+  next_duplicate = numpy.concatenate((duplicate & ~duplicate_error,
+                                      [False]))
+  return {
+      'pid': all_pids[present],
+      'packets': packets[present],
+      'errors': errors[present],
+      'duplicates': duplicates[present],
+      'tei': teis[present],
+      'error_index': error_index[error_order],
+      'error_expected_cc': error_expected_cc[error_order],
+      'tei_index': tei_index,
+      'head': dict((int(pid[i]), (int(index[i]), int(cc[i]), bool(payload[i]),
+          bool(discontinuity[i]),
+          int(index[i + 1]) if next_duplicate[i] else None)) for i in first),
+      'tail': dict((int(pid[i]), (int(index[i]), int(cc[i]), bool(payload[i]),
+          bool(repeated[i]))) for i in last),
+  }
+
+
+def scan_chunk(args):
+  """Scans a chunk of a file (runs in a worker process).
+
+  Args:
+    args: a (filename, start, end, video_pids, audio_pids, lookahead,
+        stride) tuple, where [start, end) is the chunk byte range
+
+  Returns:
+    a dictionary with the chunk results. Packet indices are relative to
+    the chunk first packet, byte offsets are file-wide.
+  """
+  (filename, start, end, video_pids, audio_pids, lookahead, stride) = args
+  data = ts_view.open_file(filename)
+  runs, gaps = ts_view.get_packet_runs(data[start:end], stride)
+  offsets = ts_view.get_run_offsets(runs, stride=stride) + start
+  packets = len(offsets)
+  if lookahead and end < len(data):
+    # the packets following the chunk (to complete its last PES units)
+    extra = data[end:end + lookahead * stride]
+    runs, _ = ts_view.get_packet_runs(extra, stride)
+    offsets = numpy.concatenate((offsets,
+        ts_view.get_run_offsets(runs, 0, lookahead, stride) + end))
+  view = ts_view.HeaderView(data, offsets[:packets], stride=stride)
+  # packet classes
+  pid = view.pid
+  cls = numpy.full(len(pid), CLASS_OTHER, dtype=numpy.int8)
+  cls[numpy.isin(pid, list(audio_pids))] = CLASS_AUDIO
+  cls[numpy.isin(pid, list(video_pids))] = CLASS_VIDEO
+  # PES units (started in this chunk) of the audio and video pids
+  ext_view = ts_view.HeaderView(data, offsets, stride=stride)
+  units = [unit for unit in pes_utils.get_pes_units(ext_view,
+      list(video_pids) + list(audio_pids)) if unit.packets[0] < packets]
+  units.sort(key=lambda unit: unit.packets[0])
+  frames = dict((column, []) for column in FRAME_COLUMNS)
+  for unit in units:
+    frames['packet'].append(unit.packets[0])
+    frames['byte'].append(int(offsets[unit.packets[0]]))
+    frames['pid'].append(unit.pid)
+    frames['pts'].append(unit.pts)
+    frames['dts'].append(unit.dts)
+    frames['type'].append(get_frame_type(unit, video_pids, audio_pids))
+  # packet counters: packets of each class since the previous frame row
+  rows = numpy.array([unit.packets[0] for unit, t in zip(units,
+      frames['type']) if t != FRAME_TYPE_NONE], dtype=numpy.int64)
+  counts = numpy.zeros((len(rows), NUM_CLASSES), dtype=numpy.int64)
+  tail_counts = numpy.zeros(NUM_CLASSES, dtype=numpy.int64)
+  for c in range(NUM_CLASSES):
+    cum = numpy.cumsum(cls == c)
+    if not len(cum):
+      continue
+    if not len(rows):
+      tail_counts[c] = cum[-1]
+      continue
+    before = cum[rows] - (cls[rows] == c)
+    counts[:, c] = before - numpy.concatenate(([0], cum[rows[:-1]]))
+    tail_counts[c] = cum[-1] - cum[rows[-1]]
+  # gop counters (local to the chunk)
+  gop_l = []
+  frame_index_l = []
+  gop = -1
+  frame_index = 0
+  for t in frames['type']:
+    if t == FRAME_TYPE_NONE:
+      continue
+    if t == 'I':
+      gop += 1
+      frame_index = 0
+    elif t in VIDEO_FRAME_TYPES:
+      frame_index += 1
+    gop_l.append(gop)
+    frame_index_l.append(frame_index)
+  return {
+      'packets': packets,
+      'gaps': [(gap_start + start, gap_end + start)
+          for gap_start, gap_end in gaps],
+      'pusi': numpy.bincount(pid[view.payload_unit_start_indicator],
+          minlength=ts_view.MAX_PID + 1),
+      'frames': frames,
+      'counts': counts,
+      'tail_counts': tail_counts,
+      'gop': gop_l,
+      'frame_index': frame_index_l,
+      'cc': get_cc_info(view),
+  }
+
+
+class Scan(object):
+  """Merges the results of the chunks of a file (in file order).
+
+  Attributes:
+    packets: total number of packets
+    stride: the packet size
+    gaps: (start, end) byte ranges not covered by any packet
+    pid_packets, pid_pusi, pid_tei, cc_errors, cc_duplicates: per-pid
+        numpy arrays (indexed by pid)
+    cc_error_index, cc_error_expected_cc, tei_index: cc errors and
+        packets with the transport_error_indicator set
+    frames: dictionary of (per-PES) lists (see FRAME_COLUMNS)
+    rows: summary rows: (type, pts, packet, byte, gop, frame_index,
+        video_packets, audio_packets, other_packets) tuples
+    pts: per-pid dictionary with the first and last pts, the number of
+        PES with pts, and the pts jumps ((packet, previous_pts, pts)
+        tuples)
+  """
+
+  def __init__(self, max_pts_jump=DEFAULT_MAX_PTS_JUMP):
+    self.max_pts_jump = max_pts_jump
+    self.packets = 0
+    self.stride = ts_view.MPEG_TS_PACKET_SIZE
+    self.gaps = []
+    num_pids = ts_view.MAX_PID + 1
+    self.pid_packets = numpy.zeros(num_pids, dtype=numpy.int64)
+    self.pid_pusi = numpy.zeros(num_pids, dtype=numpy.int64)
+    self.pid_tei = numpy.zeros(num_pids, dtype=numpy.int64)
+    self.cc_errors = numpy.zeros(num_pids, dtype=numpy.int64)
+    self.cc_duplicates = numpy.zeros(num_pids, dtype=numpy.int64)
+    self.cc_error_index = []
+    self.cc_error_expected_cc = []
+    self.tei_index = []
+    self.frames = dict((column, []) for column in FRAME_COLUMNS)
+    self.rows = []
+    self.pts = {}
+    # state carried across chunk boundaries
+    self._last_cc = {}
+    self._gop = -1
+    self._frame_index = 0
+    self._counts = numpy.zeros(NUM_CLASSES, dtype=numpy.int64)
+
+  def add(self, chunk):
+    """Merges the results of the next chunk."""
+    # chunk packet indices are relative to its first packet
+    first_packet = self.packets
+    cc_info = chunk['cc']
+    for key in ('error_index', 'tei_index'):
+      cc_info[key] = cc_info[key] + first_packet
+    for pid, (index, cc, payload, discontinuity, next_duplicate) in (
+        cc_info['head'].items()):
+      if next_duplicate is not None:
+        next_duplicate += first_packet
+      cc_info['head'][pid] = (index + first_packet, cc, payload,
+                              discontinuity, next_duplicate)
+    cc_info['tail'] = dict((pid, (tail[0] + first_packet,) + tail[1:])
+        for pid, tail in cc_info['tail'].iteritems())
+    chunk['frames']['packet'] = [packet + first_packet
+        for packet in chunk['frames']['packet']]
+    self.packets += chunk['packets']
+    self._add_gaps(chunk['gaps'])
+    self._add_cc(cc_info)
+    self.pid_pusi += chunk['pusi']
+    self._add_frames(chunk)
+
+  def _add_gaps(self, gaps):
+    for start, end in gaps:
+      if self.gaps and self.gaps[-1][1] == start:
+        # a gap across a chunk boundary
+        self.gaps[-1] = (self.gaps[-1][0], end)
+      else:
+        self.gaps.append((start, end))
+
+  def _add_cc(self, cc_info):
+    self.pid_packets[cc_info['pid']] += cc_info['packets']
+    self.pid_tei[cc_info['pid']] += cc_info['tei']
+    self.cc_errors[cc_info['pid']] += cc_info['errors']
+    self.cc_duplicates[cc_info['pid']] += cc_info['duplicates']
+    # check the first packet of every pid against the previous chunk
+    boundary_errors = []
+    for pid, (index, cc, payload, discontinuity, next_duplicate) in sorted(
+        cc_info['head'].iteritems()):
+      duplicate = False
+      if pid in self._last_cc and not discontinuity:
+        prev_cc, prev_payload, prev_duplicate = self._last_cc[pid]
+        expected_cc = (prev_cc + 1) & 0x0f if payload else prev_cc
+        duplicate = prev_payload and payload and cc == prev_cc
+        if duplicate and not prev_duplicate:
+          # a single duplicate is allowed
+          self.cc_duplicates[pid] += 1
+        elif duplicate or cc != expected_cc:
+          self.cc_errors[pid] += 1
+          boundary_errors.append((index, expected_cc))
+        if duplicate and next_duplicate is not None:
+          # (so the next packet is a second one)
+          self.cc_duplicates[pid] -= 1
+          self.cc_errors[pid] += 1
+          boundary_errors.append((next_duplicate, (cc + 1) & 0x0f))
+      tail_index, tail_cc, tail_payload, tail_duplicate = (
+          cc_info['tail'][pid])
+      if tail_index == index:
+        tail_duplicate = duplicate
+      self._last_cc[pid] = (tail_cc, tail_payload, tail_duplicate)
+    errors = sorted(boundary_errors + zip(cc_info['error_index'].tolist(),
+        cc_info['error_expected_cc'].tolist()))
+    self.cc_error_index += [index for index, _ in errors]
+    self.cc_error_expected_cc += [expected_cc for _, expected_cc in errors]
+    self.tei_index += cc_info['tei_index'].tolist()
+
+  def _add_frames(self, chunk):
+    frames = chunk['frames']
+    for column in FRAME_COLUMNS:
+      self.frames[column] += frames[column]
+    # pts continuity (per pid)
+    for packet, pid, pts in zip(frames['packet'], frames['pid'],
+        frames['pts']):
+      if pts == pts_utils.kPtsInvalid:
+        continue
+      info = self.pts.setdefault(pid, {'first': pts, 'last': None,
+          'count': 0, 'jumps': []})
+      if (info['last'] is not None and
+          abs(mod.sub(pts, info['last'])) > self.max_pts_jump):
+        info['jumps'].append((packet, info['last'], pts))
+      info['last'] = pts
+      info['count'] += 1
+    # summary rows (gop and packet counters)
+    typed = [i for i, t in enumerate(frames['type']) if t != FRAME_TYPE_NONE]
+    for k, i in enumerate(typed):
+      gop = chunk['gop'][k]
+      frame_index = chunk['frame_index'][k]
+      if gop < 0:
+        # continue the last gop of the previous chunk
+        gop = self._gop
+        frame_index += self._frame_index
+      else:
+        gop += self._gop + 1
+      counts = chunk['counts'][k]
+      if k == 0:
+        counts = counts + self._counts
+      self.rows.append((frames['type'][i], frames['pts'][i],
+          frames['packet'][i], frames['byte'][i], gop, frame_index) +
+          tuple(int(count) for count in counts))
+    if typed:
+      self._gop, self._frame_index = self.rows[-1][4:6]
+      self._counts = chunk['tail_counts'].copy()
+    else:
+      self._counts += chunk['tail_counts']
+
+
+def scan_file(filename, video_pids, audio_pids,
+    jobs=1, chunk_packets=DEFAULT_CHUNK_PACKETS,
+    lookahead=DEFAULT_LOOKAHEAD_PACKETS, stride=None,
+    max_pts_jump=DEFAULT_MAX_PTS_JUMP):
+  """Scans a file, using jobs processes.
+
+  Args:
+    filename: the (regular) file to scan
+    video_pids: the pids to classify as h.264 video
+    audio_pids: the audio pids (in order: their type char is their
+        1-based position in the list)
+    jobs: number of worker processes (1 means scanning in-process)
+    chunk_packets: number of packets per chunk
+    lookahead: packets read past a chunk to complete its last PES units
+    stride: the packet size (detected from the file contents if None)
+
+  Returns:
+    a Scan object.
+  """
+  data = ts_view.open_file(filename)
+  if stride is None:
+    stride = ts_view.detect_stride(data)
+  chunks = get_chunks(data, chunk_packets, stride)
+  del data
+  args = [(filename, start, end, list(video_pids), list(audio_pids),
+      lookahead, stride) for start, end in chunks]
+  scan = Scan(max_pts_jump)
+  scan.stride = stride
+  if jobs <= 1 or len(args) <= 1:
+    for a in args:
+      scan.add(scan_chunk(a))
+    return scan
+  pool = multiprocessing.Pool(min(jobs, len(args)))
+  try:
+    # imap keeps the chunk order, so chunks can be merged as they come
+    for chunk in pool.imap(scan_chunk, args):
+      scan.add(chunk)
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+  return scan
+
+
+def write_index(filename, frames):
+  """Writes the (typed) frames of a Scan as a text index file."""
+  with open(filename, 'w') as f:
+    f.write('# packet, byte, pid, pts, dts, type\n')
+    for packet, byte, pid, pts, dts, t in zip(*[frames[column]
+        for column in FRAME_COLUMNS]):
+      if t == FRAME_TYPE_NONE:
+        continue
+      f.write('%i, %i, %i, %i, %i, %s\n' % (packet, byte, pid, pts, dts, t))
+
+
+def read_index(filename):
+  """Reads an index file.
+
+  Returns:
+    a dictionary of numpy arrays (see FRAME_COLUMNS).
+  """
+  frames = dict((column, []) for column in FRAME_COLUMNS)
+  with open(filename) as f:
+    for line in f:
+      if line.startswith('#'):
+        continue
+      parts = [part.strip() for part in line.split(',')]
+      for column, value in zip(FRAME_COLUMNS[:-1], parts[:-1]):
+        frames[column].append(long(value))
+      frames['type'].append(parts[-1])
+  index = dict((column, numpy.array(frames[column], dtype=numpy.int64))
+      for column in FRAME_COLUMNS[:-1])
+  index['type'] = numpy.array(frames['type'], dtype='S1')
+  return index
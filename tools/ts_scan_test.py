@@ -0,0 +1,253 @@
+#!/usr/bin/python
+
+"""Unit tests for ts_scan.py."""
+
+import itertools
+import numpy
+import os
+import tempfile
+import unittest
+import h264_utils_test
+import psi_utils
+import ts_scan
+import ts_view
+from pes_utils_test import make_pes, make_packets
+
+VIDEO_PID = 0x100
+AUDIO_PID = 0x101
+PMT_PID = 0x20
+# 2 gops (and a half): I P B B P B B ...
+GOP = 'IPBBPBB'
+FRAMES = GOP * 2 + 'IPB'
+SLICES = {
+    'I': h264_utils_test.AUD_I + h264_utils_test.IDR_SLICE,
+    'P': h264_utils_test.AUD_P + h264_utils_test.P_SLICE,
+    'B': h264_utils_test.AUD_B + h264_utils_test.B_SLICE,
+}
+
+
+def make_section(table_id, table_id_extension, body):
+  section_length = 5 + len(body) + 4
+  return (chr(table_id) + chr(0xb0 | (section_length >> 8)) +
+          chr(section_length & 0xff) + chr(table_id_extension >> 8) +
+          chr(table_id_extension & 0xff) + '\xc1\x00\x00' + body +
+          '\x00' * 4)
+
+
+def make_psi_packets():
+  pat = make_section(psi_utils.TABLE_ID_PAT, 1,
+                     '\x00\x01' + chr(0xe0 | (PMT_PID >> 8)) + chr(PMT_PID))
+  pmt = make_section(psi_utils.TABLE_ID_PMT, 1,
+                     '\xe1\x00\xf0\x00' +
+                     '\x1b\xe1\x00\xf0\x00' +  # video
+                     '\x81\xe1\x01\xf0\x00')  # audio
+  return (make_packets(psi_utils.PAT_PID, '\x00' + pat) +
+          make_packets(PMT_PID, '\x00' + pmt))
+
+
+def make_stream():
+  """Returns the packets of a stream with interleaved video and audio."""
+  packets = make_psi_packets()
+  video_cc = 0
+  audio_cc = 0
+  for i, t in enumerate(FRAMES):
+    # frames of different sizes (so that they cross chunk boundaries)
+    es = SLICES[t] + 'v' * (200 * (i % 4))
+    video = make_packets(VIDEO_PID, make_pes(es, pts=3000 * i,
+                                             stream_id='\xe0'), video_cc)
+    video_cc += len(video)
+    audio = make_packets(AUDIO_PID, make_pes('a' * 100, pts=2880 * i),
+                         audio_cc)
+    audio_cc += len(audio)
+    packets += video[:1] + audio + video[1:]
+  return packets
+
+
+def make_cc_packet(pid, cc, payload=True, discontinuity=False, tei=False):
+  """Returns a packet (a string) with the given header fields."""
+  header = (chr(0x47) + chr((0x80 if tei else 0) | (pid >> 8)) +
+            chr(pid & 0xff))
+  flags = chr(0x80 if discontinuity else 0x00)
+  if not payload:
+    # (an adaptation field filling the packet)
+    return header + chr(0x20 | cc) + chr(183) + flags + '\xff' * 182
+  if discontinuity:
+    return header + chr(0x30 | cc) + chr(1) + flags + 'p' * 182
+  return header + chr(0x10 | cc) + 'p' * 184
+
+
+# (cc, payload, discontinuity, tei) per packet, and the expected
+# (errors, duplicates, tei) of every pid
+CC_STREAMS = {
+    # packets without payload repeat the cc (the last one should be 1)
+    0x30: ([(0, True, False, False), (0, False, False, False),
+            (1, True, False, False), (2, False, False, False)], (1, 0, 0)),
+    # a single duplicate is allowed
+    0x31: ([(0, True, False, False), (1, True, False, False),
+            (1, True, False, False), (2, True, False, False)], (0, 1, 0)),
+    # a double duplicate is not (the second one is an error)
+    0x32: ([(0, True, False, False), (1, True, False, False),
+            (1, True, False, False), (1, True, False, False),
+            (2, True, False, False)], (1, 1, 0)),
+    # the discontinuity_indicator resets the cc
+    0x33: ([(0, True, False, False), (1, True, False, False),
+            (7, True, True, False), (8, True, False, False)], (0, 0, 0)),
+    # (and a jump without it is an error)
+    0x34: ([(0, True, False, False), (1, True, False, False),
+            (7, True, False, False), (8, True, False, False)], (1, 0, 0)),
+    # packets with the transport_error_indicator are not checked
+    0x35: ([(0, True, False, False), (1, True, False, False),
+            (9, True, False, True), (2, True, False, False)], (0, 0, 1)),
+    # a packet with payload after one without it must increment the cc
+    # (the last one is not a duplicate but an error)
+    0x36: ([(0, True, False, False), (1, True, False, False),
+            (1, False, False, False), (1, True, False, False)], (1, 0, 0)),
+}
+
+
+def write_cc_stream(filename):
+  """Writes the CC_STREAMS (interleaved, and with null packets).
+
+  Returns:
+    the (pid, cc, payload, discontinuity, tei) tuple of every packet.
+  """
+  packets = []
+  for i, pid_packets in enumerate(itertools.izip_longest(*[
+      [(pid,) + fields for fields in CC_STREAMS[pid][0]]
+      for pid in sorted(CC_STREAMS)])):
+    packets += [packet for packet in pid_packets if packet is not None]
+    packets.append((ts_view.NULL_PID, i, True, False, False))
+  with open(filename, 'wb') as f:
+    for packet in packets:
+      f.write(make_cc_packet(*packet))
+  return packets
+
+
+class TsScanCcTest(unittest.TestCase):
+
+  def setUp(self):
+    fd, self.filename = tempfile.mkstemp(suffix='.ts')
+    os.close(fd)
+    self.packets = write_cc_stream(self.filename)
+
+  def tearDown(self):
+    os.remove(self.filename)
+
+  def testGetCcInfo(self):
+    info = ts_scan.get_cc_info(ts_view.open_view(self.filename))
+    self.assertEqual(sorted(CC_STREAMS) + [ts_view.NULL_PID],
+                     info['pid'].tolist())
+    for i, pid in enumerate(sorted(CC_STREAMS)):
+      self.assertEqual(len(CC_STREAMS[pid][0]), info['packets'][i])
+      self.assertEqual(CC_STREAMS[pid][1], (info['errors'][i],
+          info['duplicates'][i], info['tei'][i]))
+    # the errors (the 3rd, 4th, 4th, and 4th packets of their pids), in
+    # file order
+    pid_packets = dict((pid, [i for i, packet in enumerate(self.packets)
+                              if packet[0] == pid]) for pid in CC_STREAMS)
+    self.assertEqual([pid_packets[0x34][2], pid_packets[0x30][3],
+                      pid_packets[0x32][3], pid_packets[0x36][3]],
+                     info['error_index'].tolist())
+    self.assertEqual([2, 1, 2, 2], info['error_expected_cc'].tolist())
+    self.assertEqual([i for i, packet in enumerate(self.packets)
+                      if packet[4]], info['tei_index'].tolist())
+
+  def testChunkedScan(self):
+    # (the cc checks across chunk boundaries)
+    scan = ts_scan.scan_file(self.filename, [], [])
+    for chunk_packets in (1, 2, 3, 5, 9):
+      chunked = ts_scan.scan_file(self.filename, [], [],
+                                  chunk_packets=chunk_packets)
+      self.assertEqual(scan.cc_error_index, chunked.cc_error_index)
+      self.assertEqual(scan.cc_error_expected_cc,
+                       chunked.cc_error_expected_cc)
+      for attr in ('cc_errors', 'cc_duplicates'):
+        self.assertEqual(list(getattr(scan, attr)),
+                         list(getattr(chunked, attr)))
+
+
+class TsScanTest(unittest.TestCase):
+
+  def setUp(self):
+    fd, self.filename = tempfile.mkstemp(suffix='.ts')
+    packets = make_stream()
+    # a cc error (a lost non-PUSI video packet)
+    del packets[max(i for i, packet in enumerate(packets)
+                    if packet[1] == (VIDEO_PID >> 8) and
+                    packet[2] == (VIDEO_PID & 0xff))]
+    # some garbage (not a packet)
+    packets.insert(40, [0x00, 0x47] * 50)
+    with os.fdopen(fd, 'wb') as f:
+      f.write(numpy.array(sum(packets, []), dtype=numpy.uint8).tostring())
+
+  def tearDown(self):
+    os.remove(self.filename)
+
+  def scan(self, **kwargs):
+    return ts_scan.scan_file(self.filename, [VIDEO_PID], [AUDIO_PID],
+                             **kwargs)
+
+  def testScan(self):
+    scan = self.scan()
+    video_rows = [row for row in scan.rows if row[0] not in '1']
+    self.assertEqual(list(FRAMES), [row[0] for row in video_rows])
+    # gop, frame_index
+    self.assertEqual([(-1 + (i + 7) // 7, i % 7) for i in range(len(FRAMES))],
+                     [row[4:6] for row in video_rows])
+    self.assertEqual(len(FRAMES), scan.pts[AUDIO_PID]['count'])
+    self.assertEqual(1, sum(scan.cc_errors))
+    self.assertEqual(sum(scan.pid_packets), scan.packets)
+    self.assertEqual(1, len(scan.gaps))
+    self.assertEqual(100, scan.gaps[0][1] - scan.gaps[0][0])
+
+  def testChunkedScan(self):
+    scan = self.scan()
+    for kwargs in ({'chunk_packets': 7}, {'chunk_packets': 1},
+                   {'chunk_packets': 5, 'jobs': 2}):
+      chunked = self.scan(**kwargs)
+      self.assertEqual(scan.rows, chunked.rows)
+      self.assertEqual(scan.frames, chunked.frames)
+      self.assertEqual(scan.pts, chunked.pts)
+      self.assertEqual(scan.cc_error_index, chunked.cc_error_index)
+      self.assertEqual(scan.gaps, chunked.gaps)
+      for attr in ('pid_packets', 'pid_pusi', 'cc_errors', 'cc_duplicates'):
+        self.assertEqual(list(getattr(scan, attr)),
+                         list(getattr(chunked, attr)))
+
+  def testM2ts(self):
+    scan = self.scan()
+    data = numpy.fromfile(self.filename, dtype=numpy.uint8)
+    runs, _ = ts_scan.ts_view.get_packet_runs(data)
+    offsets = ts_scan.ts_view.get_run_offsets(runs)
+    # add a 4-byte header to every packet (and drop the garbage)
+    m2ts = numpy.zeros((len(offsets), 192), dtype=numpy.uint8)
+    m2ts[:, 4:] = data[offsets[:, None] + numpy.arange(188)]
+    with open(self.filename, 'wb') as f:
+      f.write(m2ts.tostring())
+    for kwargs in ({}, {'chunk_packets': 5, 'jobs': 2}):
+      m2ts_scan = self.scan(**kwargs)
+      self.assertEqual(192, m2ts_scan.stride)
+      self.assertEqual([row[:3] + row[4:] for row in scan.rows],
+                       [row[:3] + row[4:] for row in m2ts_scan.rows])
+      self.assertEqual([192 * packet + 4 for packet in
+                        m2ts_scan.frames['packet']], m2ts_scan.frames['byte'])
+      self.assertEqual([], m2ts_scan.gaps)
+
+  def testGetProgramStreams(self):
+    view = ts_scan.ts_view.open_view(self.filename)
+    self.assertEqual([(VIDEO_PID, 0x1b), (AUDIO_PID, 0x81)],
+                     psi_utils.get_program_streams(view))
+
+  def testIndex(self):
+    scan = self.scan()
+    index_filename = self.filename + '.idx'
+    ts_scan.write_index(index_filename, scan.frames)
+    index = ts_scan.read_index(index_filename)
+    os.remove(index_filename)
+    self.assertEqual(len(scan.rows), len(index['packet']))
+    self.assertEqual([row[2] for row in scan.rows], list(index['packet']))
+    self.assertEqual([row[0] for row in scan.rows], list(index['type']))
+
+
+if __name__ == '__main__':
+  unittest.main()
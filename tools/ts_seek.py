@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""Index-free pts seeking in mpeg-ts files.
+
+seek_pts() finds where to start reading a file to get the frames from a
+given pts on, without an index (or a scan from the start of the file).
+It bisects over byte offsets: every probe resyncs at the probed offset,
+and reads forward until the first video PES with a pts (or, if there is
+none in a probe window, the first pcr), which is compared to the target
+with Modulo.cmp (so pts wraps are handled). After O(log(size)) probes, it
+steps back to the last I frame before the target.
+
+Bisection assumes that timestamps grow (modulo wraps) along the file.
+Files with pts discontinuities (e.g. concatenated recordings) must be
+read from the start.
+"""
+
+import numpy
+
+import h264_utils
+import modulo
+import pes_utils
+import pts_utils
+import ts_view
+
+mod = modulo.Modulo(pts_utils.kPtsMaxValue, pts_utils.kPtsInvalid)
+
+# bytes read per probe window (probes read further if needed)
+DEFAULT_PROBE_BYTES = 16 * 1024
+# bytes read per step when going back to the previous I frame
+DEFAULT_STEP_BACK_BYTES = 128 * 1024
+# how far to go back looking for an I frame (before giving up, and
+# returning the file start)
+DEFAULT_MAX_STEP_BACK_BYTES = 16 << 20
+
+
+class Seeker(object):
+  """Probes the timestamps of a file at given byte offsets."""
+
+  def __init__(self, filename, video_pids, stride=None,
+               probe_bytes=DEFAULT_PROBE_BYTES):
+    self.data = ts_view.open_file(filename)
+    self.stride = (ts_view.detect_stride(self.data) if stride is None
+                   else stride)
+    self.video_pids = list(video_pids)
+    self.probe_bytes = probe_bytes
+    # accounting
+    self.probes = 0
+    self.bytes_read = 0
+
+  def get_view(self, start, end):
+    """Returns a HeaderView of the (resync'ed) packets in [start, end)."""
+    self.bytes_read += end - start
+    runs, _ = ts_view.get_packet_runs(self.data[start:end], self.stride)
+    return ts_view.HeaderView(self.data, ts_view.get_run_offsets(runs,
+        stride=self.stride) + start, stride=self.stride)
+
+  def get_packet_start(self, view, i):
+    """Returns the file offset of packet i (including any M2TS header)."""
+    return int(view.offsets[i]) - ts_view.get_prefix_size(self.stride)
+
+  def probe(self, start, end):
+    """Returns the first timestamp found in [start, end).
+
+    Returns:
+      a (offset, pts) tuple, where offset is the start of the packet
+      carrying the timestamp, or (end, pts_utils.kPtsInvalid) if there is
+      none.
+    """
+    self.probes += 1
+    while start < end:
+      view = self.get_view(start, min(end, start + self.probe_bytes))
+      index = numpy.nonzero(view.payload_unit_start_indicator &
+          view.payload_exists & numpy.isin(view.pid, self.video_pids))[0]
+      for i in index.tolist():
+        offset = int(view.offsets[i]) + int(view.payload_offset[i])
+        header = pes_utils.parse_pes_header(self.data[
+            offset:int(view.offsets[i]) + ts_view.MPEG_TS_PACKET_SIZE]
+            .tostring())
+        if header is not None and header['pts'] != pts_utils.kPtsInvalid:
+          return self.get_packet_start(view, i), header['pts']
+      # no video pts: use the pcr (in pts units)
+      index, pcr = view.get_pcr()
+      if len(index):
+        return (self.get_packet_start(view, index[0]),
+                int(pcr[0]) // ts_view.PCR_EXTENSION_PER_BASE)
+      start += self.probe_bytes
+    return end, pts_utils.kPtsInvalid
+
+  def bisect(self, target_pts):
+    """Returns an offset whose first timestamp precedes target_pts.
+
+    The offset is the file start if the file starts after target_pts.
+    """
+    lo = 0
+    hi = len(self.data) - len(self.data) % self.stride
+    while hi - lo > self.probe_bytes:
+      mid = lo + (hi - lo) // 2
+      mid -= mid % self.stride
+      offset, pts = self.probe(mid, hi)
+      if pts != pts_utils.kPtsInvalid and mod.cmp(pts, target_pts) < 0:
+        lo = offset
+      else:
+        hi = mid
+    return lo
+
+  def get_i_frame(self, end, target_pts,
+                  max_bytes=DEFAULT_MAX_STEP_BACK_BYTES,
+                  step_bytes=DEFAULT_STEP_BACK_BYTES):
+    """Returns the last I frame starting before end, and before target_pts.
+
+    Returns:
+      a (offset, pts) tuple, or (0, pts_utils.kPtsInvalid) if there is no
+      such I frame in the max_bytes before end.
+    """
+    start = end
+    while start > 0 and end - start < max_bytes:
+      block_end = start
+      start = max(0, start - step_bytes)
+      start -= start % self.stride
+      view = self.get_view(start, block_end)
+      frames = []
+      for unit in pes_utils.get_pes_units(view, self.video_pids[:1]):
+        if (unit.pts != pts_utils.kPtsInvalid and
+            mod.cmp(unit.pts, target_pts) < 0 and
+            h264_utils.get_pes_frame_type(unit) ==
+            h264_utils.H264_FRAME_TYPE_I):
+          frames.append((self.get_packet_start(view, unit.packets[0]),
+                         unit.pts))
+      if frames:
+        return max(frames)
+    return 0, pts_utils.kPtsInvalid
+
+
+def seek_pts(filename, target_pts, video_pids, stride=None,
+             probe_bytes=DEFAULT_PROBE_BYTES):
+  """Finds where to start reading a file to get the frames from a pts on.
+
+  Args:
+    filename: the (regular) file name
+    target_pts: the first pts to get
+    video_pids: the video pids (the first one is used to find I frames)
+    stride: the packet size (detected from the file contents if None)
+    probe_bytes: bytes read per probe
+
+  Returns:
+    a dictionary with the "offset" to start reading from (the start of
+    an I frame packet, or 0), its "pts" (pts_utils.kPtsInvalid for the
+    file start), and the number of "probes" and "bytes_read".
+  """
+  seeker = Seeker(filename, video_pids, stride, probe_bytes)
+  lo = seeker.bisect(target_pts)
+  offset, pts = 0, pts_utils.kPtsInvalid
+  if lo > 0:
+    # (the I frame can start in the packets read by the last probe)
+    offset, pts = seeker.get_i_frame(min(len(seeker.data),
+        lo + seeker.probe_bytes), target_pts)
+  return {
+      'offset': offset,
+      'pts': pts,
+      'probes': seeker.probes,
+      'bytes_read': seeker.bytes_read,
+  }
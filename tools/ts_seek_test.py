@@ -0,0 +1,60 @@
+#!/usr/bin/python
+
+"""Unit tests for ts_seek.py."""
+
+import os
+import tempfile
+import unittest
+import modulo
+import pts_utils
+import ts_gen
+import ts_scan
+import ts_seek
+
+mod = modulo.Modulo(pts_utils.kPtsMaxValue, pts_utils.kPtsInvalid)
+
+
+class TsSeekTest(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    fd, cls.filename = tempfile.mkstemp(suffix='.ts')
+    os.close(fd)
+    # (the default stream starts right before a pts wrap)
+    ts_gen.write_stream(cls.filename, 1 << 23)
+    scan = ts_scan.scan_file(cls.filename, [481], [482])
+    cls.frames = [(byte, pts, t) for byte, pid, pts, t in zip(
+        scan.frames['byte'], scan.frames['pid'], scan.frames['pts'],
+        scan.frames['type']) if pid == 481]
+
+  @classmethod
+  def tearDownClass(cls):
+    os.remove(cls.filename)
+
+  def testSeekPts(self):
+    size = os.path.getsize(self.filename)
+    # the pts wrap (a frame that follows a greater pts)
+    self.assertTrue(any(mod.cmp(self.frames[i + 1][1], self.frames[i][1]) > 0
+                        and self.frames[i + 1][1] < self.frames[i][1]
+                        for i in range(len(self.frames) - 1)))
+    for i in (20, len(self.frames) // 3, len(self.frames) // 2,
+              len(self.frames) - 1):
+      target = self.frames[i][1]
+      result = ts_seek.seek_pts(self.filename, target, [481])
+      # an I frame before the target, and before any later frame
+      self.assertIn((result['offset'], result['pts'], 'I'), self.frames)
+      self.assertTrue(mod.cmp(result['pts'], target) < 0)
+      first = min(byte for byte, pts, _ in self.frames
+                  if mod.cmp(pts, target) >= 0)
+      self.assertTrue(result['offset'] <= first)
+      # reading a small part of the file
+      self.assertTrue(result['bytes_read'] < size / 8)
+
+  def testSeekFileStart(self):
+    result = ts_seek.seek_pts(self.filename, self.frames[0][1], [481])
+    self.assertEqual(0, result['offset'])
+    self.assertEqual(pts_utils.kPtsInvalid, result['pts'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,435 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""Live mpeg-ts packet sources (stdin, pipes, fifos, and udp sockets).
+
+A live source is read by a background thread into a bounded ring of
+188-byte packets. The reader keeps itself sync'ed to the stream (looking
+for 3 0x47 bytes in a row, like Mpeg2TsReader), and when the ring is full
+it drops packets instead of stalling the producer, accounting for every
+dropped packet.
+
+Sources with 192-byte (M2TS) or 204-byte (DVB RS) packets are read the
+same way, the reader stripping the extra bytes of every packet.
+
+The reader thread waits (in select()) on both its input and a stop pipe,
+so closing a source wakes up a reader blocked on a silent fifo, stdin, or
+socket. The input is closed only after the reader thread is done.
+"""
+
+import numpy
+import os
+import select
+import socket
+import stat
+import subprocess
+import sys
+import threading
+import time
+import ts_view
+from collections import deque
+
+MPEG_TS_PACKET_SIZE = 188
+MPEG_TS_PACKET_SYNC = '\x47'
+
+# ring size (in packets): 16k packets is ~3 MB (~1 sec of a 25 Mbps mux)
+DEFAULT_RING_PACKETS = 16384
+# how much to read from the underlying fd in each read() call
+DEFAULT_READ_SIZE = 256 * MPEG_TS_PACKET_SIZE
+# how long to wait for a full ring to drain before dropping packets
+DEFAULT_PUT_TIMEOUT = 0.1
+# how long a udp source can be silent before we consider it finished
+DEFAULT_UDP_TIMEOUT = 5.0
+UDP_RCVBUF_SIZE = 8 * 1024 * 1024
+UDP_MAX_DATAGRAM_SIZE = 65536
+
+STDIN_SPEC = '-'
+UDP_PREFIX = 'udp://'
+UDP_DEFAULT_HOST = '127.0.0.1'
+
+
+def is_udp_spec(spec):
+  return spec.startswith(UDP_PREFIX)
+
+
+def parse_udp_spec(spec):
+  """Parses a "udp://[host:]port" spec into a (host, port) tuple."""
+  if not is_udp_spec(spec):
+    return None
+  rem = spec[len(UDP_PREFIX):]
+  host = UDP_DEFAULT_HOST
+  if ':' in rem:
+    host, rem = rem.rsplit(':', 1)
+  try:
+    port = int(rem)
+  except ValueError:
+    return None
+  return host, port
+
+
+def is_fifo(spec):
+  try:
+    return stat.S_ISFIFO(os.stat(spec).st_mode)
+  except OSError:
+    return False
+
+
+def is_live(spec):
+  """Whether the spec refers to a non-seekable packet source."""
+  return spec == STDIN_SPEC or is_udp_spec(spec) or is_fifo(spec)
+
+
+def is_valid_input(spec):
+  """Whether the spec is a regular file or a valid live source."""
+  if is_udp_spec(spec):
+    return parse_udp_spec(spec) is not None
+  return os.path.isfile(spec) or is_live(spec)
+
+
+def get_basename(spec):
+  """Returns a name usable to build output filenames for the spec."""
+  if spec == STDIN_SPEC:
+    return 'stdin'
+  if is_udp_spec(spec):
+    host, port = parse_udp_spec(spec)
+    return 'udp_%s_%i' % (host, port)
+  return os.path.split(spec)[1]
+
+
+class RingBuffer(object):
+  """A bounded FIFO of packets with backpressure accounting."""
+
+  def __init__(self, max_packets=DEFAULT_RING_PACKETS,
+      put_timeout=DEFAULT_PUT_TIMEOUT):
+    self._max_packets = max_packets
+    self._put_timeout = put_timeout
+    self._queue = deque()
+    self._cond = threading.Condition()
+    self._closed = False
+    # accounting
+    self.packets_in = 0
+    self.packets_out = 0
+    self.dropped = 0
+    self.max_occupancy = 0
+
+  def __len__(self):
+    return len(self._queue)
+
+  def put(self, packet):
+    """Adds a packet, dropping it if the ring stays full for too long.
+
+    A put_timeout of None means never dropping (for non-live sources).
+
+    Returns:
+      True if the packet was queued, False if it was dropped.
+    """
+    with self._cond:
+      if len(self._queue) >= self._max_packets:
+        # give the consumer a chance to catch up
+        if self._put_timeout is None:
+          deadline = None
+        else:
+          deadline = time.time() + self._put_timeout
+        while len(self._queue) >= self._max_packets and not self._closed:
+          if deadline is None:
+            self._cond.wait()
+            continue
+          remaining = deadline - time.time()
+          if remaining <= 0:
+            break
+          self._cond.wait(remaining)
+        if len(self._queue) >= self._max_packets:
+          self.dropped += 1
+          return False
+      self._queue.append(packet)
+      self.packets_in += 1
+      self.max_occupancy = max(self.max_occupancy, len(self._queue))
+      self._cond.notify_all()
+      return True
+
+  def get(self, max_packets=1):
+    """Returns a list of up to max_packets packets.
+
+    Blocks until at least one packet is available. An empty list means
+    the ring was closed and fully drained.
+    """
+    with self._cond:
+      while not self._queue and not self._closed:
+        self._cond.wait()
+      out = []
+      while self._queue and len(out) < max_packets:
+        out.append(self._queue.popleft())
+      self.packets_out += len(out)
+      self._cond.notify_all()
+      return out
+
+  def close(self):
+    with self._cond:
+      self._closed = True
+      self._cond.notify_all()
+
+
+class PacketSource(object):
+  """A sync'ed packet source backed by a bounded ring buffer.
+
+  Supports "-" (stdin), fifos/pipes, regular files, and
+  "udp://[host:]port" (loopback by default).
+  """
+
+  def __init__(self, spec, ring_packets=DEFAULT_RING_PACKETS,
+      put_timeout=DEFAULT_PUT_TIMEOUT, udp_timeout=DEFAULT_UDP_TIMEOUT,
+      stride=MPEG_TS_PACKET_SIZE, debug=0, offset=0):
+    self.spec = spec
+    self._stride = stride
+    # where to start reading (regular files only)
+    self._offset = offset
+    # bytes after the mpeg-ts packet (till the next sync byte)
+    self._suffix = stride - MPEG_TS_PACKET_SIZE - ts_view.get_prefix_size(
+        stride)
+    self._debug = debug
+    self._udp_timeout = udp_timeout
+    self._ring = RingBuffer(ring_packets, put_timeout)
+    self._thread = None
+    self._fd = None
+    self._sock = None
+    self._stop = False
+    # written to by close(), to wake the reader thread up
+    self._stop_r = self._stop_w = None
+    # accounting
+    self.bytes_read = 0
+    self.resyncs = 0
+    self.skipped_bytes = 0
+
+  def start(self):
+    if is_udp_spec(self.spec):
+      host, port = parse_udp_spec(self.spec)
+      self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+      self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+      self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+          UDP_RCVBUF_SIZE)
+      self._sock.bind((host, port))
+    elif self.spec == STDIN_SPEC:
+      self._fd = sys.stdin.fileno()
+    else:
+      self._fd = os.open(self.spec, os.O_RDONLY)
+      if self._offset:
+        os.lseek(self._fd, self._offset, os.SEEK_SET)
+    self._stop_r, self._stop_w = os.pipe()
+    self._thread = threading.Thread(target=self._run, name='ts_source')
+    self._thread.daemon = True
+    self._thread.start()
+    return self
+
+  def _read(self):
+    """Returns the next input bytes.
+
+    Returns '' at EOF, after close(), and when a udp source stays silent
+    for udp_timeout seconds.
+    """
+    fd = self._sock if self._sock is not None else self._fd
+    timeout = self._udp_timeout if self._sock is not None else None
+    readable, _, _ = select.select([fd, self._stop_r], [], [], timeout)
+    if self._stop_r in readable or not readable:
+      return ''
+    if self._sock is not None:
+      return self._sock.recv(UDP_MAX_DATAGRAM_SIZE)
+    return os.read(self._fd, DEFAULT_READ_SIZE)
+
+  def _run(self):
+    pending = ''
+    locked = False
+    try:
+      while not self._stop:
+        data = self._read()
+        if not data:
+          break
+        self.bytes_read += len(data)
+        pending = pending + data if pending else data
+        pending, locked = self._push_packets(pending, locked)
+      if pending:
+        # trailing bytes that do not make a full packet
+        self.skipped_bytes += len(pending)
+    finally:
+      self._ring.close()
+
+  def _push_packets(self, pending, locked):
+    i = 0
+    end = len(pending)
+    while end - i >= MPEG_TS_PACKET_SIZE + self._suffix:
+      if pending[i] == MPEG_TS_PACKET_SYNC and (
+          locked or self._check_sync(pending, i)):
+        locked = True
+        self._ring.put(pending[i:i + MPEG_TS_PACKET_SIZE])
+        i += self._stride
+        continue
+      # lost sync: look for the next sync point
+      if locked:
+        locked = False
+        self.resyncs += 1
+      j = self._find_sync(pending, i + 1)
+      if j < 0:
+        # keep enough bytes to find a sync point spanning the next read
+        keep = min(end - i, 3 * self._stride)
+        self.skipped_bytes += (end - i) - keep
+        i = end - keep
+        break
+      self.skipped_bytes += j - i
+      i = j
+    return pending[i:], locked
+
+  def _check_sync(self, buf, i):
+    # look for 3 'G's in a row (the last packet may be partial)
+    for k in (1, 2):
+      j = i + k * self._stride
+      if j >= len(buf):
+        return False
+      if buf[j] != MPEG_TS_PACKET_SYNC:
+        return False
+    return True
+
+  def _find_sync(self, buf, start):
+    i = buf.find(MPEG_TS_PACKET_SYNC, start)
+    while i >= 0:
+      if i + 2 * self._stride >= len(buf):
+        # not enough data to confirm the sync point yet
+        return -1
+      if self._check_sync(buf, i):
+        return i
+      i = buf.find(MPEG_TS_PACKET_SYNC, i + 1)
+    return -1
+
+  def __iter__(self):
+    while True:
+      packets = self._ring.get(256)
+      if not packets:
+        return
+      for packet in packets:
+        yield packet
+
+  def read_block(self, max_packets=256):
+    """Returns a string with up to max_packets packets ('' at EOF)."""
+    return ''.join(self._ring.get(max_packets))
+
+  def close(self):
+    """Stops the reader thread, and then closes the input."""
+    if self._stop_w is None:
+      # not started, or already closed
+      return
+    self._stop = True
+    os.write(self._stop_w, 'x')
+    self._ring.close()
+    if self._thread is not None:
+      self._thread.join()
+    if self._sock is not None:
+      self._sock.close()
+    elif self._fd is not None and self.spec != STDIN_SPEC:
+      os.close(self._fd)
+    os.close(self._stop_r)
+    os.close(self._stop_w)
+    self._stop_r = self._stop_w = None
+
+  def get_stats(self):
+    return {
+        'bytes_read': self.bytes_read,
+        'packets': self._ring.packets_in,
+        'dropped': self._ring.dropped,
+        'resyncs': self.resyncs,
+        'skipped_bytes': self.skipped_bytes,
+        'max_occupancy': self._ring.max_occupancy,
+    }
+
+  def get_stats_str(self):
+    return ('%s: %i packets, %i dropped, %i resyncs, %i skipped bytes, '
+        'max ring occupancy %i' % (self.spec, self._ring.packets_in,
+            self._ring.dropped, self.resyncs, self.skipped_bytes,
+            self._ring.max_occupancy))
+
+
+def get_stride(spec):
+  """Returns the packet size of a regular file (188 for live sources)."""
+  if is_live(spec) or not os.path.getsize(spec):
+    return MPEG_TS_PACKET_SIZE
+  with open(spec, 'rb') as f:
+    head = f.read(ts_view.DEFAULT_DETECT_BYTES)
+  return ts_view.detect_stride(numpy.frombuffer(head, dtype=numpy.uint8))
+
+
+def _pump(source, fout):
+  try:
+    while True:
+      block = source.read_block()
+      if not block:
+        break
+      fout.write(block)
+  except IOError:
+    # reader went away (e.g. the consumer stopped early)
+    pass
+  finally:
+    try:
+      fout.close()
+    except IOError:
+      pass
+
+
+def _copy(fin, fout):
+  try:
+    while True:
+      block = fin.read(DEFAULT_READ_SIZE)
+      if not block:
+        break
+      fout.write(block)
+  except IOError:
+    # reader went away (e.g. the consumer stopped early)
+    pass
+  finally:
+    fin.close()
+    try:
+      fout.close()
+    except IOError:
+      pass
+
+
+def popen(command, spec, debug=0, offset=0, **kwargs):
+  """Launches an m2pb command reading from the given input spec.
+
+  Regular mpeg-ts files are passed to the command directly (or, when read
+  from an offset, copied into the command's stdin). Live sources, and
+  M2TS (192-byte) or DVB RS (204-byte) files, are read through a
+  PacketSource, and pumped (as 188-byte packets) into the command's stdin.
+
+  Args:
+    command: the command (without the input file argument)
+    spec: the input file spec
+    debug: verbosity level
+    offset: where to start reading a regular file (a packet start)
+    kwargs: extra subprocess.Popen() arguments
+
+  Returns:
+    a (proc, source) tuple. source is None for regular files.
+  """
+  stride = get_stride(spec)
+  if not is_live(spec) and stride == MPEG_TS_PACKET_SIZE:
+    if not offset:
+      return subprocess.Popen(command + [spec], **kwargs), None
+    # pump the file from offset as is (so the byte fields of the output
+    # are the file offsets, minus offset)
+    proc = subprocess.Popen(command + [STDIN_SPEC], stdin=subprocess.PIPE,
+        **kwargs)
+    fin = open(spec, 'rb')
+    fin.seek(offset)
+    pump = threading.Thread(target=_copy, args=(fin, proc.stdin),
+        name='ts_source_copy')
+    pump.daemon = True
+    pump.start()
+    return proc, None
+  put_timeout = DEFAULT_PUT_TIMEOUT if is_live(spec) else None
+  source = PacketSource(spec, put_timeout=put_timeout, stride=stride,
+      debug=debug, offset=offset).start()
+  proc = subprocess.Popen(command + [STDIN_SPEC], stdin=subprocess.PIPE,
+      **kwargs)
+  pump = threading.Thread(target=_pump, args=(source, proc.stdin),
+      name='ts_source_pump')
+  pump.daemon = True
+  pump.start()
+  return proc, source
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+
+"""Unit tests for ts_source.py."""
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import ts_source
+
+PACKET = '\x47' + '\x00' * 187
+
+
+class PacketSourceTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def close_in_thread(self, source):
+    """Closes a source, and returns whether close() returned in time."""
+    thread = threading.Thread(target=source.close)
+    thread.daemon = True
+    thread.start()
+    thread.join(5.0)
+    return not thread.is_alive()
+
+  def testRegularFile(self):
+    filename = os.path.join(self.tmp_dir, 'in.ts')
+    with open(filename, 'wb') as f:
+      f.write('garbage' + PACKET * 10)
+    source = ts_source.PacketSource(filename, put_timeout=None).start()
+    self.assertEqual([PACKET] * 10, list(source))
+    self.assertEqual(7, source.skipped_bytes)
+    source.close()
+    # (closing twice is harmless)
+    source.close()
+
+  def testCloseBlockedFifo(self):
+    filename = os.path.join(self.tmp_dir, 'in.fifo')
+    os.mkfifo(filename)
+    # (a writer that stays open, and silent)
+    fd = os.open(filename, os.O_RDWR)
+    try:
+      source = ts_source.PacketSource(filename).start()
+      os.write(fd, PACKET * 3)
+      data = ''
+      while len(data) < 3 * len(PACKET):
+        data += source.read_block()
+      self.assertEqual(PACKET * 3, data)
+      # the reader thread is now blocked waiting for more input
+      time.sleep(0.1)
+      self.assertTrue(self.close_in_thread(source))
+      self.assertFalse(source._thread.is_alive())
+      self.assertEqual('', source.read_block())
+    finally:
+      os.close(fd)
+
+  def testCloseSilentUdp(self):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((ts_source.UDP_DEFAULT_HOST, 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    source = ts_source.PacketSource('udp://%i' % port,
+                                    udp_timeout=60).start()
+    time.sleep(0.1)
+    self.assertTrue(self.close_in_thread(source))
+    self.assertFalse(source._thread.is_alive())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+
+# Copyright Google Inc. Apache 2.0.
+
+"""Vectorized (numpy) views of the headers of an mpeg-ts file.
+
+A HeaderView is built from an mmap'ed file (a numpy uint8 array) and an
+array with the byte offset of every packet. Header fields are computed
+column-wise by gathering the relevant header bytes of all the packets at
+once, so no per-packet python code runs.
+
+Packet offsets come from a vectorized resync: the data is split into runs
+of packets (with sync bytes every stride bytes), separated by gaps
+(corrupted or non-ts areas). The stride is 188 bytes for plain mpeg-ts,
+192 for M2TS (Blu-ray, with a 4-byte arrival timestamp header), and 204
+for DVB captures with Reed-Solomon parity, and can be detected from the
+sync byte periodicity.
+"""
+
+import numpy
+import os
+
+MPEG_TS_PACKET_SIZE = 188
+MPEG_TS_PACKET_SYNC = 0x47
+# M2TS (Blu-ray) packets have a 4-byte prefix (copy permission and a 30-bit
+# arrival timestamp, at 27 MHz)
+M2TS_PACKET_SIZE = 192
+M2TS_HEADER_SIZE = 4
+M2TS_ARRIVAL_TIMESTAMP_MASK = 0x3fffffff
+# DVB packets with 16 bytes of Reed-Solomon parity at the end
+DVB_RS_PACKET_SIZE = 204
+PACKET_STRIDES = (MPEG_TS_PACKET_SIZE, M2TS_PACKET_SIZE, DVB_RS_PACKET_SIZE)
+NULL_PID = 0x1fff
+MAX_PID = 0x1fff
+
+# 90 kHz pts/pcr base times 300 gives the 27 MHz system clock
+PCR_EXTENSION_PER_BASE = 300
+kPcrPerSecond = 27000000
+kPcrMaxValue = ((1 << 33) * PCR_EXTENSION_PER_BASE) - 1
+
+# number of sync bytes (every packet) needed to lock (same as m2pb)
+MIN_LOCK_SYNCS = 3
+# bytes searched (at once) for a sync point after losing sync
+DEFAULT_RESYNC_WINDOW = 64 * 1024
+# packets whose sync byte is checked at once when following a run
+RUN_CHECK_BLOCK_PACKETS = 1 << 20
+# bytes used to detect the stride, and minimum ratio of aligned sync bytes
+DEFAULT_DETECT_BYTES = 1 << 20
+MIN_STRIDE_SYNC_RATIO = 0.5
+
+
+def open_file(filename, mode='r'):
+  """Returns a numpy uint8 array mmap'ing the file contents."""
+  if os.path.getsize(filename) == 0:
+    return numpy.zeros(0, dtype=numpy.uint8)
+  return numpy.memmap(filename, dtype=numpy.uint8, mode=mode)
+
+
+def get_prefix_size(stride):
+  """Returns the number of bytes preceding the sync byte in a packet."""
+  return M2TS_HEADER_SIZE if stride == M2TS_PACKET_SIZE else 0
+
+
+def detect_stride(data, max_bytes=DEFAULT_DETECT_BYTES):
+  """Detects the packet size (188, 192, or 204) of some data.
+
+  For every candidate stride, the data start is split in stride-byte rows,
+  and we count the sync bytes of each column: the right stride has a
+  column (the sync byte position) with sync bytes in (almost) all rows.
+
+  Returns:
+    the detected stride (MPEG_TS_PACKET_SIZE if none matches).
+  """
+  best_stride = MPEG_TS_PACKET_SIZE
+  best_ratio = MIN_STRIDE_SYNC_RATIO
+  for stride in PACKET_STRIDES:
+    rows = min(len(data), max_bytes) // stride
+    if rows < MIN_LOCK_SYNCS:
+      continue
+    sync = (numpy.asarray(data[:rows * stride]).reshape(rows, stride) ==
+        MPEG_TS_PACKET_SYNC)
+    ratio = sync.sum(axis=0).max() / float(rows)
+    if ratio > best_ratio:
+      best_stride, best_ratio = stride, ratio
+  return best_stride
+
+
+def find_sync(data, start=0, stride=MPEG_TS_PACKET_SIZE,
+    window=DEFAULT_RESYNC_WINDOW):
+  """Returns the first sync point in data[start:start + window], or -1.
+
+  A sync point is a 0x47 byte followed by MIN_LOCK_SYNCS - 1 other ones
+  (every stride bytes), starting a complete packet. Near the end of the
+  data, the syncs that fall out of it are not checked.
+  """
+  prefix = get_prefix_size(stride)
+  start = max(start, prefix)
+  end = min(start + window, len(data) - stride + prefix + 1)
+  if end <= start:
+    return -1
+  candidates = numpy.nonzero(data[start:end] == MPEG_TS_PACKET_SYNC)[0] + start
+  for k in range(1, MIN_LOCK_SYNCS):
+    following = candidates + k * stride
+    in_range = following < len(data)
+    confirmed = numpy.ones(len(candidates), dtype=bool)
+    confirmed[in_range] = data[following[in_range]] == MPEG_TS_PACKET_SYNC
+    candidates = candidates[confirmed]
+  return int(candidates[0]) if len(candidates) else -1
+
+
+def find_next_sync(data, start=0, stride=MPEG_TS_PACKET_SIZE,
+    window=DEFAULT_RESYNC_WINDOW):
+  """Returns the first sync point in data[start:] (or -1)."""
+  while start <= len(data) - stride + get_prefix_size(stride):
+    sync = find_sync(data, start, stride, window)
+    if sync >= 0:
+      return sync
+    start += window
+  return -1
+
+
+def find_first_sync(data, stride=MPEG_TS_PACKET_SIZE):
+  """Returns the offset of the first 3 sync bytes in a row, or -1."""
+  return find_sync(data, 0, stride, stride)
+
+
+def get_run_length(data, start, stride=MPEG_TS_PACKET_SIZE):
+  """Returns the number of packets in a row (with sync) at data[start:]."""
+  packets = (len(data) - start + get_prefix_size(stride)) // stride
+  length = 0
+  while length < packets:
+    # check the sync bytes block by block (to bound memory usage)
+    block = min(RUN_CHECK_BLOCK_PACKETS, packets - length)
+    first = start + length * stride
+    sync = data[first:first + block * stride:stride] == MPEG_TS_PACKET_SYNC
+    lost = numpy.nonzero(~sync)[0]
+    if len(lost):
+      return length + int(lost[0])
+    length += block
+  return length
+
+
+def get_packet_runs(data, stride=MPEG_TS_PACKET_SIZE,
+    window=DEFAULT_RESYNC_WINDOW):
+  """Splits data into runs of packets, and the gaps between them.
+
+  After a lost sync, the next sync point is searched in windows of
+  window bytes (so corrupted areas are skipped at numpy speed).
+
+  Returns:
+    a (runs, gaps) tuple. runs is a list of (offset, packets) tuples,
+    where offset is the first packet sync byte, and gaps a list of
+    (start, end) byte ranges not covered by any (complete) packet,
+    including any leading and trailing garbage. A packet covers stride
+    bytes, including its M2TS header (if any).
+  """
+  prefix = get_prefix_size(stride)
+  runs = []
+  gaps = []
+  last_end = 0
+  pos = 0
+  while True:
+    sync = find_next_sync(data, pos, stride, window)
+    if sync < 0:
+      break
+    length = get_run_length(data, sync, stride)
+    if sync - prefix > last_end:
+      gaps.append((last_end, sync - prefix))
+    runs.append((sync, length))
+    last_end = sync - prefix + length * stride
+    # look for a new sync point after the first packet without sync
+    pos = last_end + prefix + 1
+  if last_end < len(data):
+    gaps.append((last_end, len(data)))
+  return runs, gaps
+
+
+def get_run_offsets(runs, start=0, end=None, stride=MPEG_TS_PACKET_SIZE):
+  """Returns the byte offsets of packets [start, end) of some runs."""
+  out = []
+  first = 0
+  for offset, packets in runs:
+    last = first + packets
+    if end is not None and first >= end:
+      break
+    if last > start:
+      i = max(start, first) - first
+      j = (packets if end is None else min(end, last) - first)
+      out.append(offset + numpy.arange(i, j, dtype=numpy.int64) * stride)
+    first = last
+  if not out:
+    return numpy.zeros(0, dtype=numpy.int64)
+  return numpy.concatenate(out)
+
+
+def get_packet_offsets(data, stride=MPEG_TS_PACKET_SIZE):
+  """Returns the (sync byte) offsets of all the complete packets in data."""
+  runs, _ = get_packet_runs(data, stride)
+  return get_run_offsets(runs, stride=stride)
+
+
+def _cached(fn):
+  """Turns a method into a lazily-computed, cached property."""
+  name = fn.__name__
+  def wrapper(self):
+    if name not in self._cache:
+      self._cache[name] = fn(self)
+    return self._cache[name]
+  wrapper.__doc__ = fn.__doc__
+  return property(wrapper)
+
+
+class HeaderView(object):
+  """A column-oriented view of the headers of a set of packets.
+
+  Every attribute is a numpy array with one element per packet.
+  """
+
+  def __init__(self, data, offsets, gaps=(), stride=MPEG_TS_PACKET_SIZE):
+    self.data = data
+    # offsets point to the sync byte (after any M2TS header)
+    self.offsets = offsets
+    # (start, end) byte ranges not covered by any packet
+    self.gaps = gaps
+    self.stride = stride
+    self._cache = {}
+
+  def __len__(self):
+    return len(self.offsets)
+
+  def get_byte(self, i, offsets=None):
+    """Returns byte i of every packet (or of the packets at offsets)."""
+    if offsets is None:
+      offsets = self.offsets
+    return self.data[offsets + i]
+
+  @_cached
+  def sync(self):
+    return self.get_byte(0) == MPEG_TS_PACKET_SYNC
+
+  @_cached
+  def arrival_timestamp(self):
+    """The M2TS arrival timestamp (27 MHz), or None for non-M2TS packets."""
+    if self.stride != M2TS_PACKET_SIZE:
+      return None
+    b = [self.get_byte(i - M2TS_HEADER_SIZE).astype(numpy.int64)
+        for i in range(M2TS_HEADER_SIZE)]
+    return (((b[0] << 24) | (b[1] << 16) | (b[2] << 8) | b[3]) &
+        M2TS_ARRIVAL_TIMESTAMP_MASK)
+
+  @_cached
+  def transport_error_indicator(self):
+    return (self.get_byte(1) & 0x80) != 0
+
+  @_cached
+  def payload_unit_start_indicator(self):
+    return (self.get_byte(1) & 0x40) != 0
+
+  @_cached
+  def pid(self):
+    return (((self.get_byte(1).astype(numpy.int32) & 0x1f) << 8) |
+        self.get_byte(2))
+
+  @_cached
+  def adaptation_field_exists(self):
+    return (self.get_byte(3) & 0x20) != 0
+
+  @_cached
+  def payload_exists(self):
+    return (self.get_byte(3) & 0x10) != 0
+
+  @_cached
+  def continuity_counter(self):
+    return self.get_byte(3) & 0x0f
+
+  @_cached
+  def adaptation_field_length(self):
+    """The adaptation_field_length (0 for packets without one)."""
+    return numpy.where(self.adaptation_field_exists, self.get_byte(4), 0)
+
+  def _get_adaptation_field_flags(self):
+    # adaptation field flags are only valid if the field has any content
+    return numpy.where(self.adaptation_field_length > 0, self.get_byte(5), 0)
+
+  @_cached
+  def discontinuity_indicator(self):
+    return (self._get_adaptation_field_flags() & 0x80) != 0
+
+  @_cached
+  def random_access_indicator(self):
+    return (self._get_adaptation_field_flags() & 0x40) != 0
+
+  @_cached
+  def pcr_flag(self):
+    return (((self._get_adaptation_field_flags() & 0x10) != 0) &
+        (self.adaptation_field_length >= 7))
+
+  @_cached
+  def payload_offset(self):
+    """Offset of the payload from the start of the packet."""
+    return numpy.where(self.adaptation_field_exists,
+        5 + self.adaptation_field_length.astype(numpy.int32), 4)
+
+  def get_pcr(self, pid=None):
+    """Returns the PCR-carrying packets, and their PCR values.
+
+    Args:
+      pid: only consider packets from this pid
+
+    Returns:
+      a (index, pcr) tuple, where index is the packet index, and pcr is
+      the full 27 MHz pcr value (base * 300 + extension).
+    """
+    mask = self.pcr_flag
+    if pid is not None:
+      mask = mask & (self.pid == pid)
+    index = numpy.nonzero(mask)[0]
+    offsets = self.offsets[index]
+    b = [self.get_byte(i, offsets).astype(numpy.int64) for i in range(6, 12)]
+    base = ((b[0] << 25) | (b[1] << 17) | (b[2] << 9) | (b[3] << 1) |
+        (b[4] >> 7))
+    extension = ((b[4] & 0x01) << 8) | b[5]
+    return index, base * PCR_EXTENSION_PER_BASE + extension
+
+
+def open_view(filename, stride=None):
+  """Returns a HeaderView of all the packets in a file.
+
+  Args:
+    filename: the file name
+    stride: the packet size (detected from the file contents if None)
+  """
+  data = open_file(filename)
+  if stride is None:
+    stride = detect_stride(data)
+  runs, gaps = get_packet_runs(data, stride)
+  return HeaderView(data, get_run_offsets(runs, stride=stride), gaps, stride)
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+
+"""Unit tests for ts_view.py."""
+
+import numpy
+import unittest
+import ts_view
+
+
+def make_packet(pid, cc, pusi=False, pcr=None, discontinuity=False):
+  """Returns a 188-byte packet (as a list of ints)."""
+  packet = [0x47, (0x40 if pusi else 0) | (pid >> 8), pid & 0xff, 0x10 | cc]
+  if pcr is not None:
+    base, extension = pcr // 300, pcr % 300
+    packet[3] |= 0x20
+    packet += [7, 0x10 | (0x80 if discontinuity else 0),
+        (base >> 25) & 0xff, (base >> 17) & 0xff, (base >> 9) & 0xff,
+        (base >> 1) & 0xff, ((base & 1) << 7) | 0x7e | (extension >> 8),
+        extension & 0xff]
+  return packet + [0xff] * (188 - len(packet))
+
+
+def make_data(packets, prefix=()):
+  data = list(prefix)
+  for packet in packets:
+    data += packet
+  return numpy.array(data, dtype=numpy.uint8)
+
+
+class HeaderViewTest(unittest.TestCase):
+
+  def testGetPacketOffsets(self):
+    data = make_data([make_packet(0, 0)] * 3, prefix=[0x47, 0, 0])
+    offsets = ts_view.get_packet_offsets(data)
+    self.assertEqual([3, 191, 379], list(offsets))
+    # trailing partial packets are ignored
+    data = make_data([make_packet(0, 0)] * 2)[:-1]
+    self.assertEqual([0], list(ts_view.get_packet_offsets(data)))
+    # no sync at all
+    data = numpy.zeros(1000, dtype=numpy.uint8)
+    self.assertEqual([], list(ts_view.get_packet_offsets(data)))
+
+  def testGetPacketRuns(self):
+    packets = [make_packet(0x100, i % 16) for i in range(10)]
+    # a corrupted sync byte, and some garbage
+    packets[3] = [0x00] + packets[3][1:]
+    packets.insert(8, [0x00, 0x47] * 50)
+    data = make_data(packets, prefix=[0x00] * 7)
+    runs, gaps = ts_view.get_packet_runs(data, window=64)
+    self.assertEqual([(7, 3), (7 + 4 * 188, 4), (7 + 8 * 188 + 100, 2)],
+                     runs)
+    self.assertEqual([(0, 7), (7 + 3 * 188, 7 + 4 * 188),
+                      (7 + 8 * 188, 7 + 8 * 188 + 100)], gaps)
+    offsets = ts_view.get_run_offsets(runs)
+    self.assertEqual(9, len(offsets))
+    self.assertEqual(list(offsets[4:6]),
+                     list(ts_view.get_run_offsets(runs, 4, 6)))
+    self.assertTrue((data[offsets] == 0x47).all())
+
+  def testDetectStride(self):
+    packets = [make_packet(0x100, i % 16) for i in range(10)]
+    data = make_data(packets)
+    self.assertEqual(188, ts_view.detect_stride(data))
+    # M2TS: 4-byte arrival timestamp headers
+    m2ts = make_data([[0x40, 0x00, 0x01, i] + packet
+                      for i, packet in enumerate(packets)])
+    self.assertEqual(192, ts_view.detect_stride(m2ts))
+    runs, gaps = ts_view.get_packet_runs(m2ts, 192)
+    self.assertEqual([(4, 10)], runs)
+    self.assertEqual([], gaps)
+    view = ts_view.HeaderView(m2ts, ts_view.get_run_offsets(runs, stride=192),
+                              stride=192)
+    self.assertEqual([0x100] * 10, list(view.pid))
+    self.assertEqual([0x100 + i for i in range(10)],
+                     list(view.arrival_timestamp))
+    # DVB: 16 bytes of parity
+    dvb = make_data([packet + [0x47] * 16 for packet in packets])
+    self.assertEqual(204, ts_view.detect_stride(dvb))
+    self.assertEqual([204 * i for i in range(10)],
+                     list(ts_view.get_packet_offsets(dvb, 204)))
+    # no sync at all
+    self.assertEqual(188, ts_view.detect_stride(
+        numpy.zeros(1000, dtype=numpy.uint8)))
+
+  def testHeaderFields(self):
+    data = make_data([
+        make_packet(0, 3, pusi=True),
+        make_packet(481, 15, pcr=12345678),
+        make_packet(0x1fff, 0),
+    ])
+    view = ts_view.HeaderView(data, ts_view.get_packet_offsets(data))
+    self.assertEqual([0, 481, 0x1fff], list(view.pid))
+    self.assertEqual([True, False, False],
+                     list(view.payload_unit_start_indicator))
+    self.assertEqual([3, 15, 0], list(view.continuity_counter))
+    self.assertEqual([False, True, False],
+                     list(view.adaptation_field_exists))
+    self.assertEqual([4, 12, 4], list(view.payload_offset))
+    self.assertEqual([False, True, False], list(view.pcr_flag))
+
+  def testGetPcr(self):
+    pcr_values = [0, 299, 300, 27000000, ts_view.kPcrMaxValue]
+    packets = []
+    for i, pcr in enumerate(pcr_values):
+      packets.append(make_packet(100, 0))
+      packets.append(make_packet(481, i, pcr=pcr, discontinuity=(i == 2)))
+    data = make_data(packets)
+    view = ts_view.HeaderView(data, ts_view.get_packet_offsets(data))
+    index, pcr = view.get_pcr(481)
+    self.assertEqual([1, 3, 5, 7, 9], list(index))
+    self.assertEqual(pcr_values, list(pcr))
+    self.assertEqual([False, False, False, False, False, True, False, False,
+                      False, False], list(view.discontinuity_indicator))
+    index, _ = view.get_pcr(100)
+    self.assertEqual([], list(index))
+
+
+if __name__ == '__main__':
+  unittest.main()